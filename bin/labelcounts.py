@@ -26,6 +26,8 @@ import os
 import h5py
 import numpy
 
+from ilastik.applets.base.appletSerializer import SerialChunkedBlockSlot
+
 if len(sys.argv) != 2 or not sys.argv[1].endswith(".ilp"):
     sys.stderr.write("Usage: {} <my_project.ilp>\n".format( sys.argv[0] ))
     sys.exit(1)
@@ -59,8 +61,7 @@ if __name__ == "__main__":
         for image_index, group in enumerate(f['PixelClassification/LabelSets'].values()):
             # For each label block
             this_img_bins = []
-            for block in group.values():
-                data = block[:]
+            for data in SerialChunkedBlockSlot.iterBlocks(group):
                 nonzero_coords = numpy.nonzero(data)
                 bins = numpy.bincount(data[nonzero_coords].flat)
                 this_img_bins.append( bins )
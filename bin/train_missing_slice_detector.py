@@ -0,0 +1,74 @@
+"""
+Train the missing slice detector (Fill Missing Slices applet) headlessly.
+
+The patch histograms of the stack are computed in parallel blocks and stored in
+an hdf5 file, keyed by patch size and halo size.  Histograms that are already in
+that file are reused, so retraining with other settings only computes what is new.
+The trained detector is written as a pickle that can be loaded in the applet.
+
+Example usage:
+    # Slices 17, 18 and 240 of the stack are missing.
+    ./ilastik-1.1.7-Linux/bin/python train_missing_slice_detector.py /tmp/stack.h5/volume/data \\
+        --missing-slices 17 18 240 --patch-size 64 --halo-size 16 \\
+        --histograms /tmp/stack_histograms.h5 --detector /tmp/detector.pkl
+"""
+import os
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("raw_data", help="Single-channel 3D stack, e.g. /path/to/file.h5/dataset")
+    parser.add_argument("--missing-slices", type=int, nargs='+', required=True,
+                        help="z indexes of the missing slices")
+    parser.add_argument("--patch-size", type=int, default=128)
+    parser.add_argument("--halo-size", type=int, default=30)
+    parser.add_argument("--histograms", required=True, help="hdf5 file to store the histograms in")
+    parser.add_argument("--detector", required=True, help="Output file for the trained detector")
+    parser.add_argument("--recompute", action="store_true",
+                        help="Recompute the histograms even if they are stored already")
+    parsed_args = parser.parse_args()
+
+    train_detector( parsed_args.raw_data,
+                    parsed_args.missing_slices,
+                    parsed_args.patch_size,
+                    parsed_args.halo_size,
+                    parsed_args.histograms,
+                    parsed_args.detector,
+                    parsed_args.recompute )
+    print "DONE."
+
+def train_detector( raw_data_path, missing_slices, patch_size, halo_size,
+                    histogram_path, detector_path, recompute=False ):
+    import h5py
+    from lazyflow.graph import Graph
+    from lazyflow.operators.ioOperators import OpInputDataReader
+    from ilastik.applets.fillMissingSlices.opFillMissingSlices import OpFillMissingSlicesNoCache
+
+    graph = Graph()
+    opReader = OpInputDataReader(graph=graph)
+    opReader.WorkingDirectory.setValue( os.getcwd() )
+    opReader.FilePath.setValue( raw_data_path )
+
+    opFill = OpFillMissingSlicesNoCache(graph=graph)
+    opFill.Input.connect( opReader.Output )
+    opFill.PatchSize.setValue( patch_size )
+    opFill.HaloSize.setValue( halo_size )
+
+    try:
+        with h5py.File( histogram_path, 'a' ) as f:
+            if recompute or opFill.histogramKey() not in f:
+                print "Computing histograms of {}".format( raw_data_path )
+                opFill.precomputeHistograms( f, missing_slices )
+
+            print "Training detector"
+            opFill.trainFromHistogramStore( f )
+
+        with open( detector_path, 'w' ) as f:
+            f.write( opFill.Detector[:].wait() )
+        print "Wrote detector to {}".format( detector_path )
+    finally:
+        opFill.cleanUp()
+        opReader.cleanUp()
+
+if __name__ == "__main__":
+    main()
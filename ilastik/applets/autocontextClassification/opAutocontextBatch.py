@@ -24,6 +24,7 @@ from lazyflow.operators import OpValueCache, OpTrainRandomForestBlocked, \
                                OpPrecomputedInput, Op50ToMulti, OpArrayPiper, OpMultiArrayStacker
                                
 from opAutocontextClassification import createAutocontextFeatureOperators
+from opAutocontextBlockwise import OpAutocontextBlockwisePrediction
 
 
 class OpAutocontextBatch( Operator ):
@@ -33,6 +34,13 @@ class OpAutocontextBatch( Operator ):
     MaxLabelValue = InputSlot()
     AutocontextIterations = InputSlot()
     
+    # If True, the final predictions are computed block by block, running all iterations
+    #  on each block (see OpAutocontextBlockwisePrediction) instead of through the cached
+    #  per-iteration operator chain.  Must be set before the operators are set up.
+    #  Both modes output the predictions of the last iteration.
+    Blockwise = InputSlot(value=False)
+    BlockShape = InputSlot(optional=True)
+    
     PredictionProbabilities = OutputSlot()
     #PixelOnlyPredictions = OutputSlot()
     
@@ -47,6 +55,17 @@ class OpAutocontextBatch( Operator ):
         self.predictors = []
         self.prediction_caches = []
         
+        if self.Blockwise.value:
+            self.autocontext_caches = []
+            self.opBlockwise = OpAutocontextBlockwisePrediction( parent=self )
+            self.opBlockwise.Classifiers.connect( self.Classifiers )
+            self.opBlockwise.FeatureImage.connect( self.FeatureImage )
+            self.opBlockwise.MaxLabelValue.connect( self.MaxLabelValue )
+            self.opBlockwise.AutocontextIterations.connect( self.AutocontextIterations )
+            self.opBlockwise.BlockShape.connect( self.BlockShape )
+            self.PredictionProbabilities.connect( self.opBlockwise.PredictionProbabilities )
+            return
+        
         #niter = len(self.Classifiers)
         niter = self.AutocontextIterations.value
         for i in range(niter):
@@ -102,8 +121,8 @@ class OpAutocontextBatch( Operator ):
         for i in range(1, niter):
             self.predictors[i].inputs['Image'].connect(self.autocontext_caches[i-1].outputs["Output"])
         
-        #self.PixelOnlyPredictions.connect(self.predictors[-1].PMaps)    
-        self.PredictionProbabilities.connect(self.predictors[0].PMaps)
+        #self.PixelOnlyPredictions.connect(self.predictors[0].PMaps)    
+        self.PredictionProbabilities.connect(self.predictors[-1].PMaps)
         
     def setupOutputs(self):
         print "calling setupOutputs"
@@ -0,0 +1,201 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import itertools
+from functools import partial
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, RequestPool
+from lazyflow.operators import OpPredictRandomForest
+
+from opAutocontextClassification import AUTOCONTEXT_RADII
+
+try:
+    from context.operators.contextVariance import OpContextVariance
+except ImportError:
+    # opAutocontextClassification already warns about the missing module.
+    pass
+
+import logging
+logger = logging.getLogger(__name__)
+
+class OpAutocontextBlockwisePrediction( Operator ):
+    """
+    Computes the prediction of the last autocontext iteration one spatial block
+    at a time, running all iterations on the block before moving on to the next.
+
+    For each block, the pixel features are requested once, with the halo needed
+    by all iterations (each iteration's context features reach AUTOCONTEXT_RADII
+    further out).  Each iteration then predicts on a region that shrinks by one
+    context halo, its context features are stacked with the pixel features just
+    like OpAutocontextBatch does, and the intermediate predictions and stacks are
+    dropped as soon as the next iteration has them.  Nothing is cached, so peak
+    memory depends on the block size, not on the number of iterations.
+
+    Each entry of AUTOCONTEXT_RADII is given in x,y,z order (the smallest radius
+    is the one along z, the anisotropic axis).  When the spatial axes of the
+    image are in x,y,z order, the halo is split per axis accordingly; for any
+    other order, the largest radius is used along every spatial axis, so the
+    halo is large enough however OpContextVariance maps the radii.
+    """
+    name = "OpAutocontextBlockwisePrediction"
+
+    Classifiers = InputSlot(level=1)
+    FeatureImage = InputSlot()
+    MaxLabelValue = InputSlot()
+    AutocontextIterations = InputSlot()
+    BlockShape = InputSlot(optional=True) # Per-axis block shape. If not given, BlockDims is used.
+
+    PredictionProbabilities = OutputSlot()
+
+    # Default block dimensions (the channel axis is never split)
+    BlockDims = { 't' : 1, 'z' : 64, 'y' : 256, 'x' : 256 }
+
+    def setupOutputs(self):
+        self.PredictionProbabilities.meta.assignFrom( self.FeatureImage.meta )
+        self.PredictionProbabilities.meta.dtype = numpy.float32
+
+        channelIndex = self.FeatureImage.meta.axistags.index('c')
+        shape = list( self.FeatureImage.meta.shape )
+        shape[channelIndex] = self.MaxLabelValue.value
+        self.PredictionProbabilities.meta.shape = tuple(shape)
+        self.PredictionProbabilities.meta.drange = (0.0, 1.0)
+
+    def _blockShape(self):
+        shape = self.PredictionProbabilities.meta.shape
+        if self.BlockShape.ready():
+            blockShape = self.BlockShape.value
+        else:
+            blockShape = [ self.BlockDims.get(tag.key, s)
+                           for tag, s in zip( self.FeatureImage.meta.axistags, shape ) ]
+        return tuple( min(b, s) for b, s in zip( blockShape, shape ) )
+
+    def _contextHalo(self):
+        """
+        How far the context features of one iteration reach along each axis.
+        """
+        keys = [ tag.key for tag in self.FeatureImage.meta.axistags ]
+        spatialKeys = [ k for k in keys if k in 'xyz' ]
+        if spatialKeys == list('xyz')[:len(spatialKeys)]:
+            maxRadius = numpy.max( AUTOCONTEXT_RADII, axis=0 )
+            radiusByKey = dict( zip( 'xyz', maxRadius ) )
+        else:
+            radiusByKey = dict.fromkeys( 'xyz', numpy.max( AUTOCONTEXT_RADII ) )
+        return numpy.array( [ radiusByKey.get(k, 0) for k in keys ] )
+
+    def execute(self, slot, subindex, roi, result):
+        blockShape = self._blockShape()
+        ranges = [ xrange( (a // b) * b, c, b ) for a, c, b in zip( roi.start, roi.stop, blockShape ) ]
+
+        pool = RequestPool()
+        for blockStart in itertools.product( *ranges ):
+            blockStop = numpy.minimum( numpy.add( blockStart, blockShape ), roi.stop )
+            blockStart = numpy.maximum( blockStart, roi.start )
+            pool.add( Request( partial( self._predictBlock, blockStart, blockStop, roi, result ) ) )
+        pool.wait()
+        pool.clean()
+
+        return result
+
+    def _predictBlock(self, blockStart, blockStop, roi, result):
+        niter = self.AutocontextIterations.value
+        axistags = self.FeatureImage.meta.axistags
+        channelIndex = axistags.index('c')
+        shape = numpy.array( self.FeatureImage.meta.shape )
+        halo = self._contextHalo()
+
+        def region(iteration):
+            # The region the given iteration has to predict,
+            #  with all feature channels.
+            margin = (niter - 1 - iteration) * halo
+            start = numpy.maximum( blockStart - margin, 0 )
+            stop = numpy.minimum( blockStop + margin, shape )
+            start[channelIndex] = 0
+            stop[channelIndex] = shape[channelIndex]
+            return start, stop
+
+        def within(start, stop, outerStart, channelStop=None):
+            key = [ slice(a - o, b - o) for a, b, o in zip( start, stop, outerStart ) ]
+            key[channelIndex] = slice(None, channelStop)
+            return tuple(key)
+
+        featureStart, featureStop = region(0)
+        features = self.FeatureImage( list(featureStart), list(featureStop) ).wait()
+
+        stageStart = featureStart
+        stageImage = features
+        for iteration in range( niter ):
+            predictions = self._predict( iteration, stageImage )
+            stageImage = None
+            if iteration == niter - 1:
+                break
+
+            context = self._contextFeatures( predictions )
+            predictions = None
+
+            nextStart, nextStop = region( iteration + 1 )
+            # Same channel order as the stacks of OpAutocontextBatch: context features first.
+            stageImage = numpy.concatenate( ( context[ within( nextStart, nextStop, stageStart ) ],
+                                              features[ within( nextStart, nextStop, featureStart ) ] ),
+                                            axis=channelIndex )
+            context = None
+            stageStart = nextStart
+
+        blockKey = list( within( blockStart, blockStop, stageStart ) )
+        blockKey[channelIndex] = slice( roi.start[channelIndex], roi.stop[channelIndex] )
+        resultKey = [ slice(a - r, b - r) for a, b, r in zip( blockStart, blockStop, roi.start ) ]
+        resultKey[channelIndex] = slice(None)
+        result[ tuple(resultKey) ] = predictions[ tuple(blockKey) ]
+
+    def _predict(self, iteration, image):
+        opPredict = OpPredictRandomForest( graph=Graph() )
+        opPredict.Classifier.setValue( self.Classifiers[iteration].value )
+        opPredict.LabelsCount.setValue( self.MaxLabelValue.value )
+        opPredict.Image.setValue( vigra.taggedView( image, self.FeatureImage.meta.axistags ) )
+        predictions = opPredict.PMaps[:].wait()
+        opPredict.cleanUp()
+        return predictions
+
+    def _contextFeatures(self, predictions):
+        opContext = OpContextVariance( graph=Graph() )
+        opContext.Radii.setValue( AUTOCONTEXT_RADII )
+        opContext.Input.setValue( vigra.taggedView( predictions, self.FeatureImage.meta.axistags ) )
+        context = opContext.Output[:].wait()
+        opContext.cleanUp()
+        return context
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot == self.FeatureImage:
+            # Context features spread the change by one halo per iteration.
+            margin = max( 0, self.AutocontextIterations.value - 1 ) * self._contextHalo()
+            start = numpy.maximum( numpy.subtract( roi.start, margin ), 0 )
+            stop = numpy.minimum( numpy.add( roi.stop, margin ), self.FeatureImage.meta.shape )
+            channelIndex = self.FeatureImage.meta.axistags.index('c')
+            start[channelIndex] = 0
+            stop[channelIndex] = self.PredictionProbabilities.meta.shape[channelIndex]
+            self.PredictionProbabilities.setDirty( list(start), list(stop) )
+        elif slot == self.BlockShape:
+            # Same result, different blocks.
+            pass
+        else:
+            self.PredictionProbabilities.setDirty( slice(None) )
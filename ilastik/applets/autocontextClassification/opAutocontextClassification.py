@@ -429,6 +429,10 @@ class OpAutocontextClassification( Operator ):
         return OperatorSubView(self, laneIndex)
 
 
+#Radii from last year
+AUTOCONTEXT_RADII = [[1, 1, 1], [3, 3, 1], [5, 5, 1], [7, 7, 2], [10, 10, 2], \
+                     [15, 15, 3], [20, 20, 3], [30, 30, 3], [40, 40, 3]]
+
 def createAutocontextFeatureOperators(oper, wrap):
         #FIXME: just to test, create some array pipers
         ops = []
@@ -437,9 +441,7 @@ def createAutocontextFeatureOperators(oper, wrap):
         else:
             ops.append(OpContextVariance(parent=oper))
         
-        #Radii from last year
-        ops[0].inputs["Radii"].setValue([[1, 1, 1], [3, 3, 1], [5, 5, 1], [7, 7, 2], [10, 10, 2], \
-                  [15, 15, 3], [20, 20, 3], [30, 30, 3], [40, 40, 3]])
+        ops[0].inputs["Radii"].setValue(AUTOCONTEXT_RADII)
         
         #ops[0].inputs["Radii"].setValue([[1, 1, 1], [3, 3, 3], [5, 5, 5], [7, 7, 7], [10, 10, 10], \
         #          [15, 15, 10], [20, 20, 15], [30, 30, 20], [40, 40, 30]])
@@ -414,6 +414,34 @@ class SerialBlockSlot(SerialSlot):
 
         return False
 
+    def _getBlock(self, index, slicing):
+        """
+        Request the given block of the slot at the given lane.
+        If shrink_to_bb is set, the block is reduced to its nonzero bounding box.
+
+        Returns (slicing, block), where slicing is the (possibly shrunken) slicing of the block.
+        """
+        if not isinstance(slicing[0], slice):
+            slicing = roiToSlice(*slicing)
+
+        block = self.slot[index][slicing].wait()
+
+        if self._shrink_to_bb:
+            nonzero_coords = numpy.nonzero(block)
+            if len(nonzero_coords[0]) > 0:
+                block_start = sliceToRoi( slicing, (0,)*len(slicing) )[0]
+                block_bounding_box_start = numpy.array( map( numpy.min, nonzero_coords ) )
+                block_bounding_box_stop = 1 + numpy.array( map( numpy.max, nonzero_coords ) )
+                block_slicing = roiToSlice( block_bounding_box_start, block_bounding_box_stop )
+                bounding_box_roi = numpy.array([block_bounding_box_start, block_bounding_box_stop])
+                bounding_box_roi += block_start
+                
+                # Overwrite the vars that are written to the file
+                slicing = roiToSlice(*bounding_box_roi)
+                block = block[block_slicing]
+
+        return slicing, block
+
     @timeLogged(logger, logging.DEBUG)
     def _serialize(self, group, name, slot):
         logger.debug("Serializing BlockSlot: {}".format( self.name ))
@@ -424,26 +452,9 @@ class SerialBlockSlot(SerialSlot):
             subgroup = mygroup.create_group(subname)
             nonZeroBlocks = self.blockslot[index].value
             for blockIndex, slicing in enumerate(nonZeroBlocks):
-                if not isinstance(slicing[0], slice):
-                    slicing = roiToSlice(*slicing)
-
-                block = self.slot[index][slicing].wait()
+                slicing, block = self._getBlock(index, slicing)
                 blockName = 'block{:04d}'.format(blockIndex)
 
-                if self._shrink_to_bb:
-                    nonzero_coords = numpy.nonzero(block)
-                    if len(nonzero_coords[0]) > 0:
-                        block_start = sliceToRoi( slicing, (0,)*len(slicing) )[0]
-                        block_bounding_box_start = numpy.array( map( numpy.min, nonzero_coords ) )
-                        block_bounding_box_stop = 1 + numpy.array( map( numpy.max, nonzero_coords ) )
-                        block_slicing = roiToSlice( block_bounding_box_start, block_bounding_box_stop )
-                        bounding_box_roi = numpy.array([block_bounding_box_start, block_bounding_box_stop])
-                        bounding_box_roi += block_start
-                        
-                        # Overwrite the vars that are written to the file
-                        slicing = roiToSlice(*bounding_box_roi)
-                        block = block[block_slicing]
-
                 # If we have a masked array, convert it to a structured array so that h5py can handle it.
                 if slot[index].meta.has_mask:
                     mygroup.attrs["meta.has_mask"] = True
@@ -478,30 +489,171 @@ class SerialBlockSlot(SerialSlot):
             return int(index_capture.match(s).groups()[0])
         for index, t in enumerate(sorted(mygroup.items(), key=lambda (k,v): extract_index(k))):
             groupName, labelGroup = t
-            for blockData in labelGroup.values():
-                slicing = stringToSlicing(blockData.attrs['blockSlice'])
-
-                # If it is suppose to be a masked array,
-                # deserialize the pieces and rebuild the masked array.
-                assert slot[index].meta.has_mask == mygroup.attrs.get("meta.has_mask"), \
-                       "The slot and stored data have different values for" + \
-                       " `has_mask`. They are" + \
-                       " `bool(slot[index].meta.has_mask)`=" + \
-                       repr(bool(slot[index].meta.has_mask)) + " and" + \
-                       " `mygroup.attrs.get(\"meta.has_mask\", False)`=" + \
-                       repr(mygroup.attrs.get("meta.has_mask", False)) + \
-                       ". Please fix this to proceed with deserialization."
-                if slot[index].meta.has_mask:
-                    blockArray = numpy.ma.masked_array(
-                        blockData["data"][()],
-                        mask=blockData["mask"][()],
-                        fill_value=blockData["fill_value"][()],
-                        shrink=False
-                    )
-                else:
-                    blockArray = blockData[...]
+            self._deserializeLane(mygroup, labelGroup, index, slot)
+
+    def _deserializeLane(self, mygroup, labelGroup, index, slot):
+        """
+        Load all blocks of the given lane group into self.inslot[index].
+        """
+        for blockData in labelGroup.values():
+            slicing = stringToSlicing(blockData.attrs['blockSlice'])
+
+            # If it is suppose to be a masked array,
+            # deserialize the pieces and rebuild the masked array.
+            assert slot[index].meta.has_mask == mygroup.attrs.get("meta.has_mask"), \
+                   "The slot and stored data have different values for" + \
+                   " `has_mask`. They are" + \
+                   " `bool(slot[index].meta.has_mask)`=" + \
+                   repr(bool(slot[index].meta.has_mask)) + " and" + \
+                   " `mygroup.attrs.get(\"meta.has_mask\", False)`=" + \
+                   repr(mygroup.attrs.get("meta.has_mask", False)) + \
+                   ". Please fix this to proceed with deserialization."
+            if slot[index].meta.has_mask:
+                blockArray = numpy.ma.masked_array(
+                    blockData["data"][()],
+                    mask=blockData["mask"][()],
+                    fill_value=blockData["fill_value"][()],
+                    shrink=False
+                )
+            else:
+                blockArray = blockData[...]
+
+            self.inslot[index][slicing] = blockArray
+
+class SerialChunkedBlockSlot(SerialBlockSlot):
+    """
+    Like SerialBlockSlot, but stores all nonzero blocks of a lane in a single
+    chunked, compressed dataset instead of one small dataset per block.
+
+    Each lane group contains:
+
+    - ``blockData``: the flattened contents of all blocks, one after the other.
+    - ``blockMask``: (masked slots only) the flattened masks, parallel to ``blockData``.
+    - ``blockIndex``: one row per block, ``[start..., stop..., offset]``, where
+      offset is the position of the block's first element in ``blockData``.
+
+    Since the data is chunked, any single block can be read without touching the
+    others (see :py:meth:`readBlock`).
+    Lane groups that were written by SerialBlockSlot are still read.
+    """
+    # Number of elements per hdf5 chunk of the blockData dataset
+    chunkSize = 2**18
+
+    def shouldSerialize(self, group):
+        if self.dirty:
+            return True
+        if self.name not in group:
+            return True
+
+        mygroup = group[self.name]
+        for index in range(len(self.blockslot)):
+            subname = self.subname.format(index)
+            if subname not in mygroup:
+                return True
+            subgroup = mygroup[subname]
+            if 'blockIndex' not in subgroup or 'blockData' not in subgroup:
+                return True
+            if len(subgroup['blockIndex']) != len(self.blockslot[index].value):
+                return True
+        return False
+
+    @timeLogged(logger, logging.DEBUG)
+    def _serialize(self, group, name, slot):
+        logger.debug("Serializing ChunkedBlockSlot: {}".format( self.name ))
+        mygroup = group.create_group(name)
+        for index in range(len(self.blockslot)):
+            subgroup = mygroup.create_group(self.subname.format(index))
+            has_mask = bool(slot[index].meta.has_mask)
+            if has_mask:
+                mygroup.attrs["meta.has_mask"] = True
+            self._serializeLane(subgroup, index, has_mask)
+
+    def _serializeLane(self, subgroup, index, has_mask):
+        ndim = len(self.slot[index].meta.shape)
+        data = subgroup.create_dataset('blockData',
+                                       shape=(0,),
+                                       maxshape=(None,),
+                                       dtype=self.slot[index].meta.dtype,
+                                       chunks=(self.chunkSize,),
+                                       compression="gzip",
+                                       compression_opts=2)
+        if has_mask:
+            mask = subgroup.create_dataset('blockMask',
+                                           shape=(0,),
+                                           maxshape=(None,),
+                                           dtype=bool,
+                                           chunks=(self.chunkSize,),
+                                           compression="gzip",
+                                           compression_opts=2)
+
+        blockIndex = []
+        offset = 0
+        for slicing in self.blockslot[index].value:
+            slicing, block = self._getBlock(index, slicing)
+            start, stop = sliceToRoi(slicing, self.slot[index].meta.shape)
+            size = block.size
+
+            data.resize((offset + size,))
+            if has_mask:
+                mask.resize((offset + size,))
+                data[offset:offset + size] = block.data.flat
+                mask[offset:offset + size] = numpy.ma.getmaskarray(block).flat
+                subgroup.attrs['fill_value'] = block.fill_value
+            else:
+                data[offset:offset + size] = block.flat
+
+            blockIndex.append(list(start) + list(stop) + [offset])
+            offset += size
+
+        blockIndex = numpy.array(blockIndex, dtype=numpy.int64).reshape((-1, 2*ndim + 1))
+        subgroup.create_dataset('blockIndex', data=blockIndex)
+
+    @staticmethod
+    def readBlock(subgroup, blockNumber):
+        """
+        Read a single block from a lane group written by this class.
+
+        Returns (slicing, block).
+        """
+        row = subgroup['blockIndex'][blockNumber]
+        ndim = (len(row) - 1) // 2
+        start, stop, offset = row[:ndim], row[ndim:2*ndim], row[-1]
+        shape = tuple(stop - start)
+        size = int(numpy.prod(shape))
+        block = subgroup['blockData'][offset:offset + size].reshape(shape)
+        if 'blockMask' in subgroup:
+            block = numpy.ma.masked_array(
+                block,
+                mask=subgroup['blockMask'][offset:offset + size].reshape(shape),
+                fill_value=subgroup.attrs.get('fill_value'),
+                shrink=False
+            )
+        return roiToSlice(start, stop), block
+
+    @classmethod
+    def iterBlocks(cls, subgroup):
+        """
+        Iterate over the blocks of a lane group as arrays, regardless of
+        whether it was written by this class or by SerialBlockSlot.
+        """
+        if 'blockIndex' in subgroup:
+            for blockNumber in range(len(subgroup['blockIndex'])):
+                yield cls.readBlock(subgroup, blockNumber)[1]
+        else:
+            for block in subgroup.values():
+                yield block[:]
+
+    def _deserializeLane(self, mygroup, labelGroup, index, slot):
+        if 'blockIndex' not in labelGroup:
+            # This lane was saved in the old one-dataset-per-block format.
+            super(SerialChunkedBlockSlot, self)._deserializeLane(mygroup, labelGroup, index, slot)
+            return
 
-                self.inslot[index][slicing] = blockArray
+        assert bool(slot[index].meta.has_mask) == bool(mygroup.attrs.get("meta.has_mask", False)), \
+               "The slot and stored data have different values for `has_mask`."
+        for blockNumber in range(len(labelGroup['blockIndex'])):
+            slicing, block = self.readBlock(labelGroup, blockNumber)
+            self.inslot[index][slicing] = block
 
 class SerialHdf5BlockSlot(SerialBlockSlot):
 
@@ -80,6 +80,7 @@ class OpTrainCounter(Operator):
                   InputSlot("SelectedOption", stype = "object"),
                   InputSlot("Ntrees", stype = "int"), #RF parameter
                   InputSlot("MaxDepth", stype = "object"), #RF parameter, None means grow until purity
+                  InputSlot("MaxSamples", stype = "object", value = None), #training samples per regressor, None means all
                   InputSlot("BoxConstraintRois", level = 1, stype = "list", value = []),
                   InputSlot("BoxConstraintValues", level = 1, stype = "list", value = []),
                   InputSlot("UpperBound")
@@ -130,6 +131,7 @@ class OpTrainCounter(Operator):
         self.C.setValue(params["C"])
         self.Ntrees.setValue(params["ntrees"])
         self.MaxDepth.setValue(params["maxdepth"])
+        self.MaxSamples.setValue(params.get("maxSamples", None))
         self.SelectedOption.setValue(params["method"])
 
         self.fixClassifier.setValue(fix)
@@ -145,7 +147,8 @@ class OpTrainCounter(Operator):
                       "epsilon" : self.Epsilon.value,
                       "C" : self.C.value,
                       "ntrees" : self.Ntrees.value,
-                      "maxdepth" :self.MaxDepth.value
+                      "maxdepth" :self.MaxDepth.value,
+                      "maxSamples" : self.MaxSamples.value
                      }
             self._svr.set_params(**params)
             #self.Classifier.setValue(self._svr)
@@ -394,33 +397,25 @@ class OpPredictCounter(Operator):
         newKey = key[:-1]
         newKey += (slice(0,self.inputs["Image"].meta.shape[-1],None),)
 
-        res = self.inputs["Image"][newKey].wait()
-
-        shape=res.shape
-        prod = np.prod(shape[:-1])
-        res.shape = (prod, shape[-1])
-        features=res
-
-        predictions = [0]*len(forests)
+        features = self.inputs["Image"][newKey].wait()
 
         t2 = time.time()
 
+        # Each regressor predicts blockwise straight into its own output channel, so
+        # neither the per-regressor predictions nor the normalized features of the
+        # whole roi are held in memory.
+        channelStart, channelStop = roi.start[-1], roi.stop[-1]
         pool = RequestPool()
         
         def predict_forest(i):
-            predictions[i] = forests[i].predict(np.asarray(features, dtype = np.float32))
-            predictions[i] = predictions[i].reshape(result.shape[:-1])
+            forests[i].predictMean(features, out = result[..., i - channelStart])
 
 
-        for i,f in enumerate(forests):
+        for i in range(channelStart, min(channelStop, len(forests))):
             req = pool.request(partial(predict_forest,i))
 
         pool.wait()
         pool.clean()
-        #predictions[0] = forests[0].predict(np.asarray(features, dtype = np.float32), normalize = False)
-        #predictions[0] = predictions[0].reshape(result.shape)
-        prediction=np.dstack(predictions)
-        result[...] = prediction
 
         # If our LabelsCount is higher than the number of labels in the training set,
         # then our results aren't really valid.  FIXME !!!
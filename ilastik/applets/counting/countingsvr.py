@@ -21,6 +21,7 @@
 import numpy as np
 import vigra
 import itertools
+from functools import partial
 try:
     import gurobipy as gu
 except:
@@ -29,6 +30,8 @@ except:
 import h5py, cPickle
 import sys
 
+from lazyflow.request import RequestPool
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -371,8 +374,13 @@ class SVR(object):
     ]
 
 
+    # Number of pixels that are passed to the regressors at once during prediction
+    PREDICTION_BLOCKSIZE = 256 * 256
+
     def __init__(self, method = options[0]["method"], Sigma = 2.5, C = 1, epsilon = 0.000, \
                   ntrees=10, maxdepth=50, minmax=None, #RF parameters, maxdepth=None means grows until purity
+                 maxSamples=None, #maximum number of training samples per regressor, None means use all
+                 seed=None, #seed of the random sampling (and the random forests), None means random
                  **kwargs
                  ):
         """
@@ -392,6 +400,8 @@ class SVR(object):
         self._ntrees=ntrees
         self._maxdepth=maxdepth
         self._minmax = minmax
+        self._maxSamples = maxSamples
+        self._seed = seed
         if minmax:
             self._scalingFactor = minmax[1] - minmax[0]
             self._scalingFactor[self._scalingFactor == 0] = 1
@@ -483,7 +493,7 @@ class SVR(object):
         self.fitPrepared(newImg[mapping,:], newDot[mapping], tags, boxConstraints, numRegressors)
 
 
-    def splitBoxConstraints(self, numRegressors, boxConstraints):
+    def splitBoxConstraints(self, numRegressors, boxConstraints, rng = np.random):
         
         if boxConstraints is None or type(boxConstraints) is not dict:
             return [None for i in range(numRegressors)]
@@ -492,7 +502,7 @@ class SVR(object):
         boxFeatures = boxConstraints["boxFeatures"]
         indices = np.arange(boxFeatures.shape[0])
         assert(boxFeatures.shape[0] == boxIndices[-1])
-        np.random.shuffle(indices)
+        rng.shuffle(indices)
         splits = np.array_split(indices, numRegressors)
         boxConstraintList = []
         
@@ -524,6 +534,64 @@ class SVR(object):
 
 
 
+    def subsampleData(self, img, dot, tags, boxConstraints, maxSamples, rng = np.random):
+        """
+        Reduce the training data to at most maxSamples rows.
+
+        The density (foreground) rows are kept, since they carry the count information,
+        and the background rows are drawn uniformly from the remaining budget.  If there
+        are more than maxSamples foreground rows, maxSamples of them are drawn uniformly
+        and no background rows are kept.  Box constraints
+        are subsampled to the same budget, proportionally to the size of each box, and the
+        box values are rescaled to the number of pixels that were kept.
+
+        rng is the numpy RandomState the samples are drawn with.
+        Returns the subsampled (img, dot, tags, boxConstraints).
+        """
+        if maxSamples is None:
+            return img, dot, tags, boxConstraints
+
+        numPos, numNeg = tags[0], tags[1]
+        if numPos + numNeg > maxSamples:
+            if numPos > maxSamples:
+                posIndices = np.sort(rng.choice(numPos, size = maxSamples, replace = False))
+            else:
+                posIndices = np.arange(numPos)
+            numKeep = maxSamples - len(posIndices)
+            negIndices = rng.choice(numNeg, size = min(numKeep, numNeg), replace = False)
+            negIndices.sort()
+            indices = np.concatenate((posIndices, numPos + negIndices))
+            img = img[indices, :]
+            dot = dot[indices]
+            tags = [len(posIndices), len(negIndices)]
+
+        if boxConstraints is None or type(boxConstraints) is not dict:
+            return img, dot, tags, boxConstraints
+
+        boxIndices = boxConstraints["boxIndices"]
+        boxValues = boxConstraints["boxValues"]
+        boxFeatures = boxConstraints["boxFeatures"]
+        numBoxPixels = boxIndices[-1]
+        if numBoxPixels <= maxSamples:
+            return img, dot, tags, boxConstraints
+
+        fraction = float(maxSamples) / numBoxPixels
+        subBoxIndices = [0]
+        subBoxValues = []
+        subBoxFeatures = []
+        for j, value in enumerate(boxValues):
+            boxSize = boxIndices[j + 1] - boxIndices[j]
+            numKeep = max(int(boxSize * fraction), 1)
+            keep = boxIndices[j] + np.sort(rng.choice(boxSize, size = numKeep, replace = False))
+            subBoxFeatures.append(boxFeatures[keep, :])
+            subBoxValues.append(value * float(numKeep) / boxSize)
+            subBoxIndices.append(subBoxIndices[-1] + numKeep)
+
+        boxConstraints = {"boxValues" : np.array(subBoxValues), "boxIndices" : np.array(subBoxIndices),
+                          "boxFeatures" : np.concatenate(subBoxFeatures, axis = 0)}
+        return img, dot, tags, boxConstraints
+
+
     def fitPrepared(self, img, dot, tags, boxConstraints = [], numRegressors = 1, trainAll = True):
         if trainAll:
             self._regressor = [None for i in range(numRegressors)]
@@ -536,46 +604,62 @@ class SVR(object):
         numVariables = sum(img.shape[:-1])
         if numVariables == 0:
             return
-       
+
+        maxSamples = getattr(self, "_maxSamples", None)
+
+        # Each regressor draws its samples from its own RandomState (the regressors
+        #  are trained in parallel, and the global one is not thread-safe).
+        seeds = np.random.RandomState(getattr(self, "_seed", None)).randint(np.iinfo(np.int32).max,
+                                                                            size = numRegressors + 1)
+
         if numRegressors == 1:
-            try:
-                self._regressor[0] = self._fit(img, dot, tags, boxConstraints)
-            except:
-                pass
+            rng = np.random.RandomState(seeds[0])
+            img, dot, tags, boxConstraints = self.subsampleData(img, dot, tags, boxConstraints, maxSamples, rng)
+            self._regressor[0] = self._fit(img, dot, tags, boxConstraints, rng)
             return 
         
-        splitBoxConstraints = self.splitBoxConstraints(numRegressors, boxConstraints)
-        
-        for i in range(numRegressors):
-            indices = np.random.randint(0,numVariables, size = numVariables / numRegressors)    
+        splitBoxConstraints = self.splitBoxConstraints(numRegressors, boxConstraints,
+                                                       np.random.RandomState(seeds[-1]))
+
+        numSamples = numVariables / numRegressors
+        if maxSamples is not None:
+            numSamples = min(numSamples, maxSamples)
+
+        def train(i):
+            rng = np.random.RandomState(seeds[i])
+            indices = rng.randint(0,numVariables, size = numSamples)
             indices.sort()
             cut = np.where(indices < tags[0])
             newTags = [len(cut[0]), len(indices) - len(cut[0])]
 
-            
-            if numVariables == 0:
-                return 
-            #tags.append(len(boxConstraints))
-                
             newBoxConstraints = splitBoxConstraints[i]
+            if maxSamples is not None:
+                _, _, _, newBoxConstraints = self.subsampleData(img[:0], dot[:0], [0, 0], newBoxConstraints,
+                                                                maxSamples, rng)
 
             try:
-                regressor = self._fit(img[indices, :], dot[indices], newTags, newBoxConstraints)
-                self._regressor[i] = regressor
+                self._regressor[i] = self._fit(img[indices, :], dot[indices], newTags, newBoxConstraints, rng)
             except RuntimeError as err:
                 logger.error("Error while training the regressor")
                 raise err
-                pass
+
+        if not trainAll:
             #train only one regressor
-            if not trainAll:
-                break
+            train(0)
+        else:
+            #the ensemble members are independent of each other and can be trained in parallel
+            pool = RequestPool()
+            for i in range(numRegressors):
+                pool.request(partial(train, i))
+            pool.wait()
+            pool.clean()
 
         self._numRegressors = len(self._regressor)
 
         return 
     
 
-    def _fit(self, image, dot, tags, boxConstraints = []):
+    def _fit(self, image, dot, tags, boxConstraints = [], rng = None):
         img = self.normalize(image)
         if type(boxConstraints) is dict:
             boxConstraints["boxFeatures"] = self.normalize(boxConstraints["boxFeatures"])
@@ -583,7 +667,7 @@ class SVR(object):
         if self._method == "RandomForest":
             from sklearn.ensemble import RandomForestRegressor as RFR
             
-            regressor = RFR(n_estimators=self._ntrees,max_depth=self._maxdepth)
+            regressor = RFR(n_estimators=self._ntrees,max_depth=self._maxdepth,random_state=rng)
             regressor.fit(img, dot)
 
         elif self._method == "svrBoxed-gurobi":
@@ -606,25 +690,59 @@ class SVR(object):
         
 
 
-    def predict(self, oldImage):
+    def predict(self, oldImage, blockSize = None):
+        """
+        Return the prediction of every regressor as an additional last axis.
+        The image is processed in blocks of blockSize pixels, so that only one block
+        of normalized features is held in memory at a time.
+        """
         oldShape = oldImage.shape
-        resShape = oldShape[:-1]
-        image = np.copy(oldImage.reshape((-1, oldImage.shape[-1])))
-        image = self.normalize(image)
-
-        reslist = []
-        for r in self._regressor:
-            if r is None:
-                reslist.append(np.zeros(oldImage.shape[:-1]))
-            else:
-                reslist.append(r.predict(image))
-            res = np.dstack(reslist)
-            resShape = oldShape[:-1] + (len(self._regressor),)
-        
-        #res = np.zeros(oldShape[:-1])
-        res = res.view(np.ndarray)
+        image = oldImage.reshape((-1, oldShape[-1]))
+        res = np.zeros((image.shape[0], len(self._regressor)), dtype = np.float64)
+        for start, stop in self._predictionBlocks(image.shape[0], blockSize):
+            block = self.normalize(np.array(image[start:stop]))
+            for i, r in enumerate(self._regressor):
+                if r is not None:
+                    res[start:stop, i] = r.predict(block).reshape(-1)
+
         res[res < 0] = 0
-        return res.reshape(resShape)
+        return res.reshape(oldShape[:-1] + (len(self._regressor),))
+
+    def predictMean(self, oldImage, blockSize = None, out = None):
+        """
+        Return the mean prediction over all regressors, with the shape of the image
+        without its channel axis.  The ensemble mean is accumulated blockwise,
+        so the outputs of the individual regressors are never stacked.
+        If out is given (e.g. one channel of an operator's result), each block is
+        written into it directly.
+        """
+        oldShape = oldImage.shape
+        image = oldImage.reshape((-1, oldShape[-1]))
+        if out is None:
+            out = np.zeros(oldShape[:-1], dtype = np.float64)
+        assert out.shape == oldShape[:-1], "out must have the shape of the image without channels"
+        if len(self._regressor) == 0:
+            out[...] = 0
+            return out
+
+        for start, stop in self._predictionBlocks(image.shape[0], blockSize):
+            block = self.normalize(np.array(image[start:stop]))
+            res = np.zeros((stop - start,), dtype = np.float64)
+            for r in self._regressor:
+                if r is not None:
+                    pred = np.asarray(r.predict(block), dtype = np.float64).reshape(-1)
+                    np.maximum(pred, 0, out = pred)
+                    res += pred
+            res /= len(self._regressor)
+            # (out may be a non-contiguous view, flat writes in C order like the reshape above)
+            out.flat[start:stop] = res
+        return out
+
+    def _predictionBlocks(self, numPixels, blockSize = None):
+        if blockSize is None:
+            blockSize = self.PREDICTION_BLOCKSIZE
+        for start in range(0, numPixels, blockSize):
+            yield start, min(start + blockSize, numPixels)
 
     def writeHDF5(self, cachePath, targetname):
         f = h5py.File(cachePath)
@@ -640,7 +758,8 @@ class SVR(object):
             'C' : self._C,
             'epsilon' : self._epsilon,
             'ntrees' : self._ntrees,
-            'maxdepth' : self._maxdepth
+            'maxdepth' : self._maxdepth,
+            'maxSamples' : getattr(self, "_maxSamples", None)
             }
     
     def set_params(self, **params):
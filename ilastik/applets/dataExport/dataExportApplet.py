@@ -98,6 +98,8 @@ class DataExportApplet( Applet ):
         arg_parser.add_argument( '--output_format', help='Export file format', choices=all_format_names, required=False )
         arg_parser.add_argument( '--output_filename_format', help='Output file path, including special placeholders, e.g. /tmp/results_t{t_start}-t{t_stop}.h5', required=False )
         arg_parser.add_argument( '--output_internal_path', help='Specifies dataset name within an hdf5 dataset (applies to hdf5 output only), e.g. /volume/data', required=False )
+        arg_parser.add_argument( '--export_pyramid_levels', help='Also write this many 2x downsampled levels next to the exported dataset (applies to hdf5 output only)', type=int, required=False )
+        arg_parser.add_argument( '--pyramid_reduction', help='How the pyramid levels are downsampled: mean (probabilities) or mode (labels)', choices=['mean', 'mode'], required=False )
 
         arg_parser.add_argument( '--export_source', help='The data to export.  See the dropdown list on the Data Export page for choices.', required=False )
 
@@ -252,5 +254,11 @@ class DataExportApplet( Applet ):
         if parsed_args.output_format:
             opDataExport.OutputFormat.setValue( parsed_args.output_format )
 
+        if parsed_args.export_pyramid_levels is not None:
+            opDataExport.ExportPyramidLevels.setValue( parsed_args.export_pyramid_levels )
+
+        if parsed_args.pyramid_reduction:
+            opDataExport.PyramidReduction.setValue( parsed_args.pyramid_reduction )
+
         # Re-connect the 'transaction' slot to apply all settings at once.
         opDataExport.TransactionSlot.setValue(True)
@@ -64,6 +64,8 @@ class DataExportSerializer(AppletSerializer):
             SerialSlot(operator.OutputInternalPath),
             
             SerialSlot(operator.OutputFormat),
+            SerialSlot(operator.ExportPyramidLevels),
+            SerialSlot(operator.PyramidReduction),
         ]
         
         slots += extraSerialSlots
@@ -21,6 +21,7 @@
 import os
 import collections
 import numpy
+import h5py
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.utility import PathComponents, getPathVariants, format_known_keys
@@ -28,6 +29,8 @@ from lazyflow.operators.ioOperators import OpInputDataReader, OpFormattedDataExp
 from lazyflow.operators.generic import OpSubRegion
 from lazyflow.operators.valueProviders import OpMetadataInjector
 
+from opExportPyramid import OpH5PyramidWriter
+
 class OpDataExport(Operator):
     """
     Top-level operator for the export applet.
@@ -64,6 +67,11 @@ class OpDataExport(Operator):
     OutputFilenameFormat = InputSlot(value='{dataset_dir}/{nickname}_{result_type}') # A format string allowing {dataset_dir} {nickname}, {roi}, {x_start}, {x_stop}, etc.
     OutputInternalPath = InputSlot(value='exported_data')
     OutputFormat = InputSlot(value='hdf5')
+
+    # Multi-scale export (hdf5 only): number of 2x downsampled levels to write next to the 
+    #  full-resolution dataset, and how to reduce each 2x2(x2) window ('mean' or 'mode')
+    ExportPyramidLevels = InputSlot(value=0)
+    PyramidReduction = InputSlot(value='mean')
     
     ExportPath = OutputSlot() # Location of the saved file after export is complete.
     
@@ -262,11 +270,40 @@ class OpDataExport(Operator):
         # If we're not dirty, we don't have to do anything.
         if self.Dirty.value:
             self.cleanupOnDiskView()
-            self._opFormattedExport.run_export()
+            if self.ExportPyramidLevels.value > 0 and self.OutputFormat.value == 'hdf5':
+                self._run_pyramid_export()
+            else:
+                self._opFormattedExport.run_export()
             self.Dirty.setValue( False )
             self.setupOnDiskView()
             self._opImageOnDiskProvider.Dirty.setValue( False )
 
+    def _run_pyramid_export(self):
+        """
+        Export the full-resolution image and its downsampled pyramid levels in a single 
+        pass over the data.  See OpH5PyramidWriter for the layout of the file.
+        """
+        pathComp = PathComponents( self.ExportPath.value )
+        internalPath = pathComp.internalPath or self._opFormattedExport.OutputInternalPath.value
+        if not os.path.exists( pathComp.externalDirectory ):
+            os.makedirs( pathComp.externalDirectory )
+
+        with h5py.File( pathComp.externalPath, 'a' ) as f:
+            opWriter = OpH5PyramidWriter( parent=self )
+            try:
+                opWriter.progressSignal.subscribe( self.progressSignal )
+                opWriter.hdf5File.setValue( f )
+                opWriter.hdf5Path.setValue( internalPath )
+                opWriter.Levels.setValue( self.ExportPyramidLevels.value )
+                opWriter.Reduction.setValue( self.PyramidReduction.value )
+                opWriter.Image.connect( self._opFormattedExport.ImageToExport )
+
+                # The first call triggers the export
+                opWriter.WriteImage.value
+            finally:
+                opWriter.cleanUp()
+                self.progressSignal( 100 )
+
     def run_export_to_array(self):
         # This function can be used to export the results to an in-memory array, instead of to disk
         # (Typically used from pure-python clients in batch mode.)
@@ -0,0 +1,213 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import threading
+
+import numpy
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot, OrderedSignal
+from lazyflow.utility import BigRequestStreamer
+
+import logging
+logger = logging.getLogger(__name__)
+
+PYRAMID_REDUCTIONS = ('mean', 'mode')
+
+def pyramidLevelPath( internalPath, level ):
+    """
+    Name of the dataset for the given pyramid level.
+    Level 0 is the full-resolution dataset itself.
+    """
+    if level == 0:
+        return internalPath
+    return "{}_level{}".format( internalPath.rstrip('/'), level )
+
+def downsample2x( block, spatialIndexes, reduction ):
+    """
+    Reduce the given spatial axes of block by a factor of 2.
+
+    Axes with odd length are padded by repeating the last slice, so that the
+    border pixels of the result are reduced over the existing pixels only.
+    (For a factor of 2, padding by repetition keeps both mean and mode exact.)
+    """
+    padding = [ (0, 0) ] * block.ndim
+    for i in spatialIndexes:
+        padding[i] = (0, block.shape[i] % 2)
+    if any( p != (0, 0) for p in padding ):
+        block = numpy.pad( block, padding, mode='edge' )
+
+    if reduction == 'mean':
+        reduced = block.astype( numpy.float64 )
+        for i in spatialIndexes:
+            reduced = reduced.reshape( reduced.shape[:i] + (reduced.shape[i]//2, 2) + reduced.shape[i+1:] )
+            reduced = reduced.mean( axis=i+1 )
+        if numpy.issubdtype( block.dtype, numpy.integer ):
+            reduced = numpy.round( reduced )
+        return reduced.astype( block.dtype )
+
+    if reduction == 'mode':
+        # Split each spatial axis into (n/2, 2), then move all window axes to the end
+        #  and flatten them into a single axis of 2**d candidates.
+        windows = block
+        windowAxes = []
+        for offset, i in enumerate( sorted(spatialIndexes) ):
+            i += offset
+            windows = windows.reshape( windows.shape[:i] + (windows.shape[i]//2, 2) + windows.shape[i+1:] )
+            windowAxes.append( i+1 )
+        outAxes = [ a for a in range(windows.ndim) if a not in windowAxes ]
+        windows = windows.transpose( outAxes + windowAxes )
+        windowSize = 2**len(spatialIndexes)
+        windows = windows.reshape( windows.shape[:len(outAxes)] + (windowSize,) )
+
+        # Count the occurrences of each candidate within its window.
+        # Ties are resolved in favor of the first candidate.
+        counts = numpy.zeros( windows.shape, dtype=numpy.uint8 )
+        for j in range( windowSize ):
+            counts += ( windows == windows[..., j:j+1] )
+        choice = numpy.argmax( counts, axis=-1 ).ravel()
+        flatWindows = windows.reshape( (-1, windowSize) )
+        return flatWindows[ numpy.arange(len(choice)), choice ].reshape( windows.shape[:-1] )
+
+    raise ValueError( "Unknown pyramid reduction: {}".format( reduction ) )
+
+class OpH5PyramidWriter(Operator):
+    """
+    Writes the input image to an hdf5 dataset, and writes a downsampled pyramid
+    of it (2x per level in all spatial dimensions) to sibling datasets of the same
+    file while the full-resolution blocks are streamed, so the base data is only
+    requested once.
+
+    The blocks are aligned to multiples of 2**Levels in the spatial dimensions,
+    so each full-resolution block maps to exactly one block of every level.
+    The level datasets are named ``<hdf5Path>_level<k>`` and carry a
+    ``downsample_factor`` attribute.
+
+    Reduction should be 'mean' for probabilities/intensities and 'mode' for label images.
+    """
+    name = "OpH5PyramidWriter"
+
+    hdf5File = InputSlot()
+    hdf5Path = InputSlot()
+    Image = InputSlot()
+    Levels = InputSlot(value=1)
+    Reduction = InputSlot(value='mean')
+    CompressionEnabled = InputSlot(value=True)
+
+    WriteImage = OutputSlot()
+
+    # Spatial block edge length for the streamed requests (rounded up to a multiple of 2**Levels).
+    BLOCK_EDGE = 256
+
+    def __init__(self, *args, **kwargs):
+        super(OpH5PyramidWriter, self).__init__(*args, **kwargs)
+        self.progressSignal = OrderedSignal()
+        self._datasets = []
+        self._lock = threading.Lock()
+
+    def setupOutputs(self):
+        assert self.Reduction.value in PYRAMID_REDUCTIONS, \
+            "Unknown pyramid reduction: {}".format( self.Reduction.value )
+        self.WriteImage.meta.shape = (1,)
+        self.WriteImage.meta.dtype = object
+
+    def _spatialIndexes(self):
+        return [ i for i, k in enumerate( self.Image.meta.getAxisKeys() ) if k in 'xyz' ]
+
+    def _levelShape(self, level):
+        shape = list( self.Image.meta.shape )
+        for i in self._spatialIndexes():
+            shape[i] = -( -shape[i] // 2**level )
+        return tuple(shape)
+
+    def _blockShape(self):
+        factor = 2**self.Levels.value
+        edge = factor * -( -self.BLOCK_EDGE // factor )
+        blockShape = []
+        for k, s in zip( self.Image.meta.getAxisKeys(), self.Image.meta.shape ):
+            if k in 'xyz':
+                # Blocks start at multiples of edge, which is a multiple of 2**Levels
+                blockShape.append( min( edge, s ) )
+            elif k == 'c':
+                blockShape.append( s )
+            else:
+                blockShape.append( 1 )
+        return tuple(blockShape)
+
+    def _createDatasets(self):
+        h5File = self.hdf5File.value
+        basePath = self.hdf5Path.value
+        dtype = self.Image.meta.dtype
+        if isinstance( dtype, numpy.dtype ):
+            dtype = dtype.type
+        blockShape = self._blockShape()
+
+        compression = {}
+        if self.CompressionEnabled.value:
+            compression = { 'compression' : 'gzip', 'compression_opts' : 1 }
+
+        self._datasets = []
+        for level in range( self.Levels.value + 1 ):
+            path = pyramidLevelPath( basePath, level )
+            if path in h5File:
+                del h5File[path]
+            shape = self._levelShape( level )
+            chunks = tuple( max(1, min( s, b // 2**level )) if k in 'xyz' else min(s, b)
+                            for k, s, b in zip( self.Image.meta.getAxisKeys(), shape, blockShape ) )
+            dataset = h5File.create_dataset( path, shape=shape, dtype=dtype, chunks=chunks, **compression )
+            dataset.attrs['axistags'] = self.Image.meta.axistags.toJSON()
+            if level > 0:
+                dataset.attrs['downsample_factor'] = 2**level
+                dataset.attrs['reduction'] = self.Reduction.value
+            self._datasets.append( dataset )
+
+    def execute(self, slot, subindex, rroi, result):
+        self._createDatasets()
+
+        shape = self.Image.meta.shape
+        streamer = BigRequestStreamer( self.Image, ( (0,)*len(shape), shape ), self._blockShape() )
+        streamer.progressSignal.subscribe( self.progressSignal )
+        streamer.resultSignal.subscribe( self._handleBlock )
+        streamer.execute()
+
+        self._datasets = []
+        result[0] = True
+        return result
+
+    def _handleBlock(self, roi, block):
+        spatialIndexes = self._spatialIndexes()
+        reduction = self.Reduction.value
+        start = numpy.array( roi[0] )
+        stop = numpy.array( roi[1] )
+
+        # Compute all levels before taking the lock, so that reductions run in parallel.
+        levelBlocks = [ ( start.copy(), stop.copy(), block ) ]
+        for level in range( 1, self.Levels.value + 1 ):
+            block = downsample2x( block, spatialIndexes, reduction )
+            levelStart = start.copy()
+            levelStart[spatialIndexes] //= 2**level
+            levelStop = levelStart + block.shape
+            levelBlocks.append( ( levelStart, levelStop, block ) )
+
+        with self._lock:
+            for dataset, (levelStart, levelStop, levelBlock) in zip( self._datasets, levelBlocks ):
+                dataset[ tuple( slice(a, b) for a, b in zip(levelStart, levelStop) ) ] = levelBlock
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.WriteImage.setDirty()
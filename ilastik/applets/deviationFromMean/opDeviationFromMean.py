@@ -18,22 +18,48 @@
 # on the ilastik web site at:
 #		   http://ilastik.org/license.html
 ###############################################################################
+import collections
+import itertools
+import threading
+from functools import partial
+
 from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, RequestPool
 import numpy
 from ilastik.utility import MultiLaneOperatorABC, OperatorSubView
 
+import logging
+logger = logging.getLogger(__name__)
+
 class OpDeviationFromMean(Operator):
     """
     Multi-image operator.
     Calculates the pixelwise mean of a set of images, and produces a set of corresponding images for the difference from the mean.
     Note: Inputs must all have the same shape.
+
+    The mean is computed in blocks (BlockShape, or DefaultBlockSize along each axis).
+    The lanes of a block are fetched in parallel, and the mean of the block is kept
+    (up to MaxCacheBytes, least recently used blocks are dropped first) until an
+    input changes within that block.
     """    
     ScalingFactor = InputSlot() # Scale after subtraction
     Offset = InputSlot()        # Offset final results
     Input = InputSlot(level=1)  # Multi-image input
+    BlockShape = InputSlot(optional=True) # Blocks of the mean cache
 
     Mean = OutputSlot()
     Output = OutputSlot(level=1) # Multi-image output
+
+    DefaultBlockSize = 128
+    MaxCacheBytes = 256 * 2**20
+
+    def __init__(self, *args, **kwargs):
+        super(OpDeviationFromMean, self).__init__(*args, **kwargs)
+        self._meanBlocks = collections.OrderedDict() # block start -> mean of the block (least recently used first)
+        self._cachedBytes = 0
+        self._cacheKey = None
+        self._generation = 0 # Incremented whenever cached blocks are invalidated
+        self._lock = threading.Lock()
     
     def setupOutputs(self):
         # Ensure all inputs have the same shape
@@ -50,46 +76,175 @@ class OpDeviationFromMean(Operator):
         
         self.Mean.meta.assignFrom(self.Input[0].meta)
 
+        # setupOutputs is also called when the constants change, which doesn't affect the mean.
+        cacheKey = ( self.Mean.meta.shape, len(self.Input), self._blockShape() )
+        if cacheKey != self._cacheKey:
+            self._clearCache()
+        self._cacheKey = cacheKey
+
         def markAllOutputsDirty( *args ):
-            self.propagateDirty( self.Input, (), slice(None) )
+            self._invalidateAll()
         self.Input.notifyInserted( markAllOutputsDirty )
         self.Input.notifyRemoved( markAllOutputsDirty )
 
+    def _blockShape(self):
+        shape = self.Mean.meta.shape
+        if self.BlockShape.ready():
+            return tuple( min(b, s) for b, s in zip(self.BlockShape.value, shape) )
+        return tuple( min(self.DefaultBlockSize, s) for s in shape )
+
+    def _clearCache(self):
+        with self._lock:
+            self._meanBlocks.clear()
+            self._cachedBytes = 0
+            self._generation += 1
+
+    def _invalidateAll(self):
+        self._clearCache()
+        self.Mean.setDirty( slice(None) )
+        for oslot in self.Output:
+            oslot.setDirty( slice(None) )
+
+    def _isWholeImage(self, roi):
+        return ( all( a == 0 for a in roi.start ) and
+                 tuple(roi.stop) == tuple(self.Mean.meta.shape) )
+
+    def _blockStarts(self, start, stop):
+        blockShape = self._blockShape()
+        ranges = [ range( (a // b) * b, c, b ) for a, c, b in zip(start, stop, blockShape) ]
+        return itertools.product( *ranges )
+
+    def _blockRoi(self, blockStart):
+        blockStop = numpy.minimum( numpy.add(blockStart, self._blockShape()), self.Mean.meta.shape )
+        return list(blockStart), list(blockStop)
+
+    def _cachedMean(self, blockStart):
+        with self._lock:
+            mean = self._meanBlocks.pop(blockStart, None)
+            if mean is not None:
+                self._meanBlocks[blockStart] = mean # most recently used
+            return mean
+
+    def _storeMean(self, blockStart, mean, generation):
+        with self._lock:
+            if generation != self._generation:
+                # The inputs changed while the mean was computed, so it may be stale.
+                return
+            old = self._meanBlocks.pop(blockStart, None)
+            if old is not None:
+                self._cachedBytes -= old.nbytes
+            self._meanBlocks[blockStart] = mean
+            self._cachedBytes += mean.nbytes
+            while self._cachedBytes > self.MaxCacheBytes and len(self._meanBlocks) > 1:
+                _, dropped = self._meanBlocks.popitem(last=False)
+                self._cachedBytes -= dropped.nbytes
+
+    def _computeBlock(self, blockStart, laneIndex):
+        """
+        Returns the mean of the given block, and the data of lane laneIndex
+        within the block if it had to be fetched to compute the mean (otherwise None).
+        """
+        mean = self._cachedMean(blockStart)
+        if mean is not None:
+            return mean, None
+        with self._lock:
+            generation = self._generation
+
+        # Fetch all lanes of the block in parallel
+        start, stop = self._blockRoi(blockStart)
+        lanes = [None] * len(self.Input)
+        def fetch(index):
+            lanes[index] = self.Input[index](start, stop).wait()
+        pool = RequestPool()
+        for index in range( len(self.Input) ):
+            pool.add( Request( partial(fetch, index) ) )
+        pool.wait()
+        pool.clean()
+
+        mean = numpy.zeros( numpy.subtract(stop, start), dtype=self.Mean.meta.dtype )
+        for data in lanes:
+            mean += data
+        mean[:] = mean / len(lanes)
+
+        self._storeMean(blockStart, mean, generation)
+
+        laneData = lanes[laneIndex] if laneIndex is not None else None
+        return mean, laneData
+
     def execute(self, slot, subindex, roi, result):
         """
-        Compute.  This is a simple implementation, without optimizations.
+        Compute the mean (or the scaled deviation from it) block by block.
         """
-        # Compute average of *all* inputs
-        result[:] = 0.0
-        for s in self.Input:
-            result[:] += s.get(roi).wait()
-        result[:] = result / len(self.Input)
+        laneIndex = subindex[0] if slot == self.Output else None
 
-        # If the user wanted the mean, we're done.
-        if slot == self.Mean:
-            return result
+        def processBlock(blockStart):
+            mean, laneData = self._computeBlock(blockStart, laneIndex)
+            blockStart, blockStop = self._blockRoi(blockStart)
+            start = numpy.maximum(roi.start, blockStart)
+            stop = numpy.minimum(roi.stop, blockStop)
+            blockKey = tuple( slice(a - b, c - b) for a, c, b in zip(start, stop, blockStart) )
+            resultKey = tuple( slice(a - r, c - r) for a, c, r in zip(start, stop, roi.start) )
 
-        assert slot == self.Output
+            # If the user wanted the mean, we're done.
+            if slot == self.Mean:
+                result[resultKey] = mean[blockKey]
+                return
 
-        # Subtract average from the particular image being requested
-        result[:] = self.Input[subindex].get(roi).wait() - result
+            assert slot == self.Output
 
-        # Scale
-        result[:] *= self.ScalingFactor.value
+            # Subtract average from the particular image being requested
+            #  (reuse its data if it was just fetched for the mean)
+            if laneData is not None:
+                laneData = laneData[blockKey]
+            else:
+                laneData = self.Input[laneIndex](list(start), list(stop)).wait()
+            result[resultKey] = laneData - mean[blockKey]
 
-        # Add constant offset
-        result[:] += self.Offset.value
+        pool = RequestPool()
+        for blockStart in self._blockStarts(roi.start, roi.stop):
+            pool.add( Request( partial(processBlock, blockStart) ) )
+        pool.wait()
+        pool.clean()
+
+        if slot == self.Output:
+            # Scale
+            result[:] *= self.ScalingFactor.value
+
+            # Add constant offset
+            result[:] += self.Offset.value
         
         return result
 
     def propagateDirty(self, slot, subindex, roi):
-        # If the dirty slot is one of our two constants, then the entire image region is dirty
+        # If the dirty slot is one of our two constants, then the entire image region is dirty,
+        #  but the mean is unchanged.
         if slot == self.Offset or slot == self.ScalingFactor:
-            roi = slice(None) # The whole image region
-        
+            for oslot in self.Output:
+                oslot.setDirty( slice(None) )
+            return
+
+        if slot == self.BlockShape:
+            # Same results, different blocks (the cache is reset in setupOutputs).
+            return
+
+        assert slot == self.Input
+        if not self.Mean.ready() or self._isWholeImage(roi):
+            # Nothing to keep
+            self._invalidateAll()
+            return
+
+        # Only the blocks the change touches have to be recomputed
+        with self._lock:
+            for blockStart in self._blockStarts(roi.start, roi.stop):
+                mean = self._meanBlocks.pop(tuple(blockStart), None)
+                if mean is not None:
+                    self._cachedBytes -= mean.nbytes
+            self._generation += 1
+
         # All inputs affect all outputs, so every image is dirty now
+        self.Mean.setDirty( roi.start, roi.stop )
         for oslot in self.Output:
-            oslot.setDirty( roi )
+            oslot.setDirty( roi.start, roi.stop )
 
     #############################################
     ## Methods to satisfy MultiLaneOperatorABC ##
@@ -36,6 +36,7 @@ from lazyflow.operators.imgFilterOperators import OpPixelFeaturesPresmoothed as
 from lazyflow.operators import OpReorderAxes, OperatorWrapper
 
 from ilastik.applets.base.applet import DatasetConstraintError
+from ilastik.applets.featureSelection.opPixelFeaturesSharedScaleSpace import OpPixelFeaturesSharedScaleSpace
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +69,7 @@ class OpFeatureSelectionNoCache(Operator):
 
     # For ease of development and testing, the underlying feature computation implementation 
     #  can be switched via a constructor argument.  These are the possible choices.
-    FilterImplementations = ['Original', 'Refactored', 'Interpolated']
+    FilterImplementations = ['Original', 'Refactored', 'Interpolated', 'SharedScaleSpace']
     
     def __init__(self, filter_implementation, *args, **kwargs):
         super(OpFeatureSelectionNoCache, self).__init__(*args, **kwargs)
@@ -83,6 +84,9 @@ class OpFeatureSelectionNoCache(Operator):
             self.opPixelFeatures = OpPixelFeaturesPresmoothed_Interpolated(parent=self)
             self.opPixelFeatures.InterpolationScaleZ.setValue(2)
             logger.debug("Using INTERPOLATED filters")
+        elif filter_implementation == 'SharedScaleSpace':
+            self.opPixelFeatures = OpPixelFeaturesSharedScaleSpace(parent=self)
+            logger.debug("Using SHARED SCALE-SPACE filters")
         else:
             raise RuntimeError("Unknown filter implementation option: {}".format( filter_implementation ))
 
@@ -0,0 +1,284 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import collections
+import math
+
+import numpy
+import vigra
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+
+import logging
+logger = logging.getLogger(__name__)
+
+FeatureEntry = collections.namedtuple( 'FeatureEntry', 'featureId sigma start stop' )
+
+class OpPixelFeaturesSharedScaleSpace(Operator):
+    """
+    Computes the same feature matrix as OpPixelFeaturesPresmoothed, but shares
+    the Gaussian smoothings between all filters of a block.
+
+    Like the presmoothed implementations, every feature at scale sigma > 1 is
+    computed with an inner scale of 1.0 on a presmoothed image G(sqrt(sigma**2 - 1)).
+    Instead of presmoothing the raw input once per scale, the presmoothed images form
+    a scale-space pyramid: each level is computed from the previous (smaller) one
+    with the incremental sigma sqrt(s_k**2 - s_{k-1}**2).  All features of a scale are
+    derived from the same pyramid level, and only the current level is kept in memory.
+
+    As in OpPixelFeaturesPresmoothed, all feature parameters are relative to the inner
+    scale: the structure tensor uses an outer scale of 0.5 * inner, and DoG is
+    G(inner) - G(DOG_RATIO * inner) of the same presmoothed level.
+
+    For multi-channel input, the channels of each feature are ordered by input
+    channel first, then by feature channel.
+    """
+    name = "OpPixelFeaturesSharedScaleSpace"
+
+    Input = InputSlot()
+    Scales = InputSlot()
+    FeatureIds = InputSlot()
+    Matrix = InputSlot()
+
+    Output = OutputSlot()
+    Features = OutputSlot(level=1)
+
+    WINDOW_SIZE = 3.5
+
+    # DoG is computed as G(inner) - G(DOG_RATIO * inner)
+    DOG_RATIO = 0.66
+
+    # The structure tensor's outer scale is STRUCTURE_TENSOR_RATIO * inner
+    STRUCTURE_TENSOR_RATIO = 0.5
+
+    DefaultFeatureIds = [ 'GaussianSmoothing',
+                          'LaplacianOfGaussian',
+                          'StructureTensorEigenvalues',
+                          'HessianOfGaussianEigenvalues',
+                          'GaussianGradientMagnitude',
+                          'DifferenceOfGaussians' ]
+
+    FeatureNames = { 'GaussianSmoothing' : "Gaussian Smoothing",
+                     'LaplacianOfGaussian' : "Laplacian of Gaussian",
+                     'StructureTensorEigenvalues' : "Structure Tensor Eigenvalues",
+                     'HessianOfGaussianEigenvalues' : "Hessian of Gaussian Eigenvalues",
+                     'GaussianGradientMagnitude' : "Gaussian Gradient Magnitude",
+                     'DifferenceOfGaussians' : "Difference of Gaussians" }
+
+    def __init__(self, *args, **kwargs):
+        super(OpPixelFeaturesSharedScaleSpace, self).__init__(*args, **kwargs)
+        self._layout = []
+
+    def _spatialAxes(self):
+        return "".join( tag.key for tag in self.Input.meta.axistags if tag.key in 'xyz' )
+
+    def _featureChannels(self, featureId):
+        if featureId in ('StructureTensorEigenvalues', 'HessianOfGaussianEigenvalues'):
+            return len(self._spatialAxes())
+        return 1
+
+    def setupOutputs(self):
+        assert self.Input.meta.getAxisKeys()[-1] == 'c', "Channel must be the last axis"
+        scales = self.Scales.value
+        featureIds = self.FeatureIds.value
+        matrix = numpy.asarray( self.Matrix.value )
+        assert matrix.shape == (len(featureIds), len(scales)), \
+            "Selection matrix has shape {}, expected {}".format( matrix.shape, (len(featureIds), len(scales)) )
+
+        numInputChannels = self.Input.meta.shape[-1]
+
+        self._layout = []
+        start = 0
+        for i, featureId in enumerate(featureIds):
+            assert featureId in self.FeatureNames, "Unknown feature: {}".format( featureId )
+            for j, sigma in enumerate(scales):
+                if matrix[i, j]:
+                    stop = start + numInputChannels * self._featureChannels(featureId)
+                    self._layout.append( FeatureEntry(featureId, float(sigma), start, stop) )
+                    start = stop
+
+        self.Output.meta.assignFrom( self.Input.meta )
+        self.Output.meta.dtype = numpy.float32
+        self.Output.meta.shape = self.Input.meta.shape[:-1] + (start,)
+        self.Output.meta.drange = None
+
+        self.Features.resize( len(self._layout) )
+        for entry, featureSlot in zip( self._layout, self.Features ):
+            featureSlot.meta.assignFrom( self.Input.meta )
+            featureSlot.meta.dtype = numpy.float32
+            featureSlot.meta.shape = self.Input.meta.shape[:-1] + (entry.stop - entry.start,)
+            featureSlot.meta.description = u"{} (\u03c3={})".format( self.FeatureNames[entry.featureId], entry.sigma )
+            featureSlot.meta.drange = None
+
+    def getInvalidScales(self):
+        """
+        Return the selected scales whose filter window is larger than the image.
+        """
+        spatialShape = numpy.array( [ v for k, v in self.Input.meta.getTaggedShape().items() if k in 'xyz' ] )
+        matrix = numpy.asarray( self.Matrix.value )
+        invalid_scales = []
+        for j, scale in enumerate( self.Scales.value ):
+            if matrix[:, j].any() and ( scale * self.WINDOW_SIZE > spatialShape ).any():
+                invalid_scales.append( scale )
+        return invalid_scales
+
+    @staticmethod
+    def _presmoothingSigma(sigma):
+        """The sigma of the shared pyramid level that the features at sigma are computed from."""
+        if sigma > 1.0:
+            return math.sqrt( sigma**2 - 1.0 )
+        return 0.0
+
+    @staticmethod
+    def _innerSigma(sigma):
+        return min(sigma, 1.0)
+
+    def _halo(self, entries):
+        """
+        Number of border pixels needed for the given features (the presmoothing plus
+        the inner scale, and the structure tensor's outer scale on top of them).
+        """
+        if not entries:
+            return 0
+        maxSigma = max( entry.sigma for entry in entries )
+        return int( math.ceil( self.WINDOW_SIZE * 1.5 * maxSigma ) ) + 1
+
+    def execute(self, slot, subindex, roi, result):
+        if slot is self.Features:
+            offset = self._layout[ subindex[0] ].start
+        else:
+            offset = 0
+        channelStart = offset + roi.start[-1]
+        channelStop = offset + roi.stop[-1]
+
+        entries = [ e for e in self._layout if e.start < channelStop and e.stop > channelStart ]
+        result[:] = 0
+        if not entries:
+            return result
+
+        axisKeys = self.Input.meta.getAxisKeys()
+        spatialIndexes = [ i for i, k in enumerate(axisKeys) if k in 'xyz' ]
+        halo = self._halo( entries )
+
+        # Read the haloed input for all channels once.
+        shape = self.Input.meta.shape
+        readStart = list(roi.start[:-1]) + [0]
+        readStop = list(roi.stop[:-1]) + [shape[-1]]
+        for i in spatialIndexes:
+            readStart[i] = max( 0, roi.start[i] - halo )
+            readStop[i] = min( shape[i], roi.stop[i] + halo )
+        data = self.Input(readStart, readStop).wait()
+        data = numpy.asarray( data, dtype=numpy.float32 )
+
+        # The part of the haloed block that belongs to the requested roi
+        innerSlicing = tuple( slice( roi.start[i] - readStart[i], roi.stop[i] - readStart[i] )
+                              for i in spatialIndexes )
+
+        if 't' in axisKeys:
+            assert axisKeys[0] == 't'
+            volumes = data
+        else:
+            volumes = data[numpy.newaxis]
+
+        for t, volume in enumerate(volumes):
+            if 't' in axisKeys:
+                target = result[t]
+            else:
+                target = result
+            for inputChannel in range( volume.shape[-1] ):
+                for entry, feature in self._computeFeatures( volume[..., inputChannel], entries ):
+                    feature = feature[innerSlicing]
+                    numChannels = feature.shape[-1]
+                    featureStart = entry.start + inputChannel * numChannels
+                    for c in range( numChannels ):
+                        outChannel = featureStart + c
+                        if channelStart <= outChannel < channelStop:
+                            target[..., outChannel - channelStart] = feature[..., c]
+        return result
+
+    def _computeFeatures(self, volume, entries):
+        """
+        Generator over (entry, featureArray) for a single-channel volume.
+        The feature arrays have a trailing channel axis.
+        """
+        spatialAxes = self._spatialAxes()
+        window = self.WINDOW_SIZE
+
+        # Group the entries by the pyramid level they need
+        entriesByLevel = collections.defaultdict( list )
+        for entry in entries:
+            entriesByLevel[ self._presmoothingSigma(entry.sigma) ].append( entry )
+
+        level = vigra.taggedView( numpy.ascontiguousarray(volume[..., numpy.newaxis]), spatialAxes + 'c' )
+        levelSigma = 0.0
+        for nextSigma in sorted( entriesByLevel.keys() ):
+            if nextSigma > levelSigma:
+                increment = math.sqrt( nextSigma**2 - levelSigma**2 )
+                level = vigra.filters.gaussianSmoothing( level, increment, window_size=window )
+                levelSigma = nextSigma
+
+            for entry in entriesByLevel[ nextSigma ]:
+                yield entry, self._computeFeature( entry, level )
+
+    def _computeFeature(self, entry, level):
+        inner = self._innerSigma( entry.sigma )
+        window = self.WINDOW_SIZE
+        featureId = entry.featureId
+        if featureId == 'GaussianSmoothing':
+            feature = vigra.filters.gaussianSmoothing( level, inner, window_size=window )
+        elif featureId == 'LaplacianOfGaussian':
+            feature = vigra.filters.laplacianOfGaussian( level, inner, window_size=window )
+        elif featureId == 'GaussianGradientMagnitude':
+            feature = vigra.filters.gaussianGradientMagnitude( level, inner, window_size=window )
+        elif featureId == 'HessianOfGaussianEigenvalues':
+            feature = vigra.filters.hessianOfGaussianEigenvalues( level, inner, window_size=window )
+        elif featureId == 'StructureTensorEigenvalues':
+            feature = vigra.filters.structureTensorEigenvalues( level, inner, self.STRUCTURE_TENSOR_RATIO * inner,
+                                                                window_size=window )
+        elif featureId == 'DifferenceOfGaussians':
+            feature = vigra.filters.gaussianSmoothing( level, inner, window_size=window )
+            feature = feature - vigra.filters.gaussianSmoothing( level, self.DOG_RATIO * inner, window_size=window )
+        else:
+            raise RuntimeError( "Unknown feature: {}".format( featureId ) )
+
+        feature = numpy.asarray( feature, dtype=numpy.float32 )
+        if feature.ndim == len(level.shape) - 1:
+            feature = feature[..., numpy.newaxis]
+        return feature
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot is self.Input:
+            axisKeys = self.Input.meta.getAxisKeys()
+            halo = self._halo( self._layout )
+            start = list(roi.start)
+            stop = list(roi.stop)
+            shape = self.Input.meta.shape
+            for i, k in enumerate(axisKeys):
+                if k in 'xyz':
+                    start[i] = max( 0, start[i] - halo )
+                    stop[i] = min( shape[i], stop[i] + halo )
+            self.Output.setDirty( start[:-1] + [0], stop[:-1] + [self.Output.meta.shape[-1]] )
+            for featureSlot in self.Features:
+                featureSlot.setDirty( start[:-1] + [0], stop[:-1] + [featureSlot.meta.shape[-1]] )
+        else:
+            # Settings changed: setupOutputs will be called, everything is dirty.
+            self.Output.setDirty()
+            for featureSlot in self.Features:
+                featureSlot.setDirty()
@@ -18,6 +18,8 @@
 # on the ilastik web site at:
 #		   http://ilastik.org/license.html
 ###############################################################################
+import numpy
+
 from ilastik.applets.base.appletSerializer import AppletSerializer, SerialSlot
 
 from lazyflow.operators.opInterpMissingData import OpDetectMissing
@@ -36,12 +38,15 @@ class FillMissingSlicesSerializer(AppletSerializer):
         dslot = self._operator.Detector[0]
         extractedSVM = dslot[:].wait()
         self._setDataset(topGroup, 'SVM', extractedSVM)
+        self._serializeSliceIndices(topGroup)
         for s in self._operator.innerOperators:
             s.resetDirty()
 
     def _deserializeFromHdf5(self, topGroup, version, h5file, projectFilePath):
         svm = self._operator.OverloadDetector.setValue(
             self._getDataset(topGroup, 'SVM'))
+        # The detector must be set first, since it invalidates the indices.
+        self._deserializeSliceIndices(topGroup)
         for s in self._operator.innerOperators:
             s.resetDirty()
 
@@ -49,6 +54,25 @@ class FillMissingSlicesSerializer(AppletSerializer):
         return any([s.isDirty() for s in self._operator.innerOperators])
 
     ### internal ###
+    def _serializeSliceIndices(self, topGroup):
+        self._deleteDataset(topGroup, 'SliceIndex')
+        indexGroup = topGroup.create_group('SliceIndex')
+        for i, op in enumerate(self._operator.innerOperators):
+            if op.Input.ready():
+                indexGroup.create_dataset(str(i), data=numpy.void(op.dumpsSliceIndex()))
+
+    def _deserializeSliceIndices(self, topGroup):
+        if 'SliceIndex' not in topGroup.keys():
+            return
+        indexGroup = topGroup['SliceIndex']
+        for i, op in enumerate(self._operator.innerOperators):
+            if str(i) in indexGroup.keys() and op.Input.ready():
+                op.loadsSliceIndex(indexGroup[str(i)][()].tostring())
+
+    def _deleteDataset(self, group, dataName):
+        if dataName in group.keys():
+            del group[dataName]
+
     def _setDataset(self, group, dataName, dataValue):
         if dataName not in group.keys():
             # Create and assign
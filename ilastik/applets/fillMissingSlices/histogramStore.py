@@ -0,0 +1,128 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+"""
+Precomputed patch histograms for training the missing slice detector.
+
+The histograms of a stack are stored in an hdf5 group, one dataset per
+(patch size, halo size, number of bins) combination (see histogramKey()), in
+the format OpDetectMissing expects for its TrainingHistograms: one row per
+patch, nBins normalized histogram values followed by the label (1 for patches
+of missing slices, 0 otherwise).
+
+The patches and their histograms are computed with the helpers of the
+OpDetectMissing that is going to be trained, so they match the histograms it
+computes for detection.
+"""
+import threading
+from functools import partial
+
+import numpy
+
+from lazyflow.request import Request, RequestPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+def histogramKey( patchSize, haloSize, nBins ):
+    return "patch{}_halo{}_bins{}".format( patchSize, haloSize, nBins )
+
+def patchHistograms( detector, image, patchSize, haloSize ):
+    """
+    Histograms of all patches of a 2D (y, x) image, as the given OpDetectMissing
+    computes them for detection.  Returns an array of shape (nPatches, nBins).
+    """
+    patches, _ = detector._patchify( image, patchSize, haloSize )
+    return numpy.array( [ detector._toHistogram( patch ) for patch in patches ], dtype=numpy.float32 )
+
+def computeHistogramStore( detector, slot, group, patchSize, haloSize, missingSlices, blockDepth=8 ):
+    """
+    Compute the patch histograms of every z-slice of slot (a single-channel
+    3D volume, with or without a time axis) and write them to group.
+    detector is the (set up) OpDetectMissing whose helpers compute the histograms.
+
+    The volume is processed in blocks of blockDepth slices in parallel.  Only
+    the histograms are kept, so the volume does not have to fit into memory.
+    missingSlices is a collection of the z indexes of the slices that are missing.
+    Returns the created dataset.
+    """
+    keys = slot.meta.getAxisKeys()
+    shape = slot.meta.shape
+    zIndex = keys.index('z')
+    tagged = slot.meta.getTaggedShape()
+    assert tagged.get('c', 1) == 1, "Histograms can only be computed for single-channel data."
+    nBins = detector.NHistogramBins.value
+    missingSlices = set( missingSlices )
+
+    key = histogramKey( patchSize, haloSize, nBins )
+    if key in group:
+        del group[key]
+    dataset = group.create_dataset( key, shape=(0, nBins+1), maxshape=(None, nBins+1),
+                                    dtype=numpy.float32, chunks=(1024, nBins+1),
+                                    compression='gzip', compression_opts=4 )
+    dataset.attrs['patchSize'] = patchSize
+    dataset.attrs['haloSize'] = haloSize
+    dataset.attrs['nBins'] = nBins
+    dataset.attrs['range'] = detector._inputRange
+
+    lock = threading.Lock()
+
+    def processBlock( zStart, zStop ):
+        start, stop = [0]*len(shape), list(shape)
+        start[zIndex], stop[zIndex] = zStart, zStop
+        block = slot( start, stop ).wait()
+
+        # (z, y, x), with any time slices appended along z
+        order = [ keys.index(k) for k in 'tzyxc' if k in keys ]
+        block = block.transpose( order ).reshape( (-1,) + (tagged['y'], tagged['x']) )
+
+        rows = []
+        for i, image in enumerate( block ):
+            z = zStart + i % (zStop - zStart)
+            histograms = patchHistograms( detector, image, patchSize, haloSize )
+            labels = numpy.empty( (len(histograms), 1), dtype=numpy.float32 )
+            labels[:] = 1 if z in missingSlices else 0
+            rows.append( numpy.concatenate( (histograms, labels), axis=1 ) )
+        rows = numpy.concatenate( rows )
+
+        with lock:
+            n = dataset.shape[0]
+            dataset.resize( (n + len(rows), nBins+1) )
+            dataset[n:] = rows
+
+    pool = RequestPool()
+    for zStart in range( 0, shape[zIndex], blockDepth ):
+        zStop = min( zStart + blockDepth, shape[zIndex] )
+        pool.add( Request( partial( processBlock, zStart, zStop ) ) )
+    pool.wait()
+    pool.clean()
+
+    logger.info( "Stored {} patch histograms ({}) in {}".format( dataset.shape[0], key, group.name ) )
+    return dataset
+
+def loadHistograms( group, patchSize, haloSize, nBins ):
+    """
+    Returns the stored histograms for the given patch and halo size and number
+    of bins, or None if there are none.
+    """
+    key = histogramKey( patchSize, haloSize, nBins )
+    if key not in group:
+        return None
+    return group[key][:]
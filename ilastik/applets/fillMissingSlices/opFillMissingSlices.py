@@ -22,6 +22,9 @@ from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.operators import OpInterpMissingData, OpBlockedArrayCache
 from lazyflow.stype import Opaque
 
+from opMissingSliceIndex import OpMissingSliceIndex
+import histogramStore
+
 import logging
 loggerName = __name__
 logger = logging.getLogger(loggerName)
@@ -56,7 +59,15 @@ class OpFillMissingSlicesNoCache(Operator):
 
         self._opInterp.OverloadDetector.connect(self.OverloadDetector)
 
-        self.Output.connect(self._opInterp.Output)
+        # Detection results are kept per slice, so that requests
+        # don't have to run detection on InputSearchDepth slices each time.
+        self._opIndex = OpMissingSliceIndex(parent=self)
+        self._opIndex.Input.connect(self.Input)
+        self._opIndex.Missing.connect(self._opInterp.Missing)
+        self.progressSignal = self._opIndex.progressSignal
+        self._sliceIndexDirty = False
+
+        self.Output.connect(self._opIndex.Output)
         self.Missing.connect(self._opInterp.Missing)
         self.Detector.connect(self._opInterp.Detector)
 
@@ -67,10 +78,11 @@ class OpFillMissingSlicesNoCache(Operator):
         pass  # Nothing to do here.
 
     def isDirty(self):
-        return self._opInterp.isDirty()
+        return self._opInterp.isDirty() or self._sliceIndexDirty
 
     def resetDirty(self):
         self._opInterp.resetDirty()
+        self._sliceIndexDirty = False
 
     def dumps(self):
         return self._opInterp.dumps()
@@ -78,12 +90,55 @@ class OpFillMissingSlicesNoCache(Operator):
     def loads(self, s):
         self._opInterp.loads(s)
 
+    def computeSliceIndex(self):
+        self._opIndex.computeIndex()
+        # The index must be saved with the project
+        self._sliceIndexDirty = True
+
+    def dumpsSliceIndex(self):
+        return self._opIndex.dumps()
+
+    def loadsSliceIndex(self, s):
+        if self._opIndex.loads(s):
+            self._sliceIndexDirty = True
+
     def setPrecomputedHistograms(self, histos):
         self._opInterp.detector.TrainingHistograms.setValue(histos)
 
     def train(self):
         self._opInterp.train()
 
+    def histogramKey(self):
+        """
+        The key of the training histograms for the current PatchSize,
+        HaloSize and number of histogram bins (see histogramStore).
+        """
+        return histogramStore.histogramKey(
+            self.PatchSize.value, self.HaloSize.value,
+            self._opInterp.detector.NHistogramBins.value)
+
+    def precomputeHistograms(self, h5group, missingSlices):
+        """
+        Compute the training histograms of the whole input for the current
+        PatchSize and HaloSize and store them in h5group (see histogramStore).
+        """
+        histogramStore.computeHistogramStore(
+            self._opInterp.detector, self.Input, h5group,
+            self.PatchSize.value, self.HaloSize.value, missingSlices)
+
+    def trainFromHistogramStore(self, h5group):
+        """
+        Train the detector with the histograms stored in h5group for the
+        current PatchSize, HaloSize and number of histogram bins.
+        """
+        nBins = self._opInterp.detector.NHistogramBins.value
+        histos = histogramStore.loadHistograms(
+            h5group, self.PatchSize.value, self.HaloSize.value, nBins)
+        assert histos is not None, \
+            "No histograms for {} in {}".format(self.histogramKey(), h5group.name)
+        self.setPrecomputedHistograms(histos)
+        self.train()
+
 
 class OpFillMissingSlices(OpFillMissingSlicesNoCache):
     """
@@ -99,7 +154,7 @@ class OpFillMissingSlices(OpFillMissingSlicesNoCache):
         # 1) Determine shape of accesses to the interpolation operator
         # 2) Avoid duplicating work
         self._opCache = OpBlockedArrayCache(parent=self)
-        self._opCache.Input.connect(self._opInterp.Output)
+        self._opCache.Input.connect(self._opIndex.Output)
         self._opCache.fixAtCurrent.setValue(False)
 
         self.CachedOutput.connect(self._opCache.Output)
@@ -0,0 +1,297 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import cPickle as pickle
+import hashlib
+import threading
+from functools import partial
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot, OrderedSignal
+from lazyflow.request import Request, RequestPool
+from lazyflow.utility import BigRequestStreamer
+from lazyflow.operators.opInterpMissingData import OpInterpolate
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class OpMissingSliceIndex(Operator):
+    """
+    Keeps the result of missing data detection per (t, z) slice, so that
+    detection runs only once per slice instead of once per request.
+
+    The index maps each slice to None (nothing missing) or to its 2D (y, x)
+    mask of missing pixels.  Slices are indexed lazily when a request needs
+    them, or all at once (in parallel) by computeIndex().
+
+    Output is Input with the missing regions interpolated.  A request that does
+    not touch a missing region is passed through to Input.  Otherwise, only the
+    requested slices, the missing runs that touch them and MARGIN valid slices
+    on each side of the runs are read and interpolated.
+    """
+    name = "OpMissingSliceIndex"
+
+    Input = InputSlot()
+    Missing = InputSlot() # Detected missing regions (nonzero where missing), same shape as Input
+
+    Output = OutputSlot()
+
+    # Valid slices needed on each side of a missing run (cubic interpolation needs 2)
+    MARGIN = 2
+
+    def __init__(self, *args, **kwargs):
+        super(OpMissingSliceIndex, self).__init__(*args, **kwargs)
+        self.progressSignal = OrderedSignal()
+        self._index = {}
+        self._indexShape = None
+        self._lock = threading.Lock()
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom(self.Input.meta)
+        assert 'z' in self.Input.meta.getAxisKeys(), "Missing slices can only be filled in 3D data."
+
+        with self._lock:
+            if self._index and self._indexShape != self._sliceShape():
+                self._index = {}
+            self._indexShape = self._sliceShape()
+
+    def _sliceShape(self):
+        tagged = self.Input.meta.getTaggedShape()
+        return (tagged.get('t', 1), tagged['z'])
+
+    def _sliceRoi(self, t, z, slot):
+        start, stop = [0]*len(slot.meta.shape), list(slot.meta.shape)
+        keys = slot.meta.getAxisKeys()
+        start[keys.index('z')], stop[keys.index('z')] = z, z+1
+        if 't' in keys:
+            start[keys.index('t')], stop[keys.index('t')] = t, t+1
+        return start, stop
+
+    def _sliceMask(self, block):
+        # Reduce a single-slice block of Missing to its (y, x) mask.
+        keys = self.Missing.meta.getAxisKeys()
+        otherAxes = tuple( i for i, k in enumerate(keys) if k not in 'yx' )
+        mask = numpy.any( block != 0, axis=otherAxes )
+        if keys.index('y') > keys.index('x'):
+            mask = mask.T
+        return mask
+
+    def _store(self, t, z, block):
+        mask = self._sliceMask(block)
+        with self._lock:
+            self._index[(t, z)] = mask if mask.any() else None
+
+    def _indexSlice(self, t, z):
+        start, stop = self._sliceRoi(t, z, self.Missing)
+        self._store( t, z, self.Missing(start, stop).wait() )
+
+    def _ensureIndexed(self, t, zs):
+        with self._lock:
+            todo = [ z for z in zs if (t, z) not in self._index ]
+        if not todo:
+            return
+        pool = RequestPool()
+        for z in todo:
+            pool.add( Request( partial(self._indexSlice, t, z) ) )
+        pool.wait()
+        pool.clean()
+
+    def computeIndex(self):
+        """
+        Runs detection on every slice that has not been indexed yet,
+        streaming the slices through the detector in parallel.
+        """
+        keys = self.Missing.meta.getAxisKeys()
+        shape = self.Missing.meta.shape
+        blockshape = [ 1 if k in 'tz' else s for k, s in zip(keys, shape) ]
+
+        def handleBlock(roi, block):
+            start = roi[0]
+            t = start[keys.index('t')] if 't' in keys else 0
+            self._store( t, start[keys.index('z')], block )
+
+        # Only stream the (t, z) range that still contains unindexed slices.
+        nt, nz = self._sliceShape()
+        with self._lock:
+            todo = [ (t, z) for t in range(nt) for z in range(nz) if (t, z) not in self._index ]
+        if not todo:
+            self.progressSignal(100)
+            return
+        start, stop = [0]*len(shape), list(shape)
+        tMin, tMax = min( t for t, z in todo ), max( t for t, z in todo )
+        zMin, zMax = min( z for t, z in todo ), max( z for t, z in todo )
+        start[keys.index('z')], stop[keys.index('z')] = zMin, zMax+1
+        if 't' in keys:
+            start[keys.index('t')], stop[keys.index('t')] = tMin, tMax+1
+
+        streamer = BigRequestStreamer( self.Missing, (start, stop), blockshape )
+        streamer.resultSignal.subscribe( handleBlock )
+        streamer.progressSignal.subscribe( self.progressSignal )
+        streamer.execute()
+        logger.debug( "Indexed {} slices, {} with missing regions"
+                      .format( len(todo), sum( 1 for v in self._index.values() if v is not None ) ) )
+
+    def datasetIdentity(self):
+        """
+        Identifies the input dataset an index belongs to: its shape, dtype and
+        axes, and a digest of its first, middle and last slice.
+        """
+        keys = self.Input.meta.getAxisKeys()
+        nt, nz = self._sliceShape()
+        digest = hashlib.sha1()
+        for z in sorted( set( [0, nz // 2, nz - 1] ) ):
+            start, stop = self._sliceRoi(0, z, self.Input)
+            digest.update( numpy.ascontiguousarray( self.Input(start, stop).wait() ).tostring() )
+        return ( tuple(self.Input.meta.shape), str(numpy.dtype(self.Input.meta.dtype)),
+                 ''.join(keys), digest.hexdigest() )
+
+    def isIndexed(self):
+        nt, nz = self._sliceShape()
+        with self._lock:
+            return len(self._index) == nt * nz
+
+    def dumps(self):
+        """
+        Serialize the index (missing masks are stored bit-packed), together
+        with the identity of the dataset it belongs to.
+        """
+        identity = self.datasetIdentity()
+        with self._lock:
+            entries = dict( ( key, None if mask is None else (mask.shape, numpy.packbits(mask)) )
+                            for key, mask in self._index.items() )
+        return pickle.dumps( { 'shape' : self._sliceShape(), 'identity' : identity, 'slices' : entries },
+                             pickle.HIGHEST_PROTOCOL )
+
+    def loads(self, s):
+        """
+        Restore an index saved by dumps().  It is ignored if it belongs to a different dataset.
+        Returns whether the index was restored.
+        """
+        state = pickle.loads(s)
+        if tuple(state['shape']) != self._sliceShape():
+            logger.warn( "Ignoring missing slice index of shape {}, expected {}"
+                         .format( state['shape'], self._sliceShape() ) )
+            return False
+        if state.get('identity') != self.datasetIdentity():
+            logger.warn( "Ignoring missing slice index of a different dataset" )
+            return False
+        index = {}
+        for key, entry in state['slices'].items():
+            if entry is not None:
+                shape, packed = entry
+                entry = numpy.unpackbits(packed)[:numpy.prod(shape)].reshape(shape).astype(bool)
+            index[key] = entry
+        with self._lock:
+            self._index = index
+        return True
+
+    def _isMissing(self, t, z, yxKey):
+        mask = self._index[(t, z)]
+        return mask is not None and mask[yxKey].any()
+
+    def execute(self, slot, subindex, roi, result):
+        keys = self.Input.meta.getAxisKeys()
+        zIndex = keys.index('z')
+        tIndex = keys.index('t') if 't' in keys else None
+        nz = self.Input.meta.getTaggedShape()['z']
+        yxKey = tuple( slice(roi.start[keys.index(k)], roi.stop[keys.index(k)]) for k in 'yx' )
+
+        tRange = range(roi.start[tIndex], roi.stop[tIndex]) if tIndex is not None else [0]
+        for t in tRange:
+            start, stop = list(roi.start), list(roi.stop)
+            resultKey = [slice(None)] * len(keys)
+            if tIndex is not None:
+                start[tIndex], stop[tIndex] = t, t+1
+                resultKey[tIndex] = slice(t - roi.start[tIndex], t - roi.start[tIndex] + 1)
+            resultKey = tuple(resultKey)
+
+            zs = range(roi.start[zIndex], roi.stop[zIndex])
+            self._ensureIndexed(t, zs)
+            missingZs = [ z for z in zs if self._isMissing(t, z, yxKey) ]
+            if not missingZs:
+                self.Input(start, stop).writeInto(result[resultKey]).wait()
+                continue
+
+            # Extend to the whole missing runs, plus the valid slices around them.
+            zLow, zHigh = min(missingZs), max(missingZs) + 1
+            while zLow > 0:
+                self._ensureIndexed(t, [zLow - 1])
+                if not self._isMissing(t, zLow - 1, yxKey):
+                    break
+                zLow -= 1
+            while zHigh < nz:
+                self._ensureIndexed(t, [zHigh])
+                if not self._isMissing(t, zHigh, yxKey):
+                    break
+                zHigh += 1
+            zLow, zHigh = min(zLow, roi.start[zIndex]), max(zHigh, roi.stop[zIndex])
+            zLow, zHigh = max(0, zLow - self.MARGIN), min(nz, zHigh + self.MARGIN)
+            self._ensureIndexed(t, range(zLow, zHigh))
+
+            start[zIndex], stop[zIndex] = zLow, zHigh
+            data = self.Input(start, stop).wait()
+            mask = numpy.zeros( (zHigh - zLow,) + tuple( s.stop - s.start for s in yxKey ), dtype=numpy.uint8 )
+            for i, z in enumerate(range(zLow, zHigh)):
+                if self._index[(t, z)] is not None:
+                    mask[i] = self._index[(t, z)][yxKey]
+
+            filled = self._interpolate( data, mask )
+
+            cropKey = [slice(None)] * len(keys)
+            cropKey[zIndex] = slice(roi.start[zIndex] - zLow, roi.stop[zIndex] - zLow)
+            result[resultKey] = filled[tuple(cropKey)]
+
+        return result
+
+    def _interpolate(self, data, mask):
+        """
+        Interpolate the masked (z, y, x) regions of data, channel by channel.
+        """
+        keys = self.Input.meta.getAxisKeys()
+        order = [ keys.index(k) for k in 'zyx' ] + [ i for i, k in enumerate(keys) if k not in 'zyx' ]
+        zyxOther = data.transpose(order)
+        otherShape = zyxOther.shape[3:]
+        zyxOther = zyxOther.reshape( zyxOther.shape[:3] + (-1,) )
+
+        filled = numpy.empty_like(zyxOther)
+        for i in range(zyxOther.shape[-1]):
+            opInterp = OpInterpolate( graph=Graph() )
+            opInterp.InputVolume.setValue( vigra.taggedView( numpy.ascontiguousarray(zyxOther[..., i]), 'zyx' ) )
+            opInterp.Missing.setValue( vigra.taggedView( mask, 'zyx' ) )
+            filled[..., i] = opInterp.Output[:].wait()
+            opInterp.cleanUp()
+
+        filled = filled.reshape( filled.shape[:3] + otherShape )
+        return filled.transpose( numpy.argsort(order) )
+
+    def propagateDirty(self, slot, subindex, roi):
+        # Forget the affected slices.  Interpolated regions may depend on slices
+        #  far away, so the whole output is dirty.
+        keys = slot.meta.getAxisKeys()
+        zs = range(roi.start[keys.index('z')], roi.stop[keys.index('z')])
+        ts = range(roi.start[keys.index('t')], roi.stop[keys.index('t')]) if 't' in keys else [0]
+        with self._lock:
+            for t in ts:
+                for z in zs:
+                    self._index.pop((t, z), None)
+        self.Output.setDirty( slice(None) )
@@ -28,8 +28,7 @@ from lazyflow.graph import OutputSlot
 from ilastik.applets.dataExport.opDataExport import OpDataExport,OpRawSubRegionHelper, OpFormattedDataExport
 
 from ilastik.applets.nanshe.opColorizeLabelImage import OpColorizeLabelImage
-from ilastik.applets.nanshe.opMaxProjection import OpMaxProjectionCached
-from ilastik.applets.nanshe.opMeanProjection import OpMeanProjectionCached
+from ilastik.applets.nanshe.opIncrementalProjection import OpIncrementalMaxProjection, OpIncrementalMeanProjection
 
 
 class OpNansheDataExport( OpDataExport ):
@@ -58,7 +57,7 @@ class OpNansheDataExport( OpDataExport ):
         # so it can be displayed alongside the data to export in the same viewer.
         # This keeps axis order, shape, etc. in sync with the displayed export data.
         # Note that we must not modify the channels of the raw data, so it gets passed through a helper.
-        self._opMax = OpMaxProjectionCached( parent=self )
+        self._opMax = OpIncrementalMaxProjection( parent=self )
         self._opMax.Input.connect( self.RawData )
         self._opMax.Axis.setValue( 0 )
 
@@ -87,7 +86,7 @@ class OpNansheDataExport( OpDataExport ):
         # so it can be displayed alongside the data to export in the same viewer.
         # This keeps axis order, shape, etc. in sync with the displayed export data.
         # Note that we must not modify the channels of the raw data, so it gets passed through a helper.
-        self._opMean = OpMeanProjectionCached( parent=self )
+        self._opMean = OpIncrementalMeanProjection( parent=self )
         self._opMean.Input.connect( self.RawData )
         self._opMean.Axis.setValue( 0 )
 
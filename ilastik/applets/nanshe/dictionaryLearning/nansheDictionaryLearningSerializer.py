@@ -41,6 +41,8 @@ class NansheDictionaryLearningSerializer(AppletSerializer):
                                                                    SerialSlot(operator.Clean, selfdepends=True),
                                                                    SerialSlot(operator.Mode, selfdepends=True),
                                                                    SerialSlot(operator.ModeD, selfdepends=True),
+                                                                   SerialSlot(operator.Streaming, selfdepends=True),
+                                                                   SerialSlot(operator.Prefetch, selfdepends=True),
                                                                    SerialBlockSlot(operator.Output,
                                                                                    operator.CacheInput,
                                                                                    operator.CleanBlocks, selfdepends=True)])
@@ -0,0 +1,144 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+
+
+class OnlineDictionaryLearner(object):
+    """
+    Online dictionary learning (Mairal et al., "Online Learning for Matrix
+    Factorization and Sparse Coding", 2010), which is the algorithm behind
+    spams.trainDL, for the elastic net formulation (trainDL mode 2, modeD 0).
+
+    Minibatches of frames are given to update() one after another.  Only the
+    dictionary D (pixels x K) and the sufficient statistics A = sum(alpha alpha^T)
+    (K x K) and B = sum(x alpha^T) (pixels x K) are kept, so the memory needed does
+    not depend on the number of frames seen.
+
+    The sparse codes minimize
+        0.5 ||x - D alpha||^2 + lambda1 ||alpha||_1 + 0.5 lambda2 ||alpha||^2
+    (subject to alpha >= 0 if posAlpha) and are found with a fixed number of
+    FISTA iterations instead of LARS.
+    """
+
+    # Number of FISTA iterations used to compute the sparse codes of a minibatch
+    CODING_ITERATIONS = 50
+
+    def __init__(self, K, lambda1=0.2, lambda2=0.0, posAlpha=True, posD=True, clean=True, seed=0):
+        self.K = K
+        self.lambda1 = lambda1
+        self.lambda2 = lambda2
+        self.posAlpha = posAlpha
+        self.posD = posD
+        self.clean = clean
+
+        self.random = numpy.random.RandomState(seed)
+
+        self.D = None
+        self.A = None
+        self.B = None
+        self.frames_seen = 0
+
+    def _project_atoms(self, D):
+        # Atoms are constrained to the unit ball (and to be positive, if requested).
+        if self.posD:
+            numpy.maximum(D, 0, out=D)
+        norms = numpy.sqrt((D**2).sum(axis=0))
+        D /= numpy.maximum(norms, 1)
+        return D
+
+    def _random_atoms(self, X, n):
+        # Random frames of X, normalized, or random noise where they are empty.
+        atoms = X[:, self.random.randint(0, X.shape[1], n)].copy()
+        empty = (atoms != 0).sum(axis=0) == 0
+        atoms[:, empty] = self.random.random_sample((X.shape[0], empty.sum()))
+        norms = numpy.sqrt((atoms**2).sum(axis=0))
+        atoms /= numpy.where(norms != 0, norms, 1)
+        return self._project_atoms(atoms)
+
+    def _initialize(self, X):
+        self.D = self._random_atoms(X, self.K)
+        self.A = numpy.zeros((self.K, self.K), dtype=numpy.float64)
+        self.B = numpy.zeros((X.shape[0], self.K), dtype=X.dtype)
+
+    def encode(self, X):
+        """
+        Sparse codes (K x n) of the columns of X (pixels x n) with the current dictionary.
+        """
+        D = self.D
+        gram = numpy.dot(D.T, D).astype(numpy.float64)
+        gram[numpy.diag_indices_from(gram)] += self.lambda2
+        correlation = numpy.dot(D.T, X).astype(numpy.float64)
+
+        lipschitz = numpy.linalg.eigvalsh(gram)[-1]
+        if lipschitz <= 0:
+            return numpy.zeros_like(correlation)
+        step = 1.0 / lipschitz
+        threshold = self.lambda1 * step
+
+        alpha = numpy.zeros_like(correlation)
+        momentum = alpha.copy()
+        t = 1.0
+        for i in xrange(self.CODING_ITERATIONS):
+            previous_alpha = alpha
+            alpha = momentum - step * (numpy.dot(gram, momentum) - correlation)
+            if self.posAlpha:
+                alpha -= threshold
+                numpy.maximum(alpha, 0, out=alpha)
+            else:
+                alpha = numpy.sign(alpha) * numpy.maximum(numpy.abs(alpha) - threshold, 0)
+
+            next_t = (1 + numpy.sqrt(1 + 4 * t * t)) / 2
+            momentum = alpha + ((t - 1) / next_t) * (alpha - previous_alpha)
+            t = next_t
+
+        return alpha
+
+    def update(self, X):
+        """
+        Updates the dictionary with the minibatch X (pixels x n).
+        """
+        if self.D is None:
+            self._initialize(X)
+
+        alpha = self.encode(X)
+
+        self.A += numpy.dot(alpha, alpha.T)
+        self.B += numpy.dot(X, alpha.T).astype(self.B.dtype)
+        self.frames_seen += X.shape[1]
+
+        # One pass of block coordinate descent over the atoms.
+        D = self.D
+        for j in xrange(self.K):
+            if self.A[j, j] <= 1e-10:
+                if self.clean:
+                    # Unused atom, restart it from a random frame.
+                    D[:, j] = self._random_atoms(X, 1)[:, 0]
+                continue
+
+            atom = (self.B[:, j] - numpy.dot(D, self.A[:, j])) / self.A[j, j] + D[:, j]
+            D[:, j] = self._project_atoms(atom[:, None])[:, 0]
+
+    @property
+    def dictionary(self):
+        """
+        The current dictionary (K x pixels).
+        """
+        return self.D.T
@@ -66,6 +66,8 @@ class OpNansheDictionaryLearning(Operator):
     Clean = InputSlot(value=True)
     Mode = InputSlot(value=2, stype="int")
     ModeD = InputSlot(value=0, stype="int")
+    Streaming = InputSlot(value=False)
+    Prefetch = InputSlot(value=2, stype="int")
 
     CleanBlocks = OutputSlot()
     Output = OutputSlot()
@@ -92,6 +94,8 @@ class OpNansheDictionaryLearning(Operator):
         self.opDictionary.Clean.connect(self.Clean)
         self.opDictionary.Mode.connect(self.Mode)
         self.opDictionary.ModeD.connect(self.ModeD)
+        self.opDictionary.Streaming.connect(self.Streaming)
+        self.opDictionary.Prefetch.connect(self.Prefetch)
 
         self.opDictionary.CacheInput.connect(self.CacheInput)
         self.CleanBlocks.connect(self.opDictionary.CleanBlocks)
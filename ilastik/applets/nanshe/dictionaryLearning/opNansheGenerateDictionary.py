@@ -24,10 +24,17 @@ __date__ = "$Oct 17, 2014 13:07:51 EDT$"
 
 
 
+import collections
+import resource
+import time
+from functools import partial
+
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.operators import OpArrayCache
+from lazyflow.request import Request
 
 from ilastik.applets.base.applet import DatasetConstraintError
+from ilastik.applets.nanshe.dictionaryLearning.onlineDictionaryLearning import OnlineDictionaryLearner
 
 import numpy
 
@@ -37,6 +44,9 @@ import nanshe
 import nanshe.imp.segment
 import nanshe.util.iters
 
+import logging
+logger = logging.getLogger(__name__)
+
 
 class OpNansheGenerateDictionary(Operator):
     """
@@ -63,11 +73,20 @@ class OpNansheGenerateDictionary(Operator):
     Mode = InputSlot(value=2, stype="int")
     ModeD = InputSlot(value=0, stype="int")
 
+    # If set, minibatches of Batchsize frames are read from Input one at a time
+    #  (Prefetch of them ahead) and fed to an online dictionary update, instead of
+    #  reading all of Input at once.  NumIter is the number of minibatches.
+    Streaming = InputSlot(value=False)
+    Prefetch = InputSlot(value=2, stype="int")
+
     Output = OutputSlot()
 
     def __init__(self, *args, **kwargs):
         super( OpNansheGenerateDictionary, self ).__init__( *args, **kwargs )
 
+        # Throughput and memory use of the last streaming run.
+        self.streaming_stats = {}
+
         self.Input.notifyReady( self._checkConstraints )
 
     def _checkConstraints(self, *args):
@@ -152,6 +171,13 @@ class OpNansheGenerateDictionary(Operator):
 
         output_key = tuple(output_key)
 
+        if self.Streaming.value:
+            processed = self._generate_dictionary_streaming(input_key)
+
+            if slot.name == 'Output':
+                result[...] = processed[output_key]
+            return
+
         raw = self.Input[input_key].wait()
         raw = raw[..., 0]
 
@@ -192,6 +218,82 @@ class OpNansheGenerateDictionary(Operator):
         if slot.name == 'Output':
             result[...] = processed[output_key]
 
+    def _iter_minibatches(self, num_frames):
+        """
+        Frame ranges of the minibatches.  The recording is split into contiguous
+        blocks of Batchsize frames, which are visited in a random order that is
+        shuffled again for every pass through the recording.
+        """
+        batchsize = max(1, min(self.Batchsize.value, num_frames))
+        starts = numpy.arange(0, num_frames, batchsize)
+        random = numpy.random.RandomState(0)
+
+        order = []
+        for i in xrange(self.NumIter.value):
+            if not order:
+                order = list(random.permutation(starts))
+            start = order.pop()
+            yield (start, min(start + batchsize, num_frames))
+
+    def _read_minibatch(self, input_key, frames):
+        key = list(input_key)
+        key[0] = slice(frames[0], frames[1], 1)
+
+        raw = self.Input[tuple(key)].wait()
+        raw = raw[..., 0]
+
+        # Each frame is a column.
+        return numpy.asarray(raw.reshape((raw.shape[0], -1)).T, dtype=numpy.float32)
+
+    def _generate_dictionary_streaming(self, input_key):
+        """
+        Learns the dictionary from minibatches of the input, keeping only the
+        dictionary and its sufficient statistics in memory.  Returns the
+        dictionary with the same layout as nanshe.imp.segment.generate_dictionary.
+        """
+        assert (self.Mode.value == 2) and (self.ModeD.value == 0), \
+            "Streaming dictionary learning only supports Mode 2 and ModeD 0."
+
+        spatial_shape = tuple(s.stop - s.start for s in input_key[1:-1])
+
+        learner = OnlineDictionaryLearner(self.K.value,
+                                          lambda1=self.Lambda1.value,
+                                          lambda2=self.Lambda2.value,
+                                          posAlpha=self.PosAlpha.value,
+                                          posD=self.PosD.value,
+                                          clean=self.Clean.value)
+
+        # The next minibatches are read by lazyflow requests,
+        #  while the current one is being learned from.
+        minibatches = self._iter_minibatches(input_key[0].stop - input_key[0].start)
+        pending = collections.deque()
+        def prefetch():
+            while len(pending) < max(1, self.Prefetch.value):
+                frames = next(minibatches, None)
+                if frames is None:
+                    break
+                req = Request( partial(self._read_minibatch, input_key, frames) )
+                req.submit()
+                pending.append(req)
+
+        start_time = time.time()
+        prefetch()
+        while pending:
+            X = pending.popleft().wait()
+            prefetch()
+            learner.update(X)
+
+        seconds = time.time() - start_time
+        # ru_maxrss is in kilobytes on Linux.
+        self.streaming_stats = { "frames" : learner.frames_seen,
+                                 "seconds" : seconds,
+                                 "frames_per_second" : learner.frames_seen / max(seconds, 1e-9),
+                                 "peak_rss_mb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 }
+        logger.info( "Streaming dictionary learning: {frames} frames in {seconds:.2f}s "
+                     "({frames_per_second:.1f} frames/s), peak RSS {peak_rss_mb:.1f} MB".format( **self.streaming_stats ) )
+
+        return learner.dictionary.reshape((-1,) + spatial_shape)
+
     def setInSlot(self, slot, subindex, roi, value):
         pass
 
@@ -199,8 +301,12 @@ class OpNansheGenerateDictionary(Operator):
         if (slot.name == "Input") or (slot.name == "K") or (slot.name == "Gamma1") or (slot.name == "Gamma2") or\
             (slot.name == "NumThreads") or (slot.name == "Batchsize") or (slot.name == "NumIter") or\
             (slot.name == "Lambda1") or (slot.name == "Lambda2") or (slot.name == "PosAlpha") or\
-            (slot.name == "PosD") or (slot.name == "Clean") or (slot.name == "Mode") or (slot.name == "ModeD"):
+            (slot.name == "PosD") or (slot.name == "Clean") or (slot.name == "Mode") or (slot.name == "ModeD") or\
+            (slot.name == "Streaming"):
             self.Output.setDirty( slice(None) )
+        elif slot.name == "Prefetch":
+            # Does not change the result.
+            pass
         else:
             assert False, "Unknown dirty input slot"
 
@@ -230,6 +336,8 @@ class OpNansheGenerateDictionaryCached(Operator):
     Clean = InputSlot(value=True)
     Mode = InputSlot(value=2, stype="int")
     ModeD = InputSlot(value=0, stype="int")
+    Streaming = InputSlot(value=False)
+    Prefetch = InputSlot(value=2, stype="int")
 
     CleanBlocks = OutputSlot()
     Output = OutputSlot()
@@ -252,6 +360,8 @@ class OpNansheGenerateDictionaryCached(Operator):
         self.opDictionary.Clean.connect(self.Clean)
         self.opDictionary.Mode.connect(self.Mode)
         self.opDictionary.ModeD.connect(self.ModeD)
+        self.opDictionary.Streaming.connect(self.Streaming)
+        self.opDictionary.Prefetch.connect(self.Prefetch)
 
 
         self.opCache = OpArrayCache(parent=self)
@@ -0,0 +1,272 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import itertools
+import threading
+from functools import partial
+
+import numpy
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, RequestPool, RequestLock
+
+import vigra
+
+import nanshe
+import nanshe.util.iters
+
+
+class _TileState(object):
+    """
+    Cached projection state of one output tile.
+
+    partials maps the index of a group of consecutive chunks of the projected
+    axis to the reduction of that group.  result is the combination of all
+    partials (None if stale).
+    """
+    def __init__(self):
+        self.lock = RequestLock()
+        self.partials = {}
+        self.result = None
+
+
+class OpIncrementalProjection(Operator):
+    """
+    Base class for projections along Axis that stream the projected axis in
+    chunks of ChunkSize instead of requesting all of it at once.
+
+    The output is divided into tiles.  The chunks of the projected axis are
+    divided into at most PARTIALS_PER_TILE groups of consecutive chunks.  For
+    every tile, the chunks of each group are folded into one partial reduction,
+    so the memory of a tile does not grow with the length of the projected axis.
+    The partials and the combined result are kept, so a tile is computed only
+    once, and a dirty notification covering part of the projected axis only
+    drops (and later recomputes) the affected groups of the affected tiles.
+
+    Subclasses define the reduction of a chunk, how two reductions are
+    accumulated, and how the accumulated reduction becomes the output.
+    """
+    name = "OpIncrementalProjection"
+    category = "Pointwise"
+
+
+    Input = InputSlot()
+
+    Axis = InputSlot(value=0, stype="int")
+    ChunkSize = InputSlot(value=256, stype="int")
+
+    Output = OutputSlot()
+
+    # Tile edge length along the spatial axes of the output
+    TILE_EDGE = 256
+
+    # Maximum number of partial reductions kept per tile
+    PARTIALS_PER_TILE = 8
+
+    def __init__(self, *args, **kwargs):
+        super( OpIncrementalProjection, self ).__init__( *args, **kwargs )
+
+        self._generation = {self.name : 0}
+
+        self._tiles = {}
+        self._tiles_lock = threading.Lock()
+
+    def setupOutputs(self):
+        # Copy the input metadata to both outputs
+        self.Output.meta.assignFrom( self.Input.meta )
+
+        self.Output.meta.axistags = vigra.AxisTags(
+            *list(nanshe.util.iters.iter_with_skip_indices( self.Output.meta.axistags, self.Axis.value))
+        )
+
+        self.Output.meta.shape = self.Output.meta.shape[:self.Axis.value] +\
+                                 self.Output.meta.shape[self.Axis.value+1:]
+
+        self.Output.meta.generation = self._generation
+
+        tile_shape = []
+        for each_axistag, each_len in zip(self.Output.meta.axistags, self.Output.meta.shape):
+            if each_axistag.isSpatial():
+                each_len = min(each_len, self.TILE_EDGE)
+            tile_shape.append(each_len)
+        self._tile_shape = tuple(tile_shape)
+
+        with self._tiles_lock:
+            self._tiles = {}
+
+    def _reduce_chunk(self, raw, axis):
+        raise NotImplementedError
+
+    def _accumulate(self, total, reduction):
+        """
+        Add reduction to total (in place, if possible) and return the total.
+        """
+        raise NotImplementedError
+
+    def _finish(self, total):
+        """
+        The output for the accumulated reduction of all chunks.
+        """
+        raise NotImplementedError
+
+    def _chunks_per_group(self):
+        axis_len = self.Input.meta.shape[self.Axis.value]
+        chunk_size = max(1, self.ChunkSize.value)
+        num_chunks = (axis_len + chunk_size - 1) // chunk_size
+        return max(1, (num_chunks + self.PARTIALS_PER_TILE - 1) // self.PARTIALS_PER_TILE)
+
+    def _iter_tiles(self, start, stop):
+        """
+        Start coordinates of all tiles that intersect the given output roi.
+        """
+        ranges = [ xrange((a // t) * t, b, t) for a, b, t in zip(start, stop, self._tile_shape) ]
+        return itertools.product(*ranges)
+
+    def _tile_state(self, tile_start):
+        with self._tiles_lock:
+            return self._tiles.setdefault(tile_start, _TileState())
+
+    def _compute_tile(self, tile_start):
+        """
+        Returns the projection of the given tile, computing the missing chunks first.
+        """
+        axis = self.Axis.value
+        axis_len = self.Input.meta.shape[axis]
+        chunk_size = max(1, self.ChunkSize.value)
+        tile_stop = numpy.minimum(numpy.add(tile_start, self._tile_shape), self.Output.meta.shape)
+
+        num_chunks = (axis_len + chunk_size - 1) // chunk_size
+        chunks_per_group = self._chunks_per_group()
+
+        state = self._tile_state(tile_start)
+        with state.lock:
+            if state.result is None:
+                for group_index in xrange((num_chunks + chunks_per_group - 1) // chunks_per_group):
+                    if group_index in state.partials:
+                        continue
+                    partial_reduction = None
+                    for chunk_index in xrange(group_index*chunks_per_group,
+                                              min((group_index+1)*chunks_per_group, num_chunks)):
+                        key = [ slice(a, b) for a, b in zip(tile_start, tile_stop) ]
+                        key.insert(axis, slice(chunk_index*chunk_size, min((chunk_index+1)*chunk_size, axis_len)))
+                        raw = self.Input[tuple(key)].wait()
+                        reduction = self._reduce_chunk(raw, axis)
+                        if partial_reduction is None:
+                            partial_reduction = reduction
+                        else:
+                            partial_reduction = self._accumulate(partial_reduction, reduction)
+                    state.partials[group_index] = partial_reduction
+
+                total = None
+                for group_index in sorted(state.partials):
+                    if total is None:
+                        total = state.partials[group_index].copy()
+                    else:
+                        total = self._accumulate(total, state.partials[group_index])
+                state.result = self._finish(total)
+            return state.result, tile_stop
+
+    def execute(self, slot, subindex, roi, result):
+        assert(self.Axis.value < len(self.Input.meta.shape))
+
+        def copy_tile(tile_start):
+            tile_result, tile_stop = self._compute_tile(tile_start)
+            start = numpy.maximum(tile_start, roi.start)
+            stop = numpy.minimum(tile_stop, roi.stop)
+            tile_key = tuple( slice(a - t, b - t) for a, b, t in zip(start, stop, tile_start) )
+            result_key = tuple( slice(a - r, b - r) for a, b, r in zip(start, stop, roi.start) )
+            result[result_key] = tile_result[tile_key]
+
+        pool = RequestPool()
+        for tile_start in self._iter_tiles(roi.start, roi.stop):
+            pool.add( Request( partial(copy_tile, tile_start) ) )
+        pool.wait()
+        pool.clean()
+
+        return result
+
+    def setInSlot(self, slot, subindex, roi, value):
+        pass
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot.name == "Input":
+            self._generation[self.name] += 1
+
+            axis = self.Axis.value
+            chunk_size = max(1, self.ChunkSize.value)
+            group_size = chunk_size * self._chunks_per_group()
+
+            start = list(roi.start)
+            stop = list(roi.stop)
+            dirty_groups = xrange(start.pop(axis) // group_size, (stop.pop(axis) + group_size - 1) // group_size)
+
+            # Forget the dirty groups of the tiles that have been computed.
+            with self._tiles_lock:
+                states = [ self._tiles[t] for t in self._iter_tiles(start, stop) if t in self._tiles ]
+            for state in states:
+                with state.lock:
+                    for group_index in dirty_groups:
+                        state.partials.pop(group_index, None)
+                    state.result = None
+
+            self.Output.setDirty(start, stop)
+        elif slot.name == "Axis":
+            self._generation[self.name] += 1
+            self.Output.setDirty( slice(None) )
+        elif slot.name == "ChunkSize":
+            # Same result, but the chunks are different.
+            with self._tiles_lock:
+                self._tiles = {}
+        else:
+            assert False, "Unknown dirty input slot"
+
+
+class OpIncrementalMaxProjection(OpIncrementalProjection):
+    """
+    Maximum projection along Axis, see OpIncrementalProjection.
+    """
+    name = "OpIncrementalMaxProjection"
+
+    def _reduce_chunk(self, raw, axis):
+        return raw.max(axis=axis)
+
+    def _accumulate(self, total, reduction):
+        return numpy.maximum(total, reduction, out=total)
+
+    def _finish(self, total):
+        return total
+
+
+class OpIncrementalMeanProjection(OpIncrementalProjection):
+    """
+    Mean projection along Axis, see OpIncrementalProjection.
+    The chunk sums are accumulated in float64.
+    """
+    name = "OpIncrementalMeanProjection"
+
+    def _reduce_chunk(self, raw, axis):
+        return raw.sum(axis=axis, dtype=numpy.float64)
+
+    def _accumulate(self, total, reduction):
+        return numpy.add(total, reduction, out=total)
+
+    def _finish(self, total):
+        mean = total / self.Input.meta.shape[self.Axis.value]
+        return mean.astype(self.Output.meta.dtype)
@@ -68,8 +68,10 @@ class OpNansheEstimateF0(Operator):
         self.Input.notifyReady( self._checkConstraints )
 
     def _checkConstraints(self, *args):
-        slot = self.Input
+        OpNansheEstimateF0.checkInputConstraints(self.Input)
 
+    @staticmethod
+    def checkInputConstraints(slot):
         sh = slot.meta.shape
         ax = slot.meta.axistags
         if (len(slot.meta.shape) != 4) and (len(slot.meta.shape) != 5):
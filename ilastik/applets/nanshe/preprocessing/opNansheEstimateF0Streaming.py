@@ -0,0 +1,427 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import collections
+import math
+import threading
+
+import numpy
+import vigra
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+
+from ilastik.applets.nanshe.preprocessing.opNansheEstimateF0 import OpNansheEstimateF0
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RollingWindowFilter(object):
+    """
+    Base class for filters over a centered temporal window of 2*radius+1 frames,
+    with reflective borders (frame -j is frame j, frame T-1+j is frame T-1-j),
+    which consume the frames of a sequence one by one.
+
+    Only the frames that are still needed by a window are kept.
+    If the first pushed frame is not frame 0, the first output is the first
+    frame whose window lies completely within the pushed frames.
+    """
+    def __init__(self, radius, length, first_index=0):
+        assert radius < length, \
+            "Window radius {} is too large for a sequence of {} frames".format(radius, length)
+
+        self.radius = radius
+        self.length = length
+
+        self.next_input_index = first_index
+        self.next_output_index = first_index if first_index == 0 else first_index + radius
+
+        self._frames = collections.deque()
+        self._frames_start = first_index
+
+    def reflect(self, index):
+        if index < 0:
+            return -index
+        if index >= self.length:
+            return 2*(self.length - 1) - index
+        return index
+
+    def frame(self, index):
+        return self._frames[self.reflect(index) - self._frames_start]
+
+    def _needed_range(self, index):
+        """
+        The (unreflected) indices that computing output index requires.
+        """
+        return (index - self.radius, index + self.radius)
+
+    def _available(self, index):
+        # Reflection never reaches beyond the direct part of the window,
+        #  so only its clipped ends need to be checked.
+        needed_start, needed_stop = self._needed_range(index)
+        last = self._frames_start + len(self._frames) - 1
+        return (max(needed_start, 0) >= self._frames_start) and (min(needed_stop, self.length - 1) <= last)
+
+    def push(self, frame):
+        """
+        Add the next frame of the sequence.
+        Returns a list of (index, output) for all outputs that became computable.
+        """
+        self._frames.append(frame)
+        self.next_input_index += 1
+
+        outputs = []
+        while (self.next_output_index < self.length) and self._available(self.next_output_index):
+            outputs.append((self.next_output_index, self._compute(self.next_output_index)))
+            self.next_output_index += 1
+
+        # Drop the frames that no future window (or window update) needs.
+        while self._frames and (self._frames_start < self._needed_range(self.next_output_index)[0]):
+            self._frames.popleft()
+            self._frames_start += 1
+
+        return outputs
+
+    def _compute(self, index):
+        raise NotImplementedError
+
+    def nbytes(self):
+        """
+        Memory held by the state of the filter.
+        """
+        return sum(each_frame.nbytes for each_frame in self._frames)
+
+
+class RollingGaussian(RollingWindowFilter):
+    """
+    Convolution along time with the given vigra kernel (BORDER_TREATMENT_REFLECT).
+    The state is the ring of the last 2*radius+1 frames.
+    """
+    def __init__(self, kernel, length, first_index=0):
+        self._weights = [(k, kernel[k]) for k in xrange(kernel.left(), kernel.right() + 1)]
+        radius = max(-kernel.left(), kernel.right())
+        super(RollingGaussian, self).__init__(radius, length, first_index)
+
+    def _compute(self, index):
+        result = numpy.zeros(self._frames[0].shape, dtype=numpy.float64)
+        for k, weight in self._weights:
+            result += weight * self.frame(index - k)
+        return result.astype(numpy.float32)
+
+
+class RollingQuantile(RollingWindowFilter):
+    """
+    Rank order filter along time over 2*half_window_size+1 frames.
+
+    The state is the sorted window of every pixel.  Advancing by one frame
+    removes the oldest value from and inserts the newest value into each sorted
+    window, instead of ranking the whole window again.
+    """
+    def __init__(self, half_window_size, which_quantile, length, first_index=0):
+        super(RollingQuantile, self).__init__(half_window_size, length, first_index)
+        window_length = 2*half_window_size + 1
+        self._rank = int(math.floor(which_quantile*(window_length - 1) + 0.5))
+        self._sorted = None
+
+    def _needed_range(self, index):
+        # The update also needs the value that drops out of the previous window.
+        start, stop = super(RollingQuantile, self)._needed_range(index)
+        if self._sorted is not None:
+            start -= 1
+        return (start, stop)
+
+    def _compute(self, index):
+        shape = self._frames[0].shape
+        if self._sorted is None:
+            window = [self.frame(j).ravel() for j in xrange(index - self.radius, index + self.radius + 1)]
+            self._sorted = numpy.sort(numpy.array(window), axis=0)
+        else:
+            self._update(self.frame(index - self.radius - 1).ravel(),
+                         self.frame(index + self.radius).ravel())
+        return self._sorted[self._rank].reshape(shape)
+
+    def _update(self, old, new):
+        sorted_window = self._sorted
+        window_length, num_pixels = sorted_window.shape
+
+        # Position of the removed value, and insertion position of the new value
+        # in the window without the removed value.
+        removed = (sorted_window < old).sum(axis=0)
+        inserted = (sorted_window < new).sum(axis=0) - (old < new)
+
+        rows = numpy.arange(window_length)[:, None]
+        source_rows = rows - (rows > inserted)
+        source_rows += (source_rows >= removed)
+        # (The inserted row itself may point past the end, it is overwritten below.)
+        numpy.minimum(source_rows, window_length - 1, out=source_rows)
+
+        columns = numpy.arange(num_pixels)
+        updated = sorted_window[source_rows, columns]
+        updated[inserted, columns] = new
+        self._sorted = updated
+
+    def nbytes(self):
+        nbytes = super(RollingQuantile, self).nbytes()
+        if self._sorted is not None:
+            nbytes += self._sorted.nbytes
+        return nbytes
+
+
+class StreamingF0Estimator(object):
+    """
+    Same result as nanshe.imp.segment.estimate_f0, but computed while walking
+    the time axis once: frames are pushed in temporal order (in chunks of any size),
+    and F0 is returned as soon as it is determined.
+
+    Memory is bounded by the two rolling windows, independent of the number of frames.
+    """
+    def __init__(self,
+                 length,
+                 half_window_size,
+                 which_quantile,
+                 temporal_smoothing_gaussian_filter_stdev,
+                 temporal_smoothing_gaussian_filter_window_size,
+                 spatial_smoothing_gaussian_filter_stdev,
+                 spatial_smoothing_gaussian_filter_window_size,
+                 first_index=0):
+        temporal_kernel = vigra.filters.gaussianKernel(temporal_smoothing_gaussian_filter_stdev,
+                                                       1.0,
+                                                       temporal_smoothing_gaussian_filter_window_size)
+        self._smoothing = RollingGaussian(temporal_kernel, length, first_index)
+        self._quantile = RollingQuantile(half_window_size,
+                                         which_quantile,
+                                         length,
+                                         self._smoothing.next_output_index)
+
+        self._spatial_kernel = vigra.filters.gaussianKernel(spatial_smoothing_gaussian_filter_stdev,
+                                                            1.0,
+                                                            spatial_smoothing_gaussian_filter_window_size)
+        self._spatial_kernel.setBorderTreatment(vigra.filters.BorderTreatmentMode.BORDER_TREATMENT_REFLECT)
+
+    @property
+    def next_input_index(self):
+        return self._smoothing.next_input_index
+
+    @property
+    def next_output_index(self):
+        return self._quantile.next_output_index
+
+    def finished(self):
+        return self.next_output_index >= self._quantile.length
+
+    def nbytes(self):
+        return self._smoothing.nbytes() + self._quantile.nbytes()
+
+    @staticmethod
+    def first_input_index(first_output_index, half_window_size, temporal_radius):
+        """
+        First frame that must be pushed to get exact results from first_output_index on.
+        """
+        return max(0, first_output_index - half_window_size - temporal_radius)
+
+    def push(self, frames):
+        """
+        Add the next frames (first axis is time).
+        Returns (first_index, f0) for the F0 frames that became available,
+        or (next_output_index, None) if there are none yet.
+        """
+        first_index = self.next_output_index
+        f0 = []
+        for each_frame in frames:
+            for _, each_smoothed in self._smoothing.push(numpy.asarray(each_frame, dtype=numpy.float32)):
+                f0.extend(each_f0 for _, each_f0 in self._quantile.push(each_smoothed))
+
+        if not f0:
+            return(first_index, None)
+
+        f0 = numpy.array(f0, dtype=numpy.float32)
+        for d in xrange(1, f0.ndim):
+            vigra.filters.convolveOneDimension(f0, d, self._spatial_kernel, out=f0)
+
+        return(first_index, f0)
+
+
+class OpNansheEstimateF0Streaming(Operator):
+    """
+    Computes the same F0 estimate as OpNansheEstimateF0, but streams the haloed
+    input in chunks of TemporalChunkSize frames through a StreamingF0Estimator
+    instead of filtering the whole haloed block at once.
+
+    The estimator state is kept for each spatial region, so requests for consecutive
+    temporal chunks of the same region (e.g. during export) continue the stream
+    without reading the temporal halo again.  The kept states are limited to
+    MaxStreamBytes in total (least recently used ones are dropped first), and
+    the state of a stream that reached the last frame is dropped right away.
+    """
+    name = "OpNansheEstimateF0Streaming"
+    category = "Pointwise"
+
+    Input = InputSlot()
+
+    HalfWindowSize = InputSlot(value=400, stype='int')
+    WhichQuantile = InputSlot(value=0.15, stype='float')
+    TemporalSmoothingGaussianFilterStdev = InputSlot(value=5.0, stype='float')
+    TemporalSmoothingGaussianFilterWindowSize = InputSlot(value=5.0, stype='float')
+    SpatialSmoothingGaussianFilterStdev = InputSlot(value=5.0, stype='float')
+    SpatialSmoothingGaussianFilterWindowSize = InputSlot(value=5.0, stype='float')
+    TemporalChunkSize = InputSlot(value=50, stype='int')
+
+    Output = OutputSlot()
+
+    # Memory limit for the kept stream states
+    MaxStreamBytes = 256 * 2**20
+
+    def __init__(self, *args, **kwargs):
+        super( OpNansheEstimateF0Streaming, self ).__init__( *args, **kwargs )
+
+        self._generation = {self.name : 0}
+
+        self._streams = collections.OrderedDict()
+        self._streamBytes = 0
+        self._lock = threading.Lock()
+
+        self.Input.notifyReady( self._checkConstraints )
+
+    def _checkConstraints(self, *args):
+        OpNansheEstimateF0.checkInputConstraints(self.Input)
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom( self.Input.meta )
+        self.Output.meta.dtype = numpy.float32
+
+        self.Output.meta.generation = self._generation
+
+        self._resetStreams()
+
+    def _resetStreams(self):
+        with self._lock:
+            self._streams.clear()
+            self._streamBytes = 0
+
+    def streamBytes(self):
+        """
+        Memory held by the kept stream states.
+        """
+        with self._lock:
+            return self._streamBytes
+
+    def _newEstimator(self, first_index):
+        return StreamingF0Estimator(self.Input.meta.shape[0],
+                                    self.HalfWindowSize.value,
+                                    self.WhichQuantile.value,
+                                    self.TemporalSmoothingGaussianFilterStdev.value,
+                                    self.TemporalSmoothingGaussianFilterWindowSize.value,
+                                    self.SpatialSmoothingGaussianFilterStdev.value,
+                                    self.SpatialSmoothingGaussianFilterWindowSize.value,
+                                    first_index)
+
+    def _temporalRadius(self):
+        stdev = self.TemporalSmoothingGaussianFilterStdev.value
+        window_size = self.TemporalSmoothingGaussianFilterWindowSize.value
+        return int(window_size*stdev + 0.5)
+
+    def execute(self, slot, subindex, roi, result):
+        image_shape = self.Input.meta.shape
+        half_window_size = self.HalfWindowSize.value
+        chunk_size = max(1, self.TemporalChunkSize.value)
+
+        # Only the spatial halo is needed, the temporal one is streamed.
+        key = roi.toSlice()
+        halo_key, within_halo_key = OpNansheEstimateF0.compute_halo(key,
+                                                                   image_shape,
+                                                                   0,
+                                                                   0.0,
+                                                                   0.0,
+                                                                   self.SpatialSmoothingGaussianFilterStdev.value,
+                                                                   self.SpatialSmoothingGaussianFilterWindowSize.value)
+        spatial_key = tuple((s.start, s.stop) for s in halo_key[1:-1])
+        within_halo_key = tuple(within_halo_key[1:-1])
+
+        t_start, t_stop = roi.start[0], roi.stop[0]
+        read_stop = min(image_shape[0], t_stop + half_window_size + self._temporalRadius())
+
+        # Continue a previous stream of this region if it stopped right before this request.
+        with self._lock:
+            estimator = self._streams.pop(spatial_key, None)
+            if estimator is not None:
+                self._streamBytes -= estimator.nbytes()
+        if (estimator is None) or (estimator.next_output_index != t_start):
+            read_start = StreamingF0Estimator.first_input_index(t_start, half_window_size, self._temporalRadius())
+            estimator = self._newEstimator(read_start)
+
+        for chunk_start in xrange(estimator.next_input_index, read_stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, read_stop)
+            chunk_key = (slice(chunk_start, chunk_stop),) + tuple(halo_key[1:])
+            raw = self.Input[chunk_key].wait()[..., 0]
+
+            f0_start, f0 = estimator.push(raw)
+            if f0 is None:
+                continue
+
+            f0_stop = f0_start + len(f0)
+            copy_start = max(f0_start, t_start)
+            copy_stop = min(f0_stop, t_stop)
+            if copy_start < copy_stop:
+                f0 = f0[(slice(copy_start - f0_start, copy_stop - f0_start),) + within_halo_key]
+                result[copy_start - t_start:copy_stop - t_start] = f0[..., None][..., roi.start[-1]:roi.stop[-1]]
+
+        nbytes = estimator.nbytes()
+        if estimator.finished() or nbytes > self.MaxStreamBytes:
+            return result
+        with self._lock:
+            self._streams[spatial_key] = estimator
+            self._streamBytes += nbytes
+            while self._streamBytes > self.MaxStreamBytes:
+                _, dropped = self._streams.popitem(last=False)
+                self._streamBytes -= dropped.nbytes()
+
+        return result
+
+    def setInSlot(self, slot, subindex, roi, value):
+        pass
+
+    def propagateDirty(self, slot, subindex, roi):
+        self._resetStreams()
+
+        if slot.name == "Input":
+            self._generation[self.name] += 1
+
+            roi_slice = roi.toSlice()
+            roi_halo = OpNansheEstimateF0.compute_halo(roi_slice,
+                                                       self.Input.meta.shape,
+                                                       self.HalfWindowSize.value,
+                                                       self.TemporalSmoothingGaussianFilterStdev.value,
+                                                       self.TemporalSmoothingGaussianFilterWindowSize.value,
+                                                       self.SpatialSmoothingGaussianFilterStdev.value,
+                                                       self.SpatialSmoothingGaussianFilterWindowSize.value)[0]
+
+            self.Output.setDirty(roi_halo)
+        elif slot.name == "TemporalChunkSize":
+            # Doesn't change the result.
+            pass
+        elif slot.name == "TemporalSmoothingGaussianFilterStdev" or \
+             slot.name == "TemporalSmoothingGaussianFilterWindowSize" or \
+             slot.name == "HalfWindowSize" or slot.name == "WhichQuantile" or \
+             slot.name == "SpatialSmoothingGaussianFilterStdev" or \
+             slot.name == "SpatialSmoothingGaussianFilterWindowSize":
+            self._generation[self.name] += 1
+            self.Output.setDirty( slice(None) )
+        else:
+            assert False, "Unknown dirty input slot"
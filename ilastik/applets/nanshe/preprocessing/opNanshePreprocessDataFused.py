@@ -0,0 +1,273 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.operators import OpArrayCache
+
+from ilastik.applets.nanshe.preprocessing.opNansheEstimateF0 import OpNansheEstimateF0
+from ilastik.applets.nanshe.preprocessing.opNansheWaveletTransform import OpNansheWaveletTransform
+
+import nanshe
+import nanshe.util.iters
+import nanshe.imp.segment
+import nanshe.imp.filters.wavelet
+
+
+class OpNanshePreprocessDataFused(Operator):
+    """
+    Computes the same Output as OpNanshePreprocessData, but runs all enabled
+    stages (type conversion, zeroed line removal, dF/F and wavelet transform)
+    on a single haloed block instead of pulling nested halos through a chain
+    of operators.
+
+    The cumulative halo of the requested block is computed once and read once.
+    The stages then work on two float32 buffers of that size, which are swapped
+    and reused in place, so no intermediate result is copied between operators
+    or cached.
+
+    Like OpNanshePreprocessData, the zeroed lines are removed separately for
+    the haloed block F0 is estimated from and for the (smaller) block dF/F is
+    computed on (in one more buffer of that size), as lines that cross the
+    border of a block are removed differently.
+    """
+    name = "OpNanshePreprocessDataFused"
+    category = "Pointwise"
+
+
+    Input = InputSlot()
+
+
+    ToRemoveZeroedLines = InputSlot(value=True)
+    ErosionShape = InputSlot(value=[21, 1])
+    DilationShape = InputSlot(value=[1, 3])
+
+    ToExtractF0 = InputSlot(value=True)
+    HalfWindowSize = InputSlot(value=400, stype='int')
+    WhichQuantile = InputSlot(value=0.15, stype='float')
+    TemporalSmoothingGaussianFilterStdev = InputSlot(value=5.0, stype='float')
+    SpatialSmoothingGaussianFilterStdev = InputSlot(value=5.0, stype='float')
+    TemporalSmoothingGaussianFilterWindowSize = InputSlot(value=5.0, stype='float')
+    SpatialSmoothingGaussianFilterWindowSize = InputSlot(value=5.0, stype='float')
+    BiasEnabled = InputSlot(value=False, stype='bool')
+    Bias = InputSlot(value=0.0, stype='float')
+
+    ToWaveletTransform = InputSlot(value=True)
+    Scale = InputSlot(value=4)
+
+
+    Output = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super( OpNanshePreprocessDataFused, self ).__init__( *args, **kwargs )
+
+        self._generation = {self.name : 0}
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom( self.Input.meta )
+        self.Output.meta.dtype = numpy.float32
+
+        self.Output.meta.generation = self._generation
+
+    def compute_halo(self, slicing):
+        """
+        Returns the haloed slicing that must be read for the given output slicing,
+        and the slicing dF/F must be computed on (both absolute).
+        """
+        image_shape = self.Input.meta.shape
+
+        df_f_slicing = slicing
+        if self.ToWaveletTransform.value:
+            df_f_slicing = OpNansheWaveletTransform.compute_halo(slicing, image_shape, self.Scale.value)[0]
+
+        halo_slicing = df_f_slicing
+        if self.ToExtractF0.value:
+            halo_slicing = OpNansheEstimateF0.compute_halo(df_f_slicing,
+                                                           image_shape,
+                                                           self.HalfWindowSize.value,
+                                                           self.TemporalSmoothingGaussianFilterStdev.value,
+                                                           self.TemporalSmoothingGaussianFilterWindowSize.value,
+                                                           self.SpatialSmoothingGaussianFilterStdev.value,
+                                                           self.SpatialSmoothingGaussianFilterWindowSize.value)[0]
+
+        return(halo_slicing, df_f_slicing)
+
+    @staticmethod
+    def _within(inner_slicing, outer_slicing):
+        # The inner slicing relative to the outer one, without the channel axis.
+        return tuple(slice(i.start - o.start, i.stop - o.start)
+                     for i, o in zip(inner_slicing[:-1], outer_slicing[:-1]))
+
+    def execute(self, slot, subindex, roi, result):
+        key = roi.toSlice()
+        key = nanshe.util.iters.reformat_slices(key, self.Input.meta.shape)
+        halo_key, df_f_key = self.compute_halo(key)
+
+        data = self.Input[halo_key].wait()
+        data = numpy.asarray(data[..., 0], dtype=numpy.float32)
+        spare = numpy.empty_like(data)
+
+        df_f_within_halo_key = OpNanshePreprocessDataFused._within(df_f_key, halo_key)
+
+        df_f_data = None
+        if self.ToRemoveZeroedLines.value:
+            if self.ToExtractF0.value:
+                # dF/F uses the lines removed from its own block only.
+                df_f_data = nanshe.imp.segment.remove_zeroed_lines(data[df_f_within_halo_key],
+                                                                   erosion_shape=self.ErosionShape.value,
+                                                                   dilation_shape=self.DilationShape.value)
+            nanshe.imp.segment.remove_zeroed_lines(data,
+                                                   erosion_shape=self.ErosionShape.value,
+                                                   dilation_shape=self.DilationShape.value,
+                                                   out=spare)
+            data, spare = spare, data
+
+        if self.ToExtractF0.value:
+            # The spare buffer is free again, so F0 goes there.
+            f0 = nanshe.imp.segment.estimate_f0(
+                data,
+                half_window_size=self.HalfWindowSize.value,
+                which_quantile=self.WhichQuantile.value,
+                temporal_smoothing_gaussian_filter_stdev=self.TemporalSmoothingGaussianFilterStdev.value,
+                temporal_smoothing_gaussian_filter_window_size=self.TemporalSmoothingGaussianFilterWindowSize.value,
+                spatial_smoothing_gaussian_filter_stdev=self.SpatialSmoothingGaussianFilterStdev.value,
+                spatial_smoothing_gaussian_filter_window_size=self.SpatialSmoothingGaussianFilterWindowSize.value,
+                out=spare
+            )
+            f0 = f0[df_f_within_halo_key]
+            if df_f_data is not None:
+                data = df_f_data
+            else:
+                data = data[df_f_within_halo_key]
+
+            if self.BiasEnabled.value:
+                bias = self.Bias.value
+            else:
+                bias = 1 - data.min()
+
+            # dF/F, in place
+            data -= f0
+            f0 += bias
+            data /= f0
+        else:
+            data = data[df_f_within_halo_key]
+
+        if self.ToWaveletTransform.value:
+            data = numpy.ascontiguousarray(data)
+            nanshe.imp.filters.wavelet.transform(data,
+                                                 scale=self.Scale.value,
+                                                 include_intermediates=False,
+                                                 include_lower_scales=False,
+                                                 out=data)
+
+        data = data[OpNanshePreprocessDataFused._within(key, df_f_key)]
+
+        if slot.name == 'Output':
+            result[...] = data[..., None]
+
+    def setInSlot(self, slot, subindex, roi, value):
+        pass
+
+    def propagateDirty(self, slot, subindex, roi):
+        self._generation[self.name] += 1
+
+        if slot.name == "Input":
+            self.Output.setDirty(self.compute_halo(roi.toSlice())[0])
+        else:
+            self.Output.setDirty( slice(None) )
+
+
+class OpNanshePreprocessDataFusedCached(Operator):
+    """
+    OpNanshePreprocessDataFused with a cache of the final output only.
+    """
+    name = "OpNanshePreprocessDataFusedCached"
+    category = "Pointwise"
+
+
+    Input = InputSlot()
+    CacheInput = InputSlot(optional=True)
+
+
+    ToRemoveZeroedLines = InputSlot(value=True)
+    ErosionShape = InputSlot(value=[21, 1])
+    DilationShape = InputSlot(value=[1, 3])
+
+    ToExtractF0 = InputSlot(value=True)
+    HalfWindowSize = InputSlot(value=400, stype='int')
+    WhichQuantile = InputSlot(value=0.15, stype='float')
+    TemporalSmoothingGaussianFilterStdev = InputSlot(value=5.0, stype='float')
+    SpatialSmoothingGaussianFilterStdev = InputSlot(value=5.0, stype='float')
+    TemporalSmoothingGaussianFilterWindowSize = InputSlot(value=5.0, stype='float')
+    SpatialSmoothingGaussianFilterWindowSize = InputSlot(value=5.0, stype='float')
+    BiasEnabled = InputSlot(value=False, stype='bool')
+    Bias = InputSlot(value=0.0, stype='float')
+
+    ToWaveletTransform = InputSlot(value=True)
+    Scale = InputSlot(value=4)
+
+
+    CleanBlocks = OutputSlot()
+    CacheOutput = OutputSlot()
+    Output = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super( OpNanshePreprocessDataFusedCached, self ).__init__( *args, **kwargs )
+
+        self.opPreprocessData = OpNanshePreprocessDataFused(parent=self)
+
+        self.opPreprocessData.ToRemoveZeroedLines.connect(self.ToRemoveZeroedLines)
+        self.opPreprocessData.ErosionShape.connect(self.ErosionShape)
+        self.opPreprocessData.DilationShape.connect(self.DilationShape)
+
+        self.opPreprocessData.ToExtractF0.connect(self.ToExtractF0)
+        self.opPreprocessData.HalfWindowSize.connect(self.HalfWindowSize)
+        self.opPreprocessData.WhichQuantile.connect(self.WhichQuantile)
+        self.opPreprocessData.TemporalSmoothingGaussianFilterStdev.connect(self.TemporalSmoothingGaussianFilterStdev)
+        self.opPreprocessData.SpatialSmoothingGaussianFilterStdev.connect(self.SpatialSmoothingGaussianFilterStdev)
+        self.opPreprocessData.TemporalSmoothingGaussianFilterWindowSize.connect(self.TemporalSmoothingGaussianFilterWindowSize)
+        self.opPreprocessData.SpatialSmoothingGaussianFilterWindowSize.connect(self.SpatialSmoothingGaussianFilterWindowSize)
+        self.opPreprocessData.BiasEnabled.connect(self.BiasEnabled)
+        self.opPreprocessData.Bias.connect(self.Bias)
+
+        self.opPreprocessData.ToWaveletTransform.connect(self.ToWaveletTransform)
+        self.opPreprocessData.Scale.connect(self.Scale)
+
+        self.opPreprocessData.Input.connect(self.Input)
+
+        self.opCache = OpArrayCache(parent=self)
+        self.opCache.fixAtCurrent.setValue(False)
+        self.opCache.Input.connect(self.opPreprocessData.Output)
+
+        self.CleanBlocks.connect(self.opCache.CleanBlocks)
+        self.CacheOutput.connect(self.opCache.Output)
+        self.Output.connect(self.opPreprocessData.Output)
+
+    def setupOutputs(self):
+        self.opCache.blockShape.setValue( self.opCache.Output.meta.shape )
+
+    def setInSlot(self, slot, subindex, key, value):
+        assert slot == self.CacheInput
+
+        self.opCache.setInSlot(self.opCache.Input, subindex, key, value)
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
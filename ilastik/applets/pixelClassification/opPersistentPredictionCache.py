@@ -0,0 +1,305 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import os
+import hashlib
+import cPickle as pickle
+import itertools
+import threading
+from functools import partial
+
+import numpy
+import h5py
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, RequestPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+# h5py is not thread-safe, and several operators may share one cache file.
+_fileLock = threading.RLock()
+_openFiles = {} # path -> [h5py.File, number of users]
+
+def _acquireFile( path ):
+    path = os.path.abspath( path )
+    with _fileLock:
+        if path not in _openFiles:
+            _openFiles[path] = [ h5py.File( path, 'a' ), 0 ]
+        _openFiles[path][1] += 1
+        return _openFiles[path][0]
+
+def _releaseFile( path ):
+    path = os.path.abspath( path )
+    with _fileLock:
+        entry = _openFiles.get( path )
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            entry[0].close()
+            del _openFiles[path]
+
+def _hashH5Group( digest, group ):
+    def visit( name, obj ):
+        digest.update( name )
+        for attrName in sorted( obj.attrs.keys() ):
+            digest.update( attrName )
+            digest.update( numpy.asarray( obj.attrs[attrName] ).tostring() )
+        if isinstance( obj, h5py.Dataset ):
+            digest.update( numpy.asarray( obj[()] ).tostring() )
+    names = []
+    group.visit( names.append )
+    for name in sorted( names ):
+        visit( name, group[name] )
+
+def classifierDigest( classifier ):
+    """
+    A hash of the classifier's state.  Classifiers that can be saved to hdf5
+    (like the ones stored in the project file) are hashed via their hdf5 representation.
+    """
+    digest = hashlib.sha1()
+    digest.update( type(classifier).__name__ )
+    if hasattr( classifier, 'serialize_hdf5' ):
+        # In-memory file, never written to disk
+        f = h5py.File( 'classifier_digest_{}'.format( id(classifier) ), 'w', driver='core', backing_store=False )
+        try:
+            classifier.serialize_hdf5( f )
+            _hashH5Group( digest, f )
+        finally:
+            f.close()
+    else:
+        digest.update( pickle.dumps( classifier, pickle.HIGHEST_PROTOCOL ) )
+    return digest.hexdigest()
+
+def datasetIdentity( datasetInfo ):
+    """
+    Identifies the input dataset of a lane (its id and location), or None if unknown.
+    """
+    if datasetInfo is None:
+        return None
+    return "{}:{}".format( datasetInfo.datasetId, datasetInfo.filePath )
+
+class OpPersistentPredictionCache(Operator):
+    """
+    Keeps computed prediction blocks in an hdf5 file (CacheFile), so that a later
+    session, or a headless export that was interrupted, can reload them instead of
+    recomputing them.  Blocks are loaded lazily, when they are requested.
+
+    The blocks of each dataset are stored under a key that hashes the classifier,
+    the feature selection (channel names and shape of FeatureImages) and the
+    dataset identity.  If any of them changes, the stored blocks of that dataset
+    are discarded the next time predictions are requested (the datasets in the
+    file are reused, so the file does not grow with every change).  If Input
+    becomes dirty while the cache is open, the stored blocks it touches are
+    discarded.
+
+    Without a CacheFile (or without a trained classifier), Input is passed through.
+    """
+    name = "OpPersistentPredictionCache"
+
+    Input = InputSlot() # Predictions
+    Classifier = InputSlot()
+    FeatureImages = InputSlot() # The features the predictions are computed from (only the meta data is used)
+    DatasetInfo = InputSlot(optional=True) # DatasetInfo of the lane's raw data
+    CacheFile = InputSlot(optional=True) # Path of the hdf5 file to keep the predictions in
+    BlockShape = InputSlot(optional=True) # If not given, BlockDims is used (the channel axis is never split)
+
+    Output = OutputSlot()
+
+    BlockDims = { 't' : 1, 'z' : 64, 'y' : 256, 'x' : 256 }
+
+    def __init__(self, *args, **kwargs):
+        super(OpPersistentPredictionCache, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._filePath = None
+        self._group = None # The group of the current key, opened lazily
+        self._key = None # The key of _group
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom( self.Input.meta )
+        self._closeCache()
+
+    def _blockShape(self):
+        shape = self.Input.meta.shape
+        if self.BlockShape.ready():
+            blockShape = self.BlockShape.value
+        else:
+            blockShape = [ self.BlockDims.get( k, s ) for k, s in zip( self.Input.meta.getAxisKeys(), shape ) ]
+        return tuple( min(b, s) for b, s in zip( blockShape, shape ) )
+
+    def cacheKey(self):
+        """
+        The key the blocks are currently stored under, or None if they are not stored.
+        """
+        classifier = self.Classifier.value
+        if classifier is None:
+            return None
+
+        digest = hashlib.sha1()
+        digest.update( classifierDigest( classifier ) )
+        digest.update( repr( self.FeatureImages.meta.channel_names ) )
+        digest.update( repr( ( self.FeatureImages.meta.shape, str(self.FeatureImages.meta.dtype) ) ) )
+        digest.update( repr( ( self.Input.meta.shape, str(self.Input.meta.dtype), self._blockShape() ) ) )
+        digest.update( repr( self._datasetName() ) )
+        return digest.hexdigest()
+
+    def _datasetName(self):
+        identity = None
+        if self.DatasetInfo.ready():
+            identity = datasetIdentity( self.DatasetInfo.value )
+        if identity is None:
+            return "default"
+        return hashlib.sha1( identity ).hexdigest()
+
+    def _openCache(self):
+        """
+        Returns the hdf5 group of the current key (creating it if necessary), or None.
+        """
+        with self._lock:
+            if self._group is not None:
+                return self._group
+            if not self.CacheFile.ready():
+                return None
+            key = self.cacheKey()
+            if key is None:
+                return None
+
+            self._filePath = self.CacheFile.value
+            f = _acquireFile( self._filePath )
+            shape = self.Input.meta.shape
+            blockShape = self._blockShape()
+            gridShape = tuple( (s + b - 1) // b for s, b in zip( shape, blockShape ) )
+
+            with _fileLock:
+                datasets = f.require_group( 'predictions' )
+                name = self._datasetName()
+                if name in datasets and datasets[name].attrs['key'] != key:
+                    logger.info( "Discarding stored predictions for {} (classifier, features or data changed)"
+                                 .format( self._filePath ) )
+                    group = datasets[name]
+                    data = group['data']
+                    if ( data.shape == shape and data.dtype == numpy.dtype(self.Input.meta.dtype)
+                         and data.chunks == blockShape ):
+                        # Reuse the datasets: hdf5 doesn't reclaim the space of deleted ones.
+                        group['done'][...] = 0
+                        group.attrs['key'] = key
+                    else:
+                        del datasets[name]
+                if name not in datasets:
+                    group = datasets.create_group( name )
+                    group.attrs['key'] = key
+                    group.create_dataset( 'data', shape=shape, dtype=self.Input.meta.dtype,
+                                          chunks=blockShape, compression='lzf' )
+                    # (Explicitly zeroed: without a fill value, hdf5 may return stale file contents.)
+                    group.create_dataset( 'done', data=numpy.zeros( gridShape, dtype=numpy.uint8 ) )
+                group = datasets[name]
+                logger.debug( "Predictions for {}: {} of {} blocks stored"
+                              .format( self._filePath, numpy.count_nonzero( group['done'][()] ), numpy.prod( gridShape ) ) )
+            self._group = group
+            self._key = key
+            return group
+
+    def _closeCache(self):
+        with self._lock:
+            if self._group is not None:
+                with _fileLock:
+                    self._group.file.flush()
+                _releaseFile( self._filePath )
+            self._group = None
+            self._key = None
+            self._filePath = None
+
+    def _discardBlocks(self, roi):
+        """
+        Clear the done flags of the stored blocks that intersect roi, if the
+        cache is open.  The key is not recomputed here (that may train the
+        classifier): the open group always belongs to the stored key, because
+        the cache is closed whenever the Classifier or FeatureImages change.
+        """
+        with self._lock:
+            group, key = self._group, self._key
+        if group is None or key is None:
+            return
+        blockShape = self._blockShape()
+        gridKey = tuple( slice( a // b, (c + b - 1) // b ) for a, c, b in zip( roi.start, roi.stop, blockShape ) )
+        with _fileLock:
+            group['done'][gridKey] = 0
+
+    def storedBlockCount(self):
+        """
+        How many blocks are stored for the current key (0 if there is no cache file).
+        """
+        group = self._openCache()
+        if group is None:
+            return 0
+        with _fileLock:
+            return int( numpy.count_nonzero( group['done'][()] ) )
+
+    def execute(self, slot, subindex, roi, result):
+        group = self._openCache()
+        if group is None:
+            self.Input( roi.start, roi.stop ).writeInto( result ).wait()
+            return result
+
+        shape = self.Input.meta.shape
+        blockShape = self._blockShape()
+        ranges = [ range( a // b, (c + b - 1) // b ) for a, c, b in zip( roi.start, roi.stop, blockShape ) ]
+
+        pool = RequestPool()
+        for blockIndex in itertools.product( *ranges ):
+            pool.add( Request( partial( self._processBlock, group, blockIndex, blockShape, shape, roi, result ) ) )
+        pool.wait()
+        pool.clean()
+        return result
+
+    def _processBlock(self, group, blockIndex, blockShape, shape, roi, result):
+        blockStart = numpy.multiply( blockIndex, blockShape )
+        blockStop = numpy.minimum( blockStart + blockShape, shape )
+        blockKey = tuple( slice(a, b) for a, b in zip( blockStart, blockStop ) )
+
+        with _fileLock:
+            done = group['done'][blockIndex]
+            if done:
+                data = group['data'][blockKey]
+        if not done:
+            data = self.Input( list(blockStart), list(blockStop) ).wait()
+            with _fileLock:
+                group['data'][blockKey] = data
+                group['done'][blockIndex] = 1
+
+        start = numpy.maximum( roi.start, blockStart )
+        stop = numpy.minimum( roi.stop, blockStop )
+        dataKey = tuple( slice(a - b, c - b) for a, c, b in zip( start, stop, blockStart ) )
+        resultKey = tuple( slice(a - r, c - r) for a, c, r in zip( start, stop, roi.start ) )
+        result[resultKey] = data[dataKey]
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot == self.Input:
+            self._discardBlocks( roi )
+            self.Output.setDirty( roi.start, roi.stop )
+        else:
+            # The key (or the block layout) may have changed
+            self._closeCache()
+            self.Output.setDirty( slice(None) )
+
+    def cleanUp(self):
+        self._closeCache()
+        super(OpPersistentPredictionCache, self).cleanUp()
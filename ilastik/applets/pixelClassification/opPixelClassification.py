@@ -29,7 +29,7 @@ import vigra
 #lazyflow
 from lazyflow.roi import determineBlockShape
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.operators import OpValueCache, OpTrainClassifierBlocked, OpClassifierPredict,\
+from lazyflow.operators import OpValueCache, OpClassifierPredict,\
                                OpSlicedBlockedArrayCache, OpMultiArraySlicer2, \
                                OpPixelOperator, OpMaxChannelIndicatorOperator, OpCompressedUserLabelArray
 
@@ -39,6 +39,8 @@ from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory
 from ilastik.applets.base.applet import DatasetConstraintError
 from ilastik.utility.operatorSubView import OperatorSubView
 from ilastik.utility import OpMultiLaneWrapper
+from ilastik.applets.pixelClassification.opTrainClassifierStratified import OpTrainClassifierStratified
+from ilastik.applets.pixelClassification.opPersistentPredictionCache import OpPersistentPredictionCache
 
 class OpPixelClassification( Operator ):
     """
@@ -60,9 +62,13 @@ class OpPixelClassification( Operator ):
 
     FreezePredictions = InputSlot(stype='bool')
     ClassifierFactory = InputSlot(value=ParallelVigraRfLazyflowClassifierFactory(100))
+    MaxSamplesPerClass = InputSlot(value=None) # If set, train on a seeded random subset of at most this many pixels per class
 
     PredictionsFromDisk = InputSlot(optional=True, level=1)
 
+    PredictionCacheFile = InputSlot(optional=True) # If given, computed predictions are kept in this hdf5 file (see OpPersistentPredictionCache)
+    DatasetInfos = InputSlot(optional=True, level=1) # Identify each lane's data in the PredictionCacheFile
+
     PredictionProbabilities = OutputSlot(level=1) # Classification predictions (via feature cache for interactive speed)
 
     PredictionProbabilityChannels = OutputSlot(level=2) # Classification predictions, enumerated by channel
@@ -122,8 +128,9 @@ class OpPixelClassification( Operator ):
         self.NonzeroLabelBlocks.connect( self.opLabelPipeline.nonzeroBlocks )
 
         # Hook up the Training operator
-        self.opTrain = OpTrainClassifierBlocked( parent=self )
+        self.opTrain = OpTrainClassifierStratified( parent=self )
         self.opTrain.ClassifierFactory.connect( self.ClassifierFactory )
+        self.opTrain.MaxSamplesPerClass.connect( self.MaxSamplesPerClass )
         self.opTrain.Labels.connect( self.opLabelPipeline.Output )
         self.opTrain.Images.connect( self.CachedFeatureImages )
         self.opTrain.nonzeroLabelBlocks.connect( self.opLabelPipeline.nonzeroBlocks )
@@ -145,6 +152,8 @@ class OpPixelClassification( Operator ):
         self.opPredictionPipeline.FreezePredictions.connect( self.FreezePredictions )
         self.opPredictionPipeline.PredictionsFromDisk.connect( self.PredictionsFromDisk )
         self.opPredictionPipeline.PredictionMask.connect( self.PredictionMasks )
+        self.opPredictionPipeline.PredictionCacheFile.connect( self.PredictionCacheFile )
+        self.opPredictionPipeline.DatasetInfo.connect( self.DatasetInfos )
         
         def _updateNumClasses(*args):
             """
@@ -394,6 +403,8 @@ class OpPredictionPipelineNoCache(Operator):
     Classifier = InputSlot()
     PredictionsFromDisk = InputSlot( optional=True )
     NumClasses = InputSlot()
+    PredictionCacheFile = InputSlot( optional=True )
+    DatasetInfo = InputSlot( optional=True )
     
     HeadlessPredictionProbabilities = OutputSlot() # drange is 0.0 to 1.0
     HeadlessUint8PredictionProbabilities = OutputSlot() # drange 0 to 255
@@ -412,22 +423,32 @@ class OpPredictionPipelineNoCache(Operator):
         self.cacheless_predict.Image.connect(self.FeatureImages) # <--- Not from cache
         self.cacheless_predict.LabelsCount.connect(self.NumClasses)
         self.cacheless_predict.PredictionMask.connect(self.PredictionMask)
-        self.HeadlessPredictionProbabilities.connect(self.cacheless_predict.PMaps)
+
+        # Optionally keep the predictions on disk, so an interrupted export can be resumed
+        #  (without a PredictionCacheFile, this is a pass-through).
+        self.prediction_cache_disk = OpPersistentPredictionCache( parent=self )
+        self.prediction_cache_disk.name = "prediction_cache_disk (Cacheless Path)"
+        self.prediction_cache_disk.Input.connect( self.cacheless_predict.PMaps )
+        self.prediction_cache_disk.Classifier.connect( self.Classifier )
+        self.prediction_cache_disk.FeatureImages.connect( self.FeatureImages )
+        self.prediction_cache_disk.DatasetInfo.connect( self.DatasetInfo )
+        self.prediction_cache_disk.CacheFile.connect( self.PredictionCacheFile )
+        self.HeadlessPredictionProbabilities.connect(self.prediction_cache_disk.Output)
 
         # Alternate headless output: uint8 instead of float.
         # Note that drange is automatically updated.        
         self.opConvertToUint8 = OpPixelOperator( parent=self )
-        self.opConvertToUint8.Input.connect( self.cacheless_predict.PMaps )
+        self.opConvertToUint8.Input.connect( self.prediction_cache_disk.Output )
         self.opConvertToUint8.Function.setValue( lambda a: (255*a).astype(numpy.uint8) )
         self.HeadlessUint8PredictionProbabilities.connect( self.opConvertToUint8.Output )
 
         self.opArgmaxChannel = OpArgmaxChannel( parent=self )
-        self.opArgmaxChannel.Input.connect( self.cacheless_predict.PMaps )
+        self.opArgmaxChannel.Input.connect( self.prediction_cache_disk.Output )
         self.SimpleSegmentation.connect( self.opArgmaxChannel.Output )
         
         # Create a layer for uncertainty estimate
         self.opUncertaintyEstimator = OpEnsembleMargin( parent=self )
-        self.opUncertaintyEstimator.Input.connect( self.cacheless_predict.PMaps )
+        self.opUncertaintyEstimator.Input.connect( self.prediction_cache_disk.Output )
         self.HeadlessUncertaintyEstimate.connect( self.opUncertaintyEstimator.Output )
 
     def setupOutputs(self):
@@ -497,11 +518,21 @@ class OpPredictionPipeline(OpPredictionPipelineNoCache):
         self.predict.LabelsCount.connect( self.NumClasses )
         self.PredictionProbabilities.connect( self.predict.PMaps )
 
+        # Predictions kept on disk (if there is a PredictionCacheFile) are reloaded instead of recomputed.
+        # The features are the same as on the cacheless path, so both paths share the stored blocks.
+        self.prediction_cache_disk_gui = OpPersistentPredictionCache( parent=self )
+        self.prediction_cache_disk_gui.name = "prediction_cache_disk_gui"
+        self.prediction_cache_disk_gui.Input.connect( self.predict.PMaps )
+        self.prediction_cache_disk_gui.Classifier.connect( self.Classifier )
+        self.prediction_cache_disk_gui.FeatureImages.connect( self.FeatureImages )
+        self.prediction_cache_disk_gui.DatasetInfo.connect( self.DatasetInfo )
+        self.prediction_cache_disk_gui.CacheFile.connect( self.PredictionCacheFile )
+
         # Prediction cache for the GUI
         self.prediction_cache_gui = OpSlicedBlockedArrayCache( parent=self )
         self.prediction_cache_gui.name = "prediction_cache_gui"
         self.prediction_cache_gui.inputs["fixAtCurrent"].connect( self.FreezePredictions )
-        self.prediction_cache_gui.inputs["Input"].connect( self.predict.PMaps )
+        self.prediction_cache_gui.inputs["Input"].connect( self.prediction_cache_disk_gui.Output )
         self.CachedPredictionProbabilities.connect(self.prediction_cache_gui.Output )
 
         # Also provide each prediction channel as a separate layer (for the GUI)
@@ -0,0 +1,209 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import collections
+from functools import partial
+
+import numpy
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, RequestPool
+from lazyflow.roi import sliceToRoi, roiToSlice
+from lazyflow.operators import OpTrainClassifierBlocked
+from lazyflow.classifiers import LazyflowVectorwiseClassifierFactoryABC
+
+import logging
+logger = logging.getLogger(__name__)
+
+class OpTrainClassifierStratified( Operator ):
+    """
+    Drop-in replacement for OpTrainClassifierBlocked that can limit the number
+    of training samples per label class.
+
+    If MaxSamplesPerClass is None (the default), or the classifier factory is not
+    vectorwise, training is delegated to an internal OpTrainClassifierBlocked.
+
+    Otherwise, the label blocks of all lanes are scanned once to count the pixels
+    of each class.  For every class with more than MaxSamplesPerClass pixels, a
+    uniform random subset of that size is drawn across all lanes and blocks
+    (seeded with RandomSeed, so the result is reproducible).  Features are then
+    requested only for the bounding box of the sampled pixels within each block
+    that received at least one sample.
+    """
+    Images = InputSlot(level=1)
+    Labels = InputSlot(level=1)
+    nonzeroLabelBlocks = InputSlot(level=1)
+    MaxLabel = InputSlot()
+    ClassifierFactory = InputSlot()
+    MaxSamplesPerClass = InputSlot(value=None)
+    RandomSeed = InputSlot(value=0)
+
+    Classifier = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super(OpTrainClassifierStratified, self).__init__(*args, **kwargs)
+        self._opTrainBlocked = OpTrainClassifierBlocked( parent=self )
+        self._opTrainBlocked.Images.connect( self.Images )
+        self._opTrainBlocked.Labels.connect( self.Labels )
+        self._opTrainBlocked.nonzeroLabelBlocks.connect( self.nonzeroLabelBlocks )
+        self._opTrainBlocked.MaxLabel.connect( self.MaxLabel )
+        self._opTrainBlocked.ClassifierFactory.connect( self.ClassifierFactory )
+
+    def setupOutputs(self):
+        self.Classifier.meta.dtype = object
+        self.Classifier.meta.shape = (1,)
+
+    def _samplingEnabled(self):
+        return ( self.MaxSamplesPerClass.value is not None and
+                 isinstance(self.ClassifierFactory.value, LazyflowVectorwiseClassifierFactoryABC) )
+
+    def execute(self, slot, subindex, roi, result):
+        if not self._samplingEnabled():
+            result[0] = self._opTrainBlocked.Classifier.value
+            return result
+
+        blockCounts = self._countLabels()
+        if not blockCounts:
+            # No labels yet.
+            result[0] = None
+            return result
+
+        samples = self._drawSamples( blockCounts )
+        featMatrix, labelsMatrix = self._gatherSamples( blockCounts, samples )
+
+        logger.debug( "Training classifier on {} of {} labeled pixels"
+                      .format( len(labelsMatrix), sum( counts.sum() for _, _, counts in blockCounts ) ) )
+
+        classifier_factory = self.ClassifierFactory.value
+        result[0] = classifier_factory.create_and_train( featMatrix, labelsMatrix )
+        return result
+
+    def _countLabels(self):
+        """
+        Fetch every nonzero label block once and count its pixels per class.
+
+        Returns a list of (laneIndex, blockSlicing, counts), ordered by lane and
+        block start, so that the sampling does not depend on the order in
+        which the label array reports its blocks.
+        """
+        maxLabel = self.MaxLabel.value
+        blockList = []
+        for laneIndex, labels in enumerate(self.Labels):
+            if labels.meta.shape is None or not self.Images[laneIndex].ready():
+                continue
+            blocks = self.nonzeroLabelBlocks[laneIndex][0].wait()[0]
+            for block in sorted( blocks, key=lambda b: tuple(s.start for s in b) ):
+                blockList.append( (laneIndex, block) )
+
+        counts = [None] * len(blockList)
+        def countBlock( i ):
+            laneIndex, block = blockList[i]
+            labelBlock = self.Labels[laneIndex][block].wait()
+            counts[i] = numpy.bincount( labelBlock.flat, minlength=maxLabel+1 )[:maxLabel+1]
+            counts[i][0] = 0
+
+        pool = RequestPool()
+        for i in range(len(blockList)):
+            pool.add( Request( partial(countBlock, i) ) )
+        pool.wait()
+        pool.clean()
+
+        return [ (laneIndex, block, c) for (laneIndex, block), c in zip(blockList, counts) if c.any() ]
+
+    def _drawSamples(self, blockCounts):
+        """
+        Choose the samples for each class, stratified over all blocks.
+
+        Returns an OrderedDict {blockNumber : {labelClass : localIndexes}}, where
+        localIndexes index into the (C-ordered) pixels of labelClass in that block.
+        A value of None means "all pixels of that class".
+        """
+        budget = self.MaxSamplesPerClass.value
+        rng = numpy.random.RandomState( self.RandomSeed.value )
+
+        countMatrix = numpy.array( [counts for _, _, counts in blockCounts] )
+        samples = collections.OrderedDict( (k, {}) for k in range(len(blockCounts)) )
+        for labelClass in range(1, countMatrix.shape[1]):
+            classCounts = countMatrix[:, labelClass]
+            total = classCounts.sum()
+            if total == 0:
+                continue
+            if total <= budget:
+                for k in numpy.nonzero(classCounts)[0]:
+                    samples[k][labelClass] = None
+                continue
+
+            positions = numpy.sort( rng.choice( total, size=budget, replace=False ) )
+            offsets = numpy.concatenate( ([0], numpy.cumsum(classCounts)) )
+            blockOfPosition = numpy.searchsorted( offsets, positions, side='right' ) - 1
+            for k in numpy.unique(blockOfPosition):
+                samples[k][labelClass] = positions[blockOfPosition == k] - offsets[k]
+
+        for k in samples.keys():
+            if not samples[k]:
+                del samples[k]
+        return samples
+
+    def _gatherSamples(self, blockCounts, samples):
+        """
+        Fetch labels and features for the sampled pixels of each block.
+        Features are only requested for the bounding box of the chosen pixels.
+        """
+        blockNumbers = samples.keys()
+        features = [None] * len(blockNumbers)
+        labels = [None] * len(blockNumbers)
+
+        def gatherBlock( i ):
+            k = blockNumbers[i]
+            laneIndex, block, _ = blockCounts[k]
+            labelBlock = self.Labels[laneIndex][block].wait()
+            labelBlock = labelBlock.reshape( labelBlock.shape[:-1] )
+
+            coords = []
+            blockLabels = []
+            for labelClass, localIndexes in samples[k].items():
+                classCoords = numpy.transpose( numpy.nonzero( labelBlock == labelClass ) )
+                if localIndexes is not None:
+                    classCoords = classCoords[localIndexes]
+                coords.append( classCoords )
+                blockLabels.append( numpy.repeat( labelClass, len(classCoords) ) )
+            coords = numpy.concatenate( coords )
+
+            blockStart = numpy.array( sliceToRoi( block, self.Labels[laneIndex].meta.shape )[0] )[:-1]
+            bbStart = coords.min(axis=0)
+            bbStop = coords.max(axis=0) + 1
+            featureKey = list( roiToSlice( blockStart + bbStart, blockStart + bbStop ) )
+            featureKey.append( slice(None) )
+            featureBlock = self.Images[laneIndex][tuple(featureKey)].wait()
+
+            localCoords = tuple( (coords - bbStart).transpose() )
+            features[i] = featureBlock[localCoords]
+            labels[i] = numpy.concatenate( blockLabels )
+
+        pool = RequestPool()
+        for i in range(len(blockNumbers)):
+            pool.add( Request( partial(gatherBlock, i) ) )
+        pool.wait()
+        pool.clean()
+
+        return numpy.concatenate( features ), numpy.concatenate( labels ).astype(numpy.uint32)
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.Classifier.setDirty()
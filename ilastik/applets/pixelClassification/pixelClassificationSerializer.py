@@ -19,7 +19,8 @@
 #		   http://ilastik.org/license.html
 ###############################################################################
 import numpy
-from ilastik.applets.base.appletSerializer import AppletSerializer, SerialClassifierSlot, SerialBlockSlot, SerialListSlot, SerialClassifierFactorySlot
+from ilastik.applets.base.appletSerializer import AppletSerializer, SerialClassifierSlot, SerialChunkedBlockSlot, SerialListSlot, SerialClassifierFactorySlot, \
+    SerialPickledValueSlot
 
 import logging
 logger = logging.getLogger(__name__) 
@@ -37,14 +38,15 @@ class PixelClassificationSerializer(AppletSerializer):
                                 transform=str),
                  SerialListSlot(operator.LabelColors, transform=lambda x: tuple(x.flat)),
                  SerialListSlot(operator.PmapColors, transform=lambda x: tuple(x.flat)),
-                 SerialBlockSlot(operator.LabelImages,
-                                 operator.LabelInputs,
-                                 operator.NonzeroLabelBlocks,
-                                 name='LabelSets',
-                                 subname='labels{:03d}',
-                                 selfdepends=False,
-                                 shrink_to_bb=True),
+                 SerialChunkedBlockSlot(operator.LabelImages,
+                                        operator.LabelInputs,
+                                        operator.NonzeroLabelBlocks,
+                                        name='LabelSets',
+                                        subname='labels{:03d}',
+                                        selfdepends=False,
+                                        shrink_to_bb=True),
                  SerialClassifierFactorySlot(operator.ClassifierFactory),
+                 SerialPickledValueSlot(operator.MaxSamplesPerClass),
                  self._serialClassifierSlot ]
 
         super(PixelClassificationSerializer, self).__init__(projectFileGroupName, slots, operator)
@@ -66,8 +68,7 @@ class PixelClassificationSerializer(AppletSerializer):
             all_labels = set()
             for image_index, group in enumerate(topGroup['LabelSets'].values()):
                 # For each label block
-                for block in group.values():
-                    data = block[:]
+                for data in SerialChunkedBlockSlot.iterBlocks(group):
                     all_labels.update( numpy.unique(data) )
 
             if all_labels:
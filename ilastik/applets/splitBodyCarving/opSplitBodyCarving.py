@@ -18,7 +18,11 @@
 # on the ilastik web site at:
 #		   http://ilastik.org/license.html
 ###############################################################################
+import bisect
+import collections
 import copy
+import threading
+
 import numpy
 import vigra
 from lazyflow.graph import Operator, InputSlot, OutputSlot
@@ -239,7 +243,7 @@ class OpSplitBodyCarving( OpCarving ):
             super( OpSplitBodyCarving, self ).propagateDirty( slot, subindex, roi )
     
     def getFragmentNames(self, ravelerLabel):
-        names = OpSplitBodyCarving.getSavedObjectNamesForMstAndRavelerLabel(self._mst, ravelerLabel)
+        names = self._opFragmentSetLut.fragmentNames(ravelerLabel, self._mst)
         if self.CurrentEditingFragment.ready():
             pattern = "{}.".format( ravelerLabel )
             currentFragment = self.CurrentEditingFragment.value
@@ -267,6 +271,7 @@ class OpSplitBodyCarving( OpCarving ):
         """
         is_new = ( name in self._mst.object_names.keys() )
         super( OpSplitBodyCarving, self ).saveObjectAs(name)
+        self._opFragmentSetLut.fragmentSaved(name)
         if is_new:
             self.EditedRavelerBodyList.setDirty()
 
@@ -276,10 +281,21 @@ class OpSplitBodyCarving( OpCarving ):
         """
         deleted = super( OpSplitBodyCarving, self ).deleteObject(name)
         if deleted:
+            self._opFragmentSetLut.fragmentDeleted(name)
             self.EditedRavelerBodyList.setDirty()
         return deleted
 
 class OpFragmentSetLut(Operator):
+    """
+    Produces a LUT (over all supervoxels) in which the supervoxels of each saved fragment
+    of RavelerLabel are set to the fragment's position in the sorted fragment list (+1).
+    Where fragments overlap, the first one wins.  CurrentEditingFragment is left out.
+
+    The fragment names of each raveler label are indexed once, and kept up-to-date by
+    fragmentSaved() and fragmentDeleted().  The LUT of the current raveler label is kept too:
+    when it is requested again, only the entries of fragments that were saved, deleted,
+    (un)selected for editing or moved in the list since then are updated.
+    """
     MST = InputSlot()
     RavelerLabel = InputSlot()
     CurrentEditingFragment = InputSlot()
@@ -289,6 +305,9 @@ class OpFragmentSetLut(Operator):
 
     def __init__(self, *args, **kwargs):
         super( OpFragmentSetLut, self ).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._resetIndex()
+        self._resetLut()
         
         # HACK: See setupOutputs
         self.MST.notifyDirty( bind(self._setupOutputs) )
@@ -296,7 +315,83 @@ class OpFragmentSetLut(Operator):
     def setupOutputs(self):
         self.Lut.meta.shape = ( len(self.MST.value.objects.lut), )
         self.Lut.meta.dtype = numpy.uint8
-        
+
+    def _resetIndex(self):
+        self._indexedMst = None
+        self._indexedCount = 0
+        self._fragmentNames = {} # raveler label (as string) -> sorted list of saved fragment names
+
+    def _resetLut(self):
+        self._lutMst = None
+        self._lutLabel = None
+        self._owners = None # The lut, before it is cast to uint8
+        self._coverage = None # The number of shown fragments each supervoxel belongs to
+        self._shown = {} # fragment name -> (index, object lut entry, supervoxel ids) of the fragments in the lut
+
+    @staticmethod
+    def _ravelerKey(name):
+        # Fragment names are <raveler label>.<object id>
+        dot = name.find('.')
+        if dot == -1:
+            return None
+        return name[:dot]
+
+    def _index(self, mst):
+        # Must be called with the lock held.
+        # Fragments that were saved or deleted without notifying us change the number of names.
+        if self._indexedMst is not mst or self._indexedCount != len(mst.object_names):
+            fragmentNames = collections.defaultdict(list)
+            for name in mst.object_names.keys():
+                key = self._ravelerKey(name)
+                if key is not None:
+                    fragmentNames[key].append(name)
+            for names in fragmentNames.values():
+                names.sort()
+            self._fragmentNames = dict(fragmentNames)
+            self._indexedMst = mst
+            self._indexedCount = len(mst.object_names)
+        return self._fragmentNames
+
+    def fragmentNames(self, ravelerLabel, mst=None):
+        """
+        The sorted names of the saved fragments of the given raveler label.
+        """
+        if mst is None:
+            if not self.MST.ready():
+                return []
+            mst = self.MST.value
+        if mst is None:
+            return []
+        with self._lock:
+            return list( self._index(mst).get( "{}".format( ravelerLabel ), [] ) )
+
+    def fragmentSaved(self, name):
+        """
+        Must be called after a fragment is saved (new or overwritten).
+        """
+        key = self._ravelerKey(name)
+        with self._lock:
+            if self._indexedMst is None or key is None:
+                return
+            names = self._fragmentNames.setdefault(key, [])
+            i = bisect.bisect_left(names, name)
+            if i == len(names) or names[i] != name:
+                names.insert(i, name)
+                self._indexedCount += 1
+
+    def fragmentDeleted(self, name):
+        """
+        Must be called after a fragment is deleted.
+        """
+        key = self._ravelerKey(name)
+        with self._lock:
+            if self._indexedMst is None or key is None:
+                return
+            names = self._fragmentNames.get(key, [])
+            if name in names:
+                names.remove(name)
+                self._indexedCount -= 1
+
     def execute(self, slot, subindex, roi, result):
         assert slot == self.Lut
         assert roi.stop - roi.start == self.Lut.meta.shape
@@ -306,27 +401,69 @@ class OpFragmentSetLut(Operator):
             result[:] = 0
             return result
 
-        logger.info( "Requesting fragment names" )
-        mst = self.MST.value
-        names = OpSplitBodyCarving.getSavedObjectNamesForMstAndRavelerLabel(mst, ravelerLabel)
-        logger.info( "Got fragment names: {}".format( names ) )
-        
-        # Accumulate the supervoxels from each fragment that came from the current raveler object
-        result[:] = 0
-        for i, name in reversed(list(enumerate(names))):
-            if name != self.CurrentEditingFragment.value:
-                objectSupervoxels = mst.object_lut[name]
-                # Give each fragment it's own label to support different colors for each
-                result[objectSupervoxels] = i+1
-
-        logger.info( "Finished accumulating fragments into lut" )
+        with self._lock:
+            self._updateLut( self.MST.value, ravelerLabel, self.CurrentEditingFragment.value )
+            result[:] = self._owners
         return result
+
+    def _updateLut(self, mst, ravelerLabel, currentFragment):
+        # Must be called with the lock held.
+        if self._lutMst is not mst or self._lutLabel != ravelerLabel or len(self._owners) != self.Lut.meta.shape[0]:
+            self._resetLut()
+            self._lutMst = mst
+            self._lutLabel = ravelerLabel
+            self._owners = numpy.zeros( self.Lut.meta.shape, dtype=numpy.uint32 )
+            self._coverage = numpy.zeros( self.Lut.meta.shape, dtype=numpy.uint16 )
+
+        # Which fragments should be shown, and where
+        wanted = {}
+        for i, name in enumerate( self._index(mst).get( "{}".format( ravelerLabel ), [] ) ):
+            if name != currentFragment:
+                wanted[name] = (i, mst.object_lut[name])
+
+        # (A saved fragment gets new supervoxel arrays, so unchanged fragments still have the same ones.)
+        removed = [ name for name, (i, objectLut, supervoxels) in self._shown.items()
+                    if name not in wanted or wanted[name][0] != i or wanted[name][1] is not objectLut ]
+        added = [ name for name in wanted if name not in self._shown or name in removed ]
+        if not removed and not added:
+            return
+
+        # Remove the changed fragments, and find the supervoxels they were shown for.
+        owners = self._owners
+        orphans = []
+        for name in removed:
+            i, objectLut, supervoxels = self._shown.pop(name)
+            self._coverage[supervoxels] -= 1
+            wasShown = supervoxels[ owners[supervoxels] == i+1 ]
+            owners[wasShown] = 0
+            orphans.append( wasShown )
+
+        # Supervoxels that are still covered by another fragment go to the first one of those.
+        orphans = numpy.concatenate( orphans ) if orphans else numpy.zeros( (0,), dtype=int )
+        orphans = orphans[ self._coverage[orphans] > 0 ]
+        if len(orphans) > 0:
+            orphaned = numpy.zeros( owners.shape, dtype=bool )
+            orphaned[orphans] = True
+            for name, (i, objectLut, supervoxels) in sorted( self._shown.items(), key=lambda item: -item[1][0] ):
+                owners[ supervoxels[ orphaned[supervoxels] ] ] = i+1
+
+        # Add the new fragments (each one only overrides fragments that come after it)
+        for name in added:
+            i, objectLut = wanted[name]
+            # (Saved as the result of numpy.where, but loaded from the project file as a 2D array)
+            supervoxels = numpy.asarray( objectLut ).ravel()
+            self._coverage[supervoxels] += 1
+            current = owners[supervoxels]
+            # Give each fragment it's own label to support different colors for each
+            owners[supervoxels] = numpy.where( (current == 0) | (current > i+1), i+1, current )
+            self._shown[name] = (i, objectLut, supervoxels)
+
+        logger.debug( "Updated fragment lut of raveler label {}: {} fragments removed, {} added"
+                      .format( ravelerLabel, len(removed), len(added) ) )
     
     def propagateDirty(self, slot, subindex, roi):
+        if slot == self.MST:
+            with self._lock:
+                self._resetIndex()
+                self._resetLut()
         self.Lut.setDirty( slice(None) )
-
-
-
-
-
-
@@ -0,0 +1,242 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import os
+import time
+import hashlib
+import itertools
+import threading
+import cPickle as pickle
+from functools import partial
+
+import numpy
+import h5py
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot, OrderedSignal
+from lazyflow.request import Request, RequestPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+def sidecarPath( filePath, hdf5Path ):
+    """
+    The file that records the written blocks of an unfinished export of hdf5Path to filePath.
+    """
+    return "{}.{}.blocks".format( filePath, hdf5Path.strip('/').replace('/', '_') )
+
+def stateDigest( state ):
+    """
+    A digest of the state an exported image depends on, to use as the ResumeKey.
+    state may be nested of lists, tuples and dicts of arrays and plain values.
+    """
+    digest = hashlib.sha1()
+    def update( item ):
+        if isinstance( item, numpy.ndarray ):
+            item = numpy.ascontiguousarray( item )
+            digest.update( repr( ('array', item.dtype.str, item.shape) ) )
+            digest.update( item.tostring() )
+        elif isinstance( item, dict ):
+            digest.update( 'dict{}'.format( len(item) ) )
+            for key in sorted( item.keys() ):
+                update( key )
+                update( item[key] )
+        elif isinstance( item, (list, tuple) ):
+            digest.update( 'list{}'.format( len(item) ) )
+            for element in item:
+                update( element )
+        else:
+            digest.update( repr( item ) )
+    update( state )
+    return digest.hexdigest()
+
+def openExportFile( filePath, hdf5Path ):
+    """
+    Opens the hdf5 file to export hdf5Path to.  If an export of hdf5Path to that file
+    was interrupted, the file is kept so the export can be resumed.  Otherwise it is overwritten.
+    """
+    if os.path.exists( filePath ) and os.path.exists( sidecarPath( filePath, hdf5Path ) ):
+        logger.info( "Resuming the unfinished export to {}/{}".format( filePath, hdf5Path ) )
+        return h5py.File( filePath, 'a' )
+    return h5py.File( filePath, 'w' )
+
+class OpResumableH5Writer(Operator):
+    """
+    Writes the input image to an hdf5 dataset in chunk-aligned blocks.  The blocks
+    are requested in parallel and written as they arrive.
+
+    The written blocks are recorded in a small sidecar file next to the hdf5 file
+    (see sidecarPath()), which is removed when the export is complete.  If an export
+    is interrupted, writing the same image (same shape, dtype and ResumeKey) to the
+    same dataset again only writes the missing blocks.  Use openExportFile() to open
+    the file, so an unfinished export isn't overwritten.
+    """
+    name = "OpResumableH5Writer"
+
+    hdf5File = InputSlot()
+    hdf5Path = InputSlot()
+    Image = InputSlot()
+    CompressionEnabled = InputSlot(value=True)
+    ResumeKey = InputSlot(value="") # Anything else the image depends on (the sidecar is discarded if it changes)
+
+    WriteImage = OutputSlot()
+
+    # Blocks are requested with this shape (and are multiples of the chunk shape)
+    BlockDims = { 't' : 1, 'z' : 256, 'y' : 256, 'x' : 256 }
+    ChunkDims = { 't' : 1, 'z' : 64, 'y' : 64, 'x' : 64 }
+
+    # The sidecar file is updated at most this often (seconds)
+    SAVE_INTERVAL = 5.0
+
+    def __init__(self, *args, **kwargs):
+        super(OpResumableH5Writer, self).__init__(*args, **kwargs)
+        self.progressSignal = OrderedSignal()
+        self._lock = threading.Lock()
+
+    def setupOutputs(self):
+        self.WriteImage.meta.shape = (1,)
+        self.WriteImage.meta.dtype = object
+
+    def _shapes(self):
+        keys = self.Image.meta.getAxisKeys()
+        shape = self.Image.meta.shape
+        blockShape = tuple( min( self.BlockDims.get( k, s ), s ) for k, s in zip( keys, shape ) )
+        chunkShape = tuple( min( self.ChunkDims.get( k, b ), b ) for k, b in zip( keys, blockShape ) )
+        return shape, blockShape, chunkShape
+
+    def _sidecarState(self, blockShape):
+        dtype = numpy.dtype( self.Image.meta.dtype )
+        return { 'shape' : tuple( self.Image.meta.shape ),
+                 'dtype' : dtype.str,
+                 'blockShape' : tuple( blockShape ),
+                 'key' : self.ResumeKey.value }
+
+    def _loadSidecar(self, path, state):
+        if not os.path.exists( path ):
+            return None
+        try:
+            with open( path, 'rb' ) as f:
+                stored = pickle.load( f )
+        except Exception as ex:
+            logger.warn( "Ignoring unreadable export index {}: {}".format( path, ex ) )
+            return None
+        done = stored.pop( 'done' )
+        if stored != state:
+            logger.info( "Ignoring export index {}: it belongs to a different image".format( path ) )
+            return None
+        return done
+
+    def _saveSidecar(self, path, state, done):
+        state = dict( state, done=done.copy() )
+        # Write to a temporary file first, so an interruption can't leave a broken index behind.
+        tmpPath = path + ".tmp"
+        with open( tmpPath, 'wb' ) as f:
+            pickle.dump( state, f, pickle.HIGHEST_PROTOCOL )
+        if os.path.exists( path ):
+            os.remove( path )
+        os.rename( tmpPath, path )
+
+    def _prepareDataset(self, h5File, hdf5Path, shape, blockShape, chunkShape, done):
+        dtype = self.Image.meta.dtype
+        if isinstance( dtype, numpy.dtype ):
+            dtype = dtype.type
+
+        if done is not None and hdf5Path in h5File:
+            dataset = h5File[hdf5Path]
+            if dataset.shape == tuple(shape) and dataset.dtype == numpy.dtype(dtype):
+                return dataset, done
+            logger.info( "Existing dataset {} doesn't match the export, starting over".format( hdf5Path ) )
+
+        if hdf5Path in h5File:
+            del h5File[hdf5Path]
+        compression = {}
+        if self.CompressionEnabled.value:
+            compression = { 'compression' : 'gzip', 'compression_opts' : 1 }
+        dataset = h5File.create_dataset( hdf5Path, shape=shape, dtype=dtype, chunks=chunkShape, **compression )
+        if self.Image.meta.axistags is not None:
+            dataset.attrs['axistags'] = self.Image.meta.axistags.toJSON()
+        gridShape = tuple( (s + b - 1) // b for s, b in zip( shape, blockShape ) )
+        return dataset, numpy.zeros( gridShape, dtype=numpy.uint8 )
+
+    def execute(self, slot, subindex, rroi, result):
+        h5File = self.hdf5File.value
+        hdf5Path = self.hdf5Path.value
+        shape, blockShape, chunkShape = self._shapes()
+        path = sidecarPath( h5File.filename, hdf5Path )
+        state = self._sidecarState( blockShape )
+
+        done = self._loadSidecar( path, state )
+        dataset, done = self._prepareDataset( h5File, hdf5Path, shape, blockShape, chunkShape, done )
+
+        todo = [ blockIndex for blockIndex in itertools.product( *map( range, done.shape ) ) if not done[blockIndex] ]
+        total = done.size
+        if len(todo) < total:
+            logger.info( "Resuming export to {}/{}: {} of {} blocks already written"
+                         .format( h5File.filename, hdf5Path, total - len(todo), total ) )
+
+        progress = { 'done' : total - len(todo), 'bytes' : 0, 'saved' : time.time() }
+        startTime = time.time()
+
+        def writeBlock( blockIndex ):
+            blockStart = numpy.multiply( blockIndex, blockShape )
+            blockStop = numpy.minimum( blockStart + blockShape, shape )
+            data = self.Image( list(blockStart), list(blockStop) ).wait()
+
+            with self._lock:
+                dataset[ tuple( slice(a, b) for a, b in zip( blockStart, blockStop ) ) ] = data
+                done[blockIndex] = 1
+                progress['done'] += 1
+                progress['bytes'] += data.nbytes
+                # The data must be on disk before the sidecar says it's written.
+                if time.time() - progress['saved'] > self.SAVE_INTERVAL:
+                    h5File.flush()
+                    self._saveSidecar( path, state, done )
+                    progress['saved'] = time.time()
+                percentage = 100 * progress['done'] // total
+            self.progressSignal( percentage )
+
+        self.progressSignal( 100 * progress['done'] // total )
+        try:
+            pool = RequestPool()
+            for blockIndex in todo:
+                pool.add( Request( partial( writeBlock, blockIndex ) ) )
+            pool.wait()
+            pool.clean()
+        except:
+            # Keep what was written so far
+            with self._lock:
+                h5File.flush()
+                self._saveSidecar( path, state, done )
+            raise
+
+        h5File.flush()
+        if os.path.exists( path ):
+            os.remove( path )
+
+        seconds = time.time() - startTime
+        megabytes = progress['bytes'] / float( 2**20 )
+        logger.info( "Wrote {:.1f} MB to {}/{} in {:.1f} seconds ({:.1f} MB/s)"
+                     .format( megabytes, h5File.filename, hdf5Path, seconds, megabytes / max( seconds, 1e-6 ) ) )
+
+        self.progressSignal( 100 )
+        result[0] = True
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.WriteImage.setDirty()
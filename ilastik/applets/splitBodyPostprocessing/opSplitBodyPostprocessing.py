@@ -19,19 +19,20 @@
 #		   http://ilastik.org/license.html
 ###############################################################################
 import collections
+import threading
 from functools import partial
 import numpy
 import vigra
-import h5py
 from lazyflow.graph import Operator, InputSlot, OutputSlot, OperatorWrapper
 from lazyflow.roi import roiToSlice
 
 from lazyflow.request import Request
+from lazyflow.utility import BigRequestStreamer
 from lazyflow.operators import OpFilterLabels, OpCompressedCache, OpVigraLabelVolume, OpMaskedWatershed, OpSelectLabel
-from lazyflow.operators.ioOperators import OpH5WriterBigDataset
 from lazyflow.operators.opReorderAxes import OpReorderAxes
 
 from ilastik.applets.splitBodyCarving.opSplitBodyCarving import OpFragmentSetLut
+from ilastik.applets.splitBodyPostprocessing.opResumableH5Writer import OpResumableH5Writer, openExportFile, stateDigest
 
 from ilastik.utility import bind, log_exception
 
@@ -175,6 +176,9 @@ class OpSplitBodyPostprocessing(Operator):
             self._opSelectLabel.SelectedLabel[index].setValue( raveler_body_id )
             self._opFragmentSetLuts.RavelerLabel[index].setValue( raveler_body_id )
 
+        # The final image is assembled blockwise, so there's no need to cache (or export) it all at once.
+        self._opFinalCache.BlockShape.setValue( self._opAccumulateFinalImage.blockShape() )
+
     def execute(self, slot, subindex, roi, result):
         # All outputs are provided by internal operators, so this function should never be called
         assert False, "Unknown output slot: {}".format( slot.name )
@@ -186,6 +190,19 @@ class OpSplitBodyPostprocessing(Operator):
             # If anything is dirty, the entire output is dirty
             self.FinalSegmentation.setDirty()
     
+    def _exportKey(self):
+        """
+        A digest of the fragment state the final segmentation depends on: the fragments
+        of each edited body and the supervoxels of each fragment.
+        """
+        mst = self.MST.value
+        fragments = []
+        for index, raveler_body_id in enumerate( self.EditedRavelerBodyList.value ):
+            names = self._opFragmentSetLuts.innerOperators[index].fragmentNames( raveler_body_id, mst )
+            supervoxels = [ numpy.asarray( mst.object_lut[name] ).ravel() for name in names ]
+            fragments.append( (raveler_body_id, names, supervoxels) )
+        return stateDigest( fragments )
+
     def exportFinalSegmentation(self, outputPath, axisorder, progressCallback=None):
         assert self.FinalSegmentation.ready(), "Can't export yet: The final segmentation isn't ready!"
 
@@ -195,10 +212,12 @@ class OpSplitBodyPostprocessing(Operator):
         opTranspose.AxisOrder.setValue( axisorder )
         opTranspose.Input.connect( self.FinalSegmentation )
         
-        f = h5py.File(outputPath, 'w')
-        opExporter = OpH5WriterBigDataset(parent=self)
+        # An interrupted export of the same bodies and fragments is resumed.
+        f = openExportFile( outputPath, 'split_result' )
+        opExporter = OpResumableH5Writer(parent=self)
         opExporter.hdf5File.setValue( f )
         opExporter.hdf5Path.setValue( 'split_result' )
+        opExporter.ResumeKey.setValue( self._exportKey() )
         opExporter.Image.connect( opTranspose.Output )
         if progressCallback is not None:
             opExporter.progressSignal.subscribe( progressCallback )
@@ -280,84 +299,130 @@ class OpFragment(Operator):
         self.Output.setDirty()
 
 class OpAccumulateFragmentSegmentations( Operator ):
+    """
+    Overlays the fragment segmentations of all edited bodies onto the raveler labels.
+    The labels of each body are offset by the max label of everything before it
+    (the raveler labels and the preceding bodies), so no labels are duplicated.
+
+    The offsets are computed from the max label of each slot, which is kept until
+    that slot becomes dirty, and the output is assembled block by block, so any roi
+    can be requested.
+    """
     RavelerLabels = InputSlot()
     FragmentSegmentations = InputSlot(level=1)
     
     Output = OutputSlot()
     Mapping = OutputSlot()
 
+    # Blocks the output is assembled in (axes that are not listed are not split)
+    BlockDims = { 't' : 1, 'z' : 128, 'y' : 256, 'x' : 256 }
+
     def __init__(self, *args, **kwargs):
         super( OpAccumulateFragmentSegmentations, self ).__init__( *args, **kwargs )
         self._mapping = None
+        self._offsets = None
+        self._maxLabels = {} # None (the raveler labels) or body index -> max label
+        self._lock = threading.Lock()
     
     def setupOutputs(self):
         self.Output.meta.assignFrom( self.RavelerLabels.meta )
         self.Mapping.meta.dtype = object
         self.Mapping.meta.shape = (1,)
+        # The bodies may have been added or removed
+        self._resetOffsets()
+
+    def blockShape(self):
+        return tuple( min( self.BlockDims.get(k, s), s )
+                      for k, s in zip( self.RavelerLabels.meta.getAxisKeys(), self.RavelerLabels.meta.shape ) )
+
+    def _maxLabel(self, slot):
+        """
+        The max label of slot, computed block by block.
+        """
+        shape = slot.meta.shape
+        maxima = [0]
+        def handleBlock( roi, block ):
+            maxima.append( int(block.max()) )
+        streamer = BigRequestStreamer( slot, ( (0,)*len(shape), shape ), self.blockShape() )
+        streamer.resultSignal.subscribe( handleBlock )
+        streamer.execute()
+        return max( maxima )
+
+    def _cachedMaxLabel(self, key, slot):
+        # (The caller holds self._lock)
+        if key not in self._maxLabels:
+            self._maxLabels[key] = self._maxLabel( slot )
+        return self._maxLabels[key]
+
+    def _getOffsets(self):
+        """
+        Returns the label offset of each body, and computes the mapping along with them.
+        """
+        with self._lock:
+            if self._offsets is not None:
+                return self._offsets
+
+            max_label = self._cachedMaxLabel( None, self.RavelerLabels )
+            mapping = collections.OrderedDict()
+            mapping[(0,max_label+1)] = -1 # Special body-id: -1 means "identity"
+
+            offsets = []
+            for body_index, slot in enumerate(self.FragmentSegmentations):
+                offsets.append( max_label )
+                max_label += self._cachedMaxLabel( body_index, slot )
+
+                old_max = mapping.keys()[-1][1]
+                body_id = slot.meta.selected_label
+                mapping[(old_max,max_label+1)] = body_id
+
+            logger.info( "Label offsets of {} bodies computed, max label is {}".format( len(offsets), max_label ) )
+            self._mapping = mapping
+            self._offsets = offsets
+            return offsets
+
+    def _resetOffsets(self, *keys):
+        """
+        Drop the offsets and the max labels of the given slots (None for the
+        raveler labels, or body indexes), or of all slots if none are given.
+        """
+        with self._lock:
+            self._offsets = None
+            self._mapping = None
+            if not keys:
+                self._maxLabels = {}
+            for key in keys:
+                self._maxLabels.pop( key, None )
 
     def execute(self, slot, subindex, roi, result):
         if slot == self.Mapping:
+            self._getOffsets()
             result[0] = self._mapping
             return result
         elif slot == self.Output:
-            assert (roi.start == 0).all() and (roi.stop == self.Output.meta.shape).all(), "Must request entire image."
-            self.RavelerLabels(roi.start, roi.stop).writeInto( result ).wait()
-    
-            # Allocate a temporary for our fragment images
-            fragment_image = numpy.zeros( result.shape, dtype=numpy.int32 )
-            max_label = result.max()
-            self._mapping = collections.OrderedDict()
-            self._mapping[(0,max_label+1)] = -1 # Special body-id: -1 means "identity"
-    
-            for body_index, slot in enumerate(self.FragmentSegmentations):
-                slot(roi.start, roi.stop).writeInto(fragment_image.view(numpy.uint32)).wait()
-
-                # This next line shows what we want to do, but it creates a big 
-                # temporary array (e.g. fragment_image + max_label)
-                # fragment_image = numpy.where( fragment_image, fragment_image+max_label, 0) 
-
-                # Instead, we bend over backwards here to do this 'in place'
-                logger.info( "Adding body {} to final image.".format( body_index ) )
-                fragment_image[:] = numpy.where( fragment_image, fragment_image, -max_label )
-                numpy.add( fragment_image, max_label, out=fragment_image )
-                result[:] = numpy.where( fragment_image, fragment_image, result )
-                
-                logger.info( "Finding new max label..." )
-                # New max
-                max_label = result.max()
-                
-                # Update mapping
-                old_max = self._mapping.keys()[-1][1]
-                body_id = slot.meta.selected_label
-                self._mapping[(old_max,max_label+1)] = body_id
-
-            logger.info( "Finished assembling final segmentation." )
+            offsets = self._getOffsets()
+
+            def handleBlock( block_roi, block ):
+                start, stop = block_roi
+                # Later bodies are drawn over earlier ones.
+                for offset, fragment_slot in zip( offsets, self.FragmentSegmentations ):
+                    fragments = fragment_slot( start, stop ).wait()
+                    mask = fragments != 0
+                    block[mask] = fragments[mask] + offset
+                result_slicing = roiToSlice( numpy.subtract( start, roi.start ), numpy.subtract( stop, roi.start ) )
+                result[result_slicing] = block
+
+            streamer = BigRequestStreamer( self.RavelerLabels, ( roi.start, roi.stop ), self.blockShape() )
+            streamer.resultSignal.subscribe( handleBlock )
+            streamer.execute()
             return result
         else:
             assert False, "Unknown output slot: {}".format( slot.name )
 
     def propagateDirty(self, slot, subindex, roi):
+        # Only the max label of the dirty slot has to be computed again,
+        #  but the offsets of all following bodies may change.
+        if slot is self.RavelerLabels:
+            self._resetOffsets( None )
+        else:
+            self._resetOffsets( subindex[0] )
         self.Output.setDirty()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -18,18 +18,19 @@
 # on the ilastik web site at:
 #		   http://ilastik.org/license.html
 ###############################################################################
+import os
 from functools import partial
 import numpy
 import h5py
 from lazyflow.request import Request
 from lazyflow.graph import Operator, InputSlot, OutputSlot, OperatorWrapper
 from lazyflow.operators import OpCompressedCache, OpVigraLabelVolume, OpFilterLabels, OpSelectLabel, OpMaskedSelect, OpDtypeView
-from lazyflow.operators.ioOperators import OpH5WriterBigDataset
 from lazyflow.operators.opReorderAxes import OpReorderAxes
 
 from lazyflow.utility import PathComponents
 from ilastik.utility import bind, log_exception
 from ilastik.applets.splitBodyPostprocessing.opSplitBodyPostprocessing import OpAccumulateFragmentSegmentations, OpMaskedWatershed
+from ilastik.applets.splitBodyPostprocessing.opResumableH5Writer import OpResumableH5Writer, openExportFile, stateDigest
 
 import logging
 logger = logging.getLogger(__name__)
@@ -135,6 +136,9 @@ class OpSplitBodySupervoxelExport(Operator):
         for index, raveler_body_id in enumerate(raveler_bodies):
             self._opSelectLabel.SelectedLabel[index].setValue( raveler_body_id )
 
+        # The final image is assembled blockwise, so there's no need to cache (or export) it all at once.
+        self._opFinalCache.BlockShape.setValue( self._opAccumulateFinalImage.blockShape() )
+
     def execute(self, slot, subindex, roi, result):
         assert False, "Can't execute slot {}.  All slots should be connected to internal operators".format( slot.name )
 
@@ -142,6 +146,25 @@ class OpSplitBodySupervoxelExport(Operator):
         # If anything is dirty, the entire output is dirty
         self.FinalSupervoxels.setDirty()
 
+    def _exportKey(self):
+        """
+        A digest of the state the final supervoxels depend on: the edited bodies,
+        and the files (with their size and modification time) of the input datasets.
+        """
+        datasets = []
+        for infoSlot in self.DatasetInfos:
+            if not infoSlot.ready():
+                datasets.append( None )
+                continue
+            pathComponents = PathComponents( infoSlot.value.filePath, self.WorkingDirectory.value )
+            path = pathComponents.externalPath
+            if os.path.exists( path ):
+                stat = os.stat( path )
+                datasets.append( (infoSlot.value.filePath, stat.st_size, stat.st_mtime) )
+            else:
+                datasets.append( (infoSlot.value.filePath,) )
+        return stateDigest( (list( self.AnnotationBodyIds.value ), datasets) )
+
     def exportFinalSupervoxels(self, outputPath, axisorder, progressCallback=None):
         """
         Executes the export process within a request.
@@ -155,10 +178,12 @@ class OpSplitBodySupervoxelExport(Operator):
         opTranspose.AxisOrder.setValue( axisorder )
         opTranspose.Input.connect( self.FinalSupervoxels )
         
-        f = h5py.File(outputPath, 'w')
-        opExporter = OpH5WriterBigDataset(parent=self)
+        # An interrupted export of the same bodies (from the same datasets) is resumed.
+        f = openExportFile( outputPath, 'stack' )
+        opExporter = OpResumableH5Writer(parent=self)
         opExporter.hdf5File.setValue( f )
         opExporter.hdf5Path.setValue( 'stack' )
+        opExporter.ResumeKey.setValue( self._exportKey() )
         opExporter.Image.connect( opTranspose.Output )
         if progressCallback is not None:
             opExporter.progressSignal.subscribe( progressCallback )
@@ -191,6 +216,8 @@ class OpSplitBodySupervoxelExport(Operator):
                         transform[supervoxel_label][1] = body_id
 
             # Save the transform before closing the file
+            if 'transforms' in f:
+                del f['transforms']
             f.create_dataset('transforms', data=transform)
 
             # Copy all other datasets from the original segmentation file.
@@ -198,7 +225,7 @@ class OpSplitBodySupervoxelExport(Operator):
             pathComponents = PathComponents(ravelerSegmentationInfo.filePath, self.WorkingDirectory.value)
             with h5py.File(pathComponents.externalPath, 'r') as originalFile:
                 for k,dset in originalFile.items():
-                    if k not in ['transforms', 'stack']:
+                    if k not in ['transforms', 'stack'] and k not in f:
                         f.copy(dset, k)
             
             try:
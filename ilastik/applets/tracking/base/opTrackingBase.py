@@ -18,8 +18,6 @@
 # on the ilastik web site at:
 # http://ilastik.org/license.html
 # ##############################################################################
-import os
-from functools import partial
 import logging
 
 import numpy as np
@@ -30,7 +28,8 @@ from lazyflow.rtype import List
 from lazyflow.stype import Opaque
 import pgmlink
 from ilastik.applets.tracking.base.trackingUtilities import relabel, \
-    get_dict_value
+    get_dict_value, event_ids, grow_lookup, assign_lookup, lookup_dict, NO_ENTRY, \
+    lineage_key, LineageIndex
 from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
 from ilastik.applets.objectExtraction import config
 from ilastik.applets.base.applet import DatasetConstraintError
@@ -42,10 +41,22 @@ from lazyflow.roi import sliceToRoi
 logger = logging.getLogger(__name__)
 
 
+def addTraxels(ts, traxels):
+    """
+    Add a batch of traxels to the traxel store.
+    """
+    add = ts.add
+    for tr in traxels:
+        add(tr)
+
+
 class OpTrackingBase(Operator, ExportingOperator):
     name = "Tracking"
     category = "other"
 
+    # Number of frames whose features are fetched at once when the traxel store is built
+    TRAXELSTORE_CHUNK_SIZE = 20
+
     LabelImage = InputSlot()
     ObjectFeatures = InputSlot(stype=Opaque, rtype=List)
     ObjectFeaturesWithDivFeatures = InputSlot(stype=Opaque, rtype=List)
@@ -88,6 +99,8 @@ class OpTrackingBase(Operator, ExportingOperator):
         self.track_id = None
         self.extra_track_ids = None
         self.divisions = None
+        self.lineage = None
+        self._storedLineage = None
 
         self._opCache = OpCompressedCache(parent=self)
         self._opCache.InputHdf5.connect(self.InputHdf5)
@@ -207,104 +220,87 @@ class OpTrackingBase(Operator, ExportingOperator):
 
         filtered_labels = self.FilteredLabels.value
 
-        label2color = []
-        label2color.append({})
-        mergers = []
-        resolvedto = []
+        if export_mode:
+            key = lineage_key(events, time_range, filtered_labels)
+            if self._storedLineage is not None and self._storedLineage.key == key:
+                # The track ids were saved with the project
+                self._setLineage(self._storedLineage)
+                self._storedLineage = None
+                return self.track_id, self.extra_track_ids, self.divisions
+
+        # One lookup array per frame, mapping object ids to their color (track id in export mode).
+        #  All events of one kind in a frame are handled at once.
+        lookups = [np.empty(0, dtype=np.int64) for i in range(time_range[0] + 1)]
+        mergers = [{} for i in range(time_range[0])]
+        resolvedto = [{} for i in range(time_range[0])]
 
         maxId = 2  # misdetections have id 1
 
-        # handle start time offsets
-        for i in range(time_range[0]):
-            label2color.append({})
-            mergers.append({})
-            resolvedto.append({})
-
         if export_mode:
             extra_track_ids = {}
-            multi_move = {}
-            multi_move_next = {}
             divisions = []
 
         for i in time_range:
-            dis = get_dict_value(events[str(i - time_range[0] + 1)], "dis", [])
-            app = get_dict_value(events[str(i - time_range[0] + 1)], "app", [])
-            div = get_dict_value(events[str(i - time_range[0] + 1)], "div", [])
-            mov = get_dict_value(events[str(i - time_range[0] + 1)], "mov", [])
+            events_at = events[str(i - time_range[0] + 1)]
+            app = event_ids(events_at, "app", 1)
+            div = event_ids(events_at, "div", 3)
+            mov = event_ids(events_at, "mov", 2)
             merger = get_dict_value(events[str(i - time_range[0])], "merger", [])
             res = get_dict_value(events[str(i - time_range[0])], "res", {})
 
-            logger.info(" {} dis at {}".format(len(dis), i))
+            logger.info(" {} dis at {}".format(len(get_dict_value(events_at, "dis", [])), i))
             logger.info(" {} app at {}".format(len(app), i))
             logger.info(" {} div at {}".format(len(div), i))
             logger.info(" {} mov at {}".format(len(mov), i))
             logger.info(" {} merger at {}".format(len(merger), i))
             logger.info(" {} res at {}".format(len(res), i))
 
-            label2color.append({})
+            previous = lookups[-1]
+            current = np.empty(0, dtype=np.int64)
             mergers.append({})
-            moves_at = []
             resolvedto.append({})
 
+            # in export mode, the label color is used as track ID
+            ids, maxId = self._newIds(maxId, len(app), successive_ids)
+            current = assign_lookup(current, app[:, 0], ids)
+
+            # alternative way of appearance: moving objects without a color get one, in order of their moves
+            sources = mov[:, 0]
+            previous = grow_lookup(previous, sources.max() + 1 if len(sources) else 0)
+            appearing = sources[previous[sources] == NO_ENTRY]
+            _, first = np.unique(appearing, return_index=True)
+            ids, maxId = self._newIds(maxId, len(first), successive_ids)
+            previous[appearing[np.sort(first)]] = ids
+            # assign color of parent
+            current = assign_lookup(current, mov[:, 1], previous[sources])
+
+            # event(parent, child, child)
+            parents = div[:, 0]
+            previous = grow_lookup(previous, parents.max() + 1 if len(parents) else 0)
+            _, first = np.unique(parents, return_index=True)
+            appearing = np.zeros(len(parents), dtype=bool)
+            appearing[first] = previous[parents[first]] == NO_ENTRY
             if export_mode:
-                moves_to = {}
-
-            for e in app:
-                if successive_ids:
-                    label2color[-1][int(e[0])] = maxId  # in export mode, the label color is used as track ID
-                    maxId += 1
-                else:
-                    label2color[-1][int(e[0])] = np.random.randint(1, 255)
-
-            for e in mov:
-                if export_mode:
-                    if e[1] in moves_to:
-                        multi_move.setdefault(i, {})
-                        multi_move[i][e[0]] = e[1]
-                        if len(moves_to[e[1]]) == 1:  # if we are just setting up this multi move
-                            multi_move[i][moves_to[e[1]][0]] = e[1]
-                        multi_move_next[(i, e[1])] = 0
-                    moves_to.setdefault(e[1], [])
-                    moves_to[e[1]].append(e[0])  # moves_to[target] contains list of incoming object ids
-
-                # alternative way of appearance
-                if not label2color[-2].has_key(int(e[0])):
-                    if successive_ids:
-                        label2color[-2][int(e[0])] = maxId
-                        maxId += 1
-                    else:
-                        label2color[-2][int(e[0])] = np.random.randint(1, 255)
-
-                # assign color of parent
-                label2color[-1][int(e[1])] = label2color[-2][int(e[0])]
-                moves_at.append(int(e[0]))
+                # Each division takes an id for its parent (if it has none yet), then one for each child.
+                counts = appearing + 2
+                starts = maxId + np.cumsum(counts) - counts
+                maxId += int(counts.sum())
+                previous[parents[appearing]] = starts[appearing]
+                child_tracks1 = starts + appearing
+                child_tracks2 = child_tracks1 + 1
+                current = assign_lookup(current, div[:, 1], child_tracks1)
+                current = assign_lookup(current, div[:, 2], child_tracks2)
+                divisions += zip([i] * len(div), parents.tolist(), previous[parents].tolist(),
+                                 div[:, 1].tolist(), child_tracks1.tolist(),
+                                 div[:, 2].tolist(), child_tracks2.tolist())
+            else:
+                ids, maxId = self._newIds(maxId, int(appearing.sum()), successive_ids)
+                previous[parents[appearing]] = ids
+                current = assign_lookup(current, div[:, 1], previous[parents])
+                current = assign_lookup(current, div[:, 2], previous[parents])
 
-                if export_mode:
-                    key = i - 1, e[0]
-                    if key in multi_move_next:  # captures mergers staying connected over longer time spans
-                        multi_move_next[key] = e[1]  # redirects output of last merger to target in this frame
-                        multi_move_next[(i, e[1])] = 0  # sets current end to zero (might be changed by above line in the future)
-
-            for e in div:  # event(parent, child, child)
-                # if not label2color[-2].has_key(int(e[0])):
-                if not int(e[0]) in label2color[-2]:
-                    if successive_ids:
-                        label2color[-2][int(e[0])] = maxId
-                        maxId += 1
-                    else:
-                        label2color[-2][int(e[0])] = np.random.randint(1, 255)
-                ancestor_color = label2color[-2][int(e[0])]
-                if export_mode:
-                    label2color[-1][int(e[1])] = maxId
-                    label2color[-1][int(e[2])] = maxId + 1
-                    divisions.append((i, int(e[0]), ancestor_color,
-                                      int(e[1]), maxId,
-                                      int(e[2]), maxId + 1
-                    ))
-                    maxId += 2
-                else:
-                    label2color[-1][int(e[1])] = ancestor_color
-                    label2color[-1][int(e[2])] = ancestor_color
+            lookups[-1] = previous
+            lookups.append(current)
 
             for e in merger:
                 mergers[-1][int(e[0])] = int(e[1])
@@ -337,23 +333,26 @@ class OpTrackingBase(Operator, ExportingOperator):
 
         # mark the filtered objects
         for i in filtered_labels.keys():
-            if int(i) + time_range[0] >= len(label2color):
+            t = int(i) + time_range[0]
+            if t >= len(lookups):
                 continue
-            fl_at = filtered_labels[i]
-            for l in fl_at:
-                assert l not in label2color[int(i) + time_range[0]]
-                label2color[int(i) + time_range[0]][l] = 0
+            fl_at = np.asarray(filtered_labels[i], dtype=np.int64)
+            lookups[t] = grow_lookup(lookups[t], fl_at.max() + 1 if len(fl_at) else 0)
+            assert (lookups[t][fl_at] == NO_ENTRY).all()
+            lookups[t][fl_at] = 0
 
         if export_mode:  # don't set fields when in export_mode
-            self.track_id = label2color
-            self.divisions = divisions
-            self.extra_track_ids = extra_track_ids
-            return label2color, extra_track_ids, divisions
+            self._setLineage(LineageIndex(lookups, divisions, extra_track_ids, key))
+            return self.track_id, extra_track_ids, divisions
 
-        self.label2color = label2color
+        self.label2color = [lookup_dict(lookup) for lookup in lookups]
         self.resolvedto = resolvedto
         self.mergers = mergers
 
+        if 'RelabeledImage' in self.outputs:
+            # Before Output, which is computed from it
+            self.RelabeledImage.setDirty(slice(None))
+
         self.Output._value = None
         self.Output.setDirty(slice(None))
 
@@ -361,27 +360,44 @@ class OpTrackingBase(Operator, ExportingOperator):
             self.MergerOutput._value = None
             self.MergerOutput.setDirty(slice(None))
 
+    @staticmethod
+    def _newIds(maxId, n, successive_ids):
+        # n new colors (or track ids) and the next free id
+        if successive_ids:
+            return np.arange(maxId, maxId + n), maxId + n
+        return np.random.randint(1, 255, size=n), maxId
+
+    def _setLineage(self, lineage):
+        self.lineage = lineage
+        self.track_id = lineage.track_id_dicts()
+        self.divisions = lineage.divisions
+        self.extra_track_ids = lineage.extra_track_ids
+
+    def restoreLineage(self, s):
+        """
+        Restore a lineage index saved with LineageIndex.dumps().  It is used
+        (instead of computing the track ids) if it belongs to the events that are set next.
+        """
+        self._storedLineage = LineageIndex.loads(s)
+
     def export_track_ids(self):
-        return self._setLabel2Color(export_mode=True)
+        if self.lineage is None:
+            return self._setLabel2Color(export_mode=True)
+        return self.track_id, self.extra_track_ids, self.divisions
 
-    def track_children(self, track_id, start=0):
-        for t, _, track, _, child_track1, _, child_track2 in self.divisions[start:]:
-            if track == track_id:
-                children_of = partial(self.track_children, start=t)
-                return [child_track1, child_track2] + \
-                       children_of(child_track1) + children_of(child_track2)
-        return []
+    def track_children(self, track_id):
+        if self.lineage is None:
+            return []
+        return self.lineage.track_children(track_id)
 
     def track_parent(self, track_id):
-        for t, oid, track, _, child_track1, _, child_track2 in self.divisions[:-1]:
-            if track_id in (child_track1, child_track2):
-                return [track] + self.track_parent(track)
-        return []
+        if self.lineage is None:
+            return []
+        return self.lineage.track_parent(track_id)
 
     def track_family(self, track_id):
         return self.track_children(track_id), self.track_parent(track_id)
 
-
     def _generate_traxelstore(self,
                               time_range,
                               x_range,
@@ -411,21 +427,33 @@ class OpTrackingBase(Operator, ExportingOperator):
         parameters['size_range'] = size_range
 
         logger.info("generating traxels")
-        logger.info("fetching region features and division probabilities")
-        feats = self.ObjectFeatures(time_range).wait()
 
         if with_div:
             if not self.DivisionProbabilities.ready() or len(self.DivisionProbabilities([0]).wait()[0]) == 0:
                 raise Exception, "Classifier not yet ready. Did you forget to train the Division Detection Classifier?"
-            divProbs = self.DivisionProbabilities(time_range).wait()
-
-        if with_local_centers:
-            localCenters = self.RegionLocalCenters(time_range).wait()
 
         if with_classifier_prior:
             if not self.DetectionProbabilities.ready() or len(self.DetectionProbabilities([0]).wait()[0]) == 0:
                 raise Exception, "Classifier not yet ready. Did you forget to train the Object Count Classifier?"
-            detProbs = self.DetectionProbabilities(time_range).wait()
+
+        # Only TRAXELSTORE_CHUNK_SIZE frames are fetched at a time (and the next chunk
+        #  is fetched while the current one is added), so memory is bounded to two chunks.
+        sources = [('feats', self.ObjectFeatures)]
+        if with_div:
+            sources.append(('divProbs', self.DivisionProbabilities))
+        if with_local_centers:
+            sources.append(('localCenters', self.RegionLocalCenters))
+        if with_classifier_prior:
+            sources.append(('detProbs', self.DetectionProbabilities))
+
+        def fetchChunk(times):
+            # One request per frame and source, all running in parallel.
+            requests = {}
+            for t in times:
+                for name, slot in sources:
+                    requests[(t, name)] = slot([t])
+                    requests[(t, name)].submit()
+            return requests
 
         logger.info("filling traxelstore")
         ts = pgmlink.TraxelStore()
@@ -435,111 +463,116 @@ class OpTrackingBase(Operator, ExportingOperator):
         obj_sizes = []
         total_count = 0
         empty_frame = False
-        for t in feats.keys():
-            rc = feats[t][default_features_key]['RegionCenter']
-            lower = feats[t][default_features_key]['Coord<Minimum>']
-            upper = feats[t][default_features_key]['Coord<Maximum>']
-            if rc.size:
-                rc = rc[1:, ...]
-                lower = lower[1:, ...]
-                upper = upper[1:, ...]
-
-            if with_opt_correction:
-                try:
-                    rc_corr = feats[t][config.features_vigra_name]['RegionCenter_corr']
-                except:
-                    raise Exception, 'cannot consider optical correction since it has not been computed before'
-                if rc_corr.size:
-                    rc_corr = rc_corr[1:, ...]
-
-            ct = feats[t][default_features_key]['Count']
-            if ct.size:
-                ct = ct[1:, ...]
-
-            logger.info("at timestep {}, {} traxels found".format(t, rc.shape[0]))
-            count = 0
-            filtered_labels_at = []
-            for idx in range(rc.shape[0]):
-                # for 2d data, set z-coordinate to 0:
-                if len(rc[idx]) == 2:
-                    x, y = rc[idx]
-                    z = 0
-                elif len(rc[idx]) == 3:
-                    x, y, z = rc[idx]
-                else:
-                    raise Exception, "The RegionCenter feature must have dimensionality 2 or 3."
-                size = ct[idx]
-                if (x < x_range[0] or x >= x_range[1] or
-                            y < y_range[0] or y >= y_range[1] or
-                            z < z_range[0] or z >= z_range[1] or
-                            size < size_range[0] or size >= size_range[1]):
-                    filtered_labels_at.append(int(idx + 1))
-                    continue
-                else:
-                    count += 1
-                tr = pgmlink.Traxel()
-                tr.set_x_scale(x_scale)
-                tr.set_y_scale(y_scale)
-                tr.set_z_scale(z_scale)
-                tr.Id = int(idx + 1)
-                tr.Timestep = t
-
-                # pgmlink expects always 3 coordinates, z=0 for 2d data
-                tr.add_feature_array("com", 3)
-                for i, v in enumerate([x, y, z]):
-                    tr.set_feature_value('com', i, float(v))
+
+        times = list(time_range)
+        chunks = [times[i:i + self.TRAXELSTORE_CHUNK_SIZE] for i in range(0, len(times), self.TRAXELSTORE_CHUNK_SIZE)]
+        nextRequests = fetchChunk(chunks[0]) if chunks else {}
+        for chunkIndex, chunk in enumerate(chunks):
+            requests = nextRequests
+            if chunkIndex + 1 < len(chunks):
+                nextRequests = fetchChunk(chunks[chunkIndex + 1])
+
+            traxels = []
+            for t in chunk:
+                frame = dict((name, requests.pop((t, name)).wait()[t]) for name, _ in sources)
+                feats_t = frame['feats']
+                rc = feats_t[default_features_key]['RegionCenter']
+                if rc.size:
+                    rc = rc[1:, ...]
 
                 if with_opt_correction:
-                    tr.add_feature_array("com_corrected", 3)
-                    for i, v in enumerate(rc_corr[idx]):
-                        tr.set_feature_value("com_corrected", i, float(v))
-                    if len(rc_corr[idx]) == 2:
-                        tr.set_feature_value("com_corrected", 2, 0.)
-
-                if with_div:
-                    tr.add_feature_array("divProb", 1)
-                    # idx+1 because rc and ct start from 1, divProbs starts from 0
-                    tr.set_feature_value("divProb", 0, float(divProbs[t][idx + 1][1]))
-
-                if with_classifier_prior:
-                    tr.add_feature_array("detProb", len(detProbs[t][idx + 1]))
-                    for i, v in enumerate(detProbs[t][idx + 1]):
-                        val = float(v)
-                        if val < 0.0000001:
-                            val = 0.0000001
-                        if val > 0.99999999:
-                            val = 0.99999999
-                        tr.set_feature_value("detProb", i, float(v))
-
-
-                # FIXME: check whether it is 2d or 3d data!
-                if with_local_centers:
-                    tr.add_feature_array("localCentersX", len(localCenters[t][idx + 1]))
-                    tr.add_feature_array("localCentersY", len(localCenters[t][idx + 1]))
-                    tr.add_feature_array("localCentersZ", len(localCenters[t][idx + 1]))
-                    for i, v in enumerate(localCenters[t][idx + 1]):
-                        tr.set_feature_value("localCentersX", i, float(v[0]))
-                        tr.set_feature_value("localCentersY", i, float(v[1]))
-                        tr.set_feature_value("localCentersZ", i, float(v[2]))
-
-                tr.add_feature_array("count", 1)
-                tr.set_feature_value("count", 0, float(size))
+                    try:
+                        rc_corr = feats_t[config.features_vigra_name]['RegionCenter_corr']
+                    except:
+                        raise Exception, 'cannot consider optical correction since it has not been computed before'
+                    if rc_corr.size:
+                        rc_corr = rc_corr[1:, ...]
+
+                ct = feats_t[default_features_key]['Count']
+                if ct.size:
+                    ct = ct[1:, ...]
+
+                logger.info("at timestep {}, {} traxels found".format(t, rc.shape[0]))
+
+                # for 2d data, set z-coordinate to 0:
+                coms = np.zeros((rc.shape[0], 3))
+                if rc.shape[0] > 0:
+                    if rc.ndim != 2 or rc.shape[1] not in (2, 3):
+                        raise Exception, "The RegionCenter feature must have dimensionality 2 or 3."
+                    coms[:, :rc.shape[1]] = rc
+                ct = np.asarray(ct, dtype=np.float64)
+                # (frames with only background have no rows, and reshape can't infer the columns)
+                sizes = ct.reshape(rc.shape[0], -1)[:, 0] if ct.size else np.zeros(0)
+
+                keep = ((coms[:, 0] >= x_range[0]) & (coms[:, 0] < x_range[1]) &
+                        (coms[:, 1] >= y_range[0]) & (coms[:, 1] < y_range[1]) &
+                        (coms[:, 2] >= z_range[0]) & (coms[:, 2] < z_range[1]) &
+                        (sizes >= size_range[0]) & (sizes < size_range[1]))
+                count = int(np.count_nonzero(keep))
+
+                for idx in np.flatnonzero(keep):
+                    tr = pgmlink.Traxel()
+                    tr.set_x_scale(x_scale)
+                    tr.set_y_scale(y_scale)
+                    tr.set_z_scale(z_scale)
+                    tr.Id = int(idx + 1)
+                    tr.Timestep = t
+
+                    # pgmlink expects always 3 coordinates, z=0 for 2d data
+                    tr.add_feature_array("com", 3)
+                    for i, v in enumerate(coms[idx]):
+                        tr.set_feature_value('com', i, float(v))
+
+                    if with_opt_correction:
+                        tr.add_feature_array("com_corrected", 3)
+                        for i, v in enumerate(rc_corr[idx]):
+                            tr.set_feature_value("com_corrected", i, float(v))
+                        if len(rc_corr[idx]) == 2:
+                            tr.set_feature_value("com_corrected", 2, 0.)
+
+                    if with_div:
+                        tr.add_feature_array("divProb", 1)
+                        # idx+1 because rc and ct start from 1, divProbs starts from 0
+                        tr.set_feature_value("divProb", 0, float(frame['divProbs'][idx + 1][1]))
+
+                    if with_classifier_prior:
+                        detProbs_t = frame['detProbs']
+                        tr.add_feature_array("detProb", len(detProbs_t[idx + 1]))
+                        for i, v in enumerate(detProbs_t[idx + 1]):
+                            tr.set_feature_value("detProb", i, float(v))
+
+                    # FIXME: check whether it is 2d or 3d data!
+                    if with_local_centers:
+                        localCenters_t = frame['localCenters']
+                        tr.add_feature_array("localCentersX", len(localCenters_t[idx + 1]))
+                        tr.add_feature_array("localCentersY", len(localCenters_t[idx + 1]))
+                        tr.add_feature_array("localCentersZ", len(localCenters_t[idx + 1]))
+                        for i, v in enumerate(localCenters_t[idx + 1]):
+                            tr.set_feature_value("localCentersX", i, float(v[0]))
+                            tr.set_feature_value("localCentersY", i, float(v[1]))
+                            tr.set_feature_value("localCentersZ", i, float(v[2]))
+
+                    tr.add_feature_array("count", 1)
+                    tr.set_feature_value("count", 0, float(sizes[idx]))
+                    traxels.append(tr)
+
                 if median_object_size is not None:
-                    obj_sizes.append(float(size))
+                    obj_sizes.append(sizes[keep])
 
-                ts.add(tr)
+                filtered_labels_at = (np.flatnonzero(~keep) + 1).tolist()
+                if len(filtered_labels_at) > 0:
+                    filtered_labels[str(int(t) - time_range[0])] = filtered_labels_at
+                logger.info("at timestep {}, {} traxels passed filter".format(t, count))
+                max_traxel_id_at.append(int(rc.shape[0]))
+                if count == 0:
+                    empty_frame = True
 
-            if len(filtered_labels_at) > 0:
-                filtered_labels[str(int(t) - time_range[0])] = filtered_labels_at
-            logger.info("at timestep {}, {} traxels passed filter".format(t, count))
-            max_traxel_id_at.append(int(rc.shape[0]))
-            if count == 0:
-                empty_frame = True
+                total_count += count
 
-            total_count += count
+            addTraxels(ts, traxels)
 
         if median_object_size is not None:
-            median_object_size[0] = np.median(np.array(obj_sizes), overwrite_input=True)
+            median_object_size[0] = np.median(np.concatenate(obj_sizes) if obj_sizes else np.array([]), overwrite_input=True)
             logger.info('median object size = ' + str(median_object_size[0]))
 
         self.FilteredLabels.setValue(filtered_labels, check_changed=False)
@@ -580,22 +613,26 @@ class OpTrackingBase(Operator, ExportingOperator):
     def _do_export_impl(self, settings, selected_features, progress_slot, object_feature_slot, label_image_slot, lane_index, filename_suffix=""):
         from ilastik.utility.exportFile import objects_per_frame, ExportFile, ilastik_ids, Mode, Default, \
             flatten_dict, division_flatten_dict
+        from ilastik.applets.tracking.base.trackingExport import export_file_path
 
         selected_features = list(selected_features)
         with_divisions = self.Parameters.value["withDivisions"] if self.Parameters.ready() else False
+        file_path = export_file_path(settings, filename_suffix)
+
+        if settings.get("streaming", False) and settings["file type"] == "h5":
+            self._do_streaming_export(settings, selected_features, progress_slot, object_feature_slot,
+                                      label_image_slot, file_path, with_divisions)
+            return
+
         obj_count = list(objects_per_frame(label_image_slot))
         track_ids, extra_track_ids, divisions = self.export_track_ids()
-        self._setLabel2Color()
+        if not self.label2color:
+            self._setLabel2Color()
         lineage = flatten_dict(self.label2color, obj_count)
         multi_move_max = self.Parameters.value["maxObj"] if self.Parameters.ready() else 2
         t_range = self.Parameters.value["time_range"] if self.Parameters.ready() else (0, 0)
         ids = ilastik_ids(obj_count)
 
-        file_path = settings["file path"]
-        if filename_suffix:
-            path, ext = os.path.splitext(file_path)
-            file_path = path + "-" + filename_suffix + ext
-
         export_file = ExportFile(file_path)
         export_file.ExportProgress.subscribe(progress_slot)
         export_file.InsertionProgress.subscribe(progress_slot)
@@ -628,4 +665,53 @@ class OpTrackingBase(Operator, ExportingOperator):
         export_file.write_all(settings["file type"], settings["compression"])
 
         export_file.ExportProgress.unsubscribe(progress_slot)
-        export_file.InsertionProgress.unsubscribe(progress_slot)
\ No newline at end of file
+        export_file.InsertionProgress.unsubscribe(progress_slot)
+
+    def _do_streaming_export(self, settings, selected_features, progress_slot, object_feature_slot, label_image_slot,
+                             file_path, with_divisions):
+        """
+        Export the object (and division) table frame by frame with export_tracking_h5(),
+        without holding the whole table in memory.  The object and raw image rois are not exported.
+        If settings contains a "lineage directory", the lineage files of the frames are written
+        to it in the same pass.
+        """
+        from ilastik.applets.tracking.base.trackingExport import export_tracking_h5, track_columns, \
+            lineage_file_writer
+        from ilastik.utility.exportFile import Default
+
+        track_ids, extra_track_ids, divisions = self.export_track_ids()
+        if not self.label2color:
+            self._setLabel2Color()
+        label2color = self.label2color
+        multi_move_max = self.Parameters.value["maxObj"] if self.Parameters.ready() else 2
+        t_range = self.Parameters.value["time_range"] if self.Parameters.ready() else (0, 0)
+
+        def lineage_at(t, o):
+            try:
+                return label2color[t][o]
+            except (IndexError, TypeError, KeyError):
+                return 0
+
+        def frame_columns(t, count):
+            lineage = np.array([lineage_at(t, o) for o in xrange(1, count + 1)], dtype=np.int64)
+            return [(Default.Lineage["names"][0], lineage)] + \
+                track_columns(track_ids, extra_track_ids, t, count, multi_move_max, t_range)
+
+        frame_divisions = None
+        if with_divisions and divisions:
+            divisions_at = {}
+            for division in divisions:
+                t, o = division[0], division[1]
+                divisions_at.setdefault(t, []).append((t, lineage_at(t, o)) + tuple(division[1:]))
+            frame_divisions = lambda t: divisions_at.get(t, [])
+        elif with_divisions:
+            logger.debug("No divisions occurred. Division Table will not be exported!")
+
+        frame_callback = None
+        if settings.get("lineage directory"):
+            frame_callback = lineage_file_writer(self.EventsVector.value, label2color, label_image_slot,
+                                                 str(settings["lineage directory"]))
+
+        export_tracking_h5(file_path, object_feature_slot, selected_features, frame_columns,
+                           frame_divisions, Default.DivisionNames["names"], frame_callback,
+                           settings["compression"], progress_slot)
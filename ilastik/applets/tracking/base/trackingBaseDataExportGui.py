@@ -87,7 +87,8 @@ class TrackingBaseDataExportGui( DataExportGui, ExportingGui ):
         dialog = ExportObjectInfoDialog(dimensions, 
                                         feature_names, 
                                         title=self.get_export_dialog_title(), 
-                                        filename=self._default_export_filename)
+                                        filename=self._default_export_filename,
+                                        streaming=True)
         if not dialog.exec_():
             return (None, None)
 
@@ -0,0 +1,253 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+"""
+Streaming export of tracking results to hdf5.
+
+Unlike ExportFile, which builds the whole object table in memory before
+writing it, the frames are processed in chunks of FRAME_CHUNK frames (the
+frames of a chunk in parallel), and the rows of each frame are appended to
+the file right away.  Only the features of one chunk are held in memory.
+
+The file has one group per table ("table" and "divisions"), which contains
+one chunked, compressed dataset per column (named like the columns of
+ExportFile) and a "frame_offsets" dataset: the rows of frame t are
+frame_offsets[t]:frame_offsets[t+1] of each column.
+"""
+import os
+import threading
+from functools import partial
+
+import numpy
+import h5py
+
+from lazyflow.request import Request, RequestPool
+from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
+from ilastik.utility.exportFile import Default
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Frames whose features are requested (and held in memory) at once
+FRAME_CHUNK = 16
+
+# Rows per hdf5 chunk of each column
+CHUNK_ROWS = 4096
+
+DEFAULT_COMPRESSION = { 'compression' : 'gzip', 'compression_opts' : 4 }
+
+class ColumnarTable(object):
+    """
+    A table in an hdf5 group, stored column by column and appended frame by frame.
+    The columns are created with the dtypes of the first appended frame.
+    """
+    def __init__(self, group, compression=None):
+        self._group = group
+        self._compression = compression or DEFAULT_COMPRESSION
+        self._names = None
+        self._offsets = [0]
+
+    def appendFrame(self, columns):
+        """
+        Append the rows of the next frame.  columns is a list of (name, array),
+        all arrays of the same length (which may be 0).
+        """
+        lengths = set( len(data) for _, data in columns )
+        assert len(lengths) == 1, "All columns of a frame must have the same length."
+        n = lengths.pop()
+
+        if self._names is None:
+            self._names = [ name for name, _ in columns ]
+            for name, data in columns:
+                self._group.create_dataset( name, shape=(0,), maxshape=(None,), dtype=numpy.asarray(data).dtype,
+                                            chunks=(CHUNK_ROWS,), **self._compression )
+        assert [ name for name, _ in columns ] == self._names, "The columns of a table can't change between frames."
+
+        start = self._offsets[-1]
+        if n > 0:
+            for name, data in columns:
+                dataset = self._group[name]
+                dataset.resize( (start + n,) )
+                dataset[start:] = data
+        self._offsets.append( start + n )
+
+    def rowCount(self):
+        return self._offsets[-1]
+
+    def close(self):
+        self._group.create_dataset( 'frame_offsets', data=numpy.array( self._offsets, dtype=numpy.int64 ) )
+
+def feature_columns( frame_features, selection ):
+    """
+    The exported feature columns as (column name, category, feature name, channel),
+    selected from the features of one frame like flatten_ilastik_feature_table() does:
+    the default features and the selected ones, one column per channel.
+    """
+    selection = list( selection )
+    columns = []
+    names = []
+    for cat_name, category in frame_features.iteritems():
+        for feat_name, feat_array in category.iteritems():
+            if cat_name == default_features_key or \
+                    feat_name not in names and feat_name in selection:
+                names.append( feat_name )
+                channels = feat_array.shape[1]
+                if channels > 1:
+                    columns += [ ( "%s_%i" % (feat_name, c), cat_name, feat_name, c ) for c in xrange(channels) ]
+                else:
+                    columns.append( ( feat_name, cat_name, feat_name, 0 ) )
+    return columns
+
+def track_columns( table, extra_table, t, count, max_tracks, t_range ):
+    """
+    The track id columns (track_id1 ... track_id<max_tracks>) of the objects
+    1...count of frame t, like flatten_tracking_table().
+    """
+    tracks = numpy.zeros( (count, max_tracks), dtype=numpy.int32 )
+    if t_range[0] <= t <= t_range[1]:
+        for o in xrange( 1, count + 1 ):
+            if o not in table[t]:
+                continue
+            track = []
+            if hasattr( table[t][o], "__iter__" ):
+                track.extend( table[t][o] )
+            else:
+                track.append( table[t][o] )
+            if t in extra_table and o in extra_table[t]:
+                track.extend( extra_table[t][o] )
+            track = list( set( track ) )
+            tracks[o - 1, :len(track)] = track
+    return [ ( Default.TrackColumnName.format(i + 1), tracks[:, i] ) for i in xrange( max_tracks ) ]
+
+def export_file_path( settings, filename_suffix="" ):
+    file_path = settings["file path"]
+    if filename_suffix:
+        path, ext = os.path.splitext(file_path)
+        file_path = path + "-" + filename_suffix + ext
+    return file_path
+
+def lineage_file_writer( events, label2color, label_image_slot, directory ):
+    """
+    Returns a frame callback for export_tracking_h5() that writes the lineage
+    file of each frame (see write_events()) to directory, like the
+    "Export Tracking Information" button of the tracking gui does.
+    events is the EventsVector, which is indexed from the first tracked frame on.
+    Returns None if nothing was tracked.
+    """
+    # (Imported here, so that exporting without lineage files doesn't need pgmlink.)
+    from ilastik.applets.tracking.base.trackingUtilities import write_events
+
+    t_from = next( ( t for t, label2color_at in enumerate( label2color ) if len( label2color_at ) ), None )
+    if t_from is None:
+        logger.warn( "Nothing was tracked, no lineage files are written." )
+        return None
+
+    keys = label_image_slot.meta.getAxisKeys()
+    lock = threading.Lock()
+
+    def writeFrame( t ):
+        events_at = events.get( str( t - t_from ) )
+        if events_at is None:
+            return
+        start, stop = [0]*len(keys), list( label_image_slot.meta.shape )
+        start[keys.index('t')], stop[keys.index('t')] = t, t+1
+        if 'c' in keys:
+            stop[keys.index('c')] = 1
+        labelImage = label_image_slot( start, stop ).wait()
+        labelImage = labelImage.reshape( [ s for k, s in zip( keys, labelImage.shape ) if k not in 'tc' ] )
+        # h5py is not thread-safe
+        with lock:
+            write_events( events_at, directory, t, labelImage )
+    return writeFrame
+
+def export_tracking_h5( file_path, feature_slot, selection, frame_columns, frame_divisions=None,
+                        division_names=None, frame_callback=None, compression=None, progress=None ):
+    """
+    Write the object table (and the division table) of all frames of feature_slot
+    (the object features, a list-rtype slot indexed by time) to file_path.
+
+    frame_columns( t, count ) returns the tracking columns of frame t as a list
+    of (name, array of length count); they come after the id columns
+    (object_id, timestep, labelimage_oid) and before the features.
+    frame_divisions( t ), if given, returns the division rows (tuples, in the
+    order of division_names) of frame t.
+    frame_callback( t ), if given, is called once for each frame while its chunk
+    is processed (e.g. to write the lineage file of the frame).  Calls for
+    different frames may run in parallel.
+    """
+    nFrames = feature_slot.meta.shape[0]
+    progress = progress or ( lambda x: None )
+    progress(0)
+
+    with h5py.File( file_path, 'w' ) as f:
+        table = ColumnarTable( f.create_group( "table" ), compression )
+        divisionTable = None
+        if frame_divisions is not None:
+            divisionTable = ColumnarTable( f.create_group( "divisions" ), compression )
+        columns = None
+
+        def processFrame( t, features, rows ):
+            count = max( 0, len( features[default_features_key]['Count'] ) - 1 ) # no background
+            frameRows = [ ( "timestep", numpy.empty( count, dtype=numpy.int64 ) ),
+                          ( "labelimage_oid", numpy.arange( 1, count + 1, dtype=numpy.int64 ) ) ]
+            frameRows[0][1][:] = t
+            frameRows += frame_columns( t, count )
+            frameRows += [ ( name, numpy.asarray( features[cat][feat][1:, c] ) ) for name, cat, feat, c in columns ]
+
+            divisionRows = None
+            if frame_divisions is not None:
+                divisions = numpy.array( frame_divisions( t ), dtype=numpy.int64 ).reshape( -1, len(division_names) )
+                divisionRows = [ ( name, divisions[:, i] ) for i, name in enumerate( division_names ) ]
+
+            if frame_callback is not None:
+                frame_callback( t )
+            rows[t] = ( count, frameRows, divisionRows )
+
+        for chunkStart in xrange( 0, nFrames, FRAME_CHUNK ):
+            chunk = range( chunkStart, min( chunkStart + FRAME_CHUNK, nFrames ) )
+            features = feature_slot( chunk ).wait()
+            if columns is None:
+                columns = feature_columns( features[chunk[0]], selection )
+
+            rows = {}
+            pool = RequestPool()
+            for t in chunk:
+                pool.add( Request( partial( processFrame, t, features[t], rows ) ) )
+            pool.wait()
+            pool.clean()
+            del features
+
+            # Append in frame order
+            for t in chunk:
+                count, frameRows, divisionRows = rows.pop( t )
+                objectIds = numpy.arange( table.rowCount(), table.rowCount() + count, dtype=numpy.int64 )
+                table.appendFrame( [ ( "object_id", objectIds ) ] + frameRows )
+                if divisionTable is not None:
+                    divisionTable.appendFrame( divisionRows )
+            progress( 100 * chunk[-1] / nFrames )
+
+        table.close()
+        if divisionTable is not None:
+            divisionTable.close()
+        logger.info( "Exported {} objects{} of {} frames to {}".format(
+            table.rowCount(),
+            " and {} divisions".format( divisionTable.rowCount() ) if divisionTable is not None else "",
+            nFrames, file_path ) )
+    progress(100)
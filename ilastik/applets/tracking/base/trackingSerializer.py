@@ -21,8 +21,42 @@
 from ilastik.applets.base.appletSerializer import AppletSerializer,\
     SerialDictSlot, SerialSlot, SerialHdf5BlockSlot, SerialPickleableSlot
 
+import numpy
 import pgmlink
 
+class SerialLineageSlot(SerialSlot):
+    """
+    Saves the lineage index of the tracking operators, so that the track ids
+    don't have to be computed again when the project is loaded.
+    Must be deserialized before the EventsVector.
+    """
+    def __init__(self, operator, name="LineageIndex"):
+        super(SerialLineageSlot, self).__init__(operator.EventsVector, name=name)
+        self.operator = operator
+
+    def _laneOperator(self, slot):
+        if self.slot.level == 0:
+            return self.operator
+        for i, subslot in enumerate(self.slot):
+            if subslot is slot:
+                return self.operator.innerOperators[i]
+
+    def _serialize(self, group, name, slot):
+        if slot.level > 0:
+            return super(SerialLineageSlot, self)._serialize(group, name, slot)
+        op = self._laneOperator(slot)
+        if op.lineage is not None:
+            group.create_dataset(name, data=numpy.void(op.lineage.dumps()))
+
+    def _deserialize(self, subgroup, slot):
+        if slot.level > 0:
+            # Lanes without a stored index simply compute theirs
+            for key in subgroup.keys():
+                if int(key) < len(slot):
+                    self._deserialize(subgroup[key], slot[int(key)])
+            return
+        self._laneOperator(slot).restoreLineage(subgroup[()].tostring())
+
 class TrackingSerializer(AppletSerializer):
     
     def __init__(self, mainOperator, projectFileGroupName):
@@ -31,8 +65,9 @@ class TrackingSerializer(AppletSerializer):
                                      mainOperator.InputHdf5,
                                      mainOperator.CleanBlocks,
                                      name="CachedOutput"),
-                 SerialDictSlot(mainOperator.EventsVector, transform=str, selfdepends=True),
                  SerialDictSlot(mainOperator.FilteredLabels, transform=str, selfdepends=True),
+                 SerialLineageSlot(mainOperator),
+                 SerialDictSlot(mainOperator.EventsVector, transform=str, selfdepends=True),
                  ]
 
         if 'MergerOutput' in mainOperator.outputs:
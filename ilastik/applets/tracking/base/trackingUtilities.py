@@ -18,6 +18,9 @@
 # on the ilastik web site at:
 #		   http://ilastik.org/license.html
 ###############################################################################
+import hashlib
+import cPickle as pickle
+
 import h5py
 import numpy as np
 import os.path as path
@@ -29,15 +32,11 @@ logger = logging.getLogger(__name__)
 def relabel(volume, replace):
     mp = np.arange(0, np.amax(volume) + 1, dtype=volume.dtype)
     mp[1:] = 1
-    labels = np.unique(volume)
-    for label in labels:
-        if label > 0:
-            try:
-                r = replace[label]
-                mp[label] = r
-            except:                
-                pass
-#    mp[replace.keys()] = replace.values()
+    if len(replace) > 0:
+        labels = np.fromiter(replace.iterkeys(), dtype=np.int64, count=len(replace))
+        values = np.fromiter(replace.itervalues(), dtype=np.int64, count=len(replace))
+        inside = (labels > 0) & (labels < len(mp))
+        mp[labels[inside]] = values[inside]
     return mp[volume]
 
 def highlightMergers(volume, merger):
@@ -65,6 +64,50 @@ def write_dict_value(dic, key, value):
         dic[key] = value
     return dic
 
+def event_ids(events_at, name, count):
+    """
+    The object ids (the first count columns) of the events of one type, as an
+    integer array of shape (number of events, count).
+    """
+    events = np.asarray(get_dict_value(events_at, name, []))
+    if events.size == 0:
+        return np.zeros((0, count), dtype=np.int64)
+    return events.reshape(len(events), -1)[:, :count].astype(np.int64)
+
+# Marks the object ids of a lookup array that have no entry
+NO_ENTRY = -1
+
+def grow_lookup(lookup, size):
+    """
+    Returns lookup (an array indexed by object id) extended to at least size entries.
+    """
+    if len(lookup) >= size:
+        return lookup
+    grown = np.empty(max(size, 2 * len(lookup)), dtype=lookup.dtype)
+    grown[:len(lookup)] = lookup
+    grown[len(lookup):] = NO_ENTRY
+    return grown
+
+def assign_lookup(lookup, ids, values):
+    """
+    lookup[ids] = values, where the last value wins for repeated ids (like for a dict).
+    Returns the (possibly grown) lookup.
+    """
+    if len(ids) == 0:
+        return lookup
+    lookup = grow_lookup(lookup, ids.max() + 1)
+    _, last = np.unique(ids[::-1], return_index=True)
+    last = len(ids) - 1 - last
+    lookup[ids[last]] = np.broadcast_to(values, ids.shape)[last]
+    return lookup
+
+def lookup_dict(lookup):
+    """
+    The {object id: value} dict of a lookup array.
+    """
+    ids = np.flatnonzero(lookup != NO_ENTRY)
+    return dict(zip(ids.tolist(), lookup[ids].tolist()))
+
 def get_events(eventsVector):
     events = {}
     for t in range(len(eventsVector)):
@@ -179,6 +222,98 @@ def write_events(events_at, directory, t, labelImage, mergers=None):
 
     
 
+def lineage_key(events, time_range, filtered_labels):
+    """
+    Hash of the inputs a tracking result's track ids are computed from.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr(list(time_range)))
+    for t in sorted(events.keys(), key=int):
+        digest.update(t)
+        for name, count in (("app", 1), ("mov", 2), ("div", 3)):
+            digest.update(event_ids(events[t], name, count).tostring())
+        for o, r in sorted(get_dict_value(events[t], "res", {}).items()):
+            digest.update(repr((int(o), [int(c) for c in r[:-1]])))
+    for t in sorted(filtered_labels.keys(), key=int):
+        digest.update(repr((t, [int(l) for l in filtered_labels[t]])))
+    return digest.hexdigest()
+
+
+class LineageIndex(object):
+    """
+    Track ids and lineage of a tracking result, indexed so that lineage queries
+    only touch the tracks they return.
+
+    track_ids[t] is an array that maps the object ids of frame t to their track id
+    (0 for filtered objects, NO_ENTRY for objects that are not tracked).  A track
+    divides at most once, so children[track] holds its two child tracks ((0, 0) if
+    it doesn't divide) and parent[track] the track it divided from (0 if none).
+
+    divisions and extra_track_ids are as returned by OpTrackingBase.export_track_ids().
+    """
+    def __init__(self, track_ids, divisions, extra_track_ids, key=None):
+        self.track_ids = track_ids
+        self.divisions = divisions
+        self.extra_track_ids = extra_track_ids
+        self.key = key
+        self._track_id_dicts = None
+
+        size = max([2] + [int(lookup.max()) + 1 for lookup in track_ids if len(lookup)])
+        self.parent = np.zeros(size, dtype=np.int64)
+        self.children = np.zeros((size, 2), dtype=np.int64)
+        if divisions:
+            d = np.asarray(divisions, dtype=np.int64)
+            self.parent[d[:, 4]] = d[:, 2]
+            self.parent[d[:, 6]] = d[:, 2]
+            self.children[d[:, 2]] = d[:, [4, 6]]
+
+    def track_id_dicts(self):
+        """
+        track_ids as a list of {object id: track id} dicts.
+        """
+        if self._track_id_dicts is None:
+            self._track_id_dicts = [lookup_dict(lookup) for lookup in self.track_ids]
+        return self._track_id_dicts
+
+    def track_children(self, track_id):
+        """
+        All descendants of a track: its two children, followed by the
+        descendants of the first child and then those of the second child.
+        """
+        result = []
+        stack = [track_id]
+        while stack:
+            track = stack.pop()
+            if not 0 < track < len(self.children) or self.children[track, 0] == 0:
+                continue
+            child1, child2 = self.children[track].tolist()
+            result += [child1, child2]
+            stack += [child2, child1]
+        return result
+
+    def track_parent(self, track_id):
+        """
+        All ancestors of a track, starting with its parent.
+        """
+        result = []
+        track = track_id
+        while 0 < track < len(self.parent) and self.parent[track] != 0:
+            track = int(self.parent[track])
+            result.append(track)
+        return result
+
+    def dumps(self):
+        return pickle.dumps({'key': self.key,
+                             'track_ids': self.track_ids,
+                             'divisions': self.divisions,
+                             'extra_track_ids': self.extra_track_ids}, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, s):
+        state = pickle.loads(s)
+        return cls(state['track_ids'], state['divisions'], state['extra_track_ids'], state['key'])
+
+
 class LineageTrees():
 
     def createLineageTrees(self, fn=None, width=None, height=None, circular=False, withAppearing=True, from_t=0, to_t=0):
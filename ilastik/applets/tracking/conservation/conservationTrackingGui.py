@@ -42,6 +42,16 @@ class ConservationTrackingGui(TrackingBaseGui, ExportingGui):
         self._drawer.label_4.setVisible(selection > 1)
         labels[0].setVisible(selection > 1)
 
+    @threadRouted
+    def _setMergerColortable(self):
+        # Without merger resolution, the merger layer shows the number of merged objects
+        merger_layer_idx = self.layerstack.findMatchingIndex(lambda x: x.name == "Merger")
+        param = self.topLevelOperatorView.Parameters.value
+        if 'withMergerResolution' in param.keys() and not param['withMergerResolution']:
+            self.layerstack[merger_layer_idx].colorTable = self.merger_colortable
+        else:
+            self.layerstack[merger_layer_idx].colorTable = self.tracking_colortable
+
     def _loadUiFile(self):
         # Load the ui file (find it in our own directory)
         localDir = os.path.split(__file__)[0]
@@ -231,10 +241,11 @@ class ConservationTrackingGui(TrackingBaseGui, ExportingGui):
                     force_build_hypotheses_graph = False
                     )
 
-                # update showing the merger legend,
+                # update showing the merger legend and colors,
                 # as it might be (no longer) needed if merger resolving
                 # is disabled(enabled)
                 self._setMergerLegend(self.mergerLabels, self._drawer.maxObjectsBox.value())
+                self._setMergerColortable()
             except Exception as ex:
                 log_exception(logger, "Error during tracking.  See above error traceback.")
                 self._criticalMessage("Error during tracking.  See error log.\n\n"
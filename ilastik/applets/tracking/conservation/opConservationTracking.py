@@ -1,5 +1,10 @@
+import threading
+import time
+from functools import partial
+
 import numpy as np
 from lazyflow.graph import InputSlot, OutputSlot
+from lazyflow.request import Request, RequestPool
 from lazyflow.rtype import List
 from lazyflow.stype import Opaque
 import pgmlink
@@ -15,6 +20,9 @@ logger = logging.getLogger(__name__)
 
 
 class OpConservationTracking(OpTrackingBase):
+    # Number of frames (with mergers) whose features are fetched at once when the merger coordinates are extracted
+    MERGER_COORDINATES_CHUNK_SIZE = 10
+
     DivisionProbabilities = InputSlot(stype=Opaque, rtype=List)
     DetectionProbabilities = InputSlot(stype=Opaque, rtype=List)
     NumLabels = InputSlot()
@@ -64,18 +72,20 @@ class OpConservationTracking(OpTrackingBase):
         self._relabeledOpCache.BlockShape.setValue( self._blockshape )
     
     def execute(self, slot, subindex, roi, result):
+        # Output and MergerOutput color the resolved labels, which are computed
+        #  once per frame for RelabeledImage and kept in its compressed cache.
         if slot is self.Output:
             parameters = self.Parameters.value
             trange = range(roi.start[0], roi.stop[0])
             original = np.zeros(result.shape)
             original = super(OpConservationTracking, self).execute(slot, subindex, roi, original).copy() # recursive call to get properly labeled image
-            result = self.LabelImage.get(roi).wait()
-            pixel_offsets=roi.start[1:-1]  # offset only in pixels, not time and channel
+            result = self._resolvedLabels(roi)
             for t in trange:
                 if ('time_range' in parameters
                         and t <= parameters['time_range'][-1] and t >= parameters['time_range'][0]
                         and len(self.resolvedto) > t and len(self.resolvedto[t])):
-                    result[t-roi.start[0],...,0] = self._relabelMergers(result[t-roi.start[0],...,0], t, pixel_offsets)
+                    if self.CoordinateMap.value.size() > 0:
+                        result[t-roi.start[0],...,0] = relabel(result[t-roi.start[0],...,0], self.label2color[t])
                 else:
                     result[t-roi.start[0],...][:] = 0
 
@@ -84,14 +94,17 @@ class OpConservationTracking(OpTrackingBase):
         elif slot is self.MergerOutput:
             parameters = self.Parameters.value
             trange = range(roi.start[0], roi.stop[0])
-            result = self.LabelImage.get(roi).wait()
-            pixel_offsets=roi.start[1:-1]  # offset only in pixels, not time and channel
+            withMergerResolution = 'withMergerResolution' in parameters.keys() and parameters['withMergerResolution']
+            if withMergerResolution:
+                result = self._resolvedLabels(roi)
+            else:
+                result = self.LabelImage.get(roi).wait()
             for t in trange:
                 if ('time_range' in parameters
                         and t <= parameters['time_range'][-1] and t >= parameters['time_range'][0]
                         and len(self.mergers) > t and len(self.mergers[t])):
-                    if 'withMergerResolution' in parameters.keys() and parameters['withMergerResolution']:
-                        result[t-roi.start[0],...,0] = self._relabelMergers(result[t-roi.start[0],...,0], t, pixel_offsets, True)
+                    if withMergerResolution:
+                        result[t-roi.start[0],...,0] = self._resolvedMergers(result[t-roi.start[0],...,0], t)
                     else:
                         result[t-roi.start[0],...,0] = highlightMergers(result[t-roi.start[0],...,0], self.mergers[t])
                 else:
@@ -106,7 +119,10 @@ class OpConservationTracking(OpTrackingBase):
                         and t <= parameters['time_range'][-1] and t >= parameters['time_range'][0]
                         and len(self.resolvedto) > t and len(self.resolvedto[t])
                         and 'withMergerResolution' in parameters.keys() and parameters['withMergerResolution']):
+                        start = time.time()
                         result[t-roi.start[0],...,0] = self._relabelMergers(result[t-roi.start[0],...,0], t, pixel_offsets, False, True)
+                        logger.debug("resolved {} mergers at timestep {} in {:.2f}s"
+                                     .format(len(self.resolvedto[t]), t, time.time() - start))
         else:  # default bahaviour
             result = super(OpConservationTracking, self).execute(slot, subindex, roi, result)
         return result
@@ -294,15 +310,6 @@ class OpConservationTracking(OpTrackingBase):
         events = get_events(eventsVector)
         self.Parameters.setValue(parameters, check_changed=False)
         self.EventsVector.setValue(events, check_changed=False)
-        self.RelabeledImage.setDirty()
-        merger_layer_idx = self.parent.parent.trackingApplet._gui.currentGui().layerstack.findMatchingIndex(lambda x: x.name == "Merger")
-        tracking_layer_idx = self.parent.parent.trackingApplet._gui.currentGui().layerstack.findMatchingIndex(lambda x: x.name == "Tracking")
-        if 'withMergerResolution' in parameters.keys() and not parameters['withMergerResolution']:
-            self.parent.parent.trackingApplet._gui.currentGui().layerstack[merger_layer_idx].colorTable = \
-                self.parent.parent.trackingApplet._gui.currentGui().merger_colortable
-        else:
-            self.parent.parent.trackingApplet._gui.currentGui().layerstack[merger_layer_idx].colorTable = \
-                self.parent.parent.trackingApplet._gui.currentGui().tracking_colortable
 
     def propagateDirty(self, inputSlot, subindex, roi):
         super(OpConservationTracking, self).propagateDirty(inputSlot, subindex, roi)
@@ -315,42 +322,81 @@ class OpConservationTracking(OpTrackingBase):
                 self.parent.parent.trackingApplet._gui.currentGui()._drawer.maxObjectsBox.setValue(self.NumLabels.value-1)
 
     def _get_merger_coordinates(self, coordinate_map, time_range, eventsVector):
-        # fetch features
-        feats = self.ObjectFeatures(time_range).wait()
-        # iterate over all timesteps
-        for t in feats.keys():
-            rc = feats[t][default_features_key]['RegionCenter']
-            lower = feats[t][default_features_key]['Coord<Minimum>']
-            upper = feats[t][default_features_key]['Coord<Maximum>']
-            size = feats[t][default_features_key]['Count']
-            for event in eventsVector[t]:
-                # check for merger events
-                if event.type == pgmlink.EventType.Merger:
-                    idx = event.traxel_ids[0]
-                    # generate roi: assume the following order: txyzc
-                    n_dim = len(rc[idx])
-                    roi = [0]*5
-                    roi[0] = slice(int(t), int(t+1))
-                    roi[1] = slice(int(lower[idx][0]), int(upper[idx][0] + 1))
-                    roi[2] = slice(int(lower[idx][1]), int(upper[idx][1] + 1))
-                    if n_dim == 3:
-                        roi[3] = slice(int(lower[idx][2]), int(upper[idx][2] + 1))
-                    else:
-                        assert n_dim == 2
-                    image_excerpt = self.LabelImage[roi].wait()
-                    if n_dim == 2:
-                        image_excerpt = image_excerpt[0, ..., 0, 0]
-                    elif n_dim ==3:
-                        image_excerpt = image_excerpt[0, ..., 0]
-                    else:
-                        raise Exception, "n_dim = %s instead of 2 or 3"
-
-                    pgmlink.extract_coord_by_timestep_id(coordinate_map,
-                                                         image_excerpt,
-                                                         lower[idx].astype(np.int64),
-                                                         t,
-                                                         idx,
-                                                         int(size[idx,0]))
+        # Only the features of the frames with mergers are fetched, MERGER_COORDINATES_CHUNK_SIZE
+        #  frames at a time.  The coordinate map collects the coordinates of all mergers, as
+        #  resolve_mergers() resolves the whole events vector and RelabeledImage relabels
+        #  from the map afterwards.
+        merger_ids = {}
+        for t in time_range:
+            ids = [event.traxel_ids[0] for event in eventsVector[t] if event.type == pgmlink.EventType.Merger]
+            if ids:
+                merger_ids[t] = ids
+        merger_frames = sorted(merger_ids.keys())
+        logger.info("extracting the coordinates of {} mergers in {} frames"
+                    .format(sum(map(len, merger_ids.values())), len(merger_frames)))
+
+        lock = threading.Lock() # for the coordinate map
+        for i in range(0, len(merger_frames), self.MERGER_COORDINATES_CHUNK_SIZE):
+            chunk = merger_frames[i:i + self.MERGER_COORDINATES_CHUNK_SIZE]
+            feats = self.ObjectFeatures(chunk).wait()
+            frame_times = dict((t, 0.0) for t in chunk)
+            pool = RequestPool()
+            for t in chunk:
+                for idx in merger_ids[t]:
+                    pool.add(Request(partial(self._extract_merger_coordinates, coordinate_map, lock,
+                                             feats[t][default_features_key], t, idx, frame_times)))
+            pool.wait()
+            pool.clean()
+            for t in chunk:
+                logger.info("at timestep {}, extracted the coordinates of {} mergers in {:.2f}s"
+                            .format(t, len(merger_ids[t]), frame_times[t]))
+
+    def _extract_merger_coordinates(self, coordinate_map, lock, feats_t, t, idx, frame_times):
+        start = time.time()
+        rc = feats_t['RegionCenter']
+        lower = feats_t['Coord<Minimum>']
+        upper = feats_t['Coord<Maximum>']
+        size = feats_t['Count']
+
+        # generate roi: assume the following order: txyzc
+        n_dim = len(rc[idx])
+        roi = [0]*5
+        roi[0] = slice(int(t), int(t+1))
+        roi[1] = slice(int(lower[idx][0]), int(upper[idx][0] + 1))
+        roi[2] = slice(int(lower[idx][1]), int(upper[idx][1] + 1))
+        if n_dim == 3:
+            roi[3] = slice(int(lower[idx][2]), int(upper[idx][2] + 1))
+        else:
+            assert n_dim == 2
+        image_excerpt = self.LabelImage[roi].wait()
+        if n_dim == 2:
+            image_excerpt = image_excerpt[0, ..., 0, 0]
+        elif n_dim ==3:
+            image_excerpt = image_excerpt[0, ..., 0]
+        else:
+            raise Exception, "n_dim = %s instead of 2 or 3"
+
+        with lock:
+            pgmlink.extract_coord_by_timestep_id(coordinate_map,
+                                                 image_excerpt,
+                                                 lower[idx].astype(np.int64),
+                                                 t,
+                                                 idx,
+                                                 int(size[idx,0]))
+            frame_times[t] += time.time() - start
+
+    def _resolvedLabels(self, roi):
+        # The label image with the resolved mergers, from the (per-frame) cache of RelabeledImage
+        return self._relabeledOpCache.Output(roi.start, roi.stop).wait()
+
+    def _resolvedMergers(self, volume, t):
+        # Like _relabelMergers(volume, t, onlyMergers=True), for an already resolved volume
+        if self.CoordinateMap.value.size() == 0 or t >= len(self.resolvedto):
+            return np.zeros_like(volume)
+        valid_ids = [new_id for new_ids in self.resolvedto[t].values() for new_id in new_ids]
+        volume = volume.copy()
+        volume[~np.in1d(volume.ravel(), valid_ids).reshape(volume.shape)] = 0
+        return relabel(volume, self.label2color[t])
 
     def _relabelMergers(self, volume, time, pixel_offsets=[0, 0, 0], onlyMergers=False, noRelabeling=False):
         if self.CoordinateMap.value.size() == 0:
@@ -1,3 +1,5 @@
+import threading
+
 import numpy as np
 import math
 import vigra
@@ -73,6 +75,9 @@ class OpZeroBasedConsecutiveIndexRelabeling(Operator):
     To be able to compute vigra region features on a label image,
     it must contain zero based consecutive indexes. This operator
     provides a relabeled ROI of the image and the respective mapping as output.
+
+    The mapping of each frame is computed from the whole frame and kept
+    until the frame of LabelImage becomes dirty.
     """
     name = "Zero Based Consecutive Index Relabeling"
 
@@ -81,40 +86,79 @@ class OpZeroBasedConsecutiveIndexRelabeling(Operator):
     Output = OutputSlot()
     Mapping = OutputSlot(rtype=List, stype=Opaque)
 
-    def __init__(self, parent):
-        super(OpZeroBasedConsecutiveIndexRelabeling, self).__init__(parent)
+    def __init__(self, *args, **kwargs):
+        super(OpZeroBasedConsecutiveIndexRelabeling, self).__init__(*args, **kwargs)
         self._mapping = {}
+        self._labels = {} # t -> sorted labels of the frame, the new index of a label is its position
+        self._lock = threading.Lock()
 
     def setupOutputs(self):
         self.Output.meta.assignFrom(self.LabelImage.meta)
-
-    def _updateMapping(self, roi, t):
-        labelImage = self.LabelImage.get(roi).wait()
-        labels = list(np.unique(labelImage))
-        # if 0 not in labels:
-        #     labels = [0, ] + labels
-        newIndices = range(0, len(labels))
-        self._mapping[t] = dict(zip(labels, newIndices))
-        return labelImage
+        with self._lock:
+            self._mapping = {}
+            self._labels = {}
+
+    def _frameRoi(self, t):
+        taggedShape = self.LabelImage.meta.getTaggedShape()
+        timeIndex = taggedShape.keys().index('t')
+        start, stop = [0] * len(taggedShape), taggedShape.values()
+        start[timeIndex], stop[timeIndex] = t, t + 1
+        return start, stop
+
+    def _storeMapping(self, t, labels):
+        with self._lock:
+            self._labels[t] = labels
+            self._mapping[t] = dict(zip(labels, range(0, len(labels))))
+
+    def _updateMapping(self, t):
+        with self._lock:
+            labels = self._labels.get(t)
+        if labels is None:
+            labelImage = self.LabelImage(*self._frameRoi(t)).wait()
+            labels = np.unique(labelImage)
+            self._storeMapping(t, labels)
+        return labels
 
     def execute(self, slot, subindex, roi, result):
         if slot == self.Output:
             taggedShape = self.LabelImage.meta.getTaggedShape()
             timeIndex = taggedShape.keys().index('t')
-            t = roi.start[timeIndex]
-            labelImage = self._updateMapping(roi, t)
-            result = np.zeros_like(result)
-            for k, v in self._mapping[t].iteritems():
-                result[labelImage == k] = v
+            wholeFrame = all(a == 0 and b == s for i, (a, b, s) in enumerate(zip(roi.start, roi.stop, taggedShape.values()))
+                             if i != timeIndex)
+
+            for t in range(roi.start[timeIndex], roi.stop[timeIndex]):
+                start, stop = list(roi.start), list(roi.stop)
+                start[timeIndex], stop[timeIndex] = t, t + 1
+                resultKey = [slice(None)] * len(start)
+                resultKey[timeIndex] = slice(t - roi.start[timeIndex], t - roi.start[timeIndex] + 1)
+                resultKey = tuple(resultKey)
+
+                labelImage = self.LabelImage(start, stop).wait()
+                with self._lock:
+                    cached = t in self._labels
+                if wholeFrame and not cached:
+                    labels, newIndices = np.unique(labelImage, return_inverse=True)
+                    self._storeMapping(t, labels)
+                    result[resultKey] = newIndices.reshape(labelImage.shape)
+                else:
+                    result[resultKey] = np.searchsorted(self._updateMapping(t), labelImage)
 
             return result
         elif slot == self.Mapping:
-            if not self.Output.ready():
-                self._updateMapping(roi)
-            return self._mapping
+            # An empty roi means all frames
+            timeRange = roi if len(roi) > 0 else range(self.LabelImage.meta.getTaggedShape()['t'])
+            for t in timeRange:
+                self._updateMapping(t)
+            with self._lock:
+                return dict((t, self._mapping[t]) for t in timeRange)
 
     def propagateDirty(self, inputSlot, subindex, roi):
         if inputSlot is self.LabelImage:
+            timeIndex = self.LabelImage.meta.getTaggedShape().keys().index('t')
+            with self._lock:
+                for t in range(roi.start[timeIndex], roi.stop[timeIndex]):
+                    self._mapping.pop(t, None)
+                    self._labels.pop(t, None)
             self.Output.setDirty(roi)
 
     def setInSlot(self, slot, subindex, roi, value):
@@ -129,6 +173,8 @@ class OpRelabeledMergerFeatureExtraction(Operator):
     """
     This operator computes the features of relabeled segments, and combines them
     with the already computed and cached region features of the original label image.
+    Features are only recomputed for the frames that contain resolved mergers (see ResolvedTo),
+    all other frames keep their original features.
 
     ATTENTION: the new features are not cached, as they are intended only for export
     ATTENTION: No division features are recomputed, but divisions are not allowed to interact with mergers anyway
@@ -149,8 +195,8 @@ class OpRelabeledMergerFeatureExtraction(Operator):
     RegionFeatures = OutputSlot(stype=Opaque, rtype=List)
     RegionFeaturesVigra = OutputSlot(stype=Opaque, rtype=List)
 
-    def __init__(self, parent):
-        super(OpRelabeledMergerFeatureExtraction, self).__init__(parent)
+    def __init__(self, *args, **kwargs):
+        super(OpRelabeledMergerFeatureExtraction, self).__init__(*args, **kwargs)
 
         # TODO: uncached! combine old and new features for export
 
@@ -176,34 +222,52 @@ class OpRelabeledMergerFeatureExtraction(Operator):
 
     @staticmethod
     def _merge_features(featuresA, featuresB, mapping):
-        assert(featuresA.shape[1] == featuresB.shape[1], "Feature dimensions must match!")
-        max_label = max(max(mapping.keys())+1, len(featuresA))
+        assert featuresA.shape[1] == featuresB.shape[1], "Feature dimensions must match!"
+        labels = np.fromiter(mapping.iterkeys(), dtype=np.int64, count=len(mapping))
+        indices = np.fromiter(mapping.itervalues(), dtype=np.int64, count=len(mapping))
+        valid = labels != 0
+        labels, indices = labels[valid], indices[valid]
+        if len(labels) == 0:
+            return featuresA.copy()
+
+        # the resolved objects get new labels beyond the original ones, append rows for them
+        max_label = max(labels.max() + 1, len(featuresA))
+        features = np.concatenate((featuresA,
+                                   np.zeros((max_label - len(featuresA), featuresA.shape[1]), dtype=featuresA.dtype)))
+        features[labels, ...] = featuresB[indices, ...]
 
-        features = np.zeros((max_label, featuresA.shape[1]), dtype=featuresA.dtype)
-        features[:len(featuresA), ...] = featuresA
+        return features
 
-        for k, v in mapping.iteritems():
-            if k == 0:
-                continue
-            features[k, ...] = featuresB[v, ...]
+    @staticmethod
+    def _copyFrame(feature_groups):
+        return dict((name, dict(features)) for name, features in feature_groups.iteritems())
 
-        return features
+    def _framesWithMergers(self, frames):
+        resolved_to = self.ResolvedTo.value
+        return [t for t in frames if t < len(resolved_to) and len(resolved_to[t]) > 0]
 
     def execute(self, slot, subindex, roi, result):
         if slot == self.RegionFeatures:
-            feat_vigra = self.RegionFeaturesVigra(roi).wait()
             orig_feat_all = self.OriginalRegionFeatures(roi).wait()
-            mapping = self._opZeroBasedMergerImage.Mapping(roi).wait()
 
-            import copy
-            result = copy.deepcopy(orig_feat_all)
+            # only the frames with resolved mergers differ from the original features,
+            #  the others keep the original feature arrays (in new dicts, so that the
+            #  caller can't modify the cached features through them)
+            result = dict((t, self._copyFrame(frame)) for t, frame in orig_feat_all.iteritems())
+            merger_frames = self._framesWithMergers(sorted(orig_feat_all.keys()))
+            if not merger_frames:
+                return result
+
+            feat_vigra = self.RegionFeaturesVigra(merger_frames).wait()
+            mapping = self._opZeroBasedMergerImage.Mapping(merger_frames).wait()
 
             # merge the features in each frame
             for t, feature_groups in feat_vigra.iteritems():
                 for name, features in feature_groups.iteritems():
                     for k, v in features.iteritems():
-                        result[t][name][k] = self._merge_features(result[t][name][k], v, mapping[t])
+                        result[t][name][k] = self._merge_features(orig_feat_all[t][name][k], v, mapping[t])
 
+            logger.debug("Recomputed the features of {} frames with resolved mergers".format(len(merger_frames)))
             return result
         else:
             assert False, "Shouldn't get here."
@@ -20,18 +20,18 @@
 ###############################################################################
 from ilastik.applets.base.applet import DatasetConstraintError
 from ilastik.utility.exportingOperator import ExportingOperator
-from ilastik.utility.exportFile import objects_per_frame, ExportFile, ilastik_ids, Mode, Default
+from ilastik.utility.exportFile import ExportFile, ilastik_ids, Mode, Default
+from ilastik.applets.tracking.base.trackingExport import export_file_path, export_tracking_h5, track_columns
+from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
 from operator import itemgetter
 from itertools import compress
-from functools import partial
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.rtype import List, SubRegion
+from lazyflow.rtype import List
 from lazyflow.stype import Opaque
 
 import numpy as np
 
-import os
 import logging
 logger = logging.getLogger(__name__)
 
@@ -126,22 +126,20 @@ class OpManualTracking(Operator, ExportingOperator):
             for t in self.labels.keys():
                 result[t] = self.labels[t]
 
-        elif slot is self.TrackImage:
+        elif slot is self.TrackImage or slot is self.UntrackedImage:
+            self.LabelImage.get(roi).writeInto(result).wait()
             for t in range(roi.start[0], roi.stop[0]):
-                if t not in self.labels.keys():
-                    result[t - roi.start[0], ...][:] = 0
-                    return result
-
-                result[t - roi.start[0], ...] = self.LabelImage.get(roi).wait()[t - roi.start[0], ...]
-                result[t - roi.start[0], ..., 0] = self._relabel(result[t - roi.start[0], ..., 0], self.labels[t])
-
-        elif slot is self.UntrackedImage:
-            for t in range(roi.start[0], roi.stop[0]):
-                result[t - roi.start[0], ...] = self.LabelImage.get(roi).wait()[t - roi.start[0], ...]
-                labels_at = {}
-                if t in self.labels.keys():
-                    labels_at = self.labels[t]
-                result[t - roi.start[0], ..., 0] = self._relabelUntracked(result[t - roi.start[0], ..., 0], labels_at)
+                i = t - roi.start[0]
+                if slot is self.TrackImage:
+                    if t not in self.labels:
+                        result[i, ...] = 0
+                        continue
+                    # The annotations are edited in place by the gui, so the
+                    #  lookups are built for every request instead of cached.
+                    lut, default = self._trackLut(self.labels[t]), 0
+                else:
+                    lut, default = self._untrackedLut(self.labels.get(t, {})), 1
+                result[i, ..., 0] = self._applyLut(result[i, ..., 0], lut, default)
 
         return result
 
@@ -150,55 +148,59 @@ class OpManualTracking(Operator, ExportingOperator):
             self.labels = {}
             self.divisions = {}
 
+    @staticmethod
+    def _trackLut(replace):
+        # object id -> the (last) track of the object, 0 if it has none
+        lut = np.zeros(max([0] + replace.keys()) + 1, dtype=np.int64)
+        for label, tracks in replace.iteritems():
+            if label > 0 and len(tracks) > 0:
+                l = list(tracks)[-1]
+                lut[label] = 2 ** 16 - 1 if l == -1 else l
+        return lut
+
+    @staticmethod
+    def _untrackedLut(tracked_at):
+        # object id -> 0 if the object is tracked, 1 if not
+        lut = np.ones(max([0] + tracked_at.keys()) + 1, dtype=np.int64)
+        lut[0] = 0
+        for label, tracks in tracked_at.iteritems():
+            if len(tracks) > 0:
+                lut[label] = 0
+        return lut
+
+    @staticmethod
+    def _applyLut(volume, lut, default):
+        # Objects beyond the lookup are not annotated and get the default value.
+        inside = volume < len(lut)
+        result = np.where(inside, lut[np.where(inside, volume, 0)], default)
+        return result.astype(volume.dtype)
+
     def _relabel(self, volume, replace):
-        mp = np.arange(0, np.amax(volume) + 1, dtype=volume.dtype)
-        mp[1:] = 0
-        labels = np.unique(volume).tolist()
-        if 0 in labels:
-            labels.remove(0)
-        for label in labels:
-            if label in replace and len(replace[label]) > 0:
-                l = list(replace[label])[-1]
-                if l == -1:
-                    mp[label] = 2 ** 16 - 1
-                else:
-                    mp[label] = l
-        return mp[volume]
+        return self._applyLut(volume, self._trackLut(replace), 0)
 
     def _relabelUntracked(self, volume, tracked_at):
-        mp = np.arange(0, np.amax(volume) + 1, dtype=volume.dtype)
-        mp[1:] = 1
-        labels = np.unique(volume).tolist()
-        if 0 in labels:
-            labels.remove(0)
-        for label in labels:
-            if (label in tracked_at.keys()) and (len(tracked_at[label]) > 0):
-                mp[label] = 0
-        return mp[volume]
+        return self._applyLut(volume, self._untrackedLut(tracked_at), 1)
 
     def _getObjects(self, trange, misdet_idx):
-        filtered_labels = {}
         oid2tids = {}
         alltids = set()
         for t in range(trange[0], trange[1]):
-            count = 0
-            filtered_labels[t] = []
             oid2tids[t] = {}
-            troi = SubRegion(self.LabelImage, start=[t, ] + [0, ] * len(self.LabelImage.meta.shape[1:]),
-                             stop=[t + 1, ] + list(self.LabelImage.meta.shape[1:]))
-            max_oid = np.max(self.LabelImage.get(troi).wait())
-            for idx in range(max_oid + 1):
-                oid = int(idx) + 1
-                if t in self.labels.keys() and oid in self.labels[t].keys():
-                    if misdet_idx not in self.labels[t][oid]:
-                        oid2tids[t][oid] = self.labels[t][oid]
-                        for l in self.labels[t][oid]:
-                            alltids.add(l)
-                        count += 1
-
-            logger.info("at timestep {}, {} traxels found".format(t, count))
+            for oid, tids in self.labels.get(t, {}).iteritems():
+                if misdet_idx not in tids:
+                    oid2tids[t][oid] = tids
+                    alltids.update(tids)
+
+            logger.info("at timestep {}, {} traxels found".format(t, len(oid2tids[t])))
         return oid2tids, alltids
 
+    def _objectCounts(self):
+        # The number of objects in each frame, from the object features
+        #  (which are computed already) instead of the label image.
+        t_range = range(self.LabelImage.meta.shape[self.LabelImage.meta.axistags.index("t")])
+        feats = self.ObjectFeatures(t_range).wait()
+        return [max(0, len(feats[t][default_features_key]['Count']) - 1) for t in t_range]
+
     def save_export_progress_dialog(self, dialog):
         """
         Implements ExportOperator.save_export_progress_dialog
@@ -215,6 +217,24 @@ class OpManualTracking(Operator, ExportingOperator):
                 return oid
         raise ValueError("TID {} at t={} not found!".format(tid, t))
 
+    @staticmethod
+    def tid_to_oid_lookup(oid2tid):
+        """
+        Like lookup_oid_for_tid, but indexes oid2tid once for all lookups.
+        """
+        tid2oid = {}
+        for t, mapping in oid2tid.iteritems():
+            for oid, tids in mapping.iteritems():
+                for tid in tids:
+                    tid2oid.setdefault((t, tid), oid)
+
+        def lookup(tid, t):
+            try:
+                return tid2oid[(t, tid)]
+            except KeyError:
+                raise ValueError("TID {} at t={} not found!".format(tid, t))
+        return lookup
+
     def do_export(self, settings, selected_features, progress_slot, lane_index, filename_suffix=""):
         """
         Implements ExportOperator.do_export(settings, selected_features, progress_slot
@@ -227,17 +247,19 @@ class OpManualTracking(Operator, ExportingOperator):
         :return:
         """
         
-        obj_count = list(objects_per_frame(self.LabelImage))  # slow
+        file_path = export_file_path(settings, filename_suffix)
         divisions = self.divisions
         t_range = (0, self.LabelImage.meta.shape[self.LabelImage.meta.axistags.index("t")])
-        oid2tid, _ = self._getObjects(t_range, None)  # slow
+        oid2tid, _ = self._getObjects(t_range, None)
         max_tracks = max(max(map(len, i.values())) for i in oid2tid.values())
-        ids = ilastik_ids(obj_count)
 
-        file_path = settings["file path"]
-        if filename_suffix:
-            path, ext = os.path.splitext(file_path)
-            file_path = path + "-" + filename_suffix + ext
+        if settings.get("streaming", False) and settings["file type"] == "h5":
+            self._do_streaming_export(settings, selected_features, progress_slot, file_path, oid2tid, max_tracks,
+                                      t_range)
+            return
+
+        obj_count = self._objectCounts()
+        ids = ilastik_ids(obj_count)
 
         export_file = ExportFile(file_path)
         export_file.ExportProgress.subscribe(progress_slot)
@@ -252,10 +274,7 @@ class OpManualTracking(Operator, ExportingOperator):
                                 {"selection": selected_features})
 
         if divisions:
-            ott = partial(self.lookup_oid_for_tid, oid2tid)
-            divs = [(value[1], ott(key, value[1]), key, ott(value[0][0], value[1] + 1), value[0][0],
-                     ott(value[0][1], value[1] + 1), value[0][1])
-                    for key, value in sorted(divisions.iteritems(), key=itemgetter(0))]
+            divs = self._divisionRows(oid2tid)
             assert sum(Default.ManualDivMap) == len(divs[0])
             names = list(compress(Default.DivisionNames["names"], Default.ManualDivMap))
             export_file.add_columns("divisions", divs, Mode.List, extra={"names": names})
@@ -271,6 +290,33 @@ class OpManualTracking(Operator, ExportingOperator):
         export_file.ExportProgress.unsubscribe(progress_slot)
         export_file.InsertionProgress.unsubscribe(progress_slot)
 
+    def _divisionRows(self, oid2tid):
+        ott = self.tid_to_oid_lookup(oid2tid)
+        return [(value[1], ott(key, value[1]), key, ott(value[0][0], value[1] + 1), value[0][0],
+                 ott(value[0][1], value[1] + 1), value[0][1])
+                for key, value in sorted(self.divisions.iteritems(), key=itemgetter(0))]
+
+    def _do_streaming_export(self, settings, selected_features, progress_slot, file_path, oid2tid, max_tracks,
+                             t_range):
+        """
+        Export the object (and division) table frame by frame with export_tracking_h5(),
+        without holding the whole table in memory.  The object and raw image rois are not exported.
+        """
+        def frame_columns(t, count):
+            return track_columns(oid2tid, {}, t, count, max_tracks, t_range)
+
+        frame_divisions = None
+        names = None
+        if self.divisions:
+            divisions_at = {}
+            for division in self._divisionRows(oid2tid):
+                divisions_at.setdefault(division[0], []).append(division)
+            frame_divisions = lambda t: divisions_at.get(t, [])
+            names = list(compress(Default.DivisionNames["names"], Default.ManualDivMap))
+
+        export_tracking_h5(file_path, self.ObjectFeatures, selected_features, frame_columns,
+                           frame_divisions, names, None, settings["compression"], progress_slot)
+
 #    def _getObjects(self, time_range, x_range, y_range, z_range, size_range, misdet_idx):
 #        trange = range(time_range[0], time_range[1])
 #        print 'trange=', trange
@@ -46,3 +46,8 @@ size_filter = 4
 
 # for every of the n_best_successors, set this value as default if no candidate is found in the search window
 squared_distance_default = 9999
+
+# compute the division features of all objects at once, looking up the successor candidates by their centers.
+# This is faster, but the candidates differ from the default ones (all objects with a pixel in the search window,
+# found object by object in the label image), so the features are not identical: off by default.
+vectorized_division_features = False
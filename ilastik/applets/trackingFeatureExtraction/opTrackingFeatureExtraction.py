@@ -1,12 +1,14 @@
 import numpy as np
 import math
 import vigra
+from functools import partial
 
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.stype import Opaque
 from lazyflow.rtype import SubRegion, List
 from lazyflow.operators import OpArrayCache
 from lazyflow.roi import roiToSlice
+from lazyflow.request import Request, RequestPool
 from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction    ,\
     default_features_key, OpAdaptTimeListRoi
 from ilastik.applets.trackingFeatureExtraction import config
@@ -75,21 +77,33 @@ class OpDivisionFeatures(Operator):
         vroi = [slice(vroi_start[i],vroi_stop[i]) for i in range(len(vroi_start))]
         
         feats = self.RegionFeaturesVigra[slice(froi_start, froi_stop)].wait()
-        labelVolume = self.LabelVolume[vroi].wait()
         divisionFeatNames = self.DivisionFeatureNames[()].wait()[config.features_division_name] 
+
+        # The vectorized features only need the object centers, not the label image.
+        if config.vectorized_division_features:
+            labelVolume = None
+        else:
+            labelVolume = self.LabelVolume[vroi].wait()
         
-        for t in range(roi.stop[0]-roi.start[0]):
+        def computeFrame(t):
             result[t] = {}
             feats_cur = feats[t][config.features_vigra_name]
             if t+1 < froi_stop-froi_start:                
                 feats_next = feats[t+1][config.features_vigra_name]
-                                
-                img_next = labelVolume[t+1,...]
             else:
                 feats_next = None
-                img_next = None
-            res = self.featureManager.computeFeatures_at(feats_cur, feats_next, img_next, divisionFeatNames)
+            if config.vectorized_division_features:
+                res = self.featureManager.computeFeatures_vectorized(feats_cur, feats_next, divisionFeatNames)
+            else:
+                img_next = labelVolume[t+1,...] if feats_next is not None else None
+                res = self.featureManager.computeFeatures_at(feats_cur, feats_next, img_next, divisionFeatNames)
             result[t][config.features_division_name] = res 
+
+        pool = RequestPool()
+        for t in range(roi.stop[0]-roi.start[0]):
+            pool.add( Request( partial(computeFrame, t) ) )
+        pool.wait()
+        pool.clean()
         
         stop = time.time()
         logger.info("TIMING: computing division features took {:.3f}s".format(stop-start))
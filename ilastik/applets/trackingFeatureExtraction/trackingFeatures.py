@@ -1,5 +1,6 @@
 import numpy as np
 import math
+import itertools
 
 def dotproduct(v1, v2):
     return sum((a*b) for a, b in zip(v1, v2))
@@ -21,6 +22,13 @@ def angle(v1, v2):
     return (radians*180)/math.pi
 
 
+def _asRows(values, n_rows):
+    ''' values as a 2D array with n_rows rows (reshape can't infer the number of columns of an empty array) '''
+    if n_rows == 0:
+        return values.reshape((0, values.shape[1] if values.ndim > 1 else 1))
+    return values.reshape((n_rows, -1))
+
+
 
 ##### Feature base class #######
 
@@ -257,6 +265,165 @@ class FeatureManager( object ):
         return result
 
 
+    def _windowCandidates(self, coms_cur, coms_next):
+        ''' returns index pairs (i, j) such that coms_next[j] lies in the search window (template_size) around coms_cur[i].
+            The candidates are looked up in a uniform grid over coms_next, with cells of half the window size,
+            so only the 3**ndim cells around each current center are searched. '''
+        half = max(int(self.template_size) // 2, 1)
+        # window as in computeFeatures_at: [round(com) - half, round(com) + half)
+        rounded = np.floor(coms_cur + 0.5)
+        cells_cur = np.floor(rounded / half).astype(np.int64)
+        cells_next = np.floor(coms_next / half).astype(np.int64)
+
+        lowest = np.minimum(cells_cur.min(axis=0), cells_next.min(axis=0)) - 1
+        extent = np.maximum(cells_cur.max(axis=0), cells_next.max(axis=0)) - lowest + 2
+        keys_next = np.ravel_multi_index((cells_next - lowest).T, extent)
+        order = np.argsort(keys_next, kind='mergesort')
+        sorted_keys = keys_next[order]
+
+        pairs_cur = []
+        pairs_next = []
+        for offset in itertools.product([-1, 0, 1], repeat=coms_cur.shape[1]):
+            keys = np.ravel_multi_index((cells_cur + offset - lowest).T, extent)
+            starts = np.searchsorted(sorted_keys, keys, side='left')
+            counts = np.searchsorted(sorted_keys, keys, side='right') - starts
+            total = counts.sum()
+            if total == 0:
+                continue
+            offsets_in_cell = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            pairs_cur.append(np.repeat(np.arange(coms_cur.shape[0]), counts))
+            pairs_next.append(order[np.repeat(starts, counts) + offsets_in_cell])
+
+        if not pairs_cur:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        pairs_cur = np.concatenate(pairs_cur)
+        pairs_next = np.concatenate(pairs_next)
+        inside = np.all((coms_next[pairs_next] >= rounded[pairs_cur] - half) &
+                        (coms_next[pairs_next] < rounded[pairs_cur] + half), axis=1)
+        return pairs_cur[inside], pairs_next[inside]
+
+    def _getBestSquaredDistancesAll(self, coms_cur, feats_next):
+        ''' like _getBestSquaredDistances, for all objects at once. Returns the n_best candidate labels
+            (-1 if there are fewer candidates) and their distances (default value if there is no candidate) '''
+        n_cur = coms_cur.shape[0]
+        best_labels = -np.ones((n_cur, self.n_best), dtype=np.int64)
+        best_dists = np.ones((n_cur, self.n_best), dtype=np.float32) * self.squared_distance_default
+        if feats_next is None or n_cur == 0:
+            return best_labels, best_dists
+
+        coms_next = np.asarray(feats_next[self.com_name_next], dtype=np.float64).reshape((-1, coms_cur.shape[1]))
+        if coms_next.shape[0] == 0:
+            return best_labels, best_dists
+        sizes_next = np.asarray(feats_next[self.size_name]).reshape((coms_next.shape[0], -1))[:, 0]
+        valid_cur = np.all(np.isfinite(coms_cur), axis=1)
+        valid_cur[0] = False
+        valid_next = np.all(np.isfinite(coms_next), axis=1) & (sizes_next > 0)
+        valid_next[0] = False
+        if self.size_filter is None:
+            valid_next[:] = False
+        else:
+            valid_next &= sizes_next >= self.size_filter
+        labels_cur = np.flatnonzero(valid_cur)
+        labels_next = np.flatnonzero(valid_next)
+        if len(labels_cur) == 0 or len(labels_next) == 0:
+            return best_labels, best_dists
+
+        pairs_cur, pairs_next = self._windowCandidates(coms_cur[labels_cur], coms_next[labels_next])
+        pairs_cur = labels_cur[pairs_cur]
+        pairs_next = labels_next[pairs_next]
+
+        scales = self._scalesFor(coms_cur.shape[1])
+        dists = np.sqrt(np.sum((coms_next[pairs_next] - coms_cur[pairs_cur] * scales)**2, axis=1)).astype(np.float32)
+
+        # sort by object, then distance (then label, as the stable sort in _getBestSquaredDistances)
+        order = np.lexsort((pairs_next, dists, pairs_cur))
+        pairs_cur, pairs_next, dists = pairs_cur[order], pairs_next[order], dists[order]
+        group_starts = np.searchsorted(pairs_cur, pairs_cur, side='left')
+        rank = np.arange(len(pairs_cur)) - group_starts
+        keep = rank < self.n_best
+
+        best_labels[pairs_cur[keep], rank[keep]] = pairs_next[keep]
+        best_dists[pairs_cur[keep], rank[keep]] = dists[keep]
+        return best_labels, best_dists
+
+    def _scalesFor(self, ndim):
+        scales = np.ones(ndim)
+        n = min(ndim, len(self.scales))
+        scales[:n] = self.scales[:n]
+        return scales
+
+    def computeFeatures_vectorized(self, feats_cur, feats_next, feat_names):
+        ''' Same features as computeFeatures_at, computed for all objects at once.
+            The successor candidates are the objects of the next frame whose centers lie within the search window
+            (instead of all objects that have a pixel in the window), so the label image is not needed. '''
+        coms_cur = np.asarray(feats_cur[self.com_name_cur], dtype=np.float64)
+        n_cur = coms_cur.shape[0]
+        coms_cur = _asRows(coms_cur, n_cur)
+
+        best_labels, best_dists = self._getBestSquaredDistancesAll(coms_cur, feats_next)
+        n_found = np.sum(best_labels != -1, axis=1)
+        two_children = n_found >= 2
+
+        result = {}
+        for idx in range(self.n_best):
+            name = 'SquaredDistances_' + str(idx)
+            result[name] = np.ones((n_cur, 1)) * self.squared_distance_default
+            result[name][1:, 0] = best_dists[1:, idx]
+
+        for name in feat_names:
+            name_split = name.split(self.delim)
+            if "SquaredDistances" in name_split:
+                continue
+            if len(name_split) != 2:
+                raise Exception, 'tracking features consist of an operator and a feature name only, given name={}'.format(name_split)
+            op_name, feat_name = name_split
+            f_cur = _asRows(np.asarray(feats_cur[feat_name], dtype=np.float64), n_cur)
+            feat_class = self.feature_mappings[op_name](feat_name, delim=self.delim, ndim=self.ndim, feat_dim=f_cur.shape[1])
+            default = feat_class.default_value
+            values = np.ones((n_cur, feat_class.dim())) * default
+
+            if op_name in ('ParentChildrenRatio', 'ChildrenRatio', 'ParentChildrenAngle') and np.any(two_children[1:]):
+                rows = np.flatnonzero(two_children)
+                rows = rows[rows != 0]
+                f_next = np.asarray(feats_next[feat_name], dtype=np.float64).reshape((-1, f_cur.shape[1]))
+                first = f_next[best_labels[rows, 0]]
+                second = f_next[best_labels[rows, 1]]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    if op_name == 'ParentChildrenRatio':
+                        ratio = f_cur[rows] / (first + second)
+                        ratio[np.isnan(ratio)] = default
+                        values[rows] = ratio
+                    elif op_name == 'ChildrenRatio':
+                        ratio = first / second
+                        ratio[np.isnan(ratio)] = default
+                        ratio[ratio > 1] = 1. / ratio[ratio > 1]
+                        values[rows] = ratio
+                    else:
+                        values[rows, 0] = self._maxChildrenAngles(f_cur[rows], f_next, best_labels[rows],
+                                                                  feat_class.scales, default)
+            result[name] = values
+
+        return result
+
+    def _maxChildrenAngles(self, centers, f_next, best_labels, feat_scales, default):
+        ''' ParentChildrenAngle for many objects: the largest angle between two of the n_best candidates '''
+        scales = np.asarray(feat_scales[0:centers.shape[1]])
+        angles = np.ones(centers.shape[0]) * -np.inf
+        for i, j in itertools.combinations(range(best_labels.shape[1]), 2):
+            valid = (best_labels[:, i] != -1) & (best_labels[:, j] != -1)
+            v1 = (f_next[best_labels[:, i]] - centers) * scales
+            v2 = (f_next[best_labels[:, j]] - centers) * scales
+            norms = np.sqrt(np.sum(v1**2, axis=1)) * np.sqrt(np.sum(v2**2, axis=1))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cosines = np.sum(v1 * v2, axis=1) / norms
+            # as angle(): 0 for zero-length vectors (and rounding errors outside of [-1, 1])
+            defined = (norms != 0) & (np.abs(cosines) <= 1)
+            ang = np.zeros(len(cosines))
+            ang[defined] = np.degrees(np.arccos(cosines[defined]))
+            angles[valid] = np.maximum(angles[valid], ang[valid])
+        angles[np.isinf(angles)] = default
+        return angles
+
 
 if __name__ == '__main__':
     import vigra
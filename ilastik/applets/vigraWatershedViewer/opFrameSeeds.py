@@ -0,0 +1,264 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import collections
+import itertools
+import threading
+from functools import partial
+
+import numpy
+import vigra
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import Request
+
+import logging
+logger = logging.getLogger(__name__)
+
+class OpFrameSeeds(Operator):
+    """
+    Computes the watershed seeds (Input <= Threshold, labeled, seeds smaller than
+    MinSeedSize removed) of a whole frame at once and keeps them, so all block
+    requests of a frame share the same seeds, including seeds that cross block borders.
+
+    Each seed is labeled with 1 + the flat index of its first pixel in the frame,
+    so adding or removing one seed does not renumber the others.
+
+    When Threshold or MinSeedSize changes, the frames computed so far are recomputed
+    in the background, and only the blocks of BlockShape whose seeds (within Padding
+    of the block) changed are marked dirty.  At most MaxCachedFrames frames are kept;
+    the frames that were dropped before are marked dirty as a whole.
+    """
+    name = "OpFrameSeeds"
+
+    Input = InputSlot() # Single-channel image
+    Threshold = InputSlot()
+    MinSeedSize = InputSlot(value=0)
+    BlockShape = InputSlot(optional=True) # Blocks the downstream watershed is computed in
+    Padding = InputSlot(value=0) # Halo the downstream watershed reads around each block
+
+    Output = OutputSlot()
+
+    MaxCachedFrames = 4
+
+    def __init__(self, *args, **kwargs):
+        super(OpFrameSeeds, self).__init__(*args, **kwargs)
+        self._frames = collections.OrderedDict() # t -> seeds, least recently used first
+        self._replaced = {} # t -> seeds computed with earlier parameters, which were passed on
+        self._dropped = set() # frames that were passed on, but are not kept anymore
+        self._generation = 0 # counts the Threshold and MinSeedSize changes
+        self._updates = []
+        self._frameShape = None
+        self._frameLocks = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom( self.Input.meta )
+        self.Output.meta.dtype = numpy.uint32
+        self.Output.meta.drange = None
+        assert self.Input.meta.getTaggedShape().get('c', 1) == 1, "Seeds are computed from a single channel."
+
+        # setupOutputs is also called when Threshold or MinSeedSize change,
+        #  but the frames must only be dropped if the input changes shape.
+        with self._lock:
+            if self._frameShape != self.Input.meta.shape:
+                self._frames = collections.OrderedDict()
+                self._replaced = {}
+                self._dropped = set()
+            self._frameShape = self.Input.meta.shape
+    def _frameRoi(self, t):
+        keys = self.Input.meta.getAxisKeys()
+        start, stop = [0]*len(keys), list(self.Input.meta.shape)
+        if 't' in keys:
+            start[keys.index('t')], stop[keys.index('t')] = t, t+1
+        return start, stop
+
+    def _computeFrame(self, t):
+        keys = self.Input.meta.getAxisKeys()
+        data = self.Input( *self._frameRoi(t) ).wait()
+        frameShape = data.shape
+        spatial = data.reshape( [ s for k, s in zip(keys, frameShape) if k not in 'tc' ] )
+
+        mask = ( spatial <= self.Threshold.value ).astype(numpy.uint8)
+        if mask.ndim == 3:
+            labels = vigra.analysis.labelVolumeWithBackground( mask )
+        else:
+            labels = vigra.analysis.labelImageWithBackground( mask )
+        labels = numpy.asarray( labels, dtype=numpy.uint32 )
+
+        # Label each seed with its first pixel, and drop the small ones.
+        uniqueLabels, firstIndexes = numpy.unique( labels.ravel(), return_index=True )
+        lut = numpy.zeros( labels.max()+1, dtype=numpy.uint32 )
+        lut[uniqueLabels] = firstIndexes + 1
+        lut[0] = 0
+        minSize = self.MinSeedSize.value
+        if minSize > 0:
+            lut[ numpy.bincount( labels.ravel() ) < minSize ] = 0
+
+        return lut[labels].reshape( frameShape )
+
+    def _getFrame(self, t):
+        with self._frameLocks[t]:
+            return self._getFrameLocked(t)
+
+    def _getFrameLocked(self, t):
+        # Must be called with the lock of frame t held.
+        with self._lock:
+            frame = self._frames.pop(t, None)
+            if frame is not None:
+                self._frames[t] = frame # (most recently used)
+                return frame
+            generation = self._generation
+        frame = self._computeFrame(t)
+        with self._lock:
+            if generation == self._generation:
+                self._frames[t] = frame
+                self._dropped.discard(t)
+                while len(self._frames) > self.MaxCachedFrames:
+                    self._dropped.add( self._frames.popitem(last=False)[0] )
+                return frame
+            # The parameters changed while the frame was computed
+            self._replaced.setdefault(t, []).append(frame)
+        self._scheduleUpdate( [t] )
+        return frame
+
+    def execute(self, slot, subindex, roi, result):
+        keys = self.Input.meta.getAxisKeys()
+        tIndex = keys.index('t') if 't' in keys else None
+        ts = range( roi.start[tIndex], roi.stop[tIndex] ) if tIndex is not None else [0]
+
+        for i, t in enumerate(ts):
+            key = [ slice(a, b) for a, b in zip(roi.start, roi.stop) ]
+            resultKey = [ slice(None) ] * len(keys)
+            if tIndex is not None:
+                key[tIndex] = slice(0, 1)
+                resultKey[tIndex] = slice(i, i+1)
+            result[ tuple(resultKey) ] = self._getFrame(t)[ tuple(key) ]
+        return result
+
+    def _scheduleUpdate(self, ts):
+        request = Request( partial(self._updateFrames, ts) )
+        with self._lock:
+            self._updates = [ r for r in self._updates if not r.finished ] + [request]
+        request.submit()
+
+    def waitForUpdates(self):
+        """
+        Wait until the frames are recomputed after a Threshold or MinSeedSize change.
+        """
+        with self._lock:
+            updates = list(self._updates)
+        for request in updates:
+            request.wait()
+
+    def _updateFrames(self, ts):
+        for t in ts:
+            with self._frameLocks[t]:
+                with self._lock:
+                    replaced = self._replaced.pop(t, None)
+                if not replaced:
+                    continue
+                new = self._getFrameLocked(t)
+            self._dirtyChangedBlocks( t, replaced, new )
+
+    def _dirtyChangedBlocks(self, t, replaced, new):
+        keys = self.Input.meta.getAxisKeys()
+        shape = self.Input.meta.shape
+
+        changed = numpy.zeros( new.shape, dtype=bool )
+        for old in replaced:
+            changed |= ( old != new )
+        if not changed.any():
+            return
+        if not self.BlockShape.ready():
+            self._dirtyFrames( [t] )
+            return
+
+        blockShape = self.BlockShape.value
+        padding = self.Padding.value
+        ranges = [ range(0, s, b) if k not in 'tc' else [0] for k, s, b in zip(keys, shape, blockShape) ]
+        dirtyCount = 0
+        for blockStart in itertools.product( *ranges ):
+            key = []
+            start, stop = list(blockStart), []
+            for k, a, b, s in zip( keys, blockStart, blockShape, shape ):
+                if k in 'tc':
+                    key.append( slice(None) )
+                    stop.append( s )
+                else:
+                    key.append( slice( max(0, a - padding), min(s, a + b + padding) ) )
+                    stop.append( min(s, a + b) )
+            if changed[ tuple(key) ].any():
+                if 't' in keys:
+                    start[keys.index('t')], stop[keys.index('t')] = t, t+1
+                self.Output.setDirty( start, stop )
+                dirtyCount += 1
+        logger.debug( "Seeds changed in {} blocks of frame {}".format( dirtyCount, t ) )
+
+    def _dirtyFrames(self, ts):
+        keys = self.Input.meta.getAxisKeys()
+        if 't' not in keys:
+            self.Output.setDirty( slice(None) )
+            return
+        for t in ts:
+            self.Output.setDirty( *self._frameRoi(t) )
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot == self.Input:
+            keys = self.Input.meta.getAxisKeys()
+            with self._lock:
+                if 't' in keys:
+                    tIndex = keys.index('t')
+                    for t in range( roi.start[tIndex], roi.stop[tIndex] ):
+                        self._frames.pop(t, None)
+                        self._replaced.pop(t, None)
+                        self._dropped.discard(t)
+                else:
+                    self._frames = collections.OrderedDict()
+                    self._replaced = {}
+                    self._dropped = set()
+            # A change anywhere may change the seeds of the whole frame.
+            start, stop = [0]*len(keys), list(self.Input.meta.shape)
+            if 't' in keys:
+                tIndex = keys.index('t')
+                start[tIndex], stop[tIndex] = roi.start[tIndex], roi.stop[tIndex]
+            self.Output.setDirty( start, stop )
+        elif slot == self.Threshold or slot == self.MinSeedSize:
+            if not self.Output.ready():
+                return
+            # Only the frames computed so far can have been passed on.
+            #  (They are recomputed in the background, not on the GUI thread.)
+            with self._lock:
+                self._generation += 1
+                for t, frame in self._frames.items():
+                    self._replaced.setdefault(t, []).append(frame)
+                self._frames = collections.OrderedDict()
+                ts = sorted( self._replaced.keys() )
+                dropped = sorted( self._dropped )
+                self._dropped = set()
+            if dropped:
+                self._dirtyFrames( dropped )
+            if ts:
+                self._scheduleUpdate( ts )
+        elif slot == self.BlockShape or slot == self.Padding:
+            # The seeds don't depend on these.
+            pass
+        else:
+            assert False, "Unknown dirty input slot: {}".format( slot.name )
@@ -20,9 +20,12 @@
 ###############################################################################
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 
-from lazyflow.operators import OpSlicedBlockedArrayCache, OpMultiArraySlicer2, OpMultiArrayMerger, OpPixelOperator
+from lazyflow.operators import OpSlicedBlockedArrayCache, OpMultiArraySlicer2, OpMultiArrayMerger
 
-from lazyflow.operators import OpVigraWatershed, OpColorizeLabels, OpVigraLabelVolume, OpFilterLabels
+from lazyflow.operators import OpVigraWatershed, OpColorizeLabels
+
+import collections
+import threading
 
 import numpy
 import vigra
@@ -30,6 +33,64 @@ from functools import partial
 import random
 import logging
 
+from opFrameSeeds import OpFrameSeeds
+
+logger = logging.getLogger(__name__)
+
+# (width, depth) of the cache blocks if CacheBlockShape is not given and the available memory is unknown
+DEFAULT_CACHE_BLOCK_SHAPE = (256, 10)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+    logger.warn( "psutil is not available: the watershed viewer cache blocks default to {}".format( DEFAULT_CACHE_BLOCK_SHAPE ) )
+
+def chooseCacheBlockShape( taggedShape, dtype, availableBytes ):
+    """
+    Choose the (width, depth) of the viewer cache blocks for data of the given
+    tagged shape and dtype.
+
+    The width is the smallest power of two (64 to 512) that covers the largest
+    slicing plane, and the depth is as large as possible (up to 64 slices) while
+    keeping a block (input, seeds and watershed labels) within 1/256 of the
+    available memory, so that the caches of all three views fit comfortably.
+    """
+    spatial = [ taggedShape[k] for k in 'xyz' if k in taggedShape ]
+    width = 64
+    while width < min( 512, max(spatial) ):
+        width *= 2
+
+    bytesPerVoxel = numpy.dtype(dtype).itemsize + 2*numpy.dtype(numpy.uint32).itemsize
+    budget = availableBytes / 256
+    depth = int( budget // (width * width * bytesPerVoxel) )
+    depth = max( 1, min( depth, 64, min(spatial) ) )
+    return (width, depth)
+
+class OpCountBlockRecomputes(Operator):
+    """
+    Passes Input through and counts how often each requested block is computed.
+    """
+    Input = InputSlot()
+    Output = OutputSlot()
+
+    def __init__(self, *args, **kwargs):
+        super(OpCountBlockRecomputes, self).__init__(*args, **kwargs)
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom( self.Input.meta )
+
+    def execute(self, slot, subindex, roi, result):
+        with self._lock:
+            self.counts[ ( tuple(roi.start), tuple(roi.stop) ) ] += 1
+        self.Input( roi.start, roi.stop ).writeInto( result ).wait()
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.Output.setDirty( roi.start, roi.stop )
+
 class OpVigraWatershedViewer(Operator):
     name = "OpWatershedViewer"
     category = "top-level"
@@ -45,7 +106,8 @@ class OpVigraWatershedViewer(Operator):
     OverrideLabels = InputSlot(value={ 0: (0,0,0,0) })
     SeedThresholdValue = InputSlot(value=0.0)
     MinSeedSize = InputSlot(value=0)
-    CacheBlockShape = InputSlot(value=(256, 10)) # opWatershedCache block shapes. Expected: tuple of (width, depth) viewing shape
+    CacheBlockShape = InputSlot(optional=True) # opWatershedCache block shapes. Expected: tuple of (width, depth) viewing shape
+                                                # If not given, it is chosen by chooseCacheBlockShape()
 
     Seeds = OutputSlot()            # For batch export
     WatershedLabels = OutputSlot()  # Watershed labeled output
@@ -57,7 +119,7 @@ class OpVigraWatershedViewer(Operator):
 
     def __init__(self, *args, **kwargs):
         super(OpVigraWatershedViewer, self).__init__(*args, **kwargs)
-        self._seedThreshold = None
+        self.effectiveCacheBlockShape = None
         
         # Overview Schematic
         # Example here uses input channels 0,2,5
@@ -68,19 +130,20 @@ class OpVigraWatershedViewer(Operator):
         #                                .Slices[1] ----> opAverage -------------------------------------------------> opWatershed --> opWatershedCache --> opColorizer --> GUI
         #                                .Slices[2] ---/           \                                                  /
         #                                                           \     MinSeedSize                                /
-        #                                                            \               \                              /
-        #                              SeedThresholdValue ----------> opThreshold --> opSeedLabeler --> opSeedFilter --> opSeedCache --> opSeedColorizer --> GUI
+        #                                                            \                                              /
+        #                              SeedThresholdValue ----------> opFrameSeeds (whole frames) --------------------> opSeedCache --> opSeedColorizer --> GUI
+        #
+        # (opWatershed --> opRecomputeCounter --> opWatershedCache: counts how often each block is computed)
         
         # Create operators
         self.opChannelSlicer = OpMultiArraySlicer2(parent=self)
         self.opAverage = OpMultiArrayMerger(parent=self)
         self.opWatershed = OpVigraWatershed(parent=self)
+        self.opRecomputeCounter = OpCountBlockRecomputes(parent=self)
         self.opWatershedCache = OpSlicedBlockedArrayCache(parent=self)
         self.opColorizer = OpColorizeLabels(parent=self)
         
-        self.opThreshold = OpPixelOperator(parent=self)
-        self.opSeedLabeler = OpVigraLabelVolume(parent=self)
-        self.opSeedFilter = OpFilterLabels(parent=self)
+        self.opFrameSeeds = OpFrameSeeds(parent=self)
         self.opSeedCache = OpSlicedBlockedArrayCache(parent=self)        
         self.opSeedColorizer = OpColorizeLabels(parent=self)
 
@@ -98,19 +161,15 @@ class OpVigraWatershedViewer(Operator):
         self.opAverage.MergingFunction.setValue( average )
         self.opAverage.Inputs.connect( self.opChannelSlicer.Slices )
 
-        # Threshold for seeds
-        self.opThreshold.Input.connect( self.opAverage.Output )
-
-        # Label seeds
-        self.opSeedLabeler.Input.connect( self.opThreshold.Output )
-
-        # Filter seeds
-        self.opSeedFilter.MinLabelSize.connect( self.MinSeedSize )
-        self.opSeedFilter.Input.connect( self.opSeedLabeler.Output )
+        # Threshold, label and filter seeds (once per frame)
+        self.opFrameSeeds.Input.connect( self.opAverage.Output )
+        self.opFrameSeeds.Threshold.connect( self.SeedThresholdValue )
+        self.opFrameSeeds.MinSeedSize.connect( self.MinSeedSize )
+        self.opFrameSeeds.Padding.connect( self.WatershedPadding )
         
         # Cache seeds
         self.opSeedCache.fixAtCurrent.connect( self.FreezeCache )
-        self.opSeedCache.Input.connect(self.opSeedFilter.Output)
+        self.opSeedCache.Input.connect(self.opFrameSeeds.Output)
         
         # Color seeds for RBG display
         self.opSeedColorizer.Input.connect( self.opSeedCache.Output )
@@ -122,7 +181,8 @@ class OpVigraWatershedViewer(Operator):
 
         # Cache the watershed output
         self.opWatershedCache.fixAtCurrent.connect( self.FreezeCache )
-        self.opWatershedCache.Input.connect(self.opWatershed.Output)
+        self.opRecomputeCounter.Input.connect(self.opWatershed.Output)
+        self.opWatershedCache.Input.connect(self.opRecomputeCounter.Output)
 
         # Colorize the watershed labels for RGB display        
         self.opColorizer.Input.connect( self.opWatershedCache.Output )
@@ -138,7 +198,15 @@ class OpVigraWatershedViewer(Operator):
     def setupOutputs(self):
         # User has control over cache block shape
         # Width and depth are applied to x,y, or z depending on which slicing view is being used.
-        width, depth = self.CacheBlockShape.value
+        if self.CacheBlockShape.ready():
+            width, depth = self.CacheBlockShape.value
+        elif psutil is None:
+            width, depth = DEFAULT_CACHE_BLOCK_SHAPE
+        else:
+            width, depth = chooseCacheBlockShape( self.InputImage.meta.getTaggedShape(),
+                                                  self.InputImage.meta.dtype,
+                                                  psutil.virtual_memory().available )
+        self.effectiveCacheBlockShape = (width, depth)
 
         ## Cache blocks
         # Inner and outer block shapes are the same.
@@ -180,20 +248,25 @@ class OpVigraWatershedViewer(Operator):
         self.opSeedCache.innerBlockShape.setValue( (innerBlockShapeX, innerBlockShapeY, innerBlockShapeZ) )
         self.opSeedCache.outerBlockShape.setValue( (outerBlockShapeX, outerBlockShapeY, outerBlockShapeZ) )
 
+        # Threshold changes only dirty the watershed blocks (of the X-Y view) whose seeds changed
+        self.opFrameSeeds.BlockShape.setValue( innerBlockShapeZ )
+
         # For now watershed labels always come from the X-Y slicing view
         if len(self.opWatershedCache.InnerOutputs) > 0:
             self.WatershedLabels.connect( self.opWatershedCache.InnerOutputs[2] )
         
+        # Threshold changes are handled by opFrameSeeds, which only dirties the blocks whose seeds changed
         if self.SeedThresholdValue.ready():
-            seedThreshold = self.SeedThresholdValue.value
-            if not self.opWatershed.SeedImage.connected() or seedThreshold != self._seedThreshold:
-                self._seedThreshold = seedThreshold
-                
-                self.opThreshold.Function.setValue( lambda a: (a <= seedThreshold).astype(numpy.uint8) )
-                self.opWatershed.SeedImage.connect( self.opSeedFilter.Output )
+            if not self.opWatershed.SeedImage.connected():
+                self.opWatershed.SeedImage.connect( self.opFrameSeeds.Output )
         else:
             self.opWatershed.SeedImage.disconnect()
-            self.opThreshold.Function.disconnect()
+
+    def blockRecomputeCounts(self):
+        """
+        How often each watershed block has been computed, as {(start, stop) : count}.
+        """
+        return dict( self.opRecomputeCounter.counts )
 
     def propagateDirty(self, slot, subindex, roi):
         # All outputs are directly connected to internal operators
@@ -78,9 +78,11 @@ class VigraWatershedViewerGui(LayerViewerGui):
         self.updatePaddingGui()
         
         # Init block shape gui updates
-        cacheBlockShape = PreferencesManager().get( 'vigra watershed viewer', 'cache block shape', (256, 10))
+        # (If there is no preference, the operator chooses the block shape for the data.)
+        cacheBlockShape = PreferencesManager().get( 'vigra watershed viewer', 'cache block shape', None)
         op.CacheBlockShape.notifyDirty( self.updateCacheBlockGui )
-        op.CacheBlockShape.setValue( tuple(cacheBlockShape) )
+        if cacheBlockShape is not None:
+            op.CacheBlockShape.setValue( tuple(cacheBlockShape) )
         self.updateCacheBlockGui()
 
         # Init seeds gui updates
@@ -381,7 +383,13 @@ class VigraWatershedViewerGui(LayerViewerGui):
         self._drawer.paddingSpinBox.setValue( padding )
 
     def updateCacheBlockGui(self, *args):
-        width, depth = self.topLevelOperatorView.CacheBlockShape.value
+        op = self.topLevelOperatorView
+        if op.CacheBlockShape.ready():
+            width, depth = op.CacheBlockShape.value
+        elif op.effectiveCacheBlockShape is not None:
+            width, depth = op.effectiveCacheBlockShape
+        else:
+            return
         self._drawer.blockWidthSpinBox.setValue( width )
         self._drawer.blockDepthSpinBox.setValue( depth )
 
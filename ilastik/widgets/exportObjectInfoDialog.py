@@ -32,8 +32,11 @@ class ExportObjectInfoDialog(QDialog):
     :type parent: QWidget or None
     :param filename: The filename to use as default
     :type filename: str or None
+    :param streaming: offer the streaming (frame by frame) h5 table export
+    :type streaming: bool
     """
-    def __init__(self, dimensions, feature_table, req_features=None, title=None, parent=None, filename=None):
+    def __init__(self, dimensions, feature_table, req_features=None, title=None, parent=None, filename=None,
+                 streaming=False):
         super(ExportObjectInfoDialog, self).__init__(parent)
 
         ui_class, widget_class = uic.loadUiType(os.path.split(__file__)[0] + "/exportObjectInfoDialog.ui")
@@ -62,6 +65,14 @@ class ExportObjectInfoDialog(QDialog):
         # self.ui.forceUniqueIds.setEnabled(dimensions[0] > 1)
         self.ui.compressFrame.setVisible(False)
 
+        self.streamingExport = None
+        if streaming:
+            self.streamingExport = QCheckBox("Stream the tables frame by frame (no ROIs, h5 only)")
+            self.streamingExport.setToolTip("Write the object and division tables frame by frame to one dataset "
+                                            "per column, without holding the whole table in memory. "
+                                            "The ROIs and the raw image are not exported.")
+            self.ui.gridLayout_3.addWidget(self.streamingExport, 1, 0, 1, 2)
+
     def _get_file_type_index_from_filename(self, filename):
         extension = filename.rsplit(".", 1)[1].lower()
         idx = ALLOWED_EXTENSIONS.index(extension)
@@ -91,6 +102,7 @@ class ExportObjectInfoDialog(QDialog):
         normalize: make the labeling rois binary
         margin: the margin that should be added around the rois
         include raw: if True include the whole raw image instead of separate rois
+        streaming: if True (h5 only) export the tables frame by frame, without rois
         :returns: all settings that can be changed inside the dialog
         :rtype: dict
         """
@@ -107,6 +119,8 @@ class ExportObjectInfoDialog(QDialog):
                 "compression": self._compression_settings(),
                 "include raw": self.ui.includeRaw.checkState(),
             })
+            if self.streamingExport is not None and self.streamingExport.isChecked():
+                s["streaming"] = True
         return s
 
     def _drop_event(self, event):
@@ -18,6 +18,8 @@
 # on the ilastik web site at:
 #		   http://ilastik.org/license.html
 ###############################################################################
+import argparse
+
 from ilastik.workflow import Workflow
 
 #from ilastik.applets.pixelClassification import PixelClassificationApplet
@@ -52,6 +54,16 @@ class AutocontextClassificationWorkflow(Workflow):
         graph = Graph()
         super(AutocontextClassificationWorkflow, self).__init__( shell, headless, workflow_cmdline_args, project_creation_args, graph=graph, *args, **kwargs )
         self._applets = []
+
+        # Parse workflow-specific command-line args
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--blockwise-prediction', help="Compute batch predictions block by block, running all autocontext iterations on each block instead of caching every iteration.", action="store_true")
+        parser.add_argument('--prediction-block-shape', help="Block shape for --blockwise-prediction, one entry per axis of the feature image (e.g. 256,256,64,1).", type=str)
+        parsed_args, unused_args = parser.parse_known_args(workflow_cmdline_args)
+        self.blockwise_prediction = parsed_args.blockwise_prediction
+        self.prediction_block_shape = None
+        if parsed_args.prediction_block_shape:
+            self.prediction_block_shape = tuple( int(s) for s in parsed_args.prediction_block_shape.split(',') )
         
         ## Create applets 
         self.projectMetadataApplet = ProjectMetadataApplet()
@@ -132,6 +144,11 @@ class AutocontextClassificationWorkflow(Workflow):
 
         # Sync autocontext contant
         opBatchPredictor.AutocontextIterations.connect( opClassify.AutocontextIterations )
+
+        # Must be set before the predictor sets up its internal operators.
+        opBatchPredictor.Blockwise.setValue( self.blockwise_prediction )
+        if self.prediction_block_shape is not None:
+            opBatchPredictor.BlockShape.setValue( self.prediction_block_shape )
         
         # Connect Image pathway:
         # Input Image -> Features Op -> Prediction Op -> Export
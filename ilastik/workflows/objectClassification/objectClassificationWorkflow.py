@@ -85,7 +85,7 @@ class ObjectClassificationWorkflow(Workflow):
         # Parse workflow-specific command-line args
         parser = argparse.ArgumentParser()
         parser.add_argument('--fillmissing', help="use 'fill missing' applet with chosen detection method", choices=['classic', 'svm', 'none'], default='none')
-        parser.add_argument('--filter', help="pixel feature filter implementation.", choices=['Original', 'Refactored', 'Interpolated'], default='Original')
+        parser.add_argument('--filter', help="pixel feature filter implementation.", choices=['Original', 'Refactored', 'Interpolated', 'SharedScaleSpace'], default='Original')
         parser.add_argument('--nobatch', help="do not append batch applets", action='store_true', default=False)
         
         parsed_creation_args, unused_args = parser.parse_known_args(project_creation_args)
@@ -130,7 +130,7 @@ class ObjectClassificationWorkflow(Workflow):
 
         # Customization hooks
         self.dataExportApplet.prepare_for_entire_export = self.prepare_for_entire_export
-        #self.dataExportApplet.prepare_lane_for_export = self.prepare_lane_for_export
+        self.dataExportApplet.prepare_lane_for_export = self.prepare_lane_for_export
         self.dataExportApplet.post_process_lane_export = self.post_process_lane_export
         self.dataExportApplet.post_process_entire_export = self.post_process_entire_export
         
@@ -342,6 +342,14 @@ class ObjectClassificationWorkflow(Workflow):
         self.oc_freeze_status = self.objectClassificationApplet.topLevelOperator.FreezePredictions.value
         self.objectClassificationApplet.topLevelOperator.FreezePredictions.setValue(False)
 
+    def prepare_lane_for_export(self, lane_index):
+        # Detect the missing slices of the whole lane in one parallel pass,
+        #  instead of slice by slice as the export requests reach them.
+        if self.fillMissing != 'none':
+            opFillMissingSlices = self.fillMissingSlicesApplet.topLevelOperator.getLane(lane_index)
+            if opFillMissingSlices.Input.ready():
+                opFillMissingSlices.computeSliceIndex()
+
     def post_process_entire_export(self):
         # Unfreeze.
         if self.pcApplet:
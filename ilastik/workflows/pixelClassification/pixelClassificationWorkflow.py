@@ -65,7 +65,7 @@ class PixelClassificationWorkflow(Workflow):
         self._workflow_cmdline_args = workflow_cmdline_args
         # Parse workflow-specific command-line args
         parser = argparse.ArgumentParser()
-        parser.add_argument('--filter', help="pixel feature filter implementation.", choices=['Original', 'Refactored', 'Interpolated'], default='Original')
+        parser.add_argument('--filter', help="pixel feature filter implementation.", choices=['Original', 'Refactored', 'Interpolated', 'SharedScaleSpace'], default='Original')
         parser.add_argument('--print-labels-by-slice', help="Print the number of labels for each Z-slice of each image.", action="store_true")
         parser.add_argument('--label-search-value', help="If provided, only this value is considered when using --print-labels-by-slice", default=0, type=int)
         parser.add_argument('--generate-random-labels', help="Add random labels to the project file.", action="store_true")
@@ -75,6 +75,8 @@ class PixelClassificationWorkflow(Workflow):
         parser.add_argument('--tree-count', help='Number of trees for Vigra RF classifier.', type=int)
         parser.add_argument('--variable-importance-path', help='Location of variable-importance table.', type=str)
         parser.add_argument('--label-proportion', help='Proportion of feature-pixels used to train the classifier.', type=float)
+        parser.add_argument('--max-samples-per-class', help='Train on a random subset of at most this many labeled pixels per class (saved with the project).', type=int)
+        parser.add_argument('--prediction-cache-file', help='Keep computed predictions in this hdf5 file, to reuse them in later sessions and resumed exports.', type=str)
 
         # Parse the creation args: These were saved to the project file when this project was first created.
         parsed_creation_args, unused_args = parser.parse_known_args(project_creation_args)
@@ -91,6 +93,8 @@ class PixelClassificationWorkflow(Workflow):
         self.tree_count = parsed_args.tree_count
         self.variable_importance_path = parsed_args.variable_importance_path
         self.label_proportion = parsed_args.label_proportion
+        self.prediction_cache_file = parsed_args.prediction_cache_file
+        self.max_samples_per_class = parsed_args.max_samples_per_class
 
         if parsed_args.filter and parsed_args.filter != parsed_creation_args.filter:
             logger.error("Ignoring new --filter setting.  Filter implementation cannot be changed after initial project creation.")
@@ -111,6 +115,8 @@ class PixelClassificationWorkflow(Workflow):
 
         self.pcApplet = self.createPixelClassificationApplet()
         opClassify = self.pcApplet.topLevelOperator
+        if self.prediction_cache_file:
+            opClassify.PredictionCacheFile.setValue( self.prediction_cache_file )
 
         self.dataExportApplet = PixelClassificationDataExportApplet(self, "Prediction Export")
         opDataExport = self.dataExportApplet.topLevelOperator
@@ -223,6 +229,9 @@ class PixelClassificationWorkflow(Workflow):
         # Training flags -> Classification Op (for GUI restrictions)
         opClassify.LabelsAllowedFlags.connect( opData.AllowLabels )
 
+        # Dataset identity -> Classification Op (for the prediction cache file)
+        opClassify.DatasetInfos.connect( opData.DatasetGroup[self.DATA_ROLE_RAW] )
+
         # Data Export connections
         opDataExport.RawData.connect( opData.ImageGroup[self.DATA_ROLE_RAW] )
         opDataExport.RawDatasetInfo.connect( opData.DatasetGroup[self.DATA_ROLE_RAW] )
@@ -323,6 +332,10 @@ class PixelClassificationWorkflow(Workflow):
             
         if self.tree_count or self.label_proportion:
             self.pcApplet.topLevelOperator.ClassifierFactory.setDirty()
+
+        if self.max_samples_per_class:
+            # (After loading, so it overrides the setting stored in the project.)
+            self.pcApplet.topLevelOperator.MaxSamplesPerClass.setValue( self.max_samples_per_class )
             
         if self.retrain:
             # Cause the classifier to be dirty so it is forced to retrain.
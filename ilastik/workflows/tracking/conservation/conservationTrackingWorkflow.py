@@ -1,4 +1,5 @@
 import os
+import argparse
 from lazyflow.graph import Graph
 from lazyflow.utility import PathComponents, make_absolute, format_known_keys
 from ilastik.workflow import Workflow
@@ -25,6 +26,16 @@ class ConservationTrackingWorkflowBase( Workflow ):
         #     self.fromBinary = kwargs['fromBinary']
         super(ConservationTrackingWorkflowBase, self).__init__(shell, headless, graph=graph, *args, **kwargs)
 
+        # Parse workflow-specific command-line args
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--streaming-table-export', help="Export the tracking table frame by frame to a columnar hdf5 file instead of csv, without holding the whole table in memory.", action="store_true")
+        parser.add_argument('--lineage-directory', help="With --streaming-table-export, also write the lineage file of each frame to this directory.", type=str)
+        parsed_args, unused_args = parser.parse_known_args(workflow_cmdline_args)
+        self._streaming_table_export = parsed_args.streaming_table_export
+        self._lineage_directory = parsed_args.lineage_directory
+        if self._lineage_directory and not self._streaming_table_export:
+            parser.error("--lineage-directory requires --streaming-table-export")
+
         data_instructions = 'Use the "Raw Data" tab to load your intensity image(s).\n\n'
         if self.fromBinary:
             data_instructions += 'Use the "Binary Image" tab to load your segmentation image(s).'
@@ -193,6 +204,11 @@ class ConservationTrackingWorkflowBase( Workflow ):
 
         # configure export settings
         settings = {'file path': self.default_export_filename, 'compression': {}, 'file type': 'csv'}
+        if self._streaming_table_export:
+            settings = {'file path': os.path.splitext(self.default_export_filename)[0] + '.h5',
+                        'compression': {}, 'file type': 'h5', 'streaming': True}
+            if self._lineage_directory:
+                settings['lineage directory'] = self._lineage_directory
         selected_features = ['Count', 'RegionCenter']
         opTracking.configure_table_export_settings(settings, selected_features)
     
@@ -156,6 +156,58 @@ class TestOpNansheGenerateDictionary(object):
 
         assert(len(unmatched_g) == 0)
 
+    def test_OpNansheGenerateDictionaryStreaming(self):
+        p = numpy.array([[27, 51],
+                         [66, 85],
+                         [77, 45]])
+
+        space = numpy.array((100, 100))
+        radii = numpy.array((5, 6, 7))
+
+        g = nanshe.syn.data.generate_hypersphere_masks(space, p, radii)
+        g = g.astype(float)
+
+        # A recording in which the masks are randomly active.
+        random = numpy.random.RandomState(0)
+        activity = (random.random_sample((320, len(g))) < 0.3) * random.random_sample((320, len(g)))
+        gv = numpy.tensordot(activity, g, axes=1)[..., None]
+        gv = vigra.taggedView(gv, "tyxc")
+
+        graph = Graph()
+        op = OpNansheGenerateDictionary(graph=graph)
+
+        opPrep = OpArrayPiper(graph=graph)
+        opPrep.Input.setValue(gv)
+
+        op.Input.connect(opPrep.Output)
+
+        op.K.setValue(len(g))
+        op.Batchsize.setValue(32)
+        op.NumIter.setValue(50)
+        op.Lambda1.setValue(0.2)
+        op.Lambda2.setValue(0)
+        op.PosAlpha.setValue(True)
+        op.PosD.setValue(True)
+        op.Clean.setValue(True)
+        op.Mode.setValue(2)
+        op.ModeD.setValue(0)
+        op.Streaming.setValue(True)
+
+        d = op.Output[...].wait()
+
+        assert(g.shape == d.shape)
+        assert(op.streaming_stats["frames"] == 50 * 32)
+
+        # Every mask should be found (up to scaling).
+        g_unit = g.reshape(len(g), -1)
+        g_unit = g_unit / numpy.sqrt((g_unit**2).sum(axis=1))[:, None]
+        d_unit = d.reshape(len(d), -1)
+        d_unit = d_unit / numpy.maximum(numpy.sqrt((d_unit**2).sum(axis=1)), 1e-12)[:, None]
+
+        similarity = numpy.dot(g_unit, d_unit.T)
+
+        assert((similarity.max(axis=1) > 0.95).all())
+
 
 if __name__ == "__main__":
     import sys
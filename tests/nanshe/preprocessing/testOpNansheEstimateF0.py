@@ -38,6 +38,7 @@ import ilastik.applets.nanshe
 import ilastik.applets.nanshe.preprocessing
 import ilastik.applets.nanshe.preprocessing.opNansheEstimateF0
 from ilastik.applets.nanshe.preprocessing.opNansheEstimateF0 import OpNansheEstimateF0, OpNansheEstimateF0Cached
+from ilastik.applets.nanshe.preprocessing.opNansheEstimateF0Streaming import OpNansheEstimateF0Streaming
 
 
 class TestOpNansheEstimateF0(object):
@@ -91,6 +92,76 @@ class TestOpNansheEstimateF0(object):
 
         assert((b == 1).all())
 
+    def testStreaming(self):
+        numpy.random.seed(0)
+        a = numpy.random.random((120, 31, 32)).astype(numpy.float32)
+        a = a[..., None]
+        a = vigra.taggedView(a, "tyxc")
+
+        graph = Graph()
+
+        opPrep = OpArrayPiper(graph=graph)
+        opPrep.Input.setValue(a)
+
+        ops = []
+        for opClass in [OpNansheEstimateF0, OpNansheEstimateF0Streaming]:
+            op = opClass(graph=graph)
+            op.Input.connect(opPrep.Output)
+
+            op.HalfWindowSize.setValue(20)
+            op.WhichQuantile.setValue(0.3)
+            op.TemporalSmoothingGaussianFilterStdev.setValue(2.0)
+            op.SpatialSmoothingGaussianFilterStdev.setValue(1.0)
+            ops.append(op)
+
+        ops[1].TemporalChunkSize.setValue(7)
+
+        expected = ops[0].Output[...].wait()
+
+        # Consecutive temporal chunks continue the same stream.
+        b = numpy.concatenate([ops[1].Output[t:t+25].wait() for t in xrange(0, 120, 25)])
+        assert(expected.shape == b.shape)
+        assert(numpy.allclose(expected, b, atol=1e-5))
+
+        # Requests that don't continue a stream start a new one.
+        b = ops[1].Output[60:70, 5:20, 3:11].wait()
+        assert(numpy.allclose(expected[60:70, 5:20, 3:11], b, atol=1e-5))
+
+    def testStreamMemory(self):
+        numpy.random.seed(0)
+        a = numpy.random.random((120, 31, 32)).astype(numpy.float32)
+        a = a[..., None]
+        a = vigra.taggedView(a, "tyxc")
+
+        op = OpNansheEstimateF0Streaming(graph=Graph())
+        op.Input.setValue(a)
+        op.HalfWindowSize.setValue(20)
+        op.TemporalChunkSize.setValue(7)
+
+        expected = OpNansheEstimateF0Streaming(graph=Graph())
+        expected.Input.setValue(a)
+        expected.HalfWindowSize.setValue(20)
+        expected = expected.Output[...].wait()
+
+        # A stream that reached the last frame is not kept.
+        assert(op.streamBytes() == 0)
+        op.Output[0:60].wait()
+        kept = op.streamBytes()
+        assert(kept > 0)
+        op.Output[60:120].wait()
+        assert(op.streamBytes() == 0)
+
+        # The kept states never exceed MaxStreamBytes, and dropping them doesn't change the result.
+        op.MaxStreamBytes = kept + 1
+        first = op.Output[0:60, :15].wait()
+        assert(0 < op.streamBytes() <= op.MaxStreamBytes)
+        second = op.Output[0:60, 15:].wait()
+        assert(0 < op.streamBytes() <= op.MaxStreamBytes)
+        rest = op.Output[60:120, :15].wait()
+        assert(numpy.allclose(expected[0:60, :15], first, atol=1e-5))
+        assert(numpy.allclose(expected[0:60, 15:], second, atol=1e-5))
+        assert(numpy.allclose(expected[60:120, :15], rest, atol=1e-5))
+
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,142 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+"""
+Compare the input read amplification of the halo-based and the streaming F0 estimation,
+when the F0 of a synthetic calcium movie is requested in consecutive temporal chunks.
+
+Run directly to print the results:
+
+    python testOpNansheEstimateF0Benchmarking.py
+"""
+import sys
+import threading
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.utility.timer import Timer
+
+from ilastik.applets.nanshe.preprocessing.opNansheEstimateF0 import OpNansheEstimateF0
+from ilastik.applets.nanshe.preprocessing.opNansheEstimateF0Streaming import OpNansheEstimateF0Streaming
+
+import nose
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler( logging.StreamHandler(sys.stdout) )
+logger.setLevel(logging.INFO)
+
+
+class OpCountReads(OpArrayPiper):
+    """
+    Passes the input through and counts the number of pixels requested from it.
+    """
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.pixelsRead = 0
+        self._lock = threading.Lock()
+
+    def execute(self, slot, subindex, roi, result):
+        with self._lock:
+            self.pixelsRead += numpy.prod( numpy.subtract(roi.stop, roi.start) )
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+
+def syntheticCalciumMovie(shape=(2000, 64, 64), numCells=20, seed=0):
+    """
+    A noisy, slowly drifting baseline with cells that fire exponentially decaying transients.
+    """
+    rng = numpy.random.RandomState(seed)
+    numFrames = shape[0]
+    movie = 100 + 10*numpy.sin( numpy.linspace(0, 4*numpy.pi, numFrames) )[:, None, None] * numpy.ones(shape)
+
+    yy, xx = numpy.mgrid[:shape[1], :shape[2]]
+    decay = numpy.exp( -numpy.arange(50) / 10.0 )
+    for _ in xrange(numCells):
+        cy, cx = rng.randint(0, shape[1]), rng.randint(0, shape[2])
+        footprint = numpy.exp( -((yy - cy)**2 + (xx - cx)**2) / (2*3.0**2) )
+        spikes = (rng.random_sample(numFrames) < 0.01).astype(float)
+        trace = numpy.convolve( spikes, decay )[:numFrames]
+        movie += 50 * trace[:, None, None] * footprint[None]
+
+    movie += rng.normal(0, 5, shape)
+    movie = movie.astype(numpy.float32)[..., None]
+    return vigra.taggedView(movie, "tyxc")
+
+
+def runChunked(opClass, movie, chunkSize, parameters):
+    """
+    Request the F0 of the whole movie in consecutive temporal chunks.
+    Returns (f0, pixelsRead / movie.size, seconds).
+    """
+    graph = Graph()
+    opCount = OpCountReads(graph=graph)
+    opCount.Input.setValue(movie)
+
+    op = opClass(graph=graph)
+    op.Input.connect(opCount.Output)
+    for name, value in parameters.items():
+        getattr(op, name).setValue(value)
+
+    with Timer() as timer:
+        f0 = numpy.concatenate( [ op.Output[t:t+chunkSize].wait()
+                                  for t in xrange(0, movie.shape[0], chunkSize) ] )
+
+    return f0, float(opCount.pixelsRead) / movie.size, timer.seconds()
+
+
+def benchmark(shape=(2000, 64, 64), chunkSize=50, halfWindowSize=200):
+    parameters = { 'HalfWindowSize' : halfWindowSize,
+                   'WhichQuantile' : 0.15,
+                   'TemporalSmoothingGaussianFilterStdev' : 5.0,
+                   'SpatialSmoothingGaussianFilterStdev' : 5.0 }
+    movie = syntheticCalciumMovie(shape)
+
+    results = {}
+    for opClass in [OpNansheEstimateF0, OpNansheEstimateF0Streaming]:
+        f0, amplification, seconds = runChunked(opClass, movie, chunkSize, parameters)
+        results[opClass.name] = (f0, amplification, seconds)
+        logger.info( "{:>28}: read amplification {:6.2f}x, {:7.2f}s"
+                     .format( opClass.name, amplification, seconds ) )
+
+    deviation = numpy.abs( results[OpNansheEstimateF0.name][0] - results[OpNansheEstimateF0Streaming.name][0] ).max()
+    logger.info( "Max deviation: {:.3g}".format( deviation ) )
+    return results
+
+
+class TestOpNansheEstimateF0Benchmarking(object):
+
+    @classmethod
+    def setupClass(cls):
+        # This test is useful for performance evaluation,
+        #  but it takes too long to be useful as part of the normal test suite.
+        raise nose.SkipTest
+
+    def testReadAmplification(self):
+        results = benchmark()
+        f0, amplification, seconds = results[OpNansheEstimateF0Streaming.name]
+        assert amplification < 1.5, "Streaming F0 read amplification is {}".format( amplification )
+
+
+if __name__ == "__main__":
+    benchmark()
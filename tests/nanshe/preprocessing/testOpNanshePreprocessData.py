@@ -42,6 +42,7 @@ import ilastik.applets.nanshe.preprocessing
 import ilastik.applets.nanshe.preprocessing.opNanshePreprocessData
 from ilastik.applets.nanshe.preprocessing.opNanshePreprocessData import OpNanshePreprocessData,\
                                                                         OpNanshePreprocessDataCached
+from ilastik.applets.nanshe.preprocessing.opNanshePreprocessDataFused import OpNanshePreprocessDataFused
 
 class TestOpNanshePreprocessData(object):
     def testBasic1(self):
@@ -130,6 +131,124 @@ class TestOpNanshePreprocessData(object):
         b = op.Output[...].wait()
         b = vigra.taggedView(b, "tyxc")
 
+    def testFused(self):
+        space = numpy.array([100, 100, 100])
+        radii = numpy.array([5, 6])
+        magnitudes = numpy.array([15, 16])
+        points = numpy.array([[20, 30, 24],
+                              [70, 59, 65]])
+
+        masks = nanshe.syn.data.generate_hypersphere_masks(space, points, radii)
+        images = nanshe.syn.data.generate_gaussian_images(space, points, radii/3.0, magnitudes)
+        images *= masks
+        image_stack = images.max(axis = 0)
+        image_stack = image_stack[..., None]
+        image_stack = vigra.taggedView(image_stack, "tyxc")
+
+        graph = Graph()
+
+        opPrep = OpArrayPiper(graph=graph)
+        opPrep.Input.setValue(image_stack)
+
+        ops = []
+        for opClass in [OpNanshePreprocessData, OpNanshePreprocessDataFused]:
+            op = opClass(graph=graph)
+            op.Input.connect(opPrep.Output)
+
+            op.ToRemoveZeroedLines.setValue(True)
+            op.ErosionShape.setValue([21, 1])
+            op.DilationShape.setValue([1, 3])
+
+            op.ToExtractF0.setValue(True)
+            op.HalfWindowSize.setValue(20)
+            op.WhichQuantile.setValue(0.5)
+            op.TemporalSmoothingGaussianFilterStdev.setValue(5.0)
+            op.SpatialSmoothingGaussianFilterStdev.setValue(5.0)
+            op.Bias.setValue(100)
+            op.BiasEnabled.setValue(True)
+
+            op.ToWaveletTransform.setValue(True)
+            op.Scale.setValue([3, 4, 4])
+
+            ops.append(op)
+
+        expected = ops[0].Output[...].wait()
+        b = ops[1].Output[...].wait()
+
+        assert(expected.shape == b.shape)
+        assert(numpy.allclose(expected, b, atol=1e-6))
+
+        # Sub-blocks exercise the halos of the fused steps: inside the volume,
+        # straddling the spheres, and touching the borders of every axis.
+        for key in [numpy.s_[10:30, 15:45, 20:35],
+                    numpy.s_[40:90, 50:80, 55:100],
+                    numpy.s_[0:17, 0:23, 81:100],
+                    numpy.s_[83:100, 90:100, 0:9]]:
+            expected = ops[0].Output[key].wait()
+            b = ops[1].Output[key].wait()
+
+            assert(expected.shape == b.shape)
+            assert(numpy.allclose(expected, b, atol=1e-6))
+
+    def testFusedZeroedLines(self):
+        space = numpy.array([100, 100, 100])
+        radii = numpy.array([5, 6])
+        magnitudes = numpy.array([15, 16])
+        points = numpy.array([[20, 30, 24],
+                              [70, 59, 65]])
+
+        masks = nanshe.syn.data.generate_hypersphere_masks(space, points, radii)
+        images = nanshe.syn.data.generate_gaussian_images(space, points, radii/3.0, magnitudes)
+        images *= masks
+        image_stack = images.max(axis = 0) + 1
+
+        # Zeroed lines, which the blocks below cut.
+        image_stack[:, :, 50] = 0
+        image_stack[:, 20:60, 10] = 0
+
+        image_stack = image_stack[..., None]
+        image_stack = vigra.taggedView(image_stack, "tyxc")
+
+        graph = Graph()
+
+        opPrep = OpArrayPiper(graph=graph)
+        opPrep.Input.setValue(image_stack)
+
+        for toWaveletTransform in [False, True]:
+            ops = []
+            for opClass in [OpNanshePreprocessData, OpNanshePreprocessDataFused]:
+                op = opClass(graph=graph)
+                op.Input.connect(opPrep.Output)
+
+                op.ToRemoveZeroedLines.setValue(True)
+                op.ErosionShape.setValue([21, 1])
+                op.DilationShape.setValue([1, 3])
+
+                # The bias is computed from the block (1 - min).
+                op.ToExtractF0.setValue(True)
+                op.HalfWindowSize.setValue(20)
+                op.WhichQuantile.setValue(0.5)
+                op.TemporalSmoothingGaussianFilterStdev.setValue(5.0)
+                op.SpatialSmoothingGaussianFilterStdev.setValue(5.0)
+                op.BiasEnabled.setValue(False)
+
+                op.ToWaveletTransform.setValue(toWaveletTransform)
+                op.Scale.setValue([3, 4, 4])
+
+                ops.append(op)
+
+            # The dF/F blocks contain too little of the cut lines for them to be
+            # removed, unlike the haloed blocks F0 is estimated from.
+            for key in [numpy.s_[...],
+                        numpy.s_[10:30, 50:65, 0:30],
+                        numpy.s_[40:60, 35:70, 40:60],
+                        numpy.s_[0:20, 0:30, 0:20]]:
+                expected = ops[0].Output[key].wait()
+                b = ops[1].Output[key].wait()
+
+                assert(expected.shape == b.shape)
+                assert(numpy.allclose(expected, b, atol=1e-6))
+
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,184 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+"""
+Compare the memory traffic of the staged and the fused nanshe preprocessing,
+when the output is requested blockwise.
+
+The staged chain is rebuilt here with a counting operator between each pair of
+stages, so every pixel handed from one stage to the next is counted.
+
+Run directly to print the results:
+
+    python testOpNanshePreprocessDataBenchmarking.py
+"""
+import sys
+import itertools
+import threading
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.utility.timer import Timer
+
+from ilastik.applets.nanshe.opConvertType import OpConvertType
+from ilastik.applets.nanshe.preprocessing.opNansheRemoveZeroedLines import OpNansheRemoveZeroedLines
+from ilastik.applets.nanshe.preprocessing.opNansheExtractF0 import OpNansheExtractF0
+from ilastik.applets.nanshe.preprocessing.opNansheWaveletTransform import OpNansheWaveletTransform
+from ilastik.applets.nanshe.preprocessing.opNanshePreprocessDataFused import OpNanshePreprocessDataFused
+
+import nose
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler( logging.StreamHandler(sys.stdout) )
+logger.setLevel(logging.INFO)
+
+
+PARAMETERS = { 'ErosionShape' : [21, 1],
+               'DilationShape' : [1, 3],
+               'HalfWindowSize' : 50,
+               'WhichQuantile' : 0.15,
+               'TemporalSmoothingGaussianFilterStdev' : 5.0,
+               'SpatialSmoothingGaussianFilterStdev' : 5.0,
+               'BiasEnabled' : True,
+               'Bias' : 100.0,
+               'Scale' : [3, 4, 4] }
+
+
+class OpCountReads(OpArrayPiper):
+    """
+    Passes the input through and counts the number of bytes requested from it.
+    """
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.bytesRead = 0
+        self._lock = threading.Lock()
+
+    def execute(self, slot, subindex, roi, result):
+        with self._lock:
+            self.bytesRead += result.nbytes
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+
+def _setParameters(op):
+    for name, value in PARAMETERS.items():
+        if name in op.inputs:
+            op.inputs[name].setValue(value)
+
+
+def buildStaged(graph, source):
+    """
+    ConvertType -> RemoveZeroedLines -> ExtractF0 -> WaveletTransform,
+    with a counter in front of every stage.
+    Returns (output slot, [(stage name, counter)]).
+    """
+    counters = []
+    next_output = source
+    for name, opClass in [ ('ConvertType', OpConvertType),
+                           ('RemoveZeroedLines', OpNansheRemoveZeroedLines),
+                           ('ExtractF0', OpNansheExtractF0),
+                           ('WaveletTransform', OpNansheWaveletTransform) ]:
+        opCount = OpCountReads(graph=graph)
+        opCount.Input.connect(next_output)
+        counters.append( (name, opCount) )
+
+        op = opClass(graph=graph)
+        if opClass is OpConvertType:
+            op.Dtype.setValue(numpy.float32)
+        _setParameters(op)
+        op.Input.connect(opCount.Output)
+
+        next_output = op.dF_F if opClass is OpNansheExtractF0 else op.Output
+    return next_output, counters
+
+
+def buildFused(graph, source):
+    opCount = OpCountReads(graph=graph)
+    opCount.Input.connect(source)
+
+    op = OpNanshePreprocessDataFused(graph=graph)
+    _setParameters(op)
+    op.Input.connect(opCount.Output)
+    return op.Output, [ ('Fused', opCount) ]
+
+
+def syntheticMovie(shape=(300, 128, 128), seed=0):
+    rng = numpy.random.RandomState(seed)
+    movie = rng.normal(100, 5, shape)
+    # Some zeroed lines, as left behind by registration
+    for t in rng.randint(0, shape[0], 20):
+        movie[t, :, rng.randint(0, shape[2])] = 0
+    movie = movie.astype(numpy.uint16)[..., None]
+    return vigra.taggedView(movie, "tyxc")
+
+
+def requestBlockwise(output, blockShape):
+    shape = output.meta.shape
+    result = numpy.empty(shape, dtype=numpy.float32)
+    starts = [ range(0, s, b) for s, b in zip(shape, blockShape) ]
+    for start in itertools.product(*starts):
+        key = tuple( slice(a, min(a + b, s)) for a, b, s in zip(start, blockShape, shape) )
+        result[key] = output[key].wait()
+    return result
+
+
+def benchmark(shape=(300, 128, 128), blockShape=(100, 64, 64, 1)):
+    movie = syntheticMovie(shape)
+    outputBytes = numpy.prod(shape) * 4
+
+    results = {}
+    for name, build in [ ('staged', buildStaged), ('fused', buildFused) ]:
+        graph = Graph()
+        opSource = OpArrayPiper(graph=graph)
+        opSource.Input.setValue(movie)
+        output, counters = build(graph, opSource.Output)
+
+        with Timer() as timer:
+            processed = requestBlockwise(output, blockShape)
+
+        totalBytes = sum( opCount.bytesRead for _, opCount in counters )
+        results[name] = (processed, totalBytes, timer.seconds())
+
+        logger.info( "{}: {:.2f}s, {:.1f} MB moved between stages ({:.1f}x the output size)"
+                     .format( name, timer.seconds(), totalBytes / 1e6, float(totalBytes) / outputBytes ) )
+        for stageName, opCount in counters:
+            logger.info( "    into {:>18}: {:8.1f} MB".format( stageName, opCount.bytesRead / 1e6 ) )
+
+    return results
+
+
+class TestOpNanshePreprocessDataBenchmarking(object):
+
+    @classmethod
+    def setupClass(cls):
+        # This test is useful for performance evaluation,
+        #  but it takes too long to be useful as part of the normal test suite.
+        raise nose.SkipTest
+
+    def testMemoryTraffic(self):
+        results = benchmark()
+        assert results['fused'][1] < results['staged'][1]
+
+
+if __name__ == "__main__":
+    benchmark()
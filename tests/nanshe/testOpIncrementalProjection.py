@@ -0,0 +1,122 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+
+from ilastik.applets.nanshe.opIncrementalProjection import OpIncrementalMaxProjection, OpIncrementalMeanProjection
+
+
+class OpCountReads(OpArrayPiper):
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.pixelsRead = 0
+
+    def execute(self, slot, subindex, roi, result):
+        self.pixelsRead += numpy.prod(numpy.subtract(roi.stop, roi.start))
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+
+class TestOpIncrementalProjection(object):
+    def setUp(self):
+        numpy.random.seed(0)
+        a = numpy.random.random((50, 300, 20)).astype(numpy.float32)
+        a = a[..., None]
+        self.data = vigra.taggedView(a, "tyxc")
+
+    def _makeOp(self, opClass):
+        graph = Graph()
+        opPrep = OpCountReads(graph=graph)
+        opPrep.Input.setValue(self.data)
+
+        op = opClass(graph=graph)
+        op.Input.connect(opPrep.Output)
+        op.Axis.setValue(0)
+        op.ChunkSize.setValue(8)
+        return op, opPrep
+
+    def testMax(self):
+        op, opPrep = self._makeOp(OpIncrementalMaxProjection)
+
+        b = op.Output[...].wait()
+        assert((b == self.data.view(numpy.ndarray).max(axis=0)).all())
+
+        b = op.Output[10:270, 5:15].wait()
+        assert((b == self.data.view(numpy.ndarray).max(axis=0)[10:270, 5:15]).all())
+
+    def testMean(self):
+        op, opPrep = self._makeOp(OpIncrementalMeanProjection)
+
+        b = op.Output[...].wait()
+        assert(numpy.allclose(b, self.data.view(numpy.ndarray).mean(axis=0)))
+
+    def testDirtyChunk(self):
+        op, opPrep = self._makeOp(OpIncrementalMaxProjection)
+
+        op.Output[...].wait()
+        pixelsRead = opPrep.pixelsRead
+        assert(pixelsRead == self.data.size)
+
+        # Cached
+        op.Output[...].wait()
+        assert(opPrep.pixelsRead == pixelsRead)
+
+        # Only the dirty chunk of the dirty tile is read again.
+        self.data[12, 280, 3] = 10
+        opPrep.Input.setDirty((12, 280, 3, 0), (13, 281, 4, 1))
+
+        b = op.Output[...].wait()
+        assert(b[280, 3] == 10)
+        assert((b == self.data.view(numpy.ndarray).max(axis=0)).all())
+        assert(opPrep.pixelsRead - pixelsRead == 8 * (300 - 256) * 20)
+
+    def testGroupedChunks(self):
+        op, opPrep = self._makeOp(OpIncrementalMeanProjection)
+        op.PARTIALS_PER_TILE = 2
+
+        b = op.Output[...].wait()
+        assert(numpy.allclose(b, self.data.view(numpy.ndarray).mean(axis=0)))
+        pixelsRead = opPrep.pixelsRead
+        assert(pixelsRead == self.data.size)
+
+        # 7 chunks of 8 frames, folded into 2 partials per tile.
+        for state in op._tiles.values():
+            assert(len(state.partials) == 2)
+
+        # The whole group of the dirty chunk (chunks 0-3) is read again, for the dirty tile only.
+        self.data[12, 280, 3] = 10
+        opPrep.Input.setDirty((12, 280, 3, 0), (13, 281, 4, 1))
+
+        b = op.Output[...].wait()
+        assert(numpy.allclose(b, self.data.view(numpy.ndarray).mean(axis=0)))
+        assert(opPrep.pixelsRead - pixelsRead == 32 * (300 - 256) * 20)
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    ret = nose.run(defaultTest=__file__)
+    if not ret: sys.exit(1)
@@ -0,0 +1,111 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpPredictRandomForest
+
+from ilastik.applets.autocontextClassification.opAutocontextBatch import OpAutocontextBatch
+from ilastik.applets.autocontextClassification.opAutocontextClassification import AUTOCONTEXT_RADII
+
+class TestOpAutocontextBlockwise(object):
+
+    @classmethod
+    def setupClass(cls):
+        try:
+            from context.operators.contextVariance import OpContextVariance
+        except ImportError:
+            import nose
+            raise nose.SkipTest("The context package is not available.")
+
+        numpy.random.seed(0)
+        cls.nlabels = 2
+        features = numpy.random.random( (60, 50, 12, 3) ).astype(numpy.float32)
+        features[:30] += 0.5
+        cls.features = vigra.taggedView( features, 'xyzc' )
+
+        # Iteration 0 is trained on the pixel features
+        forest0 = cls._trainForest( features.reshape(-1, 3) )
+
+        # Iteration 1 is trained on the stacked context and pixel features,
+        #  so find out how many context channels there are.
+        opPredict = OpPredictRandomForest( graph=Graph() )
+        opPredict.Classifier.setValue( [forest0] )
+        opPredict.LabelsCount.setValue( cls.nlabels )
+        opPredict.Image.setValue( cls.features )
+        opContext = OpContextVariance( graph=Graph() )
+        opContext.Radii.setValue( AUTOCONTEXT_RADII )
+        opContext.Input.connect( opPredict.PMaps )
+        context = opContext.Output[:].wait()
+        stacked = numpy.concatenate( (context, features), axis=3 )
+        forest1 = cls._trainForest( stacked.reshape(-1, stacked.shape[-1]) )
+
+        cls.forests = [ [forest0], [forest1] ]
+
+    @classmethod
+    def _trainForest(cls, samples):
+        index = numpy.random.randint( 0, len(samples), 500 )
+        samples = numpy.ascontiguousarray( samples[index], dtype=numpy.float32 )
+        labels = ( samples[:, -1] > 0.75 ).astype(numpy.uint32).reshape(-1, 1)
+        forest = vigra.learning.RandomForest( 4 )
+        forest.learnRF( samples, labels )
+        return forest
+
+    def _makeOp(self, blockwise):
+        op = OpAutocontextBatch( graph=Graph() )
+        op.Blockwise.setValue( blockwise )
+        op.BlockShape.setValue( (16, 16, 5, 3) )
+        op.Classifiers.resize( 2 )
+        for i, forest in enumerate( self.forests ):
+            op.Classifiers[i].setValue( forest )
+        op.MaxLabelValue.setValue( self.nlabels )
+        op.AutocontextIterations.setValue( 2 )
+        op.FeatureImage.setValue( self.features )
+        return op
+
+    def testBlockwiseEqualsCached(self):
+        opCached = self._makeOp( False )
+        opBlockwise = self._makeOp( True )
+
+        expected = opCached.PredictionProbabilities[:].wait()
+        assert expected.shape == (60, 50, 12, self.nlabels)
+
+        predictions = opBlockwise.PredictionProbabilities[:].wait()
+        assert numpy.allclose( predictions, expected, atol=1e-5 )
+
+    def testBlockBorders(self):
+        opCached = self._makeOp( False )
+        opBlockwise = self._makeOp( True )
+
+        # Straddles block borders along every spatial axis.
+        roi = ( slice(10, 40), slice(14, 35), slice(3, 11), slice(1, 2) )
+        expected = opCached.PredictionProbabilities[roi].wait()
+        predictions = opBlockwise.PredictionProbabilities[roi].wait()
+        assert numpy.allclose( predictions, expected, atol=1e-5 )
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -32,7 +32,8 @@ from lazyflow.operators.opArrayPiper import OpArrayPiper
 
 from ilastik.applets.base.appletSerializer import \
     getOrCreateGroup, deleteIfPresent, \
-    SerialSlot, SerialListSlot, AppletSerializer, SerialDictSlot, SerialBlockSlot
+    SerialSlot, SerialListSlot, AppletSerializer, SerialDictSlot, SerialBlockSlot, \
+    SerialChunkedBlockSlot
 
 class OpMock(Operator):
     """A simple operator for testing serializers."""
@@ -779,5 +780,82 @@ class TestSerialBlockSlot2(unittest.TestCase):
         shutil.rmtree(tmp_dir)
 
 
+class TestSerialChunkedBlockSlot(unittest.TestCase):
+
+    def _init_objects(self, serialSlotClass=SerialChunkedBlockSlot):
+        raw_data = numpy.zeros((100,100,100,1), dtype=numpy.uint32)
+        raw_data = vigra.taggedView(raw_data, 'zyxc')
+
+        opLabelArrays = OperatorWrapper( OpCompressedUserLabelArray, graph=Graph() )
+        opLabelArrays.Input.resize(1)
+        opLabelArrays.Input[0].setValue( raw_data )
+        opLabelArrays.shape.setValue( raw_data.shape )
+        opLabelArrays.eraser.setValue( 255 )
+        opLabelArrays.deleteLabel.setValue( -1 )
+        opLabelArrays.blockShape.setValue( (10,10,10,1) )
+
+        # This will serialize/deserialize data to the h5 file.
+        slotSerializer = serialSlotClass( opLabelArrays.Output, opLabelArrays.Input, opLabelArrays.nonzeroBlocks,
+                                          shrink_to_bb=True )
+        return opLabelArrays, slotSerializer
+
+    def _roundtrip(self, writerClass):
+        tmp_dir = tempfile.mkdtemp()
+        h5_filepath = os.path.join(tmp_dir , 'serial_chunked_blockslot_test.h5' )
+
+        # Create an operator and a serializer to write the data.
+        opLabelArrays, slotSerializer = self._init_objects(writerClass)
+
+        # Give it some data.
+        opLabelArrays.Input[0][10:11, 10:20, 10:20, 0:1] = 1*numpy.ones((1,10,10,1), dtype=numpy.uint8)
+        opLabelArrays.Input[0][30:31, 32:38, 30:40, 0:1] = 2*numpy.ones((1,6,10,1), dtype=numpy.uint8)
+
+        with h5py.File(h5_filepath, 'w') as f:
+            label_group = f.create_group('label_data')
+            slotSerializer.serialize( label_group )
+
+        # Now start again with fresh objects.
+        # This time we'll read the data with the chunked serializer.
+        opLabelArrays, slotSerializer = self._init_objects()
+
+        with h5py.File(h5_filepath, 'r') as f:
+            label_group = f['label_data']
+            slotSerializer.deserialize( label_group )
+
+        # Verify that we get the same data back.
+        assert ( opLabelArrays.Output[0][10:11, 10:20, 10:20, 0:1].wait() == 1 ).all()
+        assert ( opLabelArrays.Output[0][30:31, 32:38, 30:40, 0:1].wait() == 2 ).all()
+        assert opLabelArrays.Output[0][:].wait().sum() == 100 + 2*60
+
+        return tmp_dir, h5_filepath
+
+    def testBasic(self):
+        tmp_dir, h5_filepath = self._roundtrip(SerialChunkedBlockSlot)
+
+        # All blocks of the lane live in a single dataset.
+        with h5py.File(h5_filepath, 'r') as f:
+            lane_group = f['label_data/Output/0000']
+            assert set(lane_group.keys()) == set(['blockData', 'blockIndex'])
+            assert len(lane_group['blockIndex']) == 2
+
+            # Each block can be read on its own, shrunk to its bounding box.
+            blocks = [SerialChunkedBlockSlot.readBlock(lane_group, i) for i in range(2)]
+            assert sorted( block.shape for _, block in blocks ) == [(1,6,10,1), (1,10,10,1)]
+
+        os.remove(h5_filepath)
+        shutil.rmtree(tmp_dir)
+
+    def testReadOldFormat(self):
+        tmp_dir, h5_filepath = self._roundtrip(SerialBlockSlot)
+
+        with h5py.File(h5_filepath, 'r') as f:
+            lane_group = f['label_data/Output/0000']
+            blocks = list(SerialChunkedBlockSlot.iterBlocks(lane_group))
+            assert sum( block.sum() for block in blocks ) == 100 + 2*60
+
+        os.remove(h5_filepath)
+        shutil.rmtree(tmp_dir)
+
+
 if __name__ == "__main__":
     unittest.main()
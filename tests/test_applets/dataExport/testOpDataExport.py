@@ -24,12 +24,14 @@ import shutil
 
 import numpy
 import vigra
+import h5py
 
 from lazyflow.graph import Graph
 from lazyflow.roi import roiToSlice
 from lazyflow.operators.ioOperators import OpInputDataReader
 
 from ilastik.applets.dataExport.opDataExport import OpDataExport
+from ilastik.applets.dataExport.opExportPyramid import downsample2x
 
 class TestOpDataExport(object):
     
@@ -96,6 +98,46 @@ class TestOpDataExport(object):
         finally:
             opRead.cleanUp()
 
+    def testPyramid(self):
+        graph = Graph()
+        opExport = OpDataExport(graph=graph)
+        try:
+            opExport.TransactionSlot.setValue(True)
+            opExport.WorkingDirectory.setValue( self._tmpdir )
+
+            class MockDatasetInfo(object): pass
+            rawInfo = MockDatasetInfo()
+            rawInfo.nickname = 'pyramid_nickname'
+            rawInfo.filePath = './somefile.h5'
+            opExport.RawDatasetInfo.setValue( rawInfo )
+            opExport.SelectionNames.setValue(['Mock Labels'])
+
+            data = numpy.random.randint( 0, 4, (301,203,1) ).astype( numpy.uint8 )
+            data = vigra.taggedView( data, vigra.defaultAxistags('xyc') )
+            opExport.Inputs.resize(1)
+            opExport.Inputs[0].setValue(data)
+
+            opExport.OutputFormat.setValue( 'hdf5' )
+            opExport.OutputFilenameFormat.setValue( '{dataset_dir}/{nickname}_pyramid' )
+            opExport.OutputInternalPath.setValue('volume/data')
+            opExport.ExportPyramidLevels.setValue( 2 )
+            opExport.PyramidReduction.setValue( 'mode' )
+
+            opExport.run_export()
+        finally:
+            opExport.cleanUp()
+
+        expected_level = data.view(numpy.ndarray)
+        with h5py.File( self._tmpdir + '/pyramid_nickname_pyramid.h5', 'r' ) as f:
+            assert (f['volume/data'][:] == expected_level).all()
+            for level, expected_shape in [ (1, (151,102,1)), (2, (76,51,1)) ]:
+                # Reducing the whole image at once must give the same result as the blockwise export
+                expected_level = downsample2x( expected_level, [0,1], 'mode' )
+                dataset = f['volume/data_level{}'.format(level)]
+                assert dataset.shape == expected_shape
+                assert dataset.attrs['downsample_factor'] == 2**level
+                assert (dataset[:] == expected_level).all(), "Pyramid level {} is wrong".format( level )
+
 if __name__ == "__main__":
     import sys
     import nose
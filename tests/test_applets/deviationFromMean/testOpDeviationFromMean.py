@@ -0,0 +1,136 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+
+from ilastik.applets.deviationFromMean.opDeviationFromMean import OpDeviationFromMean
+
+
+class OpCountReads(OpArrayPiper):
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.pixelsRead = 0
+
+    def execute(self, slot, subindex, roi, result):
+        self.pixelsRead += numpy.prod(numpy.subtract(roi.stop, roi.start))
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+
+class TestOpDeviationFromMean(object):
+
+    def setUp(self):
+        numpy.random.seed(0)
+        self.graph = Graph()
+        self.data = []
+        self.readers = []
+        for i in range(3):
+            self._appendImage()
+
+        self.op = OpDeviationFromMean( graph=self.graph )
+        self.op.ScalingFactor.setValue( 5 )
+        self.op.Offset.setValue( 10 )
+        self.op.BlockShape.setValue( (16, 16) )
+        self.op.Input.resize( 3 )
+        for i, reader in enumerate( self.readers ):
+            self.op.Input[i].connect( reader.Output )
+
+    def _appendImage(self):
+        data = vigra.taggedView( numpy.random.random( (40, 50) ).astype(numpy.float32), 'yx' )
+        reader = OpCountReads( graph=self.graph )
+        reader.Input.setValue( data )
+        self.data.append( data )
+        self.readers.append( reader )
+        return reader
+
+    def _expectedMean(self):
+        return numpy.mean( [ d.view(numpy.ndarray) for d in self.data ], axis=0 )
+
+    def _pixelsRead(self):
+        return [ reader.pixelsRead for reader in self.readers ]
+
+    def testBlockStraddlingRoi(self):
+        roi = numpy.s_[5:37, 10:45]
+        mean = self._expectedMean()
+        assert numpy.allclose( self.op.Mean[roi].wait(), mean[roi] )
+        for i in range(3):
+            expected = 10 + 5 * ( self.data[i].view(numpy.ndarray) - mean )
+            assert numpy.allclose( self.op.Output[i][roi].wait(), expected[roi] )
+
+    def testMeanIsCached(self):
+        self.op.Mean[:].wait()
+        pixelsRead = self._pixelsRead()
+        assert pixelsRead == [ 40*50 ] * 3
+
+        self.op.Mean[5:37, 10:45].wait()
+        assert self._pixelsRead() == pixelsRead
+
+    def testDirtySubRoi(self):
+        self.op.Mean[:].wait()
+        pixelsRead = self._pixelsRead()
+
+        dirtyRois = []
+        self.op.Mean.notifyDirty( lambda slot, roi: dirtyRois.append( (tuple(roi.start), tuple(roi.stop)) ) )
+
+        self.data[0][20:22, 20:22] = 7
+        self.readers[0].Input.setDirty( (20, 20), (22, 22) )
+        assert dirtyRois == [ ( (20, 20), (22, 22) ) ]
+
+        # Only the block (16:32, 16:32) is fetched again, from every lane.
+        assert numpy.allclose( self.op.Mean[:].wait(), self._expectedMean() )
+        assert numpy.subtract( self._pixelsRead(), pixelsRead ).tolist() == [ 16*16 ] * 3
+
+    def testWholeImageDirty(self):
+        self.op.Mean[:].wait()
+        assert len( self.op._meanBlocks ) > 0
+
+        # Notifications arrive as SubRegions covering the whole image
+        self.readers[1].Input.setDirty( slice(None) )
+        assert len( self.op._meanBlocks ) == 0
+        assert numpy.allclose( self.op.Mean[:].wait(), self._expectedMean() )
+
+    def testAddRemoveLane(self):
+        self.op.Mean[:].wait()
+
+        reader = self._appendImage()
+        self.op.addLane( 3 )
+        self.op.Input[3].connect( reader.Output )
+        assert len( self.op.Output ) == 4
+        assert numpy.allclose( self.op.Mean[:].wait(), self._expectedMean() )
+        expected = 10 + 5 * ( self.data[3].view(numpy.ndarray) - self._expectedMean() )
+        assert numpy.allclose( self.op.Output[3][:].wait(), expected )
+
+        self.op.removeLane( 0, 3 )
+        del self.data[0]
+        assert len( self.op.Output ) == 3
+        assert numpy.allclose( self.op.Mean[:].wait(), self._expectedMean() )
+        expected = 10 + 5 * ( self.data[0].view(numpy.ndarray) - self._expectedMean() )
+        assert numpy.allclose( self.op.Output[0][:].wait(), expected )
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,100 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+"""
+Compare the runtime and output of the feature computation implementations.
+
+Run directly to print the results:
+
+    python testFeatureSelectionBenchmarking.py
+"""
+import sys
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.utility.timer import Timer
+from ilastik.applets.featureSelection.opFeatureSelection import OpFeatureSelectionNoCache
+from ilastik.applets.featureSelection.opPixelFeaturesSharedScaleSpace import OpPixelFeaturesSharedScaleSpace
+
+import nose
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler( logging.StreamHandler(sys.stdout) )
+logger.setLevel(logging.INFO)
+
+SCALES = [0.3, 0.7, 1, 1.6, 3.5, 5.0]
+
+def computeFeatures(implementation, data, scales=SCALES):
+    """
+    Compute all features at all scales with the given implementation.
+    Returns (features, seconds).
+    """
+    featureIds = OpPixelFeaturesSharedScaleSpace.DefaultFeatureIds
+    op = OpFeatureSelectionNoCache( implementation, graph=Graph() )
+    op.InputImage.setValue( data )
+    op.Scales.setValue( scales )
+    op.FeatureIds.setValue( featureIds )
+    op.SelectionMatrix.setValue( numpy.ones( (len(featureIds), len(scales)), dtype=bool ) )
+
+    with Timer() as timer:
+        features = op.OutputImage[:].wait()
+    return features, timer.seconds()
+
+def benchmark(shape=(256,256,64,1), implementations=('Original', 'Refactored', 'SharedScaleSpace')):
+    """
+    Compute the full feature matrix with each implementation on a random volume.
+    Returns {implementation : (seconds, maxAbsDeviation, maxRelDeviation)},
+    where the deviation is measured against the 'Original' implementation.
+    """
+    data = numpy.random.random( shape ).astype(numpy.float32) * 255
+    data = vigra.taggedView( data, 'xyzc'[-len(shape):] )
+
+    reference, referenceTime = computeFeatures( 'Original', data )
+    dataRange = reference.max() - reference.min()
+
+    results = {}
+    for implementation in implementations:
+        if implementation == 'Original':
+            features, seconds = reference, referenceTime
+        else:
+            features, seconds = computeFeatures( implementation, data )
+        absDeviation = numpy.abs( features - reference ).max()
+        results[implementation] = ( seconds, absDeviation, absDeviation / dataRange )
+        logger.info( "{:>18}: {:7.2f}s (speedup {:4.2f}x), max deviation {:.3g} ({:.2%} of range)"
+                     .format( implementation, seconds, referenceTime / seconds, absDeviation, absDeviation / dataRange ) )
+    return results
+
+class TestFeatureSelectionBenchmarking(object):
+
+    @classmethod
+    def setupClass(cls):
+        # This test is useful for performance evaluation,
+        #  but it takes too long to be useful as part of the normal test suite.
+        raise nose.SkipTest
+
+    def testSharedScaleSpace(self):
+        results = benchmark()
+        seconds, absDeviation, relDeviation = results['SharedScaleSpace']
+        assert relDeviation < 0.01, "Shared scale-space features deviate too much: {}".format( relDeviation )
+
+if __name__ == "__main__":
+    benchmark()
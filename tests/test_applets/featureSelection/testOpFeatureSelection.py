@@ -145,6 +145,57 @@ class TestOpFeatureSelection(object):
         assert len(dirtyRois) == 1
         assert (dirtyRois[0].start, dirtyRois[0].stop) == sliceToRoi( slice(None), self.opFeatures.OutputImage[0].meta.shape )
 
+class TestSharedScaleSpace(object):
+    """
+    The SharedScaleSpace implementation must compute the same features as the Original (presmoothed) one.
+    """
+    scales = [0.3, 0.7, 1.0, 1.6, 3.5]
+    featureIds = [ 'GaussianSmoothing',
+                   'LaplacianOfGaussian',
+                   'StructureTensorEigenvalues',
+                   'HessianOfGaussianEigenvalues',
+                   'GaussianGradientMagnitude',
+                   'DifferenceOfGaussians' ]
+
+    def _features(self, implementation, data, key=slice(None)):
+        opFeatures = OpFeatureSelection(implementation, graph=Graph())
+        opFeatures.InputImage.setValue(data)
+        opFeatures.Scales.setValue(self.scales)
+        opFeatures.FeatureIds.setValue(self.featureIds)
+        opFeatures.SelectionMatrix.setValue( numpy.ones( (len(self.featureIds), len(self.scales)), dtype=bool ) )
+        try:
+            return opFeatures.OutputImage[key].wait()
+        finally:
+            opFeatures.cleanUp()
+
+    def _compare(self, data):
+        expected = self._features('Original', data)
+        result = self._features('SharedScaleSpace', data)
+        assert result.shape == expected.shape
+        for c in range(expected.shape[-1]):
+            valueRange = expected[..., c].max() - expected[..., c].min()
+            deviation = numpy.abs( result[..., c] - expected[..., c] ).max()
+            assert deviation <= 0.01 * valueRange + 1e-4, \
+                "Feature channel {} deviates by {} (range {})".format( c, deviation, valueRange )
+        return expected
+
+    def test_3d(self):
+        data = numpy.random.random((1,40,40,30,2)).astype(numpy.float32) * 255
+        self._compare( vigra.taggedView(data, axistags='txyzc') )
+
+    def test_2d(self):
+        data = numpy.random.random((60,50,1)).astype(numpy.float32) * 255
+        self._compare( vigra.taggedView(data, axistags='xyc') )
+
+    def test_subregion(self):
+        # A block in the middle of the image, with a subset of the channels
+        data = numpy.random.random((60,50,1)).astype(numpy.float32) * 255
+        data = vigra.taggedView(data, axistags='xyc')
+        full = self._features('SharedScaleSpace', data)
+        key = numpy.s_[17:41, 5:30, 3:20]
+        block = self._features('SharedScaleSpace', data, key)
+        assert numpy.allclose( block, full[key], atol=1e-4 )
+
 if __name__ == "__main__":
     import sys
     import nose
@@ -0,0 +1,103 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import vigra
+import h5py
+
+from lazyflow.graph import Graph
+from lazyflow.operators.opInterpMissingData import OpDetectMissing
+
+from ilastik.applets.fillMissingSlices import histogramStore
+from ilastik.applets.fillMissingSlices.opFillMissingSlices import OpFillMissingSlicesNoCache
+
+def sortedRows(histograms):
+    # The store is written block by block in parallel, so compare independent of the row order.
+    return histograms[ numpy.lexsort( histograms.transpose()[::-1] ) ]
+
+class TestHistogramStore(object):
+
+    def setUp(self):
+        numpy.random.seed(0)
+        data = numpy.random.randint( 20, 200, (12, 100, 90) ).astype(numpy.uint8)
+        self.missing = [3, 7]
+        data[self.missing] = 0
+        self.data = vigra.taggedView( data, 'zyx' )
+        self.patchSize = 32
+        self.haloSize = 5
+
+        self.h5file = h5py.File( 'histograms.h5', driver='core', backing_store=False )
+
+        self.opFill = OpFillMissingSlicesNoCache( graph=Graph() )
+        self.opFill.PatchSize.setValue( self.patchSize )
+        self.opFill.HaloSize.setValue( self.haloSize )
+        self.opFill.Input.setValue( self.data )
+
+    def tearDown(self):
+        self.h5file.close()
+        self.opFill.cleanUp()
+
+    def _expectedHistograms(self):
+        # The training histograms, computed by a separate OpDetectMissing.
+        opDetect = OpDetectMissing( graph=Graph() )
+        opDetect.PatchSize.setValue( self.patchSize )
+        opDetect.HaloSize.setValue( self.haloSize )
+        opDetect.InputVolume.setValue( self.data )
+        rows = []
+        for z, image in enumerate( self.data.view(numpy.ndarray) ):
+            patches, _ = opDetect._patchify( image, self.patchSize, self.haloSize )
+            for patch in patches:
+                rows.append( numpy.append( opDetect._toHistogram( patch ), 1 if z in self.missing else 0 ) )
+        opDetect.cleanUp()
+        return numpy.array( rows, dtype=numpy.float32 )
+
+    def testStoreMatchesDetector(self):
+        self.opFill.precomputeHistograms( self.h5file, self.missing )
+        assert self.opFill.histogramKey() in self.h5file
+
+        stored = histogramStore.loadHistograms( self.h5file, self.patchSize, self.haloSize,
+                                                self.opFill._opInterp.detector.NHistogramBins.value )
+        expected = self._expectedHistograms()
+        assert stored.shape == expected.shape
+        assert numpy.allclose( sortedRows(stored), sortedRows(expected) )
+
+    def testTrainFromStore(self):
+        self.opFill.precomputeHistograms( self.h5file, self.missing )
+        self.opFill.trainFromHistogramStore( self.h5file )
+
+        histos = self.opFill._opInterp.detector.TrainingHistograms.value
+        assert numpy.allclose( sortedRows(histos), sortedRows(self._expectedHistograms()) )
+
+    def testKeyIncludesBins(self):
+        detector = self.opFill._opInterp.detector
+        nBins = detector.NHistogramBins.value
+        self.opFill.precomputeHistograms( self.h5file, self.missing )
+
+        detector.NHistogramBins.setValue( nBins + 2 )
+        assert self.opFill.histogramKey() not in self.h5file
+        assert histogramStore.loadHistograms( self.h5file, self.patchSize, self.haloSize, nBins + 2 ) is None
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
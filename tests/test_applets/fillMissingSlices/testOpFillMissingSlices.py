@@ -0,0 +1,102 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+
+from ilastik.applets.fillMissingSlices.opFillMissingSlices import OpFillMissingSlices
+
+class TestOpFillMissingSlices(object):
+
+    def setUp(self):
+        numpy.random.seed(0)
+        z, y, x = numpy.mgrid[0:30, 0:64, 0:64]
+        data = ( 50 + 2*z + y + 0.5*x + 10*numpy.random.random( (30, 64, 64) ) ).astype(numpy.float32)
+        self.missing = [10, 11, 20]
+        data[self.missing] = 0
+        self.data = vigra.taggedView( data, 'zyx' )
+
+    def _makeOp(self, data):
+        op = OpFillMissingSlices( graph=Graph() )
+        op.DetectionMethod.setValue( 'classic' )
+        op.PatchSize.setValue( 64 )
+        op.HaloSize.setValue( 0 )
+        op.Input.setValue( data )
+        return op
+
+    def testIndexedEqualsInterpolated(self):
+        op = self._makeOp( self.data )
+        expected = op._opInterp.Output[:].wait()
+        assert (expected[self.missing] != 0).all(), "The missing slices were not detected"
+
+        assert numpy.allclose( op.Output[:].wait(), expected )
+        assert numpy.allclose( op.CachedOutput[:].wait(), expected )
+
+    def testSubRegions(self):
+        op = self._makeOp( self.data )
+        expected = op._opInterp.Output[:].wait()
+
+        # Starts inside a missing run, touches no missing slice, and ends inside one.
+        for roi in [ numpy.s_[11:15, 5:40, 10:60], numpy.s_[13:18, :, :], numpy.s_[2:11, 0:10, :] ]:
+            assert numpy.allclose( op.Output[roi].wait(), expected[roi] )
+
+    def testComputedIndex(self):
+        op = self._makeOp( self.data )
+        op.resetDirty()
+        assert not op.isDirty()
+        op.computeSliceIndex()
+        assert op._opIndex.isIndexed()
+        # The computed index must be saved
+        assert op.isDirty()
+        op.resetDirty()
+        assert not op.isDirty()
+        assert numpy.allclose( op.Output[:].wait(), op._opInterp.Output[:].wait() )
+
+    def testIndexIdentity(self):
+        op = self._makeOp( self.data )
+        op.computeSliceIndex()
+        s = op.dumpsSliceIndex()
+
+        # Same dataset: the index is restored
+        opSame = self._makeOp( self.data )
+        opSame.resetDirty()
+        opSame.loadsSliceIndex( s )
+        assert opSame._opIndex.isIndexed()
+        assert opSame.isDirty()
+
+        # Same shape, different data: the index is ignored
+        other = self.data.copy()
+        other[15] += 1
+        opOther = self._makeOp( other )
+        opOther.resetDirty()
+        opOther.loadsSliceIndex( s )
+        assert not opOther._opIndex.isIndexed()
+        assert not opOther.isDirty()
+        assert numpy.allclose( opOther.Output[:].wait(), opOther._opInterp.Output[:].wait() )
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -38,6 +38,7 @@ from ilastik.applets.counting.opCounting import \
     OpPredictionPipelineNoCache,OpPredictionPipeline
 
 from ilastik.applets.counting.countingOperators import OpTrainCounter, OpPredictCounter, OpLabelPreviewer
+from ilastik.applets.counting.countingsvr import SVR
 
  
 # def segImage():
@@ -89,6 +90,88 @@ class TestOpMean(object):
         #FIXME: why is it this the region ?
         np.testing.assert_allclose(np.mean(rimg.view(np.ndarray),axis=2),mean.view(np.ndarray)[...,0:1,0])
 
+class TestSVR(object):
+    def setUp(self):
+        self.img = np.random.rand(1000, 3)
+        self.dot = np.zeros((1000,))
+        self.dot[:100] = np.random.rand(100)
+        self.tags = [100, 900]
+
+    def testSubsample(self):
+        svr = SVR(method = "RandomForest")
+        boxConstraints = {"boxValues" : np.array([4.0, 2.0]), "boxIndices" : np.array([0, 300, 400]),
+                          "boxFeatures" : np.random.rand(400, 3)}
+        img, dot, tags, boxes = svr.subsampleData(self.img, self.dot, self.tags, boxConstraints, 200)
+        assert tags == [100, 100]
+        assert img.shape == (200, 3)
+        np.testing.assert_array_equal(dot[:100], self.dot[:100])
+        assert boxes["boxIndices"][-1] == boxes["boxFeatures"].shape[0] == 200
+        np.testing.assert_allclose(boxes["boxValues"], [2.0, 1.0])
+
+    def testSubsampleForeground(self):
+        # More foreground rows than samples: only foreground rows are kept
+        svr = SVR(method = "RandomForest")
+        img, dot, tags, boxes = svr.subsampleData(self.img, self.dot, self.tags, None, 50)
+        assert tags == [50, 0]
+        assert img.shape == (50, 3)
+        rows = [np.flatnonzero((self.img == row).all(axis=1))[0] for row in img]
+        assert max(rows) < 100 and len(set(rows)) == 50
+        np.testing.assert_array_equal(dot, self.dot[rows])
+
+    def testPredictMean(self):
+        svr = SVR(method = "RandomForest", ntrees = 2, maxSamples = 300)
+        svr.fitPrepared(self.img, self.dot, self.tags, numRegressors = 3)
+        image = np.random.rand(20, 30, 3)
+        stacked = svr.predict(image, blockSize = 77)
+        assert stacked.shape == (20, 30, 3)
+        np.testing.assert_allclose(svr.predictMean(image, blockSize = 77), np.mean(stacked, axis = -1))
+
+        # Written into a (non-contiguous) channel of a bigger array
+        out = np.zeros((20, 30, 2), dtype = np.float32)
+        svr.predictMean(image, blockSize = 77, out = out[..., 1])
+        np.testing.assert_allclose(out[..., 1], np.mean(stacked, axis = -1), rtol = 1e-5)
+        assert (out[..., 0] == 0).all()
+
+    def testSeed(self):
+        image = np.random.rand(20, 30, 3)
+        predictions = []
+        for i in range(2):
+            svr = SVR(method = "RandomForest", ntrees = 2, maxSamples = 300, seed = 42)
+            svr.fitPrepared(self.img, self.dot, self.tags, numRegressors = 3)
+            predictions.append(svr.predict(image))
+        np.testing.assert_array_equal(predictions[0], predictions[1])
+
+class TestOpPredictCounter(object):
+    def setUp(self):
+        img = np.random.rand(1000, 3)
+        dot = np.zeros((1000,))
+        dot[:100] = np.random.rand(100)
+        self.forests = np.empty((OpTrainCounter.numRegressors,), dtype = object)
+        for i in range(len(self.forests)):
+            self.forests[i] = SVR(method = "RandomForest", ntrees = 2, seed = i)
+            self.forests[i].fitPrepared(img, dot, [100, 900], numRegressors = OpTrainCounter.numRegressors,
+                                        trainAll = False)
+
+        self.image = vigra.taggedView(np.random.rand(20, 30, 3).astype(np.float32), 'yxc')
+        self.op = OpPredictCounter(graph = Graph())
+        self.op.Image.setValue(self.image)
+        self.op.LabelsCount.setValue(2)
+        self.op.Classifier.setValue(self.forests)
+
+    def testBlockwisePrediction(self):
+        SVR.PREDICTION_BLOCKSIZE, blockSize = 50, SVR.PREDICTION_BLOCKSIZE
+        try:
+            pmaps = self.op.PMaps[:].wait()
+            subPmaps = self.op.PMaps[3:17, 5:23, 1:3].wait()
+        finally:
+            SVR.PREDICTION_BLOCKSIZE = blockSize
+
+        assert pmaps.shape == (20, 30, OpTrainCounter.numRegressors)
+        for i, forest in enumerate(self.forests):
+            expected = forest.predict(self.image.view(np.ndarray))[..., 0]
+            np.testing.assert_allclose(pmaps[..., i], expected, rtol = 1e-5)
+        np.testing.assert_allclose(subPmaps, pmaps[3:17, 5:23, 1:3])
+
         
 # class TestOpObjectTrain(unittest.TestCase):
 #     
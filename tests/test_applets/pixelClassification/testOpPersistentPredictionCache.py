@@ -0,0 +1,149 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import os
+import shutil
+import tempfile
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+
+from ilastik.applets.pixelClassification.opPersistentPredictionCache import OpPersistentPredictionCache
+
+
+class OpCountReads(OpArrayPiper):
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.pixelsRead = 0
+
+    def execute(self, slot, subindex, roi, result):
+        self.pixelsRead += numpy.prod(numpy.subtract(roi.stop, roi.start))
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+
+class TestOpPersistentPredictionCache(object):
+
+    def setUp(self):
+        numpy.random.seed(0)
+        self.tmpdir = tempfile.mkdtemp()
+        self.cacheFile = os.path.join( self.tmpdir, 'predictions.h5' )
+        self.data = vigra.taggedView( numpy.random.random( (20, 60, 70, 2) ).astype(numpy.float32), 'zyxc' )
+        self.features = vigra.taggedView( numpy.zeros( (20, 60, 70, 3), dtype=numpy.float32 ), 'zyxc' )
+        self.classifier = { 'trees' : [1, 2, 3] }
+        self.ops = []
+
+    def tearDown(self):
+        for op, opReads in self.ops:
+            op.cleanUp()
+            opReads.cleanUp()
+        shutil.rmtree( self.tmpdir )
+
+    def _makeOp(self, classifier=None):
+        graph = Graph()
+        opReads = OpCountReads( graph=graph )
+        opReads.Input.setValue( self.data )
+
+        op = OpPersistentPredictionCache( graph=graph )
+        op.Input.connect( opReads.Output )
+        op.Classifier.setValue( classifier or self.classifier )
+        op.FeatureImages.setValue( self.features )
+        op.BlockShape.setValue( (10, 32, 32, 2) )
+        op.CacheFile.setValue( self.cacheFile )
+        self.ops.append( (op, opReads) )
+        return op, opReads
+
+    def _close(self, op):
+        # Like the end of a session
+        for entry in self.ops:
+            if entry[0] is op:
+                self.ops.remove( entry )
+                op.cleanUp()
+                entry[1].cleanUp()
+                return
+
+    def testReload(self):
+        op, opReads = self._makeOp()
+        assert numpy.allclose( op.Output[:].wait(), self.data )
+        assert opReads.pixelsRead == self.data.size
+        assert op.storedBlockCount() == 2 * 2 * 3
+        self._close( op )
+
+        op, opReads = self._makeOp()
+        assert op.storedBlockCount() == 2 * 2 * 3
+        assert numpy.allclose( op.Output[5:15, 10:50, 20:65].wait(), self.data[5:15, 10:50, 20:65] )
+        assert opReads.pixelsRead == 0
+
+    def testInterruptedExport(self):
+        # Only the first z-block is exported before the "crash"
+        op, opReads = self._makeOp()
+        op.Output[0:10].wait()
+        assert op.storedBlockCount() == 2 * 3
+        self._close( op )
+
+        op, opReads = self._makeOp()
+        assert numpy.allclose( op.Output[:].wait(), self.data )
+        assert opReads.pixelsRead == self.data[10:20].size
+        assert op.storedBlockCount() == 2 * 2 * 3
+
+    def testKeyChange(self):
+        op, opReads = self._makeOp()
+        op.Output[:].wait()
+        self._close( op )
+        fileSize = os.path.getsize( self.cacheFile )
+
+        for i in range(3):
+            op, opReads = self._makeOp( { 'trees' : [i] } )
+            assert op.storedBlockCount() == 0
+            assert numpy.allclose( op.Output[:].wait(), self.data )
+            assert opReads.pixelsRead == self.data.size
+            self._close( op )
+
+        # The datasets are reused instead of being deleted and recreated
+        #  (which would leave the space of the old ones behind each time)
+        assert os.path.getsize( self.cacheFile ) < 1.5 * fileSize
+
+    def testDirtyInput(self):
+        op, opReads = self._makeOp()
+        op.Output[:].wait()
+        pixelsRead = opReads.pixelsRead
+
+        self.data[12, 40, 40] = 5
+        opReads.Input.setDirty( (12, 40, 40, 0), (13, 41, 41, 2) )
+        assert op.storedBlockCount() == 2 * 2 * 3 - 1
+
+        assert numpy.allclose( op.Output[:].wait(), self.data )
+        assert opReads.pixelsRead - pixelsRead == 10 * 28 * 32 * 2
+
+        # The discarded block is stored again, with the new data
+        self._close( op )
+        op, opReads = self._makeOp()
+        assert numpy.allclose( op.Output[:].wait(), self.data )
+        assert opReads.pixelsRead == 0
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
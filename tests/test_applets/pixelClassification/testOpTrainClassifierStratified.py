@@ -0,0 +1,159 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import itertools
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot
+from lazyflow.classifiers import LazyflowVectorwiseClassifierFactoryABC
+
+from ilastik.applets.pixelClassification.opTrainClassifierStratified import OpTrainClassifierStratified
+
+class RecordedTraining(object):
+    def __init__(self, X, y):
+        self.X = numpy.asarray(X)
+        self.y = numpy.asarray(y).reshape(-1).astype(numpy.uint32)
+
+    def sortedRows(self):
+        # (features..., label), sorted, to compare trainings independent of the sample order
+        rows = numpy.concatenate( (self.X, self.y[:, None]), axis=1 )
+        return rows[ numpy.lexsort( rows.transpose()[::-1] ) ]
+
+class RecordingClassifierFactory(LazyflowVectorwiseClassifierFactoryABC):
+    """
+    Instead of training a classifier, returns the training data it was given.
+    """
+    def create_and_train(self, X, y, *args, **kwargs):
+        return RecordedTraining(X, y)
+
+    @property
+    def description(self):
+        return "Recording factory"
+
+    def estimated_ram_usage_per_requested_predictionchannel(self):
+        return 0
+
+    def __eq__(self, other):
+        return isinstance(other, RecordingClassifierFactory)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+class OpNonzeroBlocks(Operator):
+    """
+    The nonzero label blocks of Input, in the format of OpCompressedUserLabelArray.nonzeroBlocks.
+    """
+    Input = InputSlot()
+    BlockShape = InputSlot()
+    Output = OutputSlot()
+
+    def setupOutputs(self):
+        self.Output.meta.shape = (1,)
+        self.Output.meta.dtype = object
+
+    def execute(self, slot, subindex, roi, result):
+        labels = self.Input[:].wait()
+        blockShape = self.BlockShape.value
+        ranges = [ range(0, s, b) for s, b in zip(labels.shape, blockShape) ]
+        blocks = []
+        for start in itertools.product( *ranges ):
+            block = tuple( slice(a, min(a + b, s)) for a, b, s in zip(start, blockShape, labels.shape) )
+            if labels[block].any():
+                blocks.append( block )
+        result[0] = blocks
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.Output.setDirty()
+
+class TestOpTrainClassifierStratified(object):
+    def setUp(self):
+        # Two lanes with a few thousand pixels of class 1 and a few hundred of class 2
+        rng = numpy.random.RandomState(0)
+        graph = Graph()
+        self.op = OpTrainClassifierStratified(graph=graph)
+        self.op.Images.resize(2)
+        self.op.Labels.resize(2)
+        self.op.nonzeroLabelBlocks.resize(2)
+        self._opBlocks = []
+        self.classCounts = numpy.zeros(3, dtype=int)
+        for lane, shape in enumerate( [(60, 70), (45, 50)] ):
+            features = rng.rand( *(shape + (3,)) ).astype(numpy.float32)
+            labels = numpy.zeros( shape + (1,), dtype=numpy.uint8 )
+            labels[5:40, 10:60] = 1
+            labels[ rng.rand( *labels.shape ) < 0.1 ] = 2
+            labels[30:, 40:] = 0
+            self.classCounts += numpy.bincount( labels.flat, minlength=3 )
+
+            self.op.Images[lane].setValue( vigra.taggedView( features, 'yxc' ) )
+            self.op.Labels[lane].setValue( vigra.taggedView( labels, 'yxc' ) )
+            opBlocks = OpNonzeroBlocks(graph=graph)
+            opBlocks.Input.connect( self.op.Labels[lane] )
+            opBlocks.BlockShape.setValue( (16, 16, 1) )
+            self.op.nonzeroLabelBlocks[lane].connect( opBlocks.Output )
+            self._opBlocks.append( opBlocks )
+
+        self.op.MaxLabel.setValue(2)
+        self.op.ClassifierFactory.setValue( RecordingClassifierFactory() )
+        assert self.classCounts[1] > 1000 and 100 < self.classCounts[2] < 1000
+
+    def _train(self, maxSamples, seed=0):
+        self.op.MaxSamplesPerClass.setValue( maxSamples )
+        self.op.RandomSeed.setValue( seed )
+        return self.op.Classifier.value
+
+    def testClassCaps(self):
+        training = self._train(200)
+        counts = numpy.bincount( training.y, minlength=3 )
+        assert counts[0] == 0
+        assert counts[1] == 200
+        assert counts[2] == 200
+
+        training = self._train(1000)
+        counts = numpy.bincount( training.y, minlength=3 )
+        assert counts[1] == 1000
+        assert counts[2] == self.classCounts[2], "Classes below the cap must keep all their pixels"
+
+        # Every sample is a labeled pixel of its class
+        allRows = self._train(None).sortedRows()
+        allRows = set( map(tuple, allRows) )
+        assert all( tuple(row) in allRows for row in training.sortedRows() )
+
+    def testSeed(self):
+        first = self._train(200, seed=1)
+        second = self._train(200, seed=1)
+        other = self._train(200, seed=2)
+        assert (first.X == second.X).all() and (first.y == second.y).all()
+        assert not numpy.array_equal( first.sortedRows(), other.sortedRows() )
+
+    def testUncappedEqualsBlocked(self):
+        blocked = self._train(None)
+        uncapped = self._train( self.classCounts.max() )
+        assert len(blocked.y) == self.classCounts[1:].sum()
+        assert (blocked.sortedRows() == uncapped.sortedRows()).all()
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,166 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+
+from lazyflow.graph import Graph
+
+from ilastik.applets.splitBodyCarving.opSplitBodyCarving import OpSplitBodyCarving, OpFragmentSetLut
+
+NUM_SUPERVOXELS = 200
+
+class Objects(object):
+    def __init__(self):
+        self.lut = numpy.zeros( (NUM_SUPERVOXELS,), dtype=numpy.int32 )
+
+class Mst(object):
+    """
+    The parts of the carving MST that OpFragmentSetLut uses.
+    """
+    def __init__(self):
+        self.objects = Objects()
+        self.object_names = {}
+        self.object_lut = {}
+
+def previousLut(mst, ravelerLabel, currentFragment):
+    """
+    The full rebuild of the previous OpFragmentSetLut.execute().
+    """
+    result = numpy.zeros( (NUM_SUPERVOXELS,), dtype=numpy.uint8 )
+    if ravelerLabel == 0:
+        return result
+    names = OpSplitBodyCarving.getSavedObjectNamesForMstAndRavelerLabel(mst, ravelerLabel)
+    for i, name in reversed(list(enumerate(names))):
+        if name != currentFragment:
+            objectSupervoxels = mst.object_lut[name]
+            result[objectSupervoxels] = i+1
+    return result
+
+class TestOpFragmentSetLut(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.mst = Mst()
+        self.op = OpFragmentSetLut( graph=self.graph )
+
+        self._save( '12.1', range(10, 40), notify=False )
+        self._save( '12.2', range(30, 60), notify=False ) # overlaps 12.1
+        self._save( '12.3', range(55, 70) + [5], notify=False ) # overlaps 12.2
+        self._save( '13.1', range(0, 20), notify=False ) # overlaps the fragments of 12
+
+        self.op.MST.setValue( self.mst )
+        self.op.RavelerLabel.setValue( 12 )
+        self.op.CurrentEditingFragment.setValue( "" )
+
+    def tearDown(self):
+        self.op.cleanUp()
+
+    def _save(self, name, supervoxels, notify=True):
+        # Like OpCarving.saveObjectAs(): the supervoxels are stored as the result of numpy.where
+        is_new = name not in self.mst.object_names
+        if is_new:
+            self.mst.object_names[name] = len(self.mst.object_names) + 1
+        mask = numpy.zeros( (NUM_SUPERVOXELS,), dtype=bool )
+        mask[supervoxels] = True
+        self.mst.object_lut[name] = numpy.where( mask )
+        if notify:
+            self.op.fragmentSaved( name )
+
+    def _delete(self, name):
+        # Like OpCarving.deleteObject_impl()
+        del self.mst.object_lut[name]
+        del self.mst.object_names[name]
+        self.op.fragmentDeleted( name )
+
+    def _check(self, step):
+        expected = previousLut( self.mst, self.op.RavelerLabel.value, self.op.CurrentEditingFragment.value )
+        lut = self.op.Lut[:].wait()
+        assert lut.dtype == numpy.uint8
+        assert numpy.array_equal( lut, expected ), "{}: {} != {}".format( step, lut.nonzero(), expected.nonzero() )
+
+    def testSequence(self):
+        self._check( "initial" )
+
+        self._save( '12.15', range(35, 50) )
+        self._check( "save new overlapping fragment (in the middle of the list)" )
+
+        self._save( '12.2', range(45, 58) + [100] )
+        self._check( "overwrite" )
+
+        self.op.CurrentEditingFragment.setValue( '12.15' )
+        self._check( "select for editing" )
+
+        self._save( '12.15', range(20, 47) )
+        self._check( "save the fragment that is being edited" )
+
+        self.op.CurrentEditingFragment.setValue( "" )
+        self._check( "deselect" )
+
+        self._delete( '12.1' )
+        self._check( "delete the first fragment" )
+
+        self.op.RavelerLabel.setValue( 13 )
+        self._check( "switch raveler label" )
+
+        self._save( '12.4', range(0, 15) )
+        self._check( "save a fragment of another raveler label" )
+
+        self.op.RavelerLabel.setValue( 12 )
+        self._check( "switch back" )
+
+        self._save( '12.5', range(60, 80), notify=False )
+        self._check( "save a new fragment without notification" )
+
+        self._save( '12.3', range(0, 3) + range(65, 90), notify=False )
+        self._check( "overwrite without notification" )
+
+        self.op.RavelerLabel.setValue( 0 )
+        self._check( "no raveler label" )
+        self.op.RavelerLabel.setValue( 12 )
+        self._check( "raveler label again" )
+
+        assert self.op.fragmentNames( 12 ) == OpSplitBodyCarving.getSavedObjectNamesForMstAndRavelerLabel( self.mst, 12 )
+
+    def testRandomSequence(self):
+        rng = numpy.random.RandomState(0)
+        for step in range(300):
+            action = rng.randint(6)
+            label = rng.choice( [12, 13] )
+            name = "{}.{}".format( label, rng.randint(1, 12) )
+            if action < 2:
+                start = rng.randint( NUM_SUPERVOXELS - 30 )
+                supervoxels = range( start, start + rng.randint(1, 30) )
+                self._save( name, supervoxels, notify=(action == 0 or name not in self.mst.object_names) )
+            elif action == 2:
+                if name in self.mst.object_names:
+                    self._delete( name )
+            elif action == 3:
+                self.op.CurrentEditingFragment.setValue( name if rng.randint(2) else "" )
+            elif action == 4:
+                self.op.RavelerLabel.setValue( label )
+            self._check( "step {} (action {}, {})".format( step, action, name ) )
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
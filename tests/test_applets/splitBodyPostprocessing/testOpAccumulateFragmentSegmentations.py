@@ -0,0 +1,157 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import collections
+import threading
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+
+from ilastik.applets.splitBodyPostprocessing.opSplitBodyPostprocessing import OpAccumulateFragmentSegmentations
+
+def previousAccumulate(ravelerLabels, fragmentSegmentations, bodyIds):
+    """
+    The previous whole-volume OpAccumulateFragmentSegmentations: returns the output and the mapping.
+    """
+    result = ravelerLabels.copy()
+    fragment_image = numpy.zeros( result.shape, dtype=numpy.int32 )
+    max_label = result.max()
+    mapping = collections.OrderedDict()
+    mapping[(0,max_label+1)] = -1
+
+    for fragments, body_id in zip( fragmentSegmentations, bodyIds ):
+        fragment_image.view(numpy.uint32)[:] = fragments
+        fragment_image[:] = numpy.where( fragment_image, fragment_image, -max_label )
+        numpy.add( fragment_image, max_label, out=fragment_image )
+        result[:] = numpy.where( fragment_image, fragment_image, result )
+        max_label = result.max()
+
+        old_max = mapping.keys()[-1][1]
+        mapping[(old_max,max_label+1)] = body_id
+    return result, mapping
+
+class OpCountReads(OpArrayPiper):
+    """
+    Passes the input through, counts the pixels requested from it and
+    provides the selected_label of a fragment segmentation.
+    """
+    def __init__(self, selected_label=None, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.selected_label = selected_label
+        self.pixelsRead = 0
+        self._lock = threading.Lock()
+
+    def setupOutputs(self):
+        super( OpCountReads, self ).setupOutputs()
+        if self.selected_label is not None:
+            self.Output.meta.selected_label = self.selected_label
+
+    def execute(self, slot, subindex, roi, result):
+        with self._lock:
+            self.pixelsRead += numpy.prod( numpy.subtract( roi.stop, roi.start ) )
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+class TestOpAccumulateFragmentSegmentations(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        shape = (20, 30, 40)
+        self.raveler = numpy.zeros( shape, dtype=numpy.uint32 )
+        self.raveler[:10] = 5
+        self.raveler[10:, :, :20] = 17
+        self.raveler[10:, :, 20:] = 9
+
+        # Three bodies: the first two overlap, the last one is empty
+        body1 = numpy.zeros( shape, dtype=numpy.uint32 )
+        body1[2:12, 5:25, 10:30] = 1
+        body1[2:12, 5:25, 20:30] = 3
+        body2 = numpy.zeros( shape, dtype=numpy.uint32 )
+        body2[8:18, 15:30, 25:40] = 2
+        body2[8:18, 15:20, 25:40] = 4
+        body3 = numpy.zeros( shape, dtype=numpy.uint32 )
+        self.bodies = [body1, body2, body3]
+        self.bodyIds = [5, 17, 9]
+
+        self.opRaveler = OpCountReads( graph=self.graph )
+        self.opRaveler.Input.setValue( vigra.taggedView( self.raveler, 'zyx' ) )
+        self.opBodies = []
+        for body, body_id in zip( self.bodies, self.bodyIds ):
+            opBody = OpCountReads( body_id, graph=self.graph )
+            opBody.Input.setValue( vigra.taggedView( body, 'zyx' ) )
+            self.opBodies.append( opBody )
+
+        self.op = OpAccumulateFragmentSegmentations( graph=self.graph )
+        # Small blocks, so that the rois straddle them
+        self.op.BlockDims = { 'z' : 8, 'y' : 16, 'x' : 16 }
+        self.op.RavelerLabels.connect( self.opRaveler.Output )
+        self.op.FragmentSegmentations.resize( len(self.bodies) )
+        for slot, opBody in zip( self.op.FragmentSegmentations, self.opBodies ):
+            slot.connect( opBody.Output )
+
+    def tearDown(self):
+        self.op.cleanUp()
+        for op in [self.opRaveler] + self.opBodies:
+            op.cleanUp()
+
+    def _check(self):
+        expected, expectedMapping = previousAccumulate( self.raveler, self.bodies, self.bodyIds )
+        assert numpy.array_equal( self.op.Output[:].wait(), expected )
+        assert self.op.Mapping[:].wait()[0] == expectedMapping
+        for roi in [ numpy.s_[5:13, 10:20, 12:35], numpy.s_[7:9, 15:17, 15:17], numpy.s_[19:20, 29:30, 0:40] ]:
+            assert numpy.array_equal( self.op.Output[roi].wait(), expected[roi] ), roi
+        return expected
+
+    def testOutput(self):
+        expected = self._check()
+        # The bodies overlap and the empty body doesn't add any labels
+        assert expected.max() == 17 + 3 + 4
+        assert self.op.Mapping[:].wait()[0].keys()[-1] == (24 + 1, 24 + 1)
+
+    def testDirtyBody(self):
+        self._check()
+        for op in [self.opRaveler] + self.opBodies:
+            op.pixelsRead = 0
+
+        # Only the max label of the dirty body is computed again
+        self.bodies[1][0:2, 0:2, 0:2] = 7
+        self.opBodies[1].Input.setDirty( (0, 0, 0), (2, 2, 2) )
+        self.op.Output[:].wait()
+        size = self.raveler.size
+        assert self.opRaveler.pixelsRead == size
+        assert self.opBodies[0].pixelsRead == size
+        assert self.opBodies[1].pixelsRead == 2 * size
+        assert self.opBodies[2].pixelsRead == size
+        self._check()
+
+        # The raveler labels change the offsets of all bodies
+        self.raveler[0, 0, 0] = 30
+        self.opRaveler.Input.setDirty( (0, 0, 0), (1, 1, 1) )
+        self._check()
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,172 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import os
+import shutil
+import tempfile
+import threading
+import cPickle as pickle
+
+import numpy
+import h5py
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+
+from ilastik.applets.splitBodyPostprocessing.opResumableH5Writer import \
+    OpResumableH5Writer, openExportFile, sidecarPath, stateDigest
+
+class ReadFailed(Exception):
+    pass
+
+class OpCountReads(OpArrayPiper):
+    """
+    Passes the input through and counts the blocks requested from it.  If failingBlock
+    is set, reading the block that starts there fails, but only once the other blocks
+    are written (or after a timeout), so the interrupted export is the same every time.
+    """
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.blocksRead = 0
+        self.failingBlock = None
+        self.othersWritten = threading.Event()
+        self._lock = threading.Lock()
+
+    def execute(self, slot, subindex, roi, result):
+        if self.failingBlock is not None and tuple(roi.start) == self.failingBlock:
+            self.othersWritten.wait( 10.0 )
+            raise ReadFailed( "Reading {} failed".format( self.failingBlock ) )
+        with self._lock:
+            self.blocksRead += 1
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+class TestOpResumableH5Writer(object):
+
+    # 3*2*2 blocks of (16, 32, 32)
+    SHAPE = (1, 40, 64, 64, 1)
+    NUM_BLOCKS = 12
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.filePath = os.path.join( self.tmpDir, 'export.h5' )
+        self.data = numpy.random.RandomState(0).randint( 0, 1000, size=self.SHAPE ).astype( numpy.uint32 )
+        self.graph = Graph()
+        self.ops = []
+
+    def tearDown(self):
+        for op in reversed(self.ops):
+            op.cleanUp()
+        shutil.rmtree( self.tmpDir )
+
+    def _export(self, key="", failingBlock=None):
+        """
+        Exports self.data to self.filePath/stack.  Returns the number of blocks read
+        and whether the export completed.
+        """
+        opSource = OpCountReads( graph=self.graph )
+        opSource.Input.setValue( vigra.taggedView( self.data, 'tzyxc' ) )
+        opSource.failingBlock = failingBlock
+
+        f = openExportFile( self.filePath, 'stack' )
+        opExporter = OpResumableH5Writer( graph=self.graph )
+        self.ops += [opSource, opExporter]
+        opExporter.BlockDims = { 't' : 1, 'z' : 16, 'y' : 32, 'x' : 32 }
+        opExporter.ChunkDims = { 't' : 1, 'z' : 8, 'y' : 16, 'x' : 16 }
+        opExporter.hdf5File.setValue( f )
+        opExporter.hdf5Path.setValue( 'stack' )
+        opExporter.ResumeKey.setValue( key )
+        opExporter.Image.connect( opSource.Output )
+
+        def checkProgress( percentage ):
+            if percentage >= 100 * (self.NUM_BLOCKS - 1) // self.NUM_BLOCKS:
+                opSource.othersWritten.set()
+        opExporter.progressSignal.subscribe( checkProgress )
+
+        try:
+            assert opExporter.WriteImage.value
+            completed = True
+        except ReadFailed:
+            completed = False
+        finally:
+            f.close()
+        return opSource.blocksRead, completed
+
+    def _writtenBlocks(self):
+        with open( sidecarPath( self.filePath, 'stack' ), 'rb' ) as f:
+            return int( pickle.load( f )['done'].sum() )
+
+    def _checkExport(self):
+        assert not os.path.exists( sidecarPath( self.filePath, 'stack' ) )
+        with h5py.File( self.filePath, 'r' ) as f:
+            assert ( f['stack'][:] == self.data ).all()
+
+    def testExport(self):
+        blocksRead, completed = self._export()
+        assert completed
+        assert blocksRead == self.NUM_BLOCKS
+        self._checkExport()
+
+    def testResume(self):
+        blocksRead, completed = self._export( failingBlock=(0, 32, 32, 0, 0) )
+        assert not completed
+        written = self._writtenBlocks()
+        assert 0 < written < self.NUM_BLOCKS
+        assert blocksRead >= written
+
+        # Only the missing blocks are written
+        blocksRead, completed = self._export()
+        assert completed
+        assert blocksRead == self.NUM_BLOCKS - written, (blocksRead, written)
+        self._checkExport()
+
+        # Once the export is complete, the file is overwritten
+        blocksRead, completed = self._export()
+        assert completed
+        assert blocksRead == self.NUM_BLOCKS
+
+    def testResumeKeyChanged(self):
+        blocksRead, completed = self._export( key=stateDigest( [1, 2] ), failingBlock=(0, 32, 32, 0, 0) )
+        assert not completed
+        assert self._writtenBlocks() > 0
+
+        # The blocks written for the other key are discarded
+        self.data += 1
+        blocksRead, completed = self._export( key=stateDigest( [1, 3] ) )
+        assert completed
+        assert blocksRead == self.NUM_BLOCKS
+        self._checkExport()
+
+    def testStateDigest(self):
+        supervoxels = numpy.arange( 10, dtype=numpy.uint32 )
+        state = [ (5, ['5.1', '5.2'], [supervoxels[:4], supervoxels[4:]]) ]
+        assert stateDigest( state ) == stateDigest( [ (5, ['5.1', '5.2'], [supervoxels[:4].copy(), supervoxels[4:]]) ] )
+        # A supervoxel moved to the other fragment
+        assert stateDigest( state ) != stateDigest( [ (5, ['5.1', '5.2'], [supervoxels[:5], supervoxels[5:]]) ] )
+        assert stateDigest( state ) != stateDigest( [ (5, ['5.1', '5.3'], [supervoxels[:4], supervoxels[4:]]) ] )
+        assert stateDigest( { 'a' : 1, 'b' : 2 } ) == stateDigest( { 'b' : 2, 'a' : 1 } )
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
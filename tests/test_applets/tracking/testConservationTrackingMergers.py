@@ -0,0 +1,142 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import vigra
+import pgmlink
+
+from lazyflow.graph import Graph
+from lazyflow.rtype import SubRegion
+
+from ilastik.applets.tracking.base.trackingUtilities import relabel
+from ilastik.applets.tracking.conservation.opConservationTracking import OpConservationTracking
+
+def makeLabelImage():
+    """
+    Three 2d frames of a txyzc label image.  Object 2 of frame 1 is a merger.
+    """
+    labelImage = numpy.zeros((3, 20, 16, 1, 1), dtype=numpy.uint32)
+    labelImage[0, 2:6, 3:7] = 1
+    labelImage[1, 4:12, 4:10] = 2
+    labelImage[1, 14:18, 1:5] = 1
+    labelImage[1, 15:19, 10:14] = 3
+    labelImage[2, 3:9, 2:6] = 1
+    labelImage[2, 10:14, 8:12] = 2
+    return labelImage
+
+def makeCoordinateMap():
+    """
+    The coordinates of the objects the merger of frame 1 is resolved to.
+    """
+    resolved = numpy.zeros((20, 16), dtype=numpy.uint32)
+    resolved[4:8, 4:10] = 4
+    resolved[8:12, 4:10] = 5
+
+    coordinate_map = pgmlink.TimestepIdCoordinateMap()
+    for new_id in (4, 5):
+        xs, ys = numpy.nonzero(resolved == new_id)
+        lower = numpy.array([xs.min(), ys.min()], dtype=numpy.int64)
+        excerpt = numpy.ascontiguousarray(resolved[xs.min():xs.max() + 1, ys.min():ys.max() + 1])
+        pgmlink.extract_coord_by_timestep_id(coordinate_map, excerpt, lower, 1, new_id, len(xs))
+    return coordinate_map
+
+class TestConservationTrackingMergers(object):
+    def setUp(self):
+        self.labelImage = makeLabelImage()
+        taggedLabelImage = vigra.taggedView(self.labelImage, 'txyzc')
+
+        graph = Graph()
+        self.op = OpConservationTracking(graph=graph)
+        self.op.NumLabels.setValue(4)
+        self.op.ObjectFeatures.setValue({})
+        self.op.ObjectFeaturesWithDivFeatures.setValue({})
+        self.op.ComputedFeatureNames.setValue({})
+        self.op.ComputedFeatureNamesWithDivFeatures.setValue({})
+        self.op.DivisionProbabilities.setValue({})
+        self.op.DetectionProbabilities.setValue({})
+        self.op.RawImage.setValue(vigra.taggedView(self.labelImage.astype(numpy.uint8), 'txyzc'))
+        self.op.LabelImage.setValue(taggedLabelImage)
+
+        # The state tracking leaves behind
+        self.op.mergers = [{}, {2: 2}, {}]
+        self.op.resolvedto = [{}, {2: [4, 5]}, {}]
+        self.op.label2color = [{1: 6}, {1: 7, 3: 8, 4: 9, 5: 10}, {1: 6, 2: 7}]
+        self.op.CoordinateMap.setValue(makeCoordinateMap())
+        self.op.Parameters.setValue({'time_range': [0, 2], 'withMergerResolution': True})
+
+    def rois(self):
+        shape = self.labelImage.shape
+        return [SubRegion(self.op.RelabeledImage, start=(0, 0, 0, 0, 0), stop=shape),
+                SubRegion(self.op.RelabeledImage, start=(1, 6, 2, 0, 0), stop=(3, 17, 12, 1, 1)),
+                SubRegion(self.op.RelabeledImage, start=(1, 9, 0, 0, 0), stop=(2, 20, 16, 1, 1))]
+
+    def testResolvedLabels(self):
+        for roi in self.rois():
+            resolved = self.op._resolvedLabels(roi)
+            volume = self.labelImage[roi.toSlice()]
+            for t in range(roi.start[0], roi.stop[0]):
+                i = t - roi.start[0]
+                expected = self.op._relabelMergers(volume[i, ..., 0].copy(), t, roi.start[1:-1], False, True)
+                assert (resolved[i, ..., 0] == expected).all(), "resolved labels differ at t={}".format(t)
+
+                # Output colors the resolved labels of the frames with resolved mergers
+                if len(self.op.resolvedto[t]):
+                    expected = self.op._relabelMergers(volume[i, ..., 0].copy(), t, roi.start[1:-1])
+                    assert (relabel(resolved[i, ..., 0], self.op.label2color[t]) == expected).all()
+
+        resolved = self.op._resolvedLabels(self.rois()[0])
+        assert set(numpy.unique(resolved[1])) == set([0, 1, 3, 4, 5])
+
+    def testResolvedMergers(self):
+        for roi in self.rois():
+            resolved = self.op._resolvedLabels(roi)
+            volume = self.labelImage[roi.toSlice()]
+            for t in range(roi.start[0], roi.stop[0]):
+                i = t - roi.start[0]
+                expected = self.op._relabelMergers(volume[i, ..., 0].copy(), t, roi.start[1:-1], True)
+                assert (self.op._resolvedMergers(resolved[i, ..., 0], t) == expected).all(), \
+                    "resolved mergers differ at t={}".format(t)
+
+            # The merger output is only computed for frames with mergers
+            mergerOutput = self.op.MergerOutput(roi.start, roi.stop).wait()
+            for t in range(roi.start[0], roi.stop[0]):
+                i = t - roi.start[0]
+                if len(self.op.mergers[t]):
+                    expected = self.op._relabelMergers(volume[i, ..., 0].copy(), t, roi.start[1:-1], True)
+                else:
+                    expected = 0
+                assert (mergerOutput[i, ..., 0] == expected).all()
+
+        mergerOutput = self.op.MergerOutput[:].wait()
+        assert set(numpy.unique(mergerOutput[1])) == set([0, 9, 10])
+
+    def testEmptyCoordinateMap(self):
+        self.op.CoordinateMap.setValue(pgmlink.TimestepIdCoordinateMap())
+        volume = self.labelImage[1, ..., 0].copy()
+        expected = self.op._relabelMergers(volume.copy(), 1, [0, 0, 0], True)
+        assert (self.op._resolvedMergers(volume, 1) == expected).all()
+        assert (expected == 0).all()
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,217 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+from functools import partial
+
+import h5py
+import numpy
+
+from lazyflow.graph import Graph
+
+from ilastik.applets.tracking.base.opTrackingBase import OpTrackingBase
+from ilastik.applets.tracking.base.trackingSerializer import SerialLineageSlot
+from ilastik.applets.tracking.base.trackingUtilities import get_dict_value
+
+TIME_RANGE = [0, 4]
+
+def makeEvents():
+    """
+    Events of a small tracking result: events[str(t+1)] holds the transitions from
+    frame t to frame t+1.  It has appearances, moves, a merger (two objects moving
+    into object 1 of frame 2, resolved in frame 2) and divisions, one of them of
+    a track that only starts with the division.
+    """
+    def a(rows):
+        return numpy.array(rows, dtype=numpy.float64)
+    return { '0' : {},
+             '1' : { 'mov' : a([[1, 1, 0.1], [2, 2, 0.1]]),
+                     'div' : a([[3, 3, 4, 0.5]]),
+                     'app' : a([[5, 0.2]]) },
+             '2' : { 'mov' : a([[1, 1, 0.1], [2, 1, 0.1], [3, 2, 0.1], [5, 5, 0.1]]),
+                     'div' : a([[4, 3, 4, 0.5]]),
+                     'merger' : a([[1, 2, 0.3]]),
+                     'res' : { 1 : a([6, 7, 0.3]) } },
+             '3' : { 'mov' : a([[1, 1, 0.1], [2, 2, 0.1], [3, 3, 0.1], [6, 6, 0.1]]),
+                     'div' : a([[4, 4, 7, 0.5], [5, 5, 8, 0.5]]),
+                     'dis' : a([[7, 0.2]]),
+                     'app' : a([[9, 0.2]]) },
+             '4' : { 'mov' : a([[1, 1, 0.1], [4, 4, 0.1], [8, 8, 0.1]]),
+                     'div' : a([[3, 3, 5, 0.5]]),
+                     'merger' : a([[4, 2, 0.3]]),
+                     'res' : { 4 : a([10, 11, 0.3]) } } }
+
+FILTERED_LABELS = { '2' : [9], '4' : [12] }
+
+def previousTrackIds(events, time_range, filtered_labels):
+    """
+    The track ids, extra track ids and divisions of the per-event loop
+    _setLabel2Color(export_mode=True) used before the lineage index.
+    """
+    label2color = [{}]
+    extra_track_ids = {}
+    divisions = []
+    maxId = 2
+    for i in range(time_range[0]):
+        label2color.append({})
+
+    for i in time_range:
+        app = get_dict_value(events[str(i - time_range[0] + 1)], "app", [])
+        div = get_dict_value(events[str(i - time_range[0] + 1)], "div", [])
+        mov = get_dict_value(events[str(i - time_range[0] + 1)], "mov", [])
+        res = get_dict_value(events[str(i - time_range[0])], "res", {})
+        label2color.append({})
+
+        for e in app:
+            label2color[-1][int(e[0])] = maxId
+            maxId += 1
+
+        for e in mov:
+            if not label2color[-2].has_key(int(e[0])):
+                label2color[-2][int(e[0])] = maxId
+                maxId += 1
+            label2color[-1][int(e[1])] = label2color[-2][int(e[0])]
+
+        for e in div:
+            if not int(e[0]) in label2color[-2]:
+                label2color[-2][int(e[0])] = maxId
+                maxId += 1
+            ancestor_color = label2color[-2][int(e[0])]
+            label2color[-1][int(e[1])] = maxId
+            label2color[-1][int(e[2])] = maxId + 1
+            divisions.append((i, int(e[0]), ancestor_color, int(e[1]), maxId, int(e[2]), maxId + 1))
+            maxId += 2
+
+        for o, r in res.iteritems():
+            extra_track_ids.setdefault(i, {})
+            extra_track_ids[i][int(o)] = [int(c) for c in r[:-1]]
+
+    res = get_dict_value(events[str(time_range[-1] - time_range[0] + 1)], "res", {})
+    extra_track_ids[time_range[-1] + 1] = {}
+    for o, r in res.iteritems():
+        extra_track_ids[time_range[-1] + 1][int(o)] = [int(c) for c in r[:-1]]
+
+    for i in filtered_labels.keys():
+        if int(i) + time_range[0] >= len(label2color):
+            continue
+        for l in filtered_labels[i]:
+            label2color[int(i) + time_range[0]][l] = 0
+
+    return label2color, extra_track_ids, divisions
+
+def previousTrackChildren(divisions, track_id, start=0):
+    for t, _, track, _, child_track1, _, child_track2 in divisions[start:]:
+        if track == track_id:
+            children_of = partial(previousTrackChildren, divisions, start=t)
+            return [child_track1, child_track2] + \
+                   children_of(child_track1) + children_of(child_track2)
+    return []
+
+def previousTrackParent(divisions, track_id):
+    # The previous implementation skipped the last division (divisions[:-1]),
+    #  so the children of that division had no parent.  The index doesn't.
+    for t, oid, track, _, child_track1, _, child_track2 in divisions:
+        if track_id in (child_track1, child_track2):
+            return [track] + previousTrackParent(divisions, track)
+    return []
+
+class TestLineageIndex(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.ops = []
+
+    def tearDown(self):
+        for op in self.ops:
+            op.cleanUp()
+
+    def _makeOp(self, events=None, projectGroup=None):
+        """
+        A tracking operator with the given events.  If projectGroup is given, the
+        lineage index saved in it is loaded first; returns the operator and that index.
+        """
+        op = OpTrackingBase( graph=self.graph )
+        self.ops.append(op)
+        op.Parameters.setValue( { 'time_range' : TIME_RANGE } )
+        op.FilteredLabels.setValue( FILTERED_LABELS )
+        stored = None
+        if projectGroup is not None:
+            # Like the TrackingSerializer, before the events
+            SerialLineageSlot(op).deserialize(projectGroup)
+            stored = op._storedLineage
+            assert stored is not None
+        op.EventsVector.setValue( events or makeEvents() )
+        return op, stored
+
+    def testTrackIds(self):
+        op, _ = self._makeOp()
+        track_ids, extra_track_ids, divisions = op.export_track_ids()
+        expected_ids, expected_extra, expected_divisions = \
+            previousTrackIds( makeEvents(), range(*TIME_RANGE), FILTERED_LABELS )
+
+        assert track_ids == expected_ids
+        assert extra_track_ids == expected_extra
+        assert divisions == expected_divisions
+        assert len(divisions) == 5
+
+        # The second export reuses the index
+        lineage = op.lineage
+        assert op.export_track_ids()[0] is track_ids
+        assert op.lineage is lineage
+
+        for track in range(max(d[6] for d in divisions) + 2):
+            assert op.track_children(track) == previousTrackChildren(divisions, track), track
+            assert op.track_parent(track) == previousTrackParent(divisions, track), track
+            assert op.track_family(track) == (op.track_children(track), op.track_parent(track))
+
+    def testSerialLineageSlot(self):
+        op, _ = self._makeOp()
+        track_ids, extra_track_ids, divisions = op.export_track_ids()
+
+        f = h5py.File( 'lineage.h5', 'w', driver='core', backing_store=False )
+        try:
+            SerialLineageSlot(op).serialize(f)
+            assert 'LineageIndex' in f
+
+            # Reloading with the same events uses the saved index
+            reloaded, stored = self._makeOp( projectGroup=f )
+            assert reloaded.export_track_ids() == (track_ids, extra_track_ids, divisions)
+            assert reloaded.lineage is stored
+            assert reloaded._storedLineage is None
+            for track in range(max(d[6] for d in divisions) + 2):
+                assert reloaded.track_children(track) == op.track_children(track)
+                assert reloaded.track_parent(track) == op.track_parent(track)
+
+            # An index saved for other events is ignored
+            events = makeEvents()
+            del events['3']['app']
+            changed, stored = self._makeOp( events, projectGroup=f )
+            changed.export_track_ids()
+            assert changed.lineage is not stored
+            assert changed.track_id == previousTrackIds( events, range(*TIME_RANGE), FILTERED_LABELS )[0]
+        finally:
+            f.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
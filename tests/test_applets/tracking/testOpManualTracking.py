@@ -0,0 +1,235 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import vigra
+
+from lazyflow.graph import Graph, Operator, OutputSlot
+from lazyflow.rtype import List, SubRegion
+from lazyflow.stype import Opaque
+
+from ilastik.utility import OpMultiLaneWrapper
+from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
+from ilastik.applets.tracking.manual.opManualTracking import OpManualTracking
+
+def previousRelabel(volume, replace):
+    """
+    The previous OpManualTracking._relabel, which scanned the labels of the volume.
+    """
+    mp = numpy.arange(0, numpy.amax(volume) + 1, dtype=volume.dtype)
+    mp[1:] = 0
+    labels = numpy.unique(volume).tolist()
+    if 0 in labels:
+        labels.remove(0)
+    for label in labels:
+        if label in replace and len(replace[label]) > 0:
+            l = list(replace[label])[-1]
+            if l == -1:
+                mp[label] = 2 ** 16 - 1
+            else:
+                mp[label] = l
+    return mp[volume]
+
+def previousRelabelUntracked(volume, tracked_at):
+    """
+    The previous OpManualTracking._relabelUntracked.
+    """
+    mp = numpy.arange(0, numpy.amax(volume) + 1, dtype=volume.dtype)
+    mp[1:] = 1
+    labels = numpy.unique(volume).tolist()
+    if 0 in labels:
+        labels.remove(0)
+    for label in labels:
+        if (label in tracked_at.keys()) and (len(tracked_at[label]) > 0):
+            mp[label] = 0
+    return mp[volume]
+
+def previousObjects(labelImage, labels, trange, misdet_idx):
+    """
+    The previous OpManualTracking._getObjects, which scanned the label image of every frame.
+    """
+    oid2tids = {}
+    alltids = set()
+    for t in range(trange[0], trange[1]):
+        oid2tids[t] = {}
+        max_oid = numpy.max(labelImage[t])
+        for idx in range(max_oid + 1):
+            oid = int(idx) + 1
+            if t in labels.keys() and oid in labels[t].keys():
+                if misdet_idx not in labels[t][oid]:
+                    oid2tids[t][oid] = labels[t][oid]
+                    for l in labels[t][oid]:
+                        alltids.add(l)
+    return oid2tids, alltids
+
+def makeLabelImage():
+    """
+    Four frames of a txyzc label image, the last one without objects.
+    """
+    labelImage = numpy.zeros((4, 12, 10, 1, 1), dtype=numpy.uint32)
+    labelImage[0, 1:3, 1:3] = 1
+    labelImage[0, 4:6, 1:3] = 2
+    labelImage[0, 8:11, 6:9] = 5
+    labelImage[0, 0, 9] = 9
+    labelImage[1, 1:4, 1:4] = 1
+    labelImage[1, 6:9, 2:5] = 3
+    labelImage[1, 10:, 8:] = 2
+    labelImage[2, :2, :2] = 4
+    labelImage[2, 5:, 5:] = 7
+    return labelImage
+
+class OpObjectFeatures(Operator):
+    """
+    Provides the object counts of a label image (including the background)
+    like the object extraction does.
+    """
+    Output = OutputSlot(stype=Opaque, rtype=List)
+
+    def __init__(self, labelImage, *args, **kwargs):
+        super(OpObjectFeatures, self).__init__(*args, **kwargs)
+        self._labelImage = labelImage
+
+    def setupOutputs(self):
+        self.Output.meta.shape = (self._labelImage.shape[0],)
+        self.Output.meta.dtype = object
+
+    def execute(self, slot, subindex, roi, result):
+        assert slot is self.Output
+        result = {}
+        for t in roi:
+            counts = numpy.bincount(self._labelImage[t].ravel())
+            result[t] = {default_features_key: {'Count': counts.reshape(-1, 1)}}
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+class TestOpManualTracking(object):
+    def setUp(self):
+        self.labelImage = makeLabelImage()
+        taggedLabelImage = vigra.taggedView(self.labelImage, 'txyzc')
+
+        graph = Graph()
+        # Like the workflow (and the gui), use a lane view of the wrapped operator
+        self.opWrapper = OpMultiLaneWrapper(OpManualTracking, graph=graph)
+        self.opWrapper.addLane(0)
+        self.op = self.opWrapper.getLane(0)
+
+        self.opFeatures = OpObjectFeatures(self.labelImage, graph=graph)
+
+        self.op.LabelImage.setValue(taggedLabelImage)
+        self.op.BinaryImage.setValue(vigra.taggedView((self.labelImage > 0).astype(numpy.uint8), 'txyzc'))
+        self.op.RawImage.setValue(vigra.taggedView(self.labelImage.astype(numpy.uint8), 'txyzc'))
+        self.op.ObjectFeatures.connect(self.opFeatures.Output)
+        self.op.ComputedFeatureNames.setValue({})
+
+        self.annotate()
+
+    def annotate(self):
+        """
+        Annotate the objects in place, like the gui.  The label 9 of frame 0 is beyond all
+        annotated labels, label 2 is a misdetection and frame 3 has no annotations.
+        """
+        labels = self.op.labels
+        labels[0][1] = set([1])
+        labels[0][2] = set([-1])
+        labels[0][5] = set([2, 3])
+        labels[1][1] = set([1])
+        labels[1][3] = set([])
+        labels[1][2] = set([3])
+        labels[2][7] = set([3])
+
+    def checkImages(self):
+        trackImage = self.op.TrackImage[:].wait()
+        untrackedImage = self.op.UntrackedImage[:].wait()
+        labels = self.op.labels
+        for t in range(self.labelImage.shape[0]):
+            volume = self.labelImage[t, ..., 0]
+            assert (trackImage[t, ..., 0] == previousRelabel(volume, labels[t])).all(), \
+                "track image differs at t={}".format(t)
+            assert (untrackedImage[t, ..., 0] == previousRelabelUntracked(volume, labels[t])).all(), \
+                "untracked image differs at t={}".format(t)
+        return trackImage, untrackedImage
+
+    def testImages(self):
+        trackImage, untrackedImage = self.checkImages()
+        assert trackImage[0, 0, 9, 0, 0] == 0
+        assert (trackImage[0][self.labelImage[0] == 2] == 2 ** 16 - 1).all()
+        assert untrackedImage[0, 0, 9, 0, 0] == 1
+
+        # Frames without annotations are not tracked
+        start, stop = (1, 0, 0, 0, 0), (3, 12, 10, 1, 1)
+        trackImage = self.op.TrackImage(start, stop).wait()
+        assert (trackImage == self.op.TrackImage[:].wait()[1:3]).all()
+        del self.op.labels[2]
+        trackImage = self.op.TrackImage(start, stop).wait()
+        assert (trackImage[1] == 0).all()
+        assert (trackImage[0, ..., 0] == previousRelabel(self.labelImage[1, ..., 0], self.op.labels[1])).all()
+
+    def testGuiEdits(self):
+        self.checkImages()
+
+        # Edit the annotations in place and mark the outputs dirty, like the gui does
+        labels = self.op.labels
+        labels[0][9] = set([4])
+        labels[0][5].remove(3)
+        labels[1][3].add(2)
+        labels[3][1] = set([1])
+        del labels[1][1]
+        for slot in (self.op.TrackImage, self.op.UntrackedImage):
+            roi = SubRegion(slot, start=[0,] + 4*[0,], stop=[4,] + list(slot.meta.shape[1:]))
+            slot.setDirty(roi)
+        self.op.Labels.setDirty([0, 1, 3])
+
+        trackImage, _ = self.checkImages()
+        assert trackImage[0, 0, 9, 0, 0] == 4
+        assert (trackImage[1][self.labelImage[1] == 1] == 0).all()
+
+    def testExportTables(self):
+        t_range = (0, self.labelImage.shape[0])
+        for misdet_idx in (None, -1):
+            oid2tid, alltids = self.op._getObjects(t_range, misdet_idx)
+            expected_oid2tid, expected_alltids = previousObjects(self.labelImage, self.op.labels, t_range, misdet_idx)
+            assert oid2tid == expected_oid2tid
+            assert alltids == expected_alltids
+
+        counts = self.op._objectCounts()
+        assert counts == [self.labelImage[t].max() for t in range(t_range[0], t_range[1])]
+
+        oid2tid, alltids = self.op._getObjects(t_range, None)
+        lookup = OpManualTracking.tid_to_oid_lookup(oid2tid)
+        for t in range(t_range[0], t_range[1]):
+            for tid in alltids:
+                try:
+                    expected = OpManualTracking.lookup_oid_for_tid(oid2tid, tid, t)
+                except ValueError:
+                    try:
+                        lookup(tid, t)
+                    except ValueError:
+                        continue
+                    assert False, "TID {} at t={} should not be found".format(tid, t)
+                assert lookup(tid, t) == expected
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,291 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import copy
+import threading
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph, Operator, OutputSlot
+from lazyflow.operators import OpArrayPiper
+from lazyflow.rtype import List
+from lazyflow.stype import Opaque
+
+from ilastik.applets.tracking.conservation.opRelabeledMergerFeatureExtraction import \
+    OpZeroBasedConsecutiveIndexRelabeling, OpRelabeledMergerFeatureExtraction
+
+def previousRelabeling(labelImage):
+    """
+    The mask loop of the previous OpZeroBasedConsecutiveIndexRelabeling, for one frame.
+    """
+    labels = list(numpy.unique(labelImage))
+    mapping = dict(zip(labels, range(0, len(labels))))
+    result = numpy.zeros_like(labelImage)
+    for k, v in mapping.iteritems():
+        result[labelImage == k] = v
+    return result, mapping
+
+def previousMergeFeatures(featuresA, featuresB, mapping):
+    max_label = max(max(mapping.keys())+1, len(featuresA))
+
+    features = numpy.zeros((max_label, featuresA.shape[1]), dtype=featuresA.dtype)
+    features[:len(featuresA), ...] = featuresA
+
+    for k, v in mapping.iteritems():
+        if k == 0:
+            continue
+        features[k, ...] = featuresB[v, ...]
+
+    return features
+
+def previousRegionFeatures(orig_feat_all, feat_vigra, mapping):
+    result = copy.deepcopy(orig_feat_all)
+    for t, feature_groups in feat_vigra.iteritems():
+        for name, features in feature_groups.iteritems():
+            for k, v in features.iteritems():
+                result[t][name][k] = previousMergeFeatures(result[t][name][k], v, mapping[t])
+    return result
+
+def makeLabels():
+    """
+    Three frames of a txyzc label image: labels beyond 255, a frame with
+    background only, and labels that only occur in a corner of the frame.
+    """
+    labels = numpy.zeros((3, 12, 10, 1, 1), dtype=numpy.uint32)
+    labels[0, 1:4, 1:4] = 7
+    labels[0, 6:9, 2:5] = 300
+    labels[0, 10:, 8:] = 3
+    labels[2, :2, :2] = 12
+    labels[2, 5:, 5:] = 9
+    return vigra.taggedView(labels, 'txyzc')
+
+class OpCountReads(OpArrayPiper):
+    """
+    Passes the input through and counts the pixels requested from it.
+    """
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.pixelsRead = 0
+        self._lock = threading.Lock()
+
+    def execute(self, slot, subindex, roi, result):
+        with self._lock:
+            self.pixelsRead += numpy.prod( numpy.subtract( roi.stop, roi.start ) )
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+class OpSyntheticFeatures(Operator):
+    """
+    Provides features for the frames of the zero based merger image, like
+    OpRegionFeatures (an object array indexed by t).  Counts the frames requested.
+    """
+    Output = OutputSlot()
+
+    def __init__(self, counts, *args, **kwargs):
+        super( OpSyntheticFeatures, self ).__init__( *args, **kwargs )
+        self.counts = counts
+        self.framesRequested = []
+
+    def setupOutputs(self):
+        self.Output.meta.shape = (len(self.counts),)
+        self.Output.meta.dtype = object
+        self.Output.meta.axistags = vigra.defaultAxistags('t')
+
+    def execute(self, slot, subindex, roi, result):
+        for i, t in enumerate(range(roi.start[0], roi.stop[0])):
+            self.framesRequested.append(t)
+            result[i] = features(t, self.counts[t], 10.0)
+        return result
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+class OpFeatureDict(Operator):
+    """
+    Provides the given features like OpObjectExtraction.RegionFeatures
+    (a dict of frames, requested with a list of time indexes).
+    """
+    Output = OutputSlot(stype=Opaque, rtype=List)
+
+    def __init__(self, features, *args, **kwargs):
+        super( OpFeatureDict, self ).__init__( *args, **kwargs )
+        self.features = features
+
+    def setupOutputs(self):
+        self.Output.meta.shape = (len(self.features),)
+        self.Output.meta.dtype = object
+
+    def execute(self, slot, subindex, roi, result):
+        return dict( (t, self.features[t]) for t in roi )
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+def features(t, n, offset=0.0):
+    rng = numpy.random.RandomState(t)
+    return { 'Default features' : { 'Count' : offset + rng.randint( 1, 100, size=(n, 1) ).astype( numpy.float32 ),
+                                    'RegionCenter' : offset + rng.random_sample( (n, 2) ).astype( numpy.float32 ) } }
+
+class TestZeroBasedConsecutiveIndexRelabeling(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.labels = makeLabels()
+        self.opReads = OpCountReads( graph=self.graph )
+        self.opReads.Input.setValue( self.labels )
+        self.op = OpZeroBasedConsecutiveIndexRelabeling( graph=self.graph )
+        self.op.LabelImage.connect( self.opReads.Output )
+
+    def tearDown(self):
+        self.op.cleanUp()
+        self.opReads.cleanUp()
+
+    def testWholeFrames(self):
+        output = self.op.Output[:].wait()
+        mapping = self.op.Mapping([]).wait()
+        assert sorted(mapping.keys()) == [0, 1, 2]
+        for t in range(3):
+            expected, expectedMapping = previousRelabeling( self.labels[t:t+1] )
+            assert numpy.array_equal( output[t:t+1], expected ), t
+            assert mapping[t] == expectedMapping, t
+
+        # the mapping was kept, only the output roi was read again
+        pixelsRead = self.opReads.pixelsRead
+        assert self.op.Mapping([0, 2]).wait() == dict( (t, mapping[t]) for t in [0, 2] )
+        assert self.opReads.pixelsRead == pixelsRead
+
+    def testPartialRoi(self):
+        # A roi that only contains some of the labels of the frame is relabeled
+        #  with the indexes of the whole frame (searchsorted path)
+        expected, expectedMapping = previousRelabeling( self.labels[0:1] )
+        assert numpy.array_equal( self.op.Output[0:1, 5:, :5].wait(), expected[:, 5:, :5] )
+        assert numpy.array_equal( self.op.Output[0:1, 9:, 7:].wait(), expected[:, 9:, 7:] )
+        assert self.op.Mapping([0]).wait()[0] == expectedMapping
+
+        # The mapping of frame 0 is cached now, frame 2 is still computed from the whole frame
+        pixelsRead = self.opReads.pixelsRead
+        self.op.Output[0:1, :2, :2].wait()
+        assert self.opReads.pixelsRead - pixelsRead == 2 * 2
+        expected, expectedMapping = previousRelabeling( self.labels[2:3] )
+        assert numpy.array_equal( self.op.Output[2:3, 4:6, 4:6].wait(), expected[:, 4:6, 4:6] )
+        assert self.op.Mapping([2]).wait()[2] == expectedMapping
+
+    def testDirtyFrame(self):
+        self.op.Output[:].wait()
+        self.labels[1, 3:5, 3:5] = 42
+        self.labels[2, 5:, 5:] = 0
+        self.opReads.Input.setDirty( (1, 3, 3, 0, 0), (3, 5, 5, 1, 1) )
+
+        # Frames 1 and 2 get new mappings, also for rois that don't contain the changed pixels
+        for t in (1, 2):
+            expected, expectedMapping = previousRelabeling( self.labels[t:t+1] )
+            assert numpy.array_equal( self.op.Output[t:t+1, :2, :2].wait(), expected[:, :2, :2] ), t
+            assert self.op.Mapping([t]).wait()[t] == expectedMapping, t
+            assert numpy.array_equal( self.op.Output[t:t+1].wait(), expected ), t
+
+        # Frame 0 keeps its mapping
+        pixelsRead = self.opReads.pixelsRead
+        self.op.Mapping([0]).wait()
+        assert self.opReads.pixelsRead == pixelsRead
+
+class TestRelabeledMergerFeatureExtraction(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.ops = []
+        self.labels = makeLabels()
+        # Two mergers in frame 0 (7 and 300) are resolved into 21, 22 and 23,
+        #  frame 2 has no mergers
+        relabeled = self.labels.copy()
+        relabeled[0, 1:4, 1:2] = 21
+        relabeled[0, 1:4, 2:4] = 22
+        relabeled[0, 6:9, 2:5] = 23
+        self.relabeled = vigra.taggedView(relabeled, 'txyzc')
+        self.resolvedTo = [ { 7 : [21, 22], 300 : [23] }, {}, {} ]
+
+    def tearDown(self):
+        for op in reversed(self.ops):
+            op.cleanUp()
+
+    def _makeOp(self, originalFeatures):
+        opFeatures = OpSyntheticFeatures( [4, 1, 1], graph=self.graph )
+        opOriginal = OpFeatureDict( originalFeatures, graph=self.graph )
+        op = OpRelabeledMergerFeatureExtraction( graph=self.graph )
+        self.ops += [opFeatures, opOriginal, op]
+
+        op.RawImage.setValue( vigra.taggedView( numpy.ones(self.labels.shape, dtype=numpy.float32), 'txyzc' ) )
+        op.LabelImage.setValue( self.labels )
+        op.RelabeledImage.setValue( self.relabeled )
+        op.ResolvedTo.setValue( self.resolvedTo )
+        op.OriginalRegionFeatures.connect( opOriginal.Output )
+        # Instead of computing the features of the merger image
+        op._opAdaptTimeListRoi.Input.connect( opFeatures.Output )
+        return op, opFeatures
+
+    def testMergeFeatures(self):
+        rng = numpy.random.RandomState(0)
+        featuresA = rng.random_sample( (301, 2) ).astype( numpy.float32 )
+        cases = [ { 0 : 0, 21 : 1, 22 : 2, 323 : 3 },  # beyond the original labels
+                  { 0 : 0, 3 : 1, 300 : 2 },           # within the original labels
+                  { 0 : 0 } ]                          # background only
+        for mapping in cases:
+            featuresB = rng.random_sample( (len(mapping), 2) ).astype( numpy.float32 )
+            merged = OpRelabeledMergerFeatureExtraction._merge_features( featuresA, featuresB, mapping )
+            assert merged.dtype == featuresA.dtype
+            assert numpy.array_equal( merged, previousMergeFeatures( featuresA, featuresB, mapping ) ), mapping
+            assert merged is not featuresA
+
+    def testRegionFeatures(self):
+        original = dict( (t, features(t, 301)) for t in range(3) )
+        op, opFeatures = self._makeOp( original )
+        originalCopy = copy.deepcopy( original )
+
+        result = op.RegionFeatures([0, 1, 2]).wait()
+        # Only the frame with mergers was recomputed
+        assert opFeatures.framesRequested == [0]
+
+        mapping = op._opZeroBasedMergerImage.Mapping([0]).wait()
+        assert sorted(mapping[0].keys()) == [0, 21, 22, 23]
+        featVigra = { 0 : opFeatures.Output[0:1].wait()[0] }
+        expected = previousRegionFeatures( original, featVigra, mapping )
+        assert sorted(result.keys()) == sorted(expected.keys())
+        for t in expected:
+            for name in expected[t]:
+                assert sorted(result[t][name].keys()) == sorted(expected[t][name].keys())
+                for k in expected[t][name]:
+                    assert numpy.array_equal( result[t][name][k], expected[t][name][k] ), (t, name, k)
+
+        # The result doesn't share any dicts with the original features
+        for t in result:
+            result[t]['Default features']['Count'] = None
+            result[t]['Added'] = {}
+        for t in original:
+            assert sorted(original[t].keys()) == sorted(originalCopy[t].keys())
+            for name in original[t]:
+                for k in original[t][name]:
+                    assert numpy.array_equal( original[t][name][k], originalCopy[t][name][k] )
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
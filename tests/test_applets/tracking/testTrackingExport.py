@@ -0,0 +1,175 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import os
+import shutil
+import tempfile
+
+import numpy
+import h5py
+
+from lazyflow.graph import Graph, Operator, OutputSlot
+from lazyflow.rtype import List
+from lazyflow.stype import Opaque
+
+from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
+from ilastik.applets.tracking.base import trackingExport
+from ilastik.applets.tracking.base.trackingExport import export_tracking_h5, track_columns
+from ilastik.utility.exportFile import ExportFile, Mode, Default, ilastik_ids, flatten_dict
+
+# Objects per frame (frame 2 has only background)
+OBJECT_COUNTS = [4, 3, 0, 5, 2]
+MAX_TRACKS = 2
+T_RANGE = (1, 4)
+
+def syntheticFeatures(t):
+    """
+    The features of frame t: the default features (one of them with two channels)
+    and two more categories, which both have a "Mean".
+    """
+    rng = numpy.random.RandomState(t)
+    n = OBJECT_COUNTS[t] + 1 # with background
+    return { default_features_key : { 'Count' : rng.randint( 1, 100, size=(n, 1) ).astype( numpy.float32 ),
+                                      'RegionCenter' : rng.random_sample( (n, 2) ).astype( numpy.float32 ) },
+             'Standard Object Features' : { 'Mean' : rng.random_sample( (n, 1) ).astype( numpy.float32 ),
+                                            'Variance' : rng.random_sample( (n, 1) ).astype( numpy.float32 ) },
+             'Other Features' : { 'Mean' : rng.random_sample( (n, 1) ).astype( numpy.float32 ) } }
+
+class OpSyntheticFeatures(Operator):
+    """
+    Provides syntheticFeatures() like OpObjectExtraction.RegionFeatures
+    (a dict of frames, requested with a list of time indexes).
+    """
+    Output = OutputSlot(stype=Opaque, rtype=List)
+
+    def setupOutputs(self):
+        self.Output.meta.shape = (len(OBJECT_COUNTS),)
+        self.Output.meta.dtype = object
+
+    def execute(self, slot, subindex, roi, result):
+        if len(roi) == 0:
+            roi = range(len(OBJECT_COUNTS))
+        return dict( (t, syntheticFeatures(t)) for t in roi )
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+def trackingResult():
+    """
+    Lineage ids and track ids (with a merger that was resolved into two tracks)
+    of the objects, and the divisions (frame, parent oid, parent track,
+    child oids and tracks), like OpTrackingBase.export_track_ids() returns them.
+    """
+    label2color = [ {1 : 2, 2 : 3, 3 : 4, 4 : 5}, {1 : 2, 2 : 3, 3 : 4}, {}, {1 : 2, 2 : 6, 3 : 7}, {1 : 6, 2 : 0} ]
+    track_ids = [ {1 : 2, 2 : 3, 3 : 4, 4 : 5}, {1 : 2, 2 : 3, 3 : 4}, {}, {1 : 2, 2 : 8, 3 : 9, 5 : 10}, {1 : 8, 2 : 0} ]
+    extra_track_ids = { 1 : { 3 : [11] }, 4 : {} }
+    divisions = [ (3, 2, 3, 2, 8, 3, 9), (3, 4, 5, 5, 10, 4, 11) ]
+    return label2color, track_ids, extra_track_ids, divisions
+
+class TestTrackingExport(object):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.opFeatures = OpSyntheticFeatures( graph=Graph() )
+        self.selection = [ 'Mean', 'Variance' ]
+        # Several chunks, the last one incomplete
+        self._frameChunk = trackingExport.FRAME_CHUNK
+        trackingExport.FRAME_CHUNK = 2
+
+    def tearDown(self):
+        trackingExport.FRAME_CHUNK = self._frameChunk
+        self.opFeatures.cleanUp()
+        shutil.rmtree( self.tmpDir )
+
+    def _exportFile(self):
+        """
+        The tables ExportFile writes for the tracking result (like OpTrackingBase._do_export_impl).
+        """
+        label2color, track_ids, extra_track_ids, divisions = trackingResult()
+        export_file = ExportFile( os.path.join( self.tmpDir, 'table.h5' ) )
+        export_file.add_columns( "table", range( sum( OBJECT_COUNTS ) ), Mode.List, Default.KnimeId )
+        export_file.add_columns( "table", list( ilastik_ids( OBJECT_COUNTS ) ), Mode.List, Default.IlastikId )
+        export_file.add_columns( "table", flatten_dict( label2color, OBJECT_COUNTS ), Mode.List, Default.Lineage )
+        export_file.add_columns( "table", track_ids, Mode.IlastikTrackingTable,
+                                 { "max" : MAX_TRACKS, "counts" : OBJECT_COUNTS, "extra ids" : extra_track_ids,
+                                   "range" : T_RANGE } )
+        export_file.add_columns( "table", self.opFeatures.Output, Mode.IlastikFeatureTable,
+                                 { "selection" : self.selection } )
+        lineages = [ label2color[d[0]].get( d[1], 0 ) for d in divisions ]
+        export_file.add_columns( "divisions", [ (d[0], l) + d[1:] for d, l in zip( divisions, lineages ) ],
+                                 Mode.List, Default.DivisionNames )
+        export_file.write_all( "h5" )
+        with h5py.File( export_file.file_name, 'r' ) as f:
+            return f['table'][:], f['divisions'][:]
+
+    def _streamingExport(self):
+        label2color, track_ids, extra_track_ids, divisions = trackingResult()
+
+        def frame_columns( t, count ):
+            lineage = numpy.array( [ label2color[t].get( o, 0 ) for o in range( 1, count + 1 ) ], dtype=numpy.int64 )
+            return [ ( Default.Lineage["names"][0], lineage ) ] + \
+                track_columns( track_ids, extra_track_ids, t, count, MAX_TRACKS, T_RANGE )
+
+        def frame_divisions( t ):
+            return [ (d[0], label2color[d[0]].get( d[1], 0 )) + d[1:] for d in divisions if d[0] == t ]
+
+        called = []
+        filePath = os.path.join( self.tmpDir, 'streamed.h5' )
+        export_tracking_h5( filePath, self.opFeatures.Output, self.selection, frame_columns,
+                            frame_divisions, Default.DivisionNames["names"], called.append )
+        assert sorted( called ) == range( len(OBJECT_COUNTS) )
+        return h5py.File( filePath, 'r' )
+
+    def testColumns(self):
+        table, divisions = self._exportFile()
+        f = self._streamingExport()
+        try:
+            # The same columns, with the same values
+            assert sorted( f['table'].keys() ) == sorted( table.dtype.names + ('frame_offsets',) )
+            for name in table.dtype.names:
+                assert f['table'][name].shape == table[name].shape, name
+                assert ( f['table'][name][:] == table[name] ).all(), name
+            assert 'RegionCenter_0' in table.dtype.names and 'Variance' in table.dtype.names
+
+            assert sorted( f['divisions'].keys() ) == sorted( divisions.dtype.names + ('frame_offsets',) )
+            for name in divisions.dtype.names:
+                assert ( f['divisions'][name][:] == divisions[name] ).all(), name
+        finally:
+            f.close()
+
+    def testFrameOffsets(self):
+        f = self._streamingExport()
+        try:
+            offsets = f['table/frame_offsets'][:]
+            assert list( offsets ) == list( numpy.cumsum( [0] + OBJECT_COUNTS ) )
+            timesteps = f['table/timestep'][:]
+            for t in range( len(OBJECT_COUNTS) ):
+                assert ( timesteps[offsets[t]:offsets[t+1]] == t ).all()
+            assert list( f['divisions/frame_offsets'][:] ) == [0, 0, 0, 0, 2, 2]
+        finally:
+            f.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
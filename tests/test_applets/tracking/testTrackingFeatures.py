@@ -0,0 +1,118 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+
+from ilastik.applets.trackingFeatureExtraction.trackingFeatures import FeatureManager
+
+FEATURE_NAMES = [ 'ParentChildrenRatio_Count', 'ParentChildrenRatio_Mean', 'ChildrenRatio_Count', 'ChildrenRatio_Mean',
+                  'ParentChildrenAngle_RegionCenter' ]
+
+def labelImage(shape, objects):
+    """
+    A label image with one square object per (center, halfWidth), labeled in order (from 1).
+    """
+    labels = numpy.zeros( shape, dtype=numpy.uint32 )
+    for label, (center, halfWidth) in enumerate( objects, start=1 ):
+        key = tuple( slice( max(0, c - halfWidth), c + halfWidth + 1 ) for c in center )
+        labels[key] = label
+    return labels
+
+def regionFeatures(labels, intensities):
+    """
+    RegionCenter, Count and Mean of each label, as extracted by vigra (row 0 is the background).
+    """
+    n = labels.max() + 1
+    counts = numpy.bincount( labels.ravel(), minlength=n ).astype(numpy.float64)
+    coords = numpy.indices( labels.shape ).reshape( labels.ndim, -1 )
+    with numpy.errstate( divide='ignore', invalid='ignore' ):
+        centers = numpy.array( [ numpy.bincount( labels.ravel(), weights=c, minlength=n ) for c in coords ] ).T / counts[:, None]
+        means = numpy.bincount( labels.ravel(), weights=intensities.ravel(), minlength=n ) / counts
+    return { 'RegionCenter' : centers, 'Count' : counts[:, None], 'Mean' : means[:, None] }
+
+class TestTrackingFeatures(object):
+
+    def setUp(self):
+        numpy.random.seed(0)
+        self.shape = (100, 120)
+        self.manager = FeatureManager( ndim=2 )
+
+    def _frame(self, objects):
+        labels = labelImage( self.shape, objects )
+        return labels, regionFeatures( labels, numpy.random.random( self.shape ) )
+
+    def _compare(self, feats_cur, feats_next, img_next):
+        expected = self.manager.computeFeatures_at( feats_cur, feats_next, img_next, FEATURE_NAMES )
+        result = self.manager.computeFeatures_vectorized( feats_cur, feats_next, FEATURE_NAMES )
+        assert sorted( result.keys() ) == sorted( expected.keys() )
+        for name in expected:
+            assert result[name].shape == expected[name].shape, name
+            assert numpy.allclose( result[name], expected[name], equal_nan=True ), \
+                "{}:\n{}\n{}".format( name, result[name], expected[name] )
+
+    def testDivisions(self):
+        _, feats_cur = self._frame( [ ( (1, 1), 1 ),        # at the image corner: one candidate
+                                      ( (50, 60), 1 ),      # three candidates and a small object
+                                      ( (90, 110), 2 ),     # near the border: two candidates
+                                      ( (20, 100), 1 ) ] )  # no candidates
+        img_next, feats_next = self._frame( [ ( (4, 3), 1 ),
+                                              ( (45, 55), 1 ), ( (56, 64), 2 ), ( (52, 70), 1 ), ( (50, 50), 0 ),
+                                              ( (97, 117), 1 ), ( (86, 104), 1 ) ] )
+        self._compare( feats_cur, feats_next, img_next )
+
+        # The object at the corner has a single candidate, so its division features have the defaults.
+        result = self.manager.computeFeatures_vectorized( feats_cur, feats_next, FEATURE_NAMES )
+        assert result['SquaredDistances_1'][1, 0] == self.manager.squared_distance_default
+        assert result['ChildrenRatio_Count'][1, 0] == 0
+
+    def testLastFrame(self):
+        _, feats_cur = self._frame( [ ( (50, 60), 1 ), ( (0, 119), 1 ) ] )
+        self._compare( feats_cur, None, None )
+
+    def testEmptyNextFrame(self):
+        _, feats_cur = self._frame( [ ( (50, 60), 1 ), ( (99, 0), 1 ) ] )
+        img_next, feats_next = self._frame( [] )
+        self._compare( feats_cur, feats_next, img_next )
+
+    def testEmptyCurrentFrame(self):
+        _, feats_cur = self._frame( [] )
+        img_next, feats_next = self._frame( [ ( (50, 60), 1 ), ( (55, 62), 1 ) ] )
+        self._compare( feats_cur, feats_next, img_next )
+
+    def testNoRows(self):
+        # Feature arrays without any rows (not even the background)
+        feats_cur = { 'RegionCenter' : numpy.zeros( (0, 2) ), 'Count' : numpy.zeros( (0, 1) ), 'Mean' : numpy.zeros( (0, 1) ) }
+        _, feats_next = self._frame( [ ( (50, 60), 1 ) ] )
+        result = self.manager.computeFeatures_vectorized( feats_cur, feats_next, FEATURE_NAMES )
+        for name, values in result.items():
+            assert values.shape[0] == 0, name
+
+        _, feats_cur = self._frame( [ ( (50, 60), 1 ) ] )
+        feats_next = { 'RegionCenter' : numpy.zeros( (0, 2) ), 'Count' : numpy.zeros( (0, 1) ), 'Mean' : numpy.zeros( (0, 1) ) }
+        result = self.manager.computeFeatures_vectorized( feats_cur, feats_next, FEATURE_NAMES )
+        assert ( result['SquaredDistances_0'] == self.manager.squared_distance_default ).all()
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,167 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+
+from lazyflow.graph import Graph, Operator, OutputSlot
+from lazyflow.rtype import List
+from lazyflow.stype import Opaque
+
+from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
+from ilastik.applets.tracking.base import opTrackingBase
+from ilastik.applets.tracking.base.opTrackingBase import OpTrackingBase
+
+X_RANGE, Y_RANGE, Z_RANGE = (10, 90), (10, 90), (0, 10)
+SIZE_RANGE = (10, 450)
+
+def syntheticFeatures(t):
+    """
+    Region features of frame t.  Frame 2 has only background, and in frame 4
+    all objects are filtered out.
+    """
+    rng = numpy.random.RandomState(t)
+    n = { 2 : 0 }.get(t, 12)
+    centers = rng.random_sample( (n+1, 3) ) * [100, 100, 10]
+    counts = rng.randint( 1, 500, size=(n+1, 1) ).astype(numpy.float32)
+    if t == 4:
+        counts[:] = 1
+    return { default_features_key : { 'RegionCenter' : centers,
+                                       'Coord<Minimum>' : centers - 5,
+                                       'Coord<Maximum>' : centers + 5,
+                                       'Count' : counts } }
+
+class OpSyntheticDetections(Operator):
+    """
+    Provides syntheticFeatures() like OpObjectExtraction.RegionFeatures
+    (a dict of frames, requested with a list of time indexes).
+    """
+    Output = OutputSlot(stype=Opaque, rtype=List)
+
+    def __init__(self, numFrames, *args, **kwargs):
+        super( OpSyntheticDetections, self ).__init__( *args, **kwargs )
+        self.numFrames = numFrames
+
+    def setupOutputs(self):
+        self.Output.meta.shape = (self.numFrames,)
+        self.Output.meta.dtype = object
+
+    def execute(self, slot, subindex, roi, result):
+        if len(roi) == 0:
+            roi = range(self.numFrames)
+        return dict( (t, syntheticFeatures(t)) for t in roi )
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+def expectedTraxels(times):
+    """
+    The traxels, filtered labels and object sizes of the per-object loop the
+    traxel store used to be built with.
+    """
+    traxels = {}
+    filtered_labels = {}
+    obj_sizes = []
+    empty_frame = False
+    for t in times:
+        feats = syntheticFeatures(t)[default_features_key]
+        rc = feats['RegionCenter'][1:]
+        ct = feats['Count'][1:]
+        count = 0
+        filtered_labels_at = []
+        for idx in range(rc.shape[0]):
+            x, y, z = rc[idx]
+            size = ct[idx]
+            if (x < X_RANGE[0] or x >= X_RANGE[1] or
+                    y < Y_RANGE[0] or y >= Y_RANGE[1] or
+                    z < Z_RANGE[0] or z >= Z_RANGE[1] or
+                    size < SIZE_RANGE[0] or size >= SIZE_RANGE[1]):
+                filtered_labels_at.append(int(idx + 1))
+                continue
+            count += 1
+            traxels[(t, idx + 1)] = ( (x, y, z), float(size) )
+            obj_sizes.append(float(size))
+        if len(filtered_labels_at) > 0:
+            filtered_labels[str(int(t) - times[0])] = filtered_labels_at
+        if count == 0:
+            empty_frame = True
+    return traxels, filtered_labels, numpy.median(obj_sizes), empty_frame
+
+class TestTraxelStore(object):
+
+    def setUp(self):
+        self.numFrames = 7
+        graph = Graph()
+        self.opDetections = OpSyntheticDetections( self.numFrames, graph=graph )
+        self.opTracking = OpTrackingBase( graph=graph )
+        self.opTracking.ObjectFeatures.connect( self.opDetections.Output )
+        self.opTracking.Parameters.setValue( {} )
+        # Several chunks, the last one incomplete
+        self.opTracking.TRAXELSTORE_CHUNK_SIZE = 3
+
+        # Record the traxels as they are added to the store
+        self.added = {}
+        self._addTraxels = opTrackingBase.addTraxels
+        def recordTraxels(ts, traxels):
+            for tr in traxels:
+                com = tuple( tr.get_feature_value('com', i) for i in range(3) )
+                self.added[(tr.Timestep, tr.Id)] = ( com, tr.get_feature_value('count', 0) )
+            self._addTraxels(ts, traxels)
+        opTrackingBase.addTraxels = recordTraxels
+
+    def tearDown(self):
+        opTrackingBase.addTraxels = self._addTraxels
+        self.opTracking.cleanUp()
+        self.opDetections.cleanUp()
+
+    def testTraxelStore(self):
+        times = range(self.numFrames)
+        median_object_size = [0]
+        ts, empty_frame = self.opTracking._generate_traxelstore( times, X_RANGE, Y_RANGE, Z_RANGE, SIZE_RANGE,
+                                                                 median_object_size=median_object_size )
+        traxels, filtered_labels, median, expected_empty_frame = expectedTraxels( times )
+
+        assert sorted( self.added.keys() ) == sorted( traxels.keys() )
+        for key, (com, size) in traxels.items():
+            assert numpy.allclose( self.added[key][0], com ), key
+            assert numpy.isclose( self.added[key][1], size ), key
+
+        assert self.opTracking.FilteredLabels.value == filtered_labels
+        assert numpy.isclose( median_object_size[0], median )
+
+        # Frames 2 (only background) and 4 (all filtered) can't be tracked
+        assert empty_frame and expected_empty_frame
+        assert '2' not in filtered_labels
+        assert filtered_labels['4'] == range(1, 13)
+
+    def testWithoutEmptyFrames(self):
+        times = [0, 1, 3]
+        ts, empty_frame = self.opTracking._generate_traxelstore( times, X_RANGE, Y_RANGE, Z_RANGE, SIZE_RANGE )
+        traxels, filtered_labels, _, expected_empty_frame = expectedTraxels( times )
+        assert sorted( self.added.keys() ) == sorted( traxels.keys() )
+        assert self.opTracking.FilteredLabels.value == filtered_labels
+        assert not empty_frame and not expected_empty_frame
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
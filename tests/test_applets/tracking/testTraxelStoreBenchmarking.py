@@ -0,0 +1,132 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+"""
+Time and memory of building the traxel store from synthetic detections,
+streaming the object features in chunks of frames versus fetching all frames at once.
+
+Run directly to print the results:
+
+    python testTraxelStoreBenchmarking.py
+"""
+import sys
+import resource
+
+import numpy
+
+from lazyflow.graph import Graph, Operator, OutputSlot
+from lazyflow.rtype import List
+from lazyflow.stype import Opaque
+from lazyflow.utility.timer import Timer
+
+from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
+from ilastik.applets.tracking.base.opTrackingBase import OpTrackingBase
+
+import nose
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler( logging.StreamHandler(sys.stdout) )
+logger.setLevel(logging.INFO)
+
+
+class OpSyntheticDetections(Operator):
+    """
+    Provides region features of random detections, like OpObjectExtraction.RegionFeatures
+    (a dict of frames, requested with a list of time indexes).
+    """
+    Output = OutputSlot(stype=Opaque, rtype=List)
+
+    def __init__(self, numFrames, objectsPerFrame, *args, **kwargs):
+        super( OpSyntheticDetections, self ).__init__( *args, **kwargs )
+        self.numFrames = numFrames
+        self.objectsPerFrame = objectsPerFrame
+
+    def setupOutputs(self):
+        self.Output.meta.shape = (self.numFrames,)
+        self.Output.meta.dtype = object
+
+    def execute(self, slot, subindex, roi, result):
+        if len(roi) == 0:
+            roi = range(self.numFrames)
+        features = {}
+        for t in roi:
+            rng = numpy.random.RandomState(t)
+            n = self.objectsPerFrame
+            centers = rng.random_sample( (n+1, 3) ) * [1000, 1000, 100]
+            counts = rng.randint( 1, 500, size=(n+1, 1) ).astype(numpy.float32)
+            features[t] = { default_features_key : { 'RegionCenter' : centers,
+                                                     'Coord<Minimum>' : centers - 5,
+                                                     'Coord<Maximum>' : centers + 5,
+                                                     'Count' : counts } }
+        return features
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+
+def buildTraxelStore(numFrames, objectsPerFrame, chunkSize):
+    """
+    Returns (number of traxels, seconds, growth of the peak resident memory in MB).
+    """
+    graph = Graph()
+    opDetections = OpSyntheticDetections(numFrames, objectsPerFrame, graph=graph)
+    opTracking = OpTrackingBase(graph=graph)
+    opTracking.ObjectFeatures.connect( opDetections.Output )
+    opTracking.TRAXELSTORE_CHUNK_SIZE = chunkSize
+
+    rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with Timer() as timer:
+        ts, empty_frame = opTracking._generate_traxelstore( range(numFrames),
+                                                            x_range=(10, 990), y_range=(10, 990), z_range=(0, 100),
+                                                            size_range=(10, 450) )
+    rssGrowth = ( resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rssBefore ) / 1024.0
+
+    numTraxels = sum( len(v) for v in opTracking.FilteredLabels.value.values() )
+    numTraxels = numFrames * objectsPerFrame - numTraxels
+    opTracking.cleanUp()
+    opDetections.cleanUp()
+    return numTraxels, timer.seconds(), rssGrowth
+
+
+def benchmark(numFrames=200, objectsPerFrame=5000):
+    results = {}
+    # Streamed first, so the all-at-once run can't reuse its peak memory
+    for name, chunkSize in [ ('streamed', OpTrackingBase.TRAXELSTORE_CHUNK_SIZE), ('all frames', numFrames) ]:
+        results[name] = buildTraxelStore(numFrames, objectsPerFrame, chunkSize)
+        logger.info( "{:>12}: {} traxels in {:7.2f}s, peak memory +{:.0f} MB".format( name, *results[name] ) )
+    return results
+
+
+class TestTraxelStoreBenchmarking(object):
+
+    @classmethod
+    def setupClass(cls):
+        # This test is useful for performance evaluation,
+        #  but it takes too long to be useful as part of the normal test suite.
+        raise nose.SkipTest
+
+    def testStreamedTraxelStore(self):
+        results = benchmark()
+        assert results['streamed'][0] == results['all frames'][0]
+
+
+if __name__ == "__main__":
+    benchmark()
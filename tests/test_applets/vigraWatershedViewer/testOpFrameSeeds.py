@@ -0,0 +1,200 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+
+from ilastik.applets.vigraWatershedViewer.opFrameSeeds import OpFrameSeeds
+from ilastik.applets.vigraWatershedViewer.opVigraWatershedViewer import chooseCacheBlockShape
+
+
+class OpCountReads(OpArrayPiper):
+    def __init__(self, *args, **kwargs):
+        super( OpCountReads, self ).__init__( *args, **kwargs )
+        self.pixelsRead = 0
+
+    def execute(self, slot, subindex, roi, result):
+        self.pixelsRead += numpy.prod(numpy.subtract(roi.stop, roi.start))
+        return super( OpCountReads, self ).execute( slot, subindex, roi, result )
+
+
+def expectedSeeds(image, threshold, minSize):
+    # Seeds of one 2D frame, labeled with 1 + the flat index of their first pixel
+    labels = vigra.analysis.labelImageWithBackground( (image <= threshold).astype(numpy.uint8) )
+    labels = numpy.asarray( labels, dtype=numpy.uint32 )
+    seeds = numpy.zeros_like( labels )
+    for label in range( 1, labels.max()+1 ):
+        where = ( labels == label )
+        if where.sum() >= minSize:
+            seeds[where] = numpy.flatnonzero( where.ravel() )[0] + 1
+    return seeds
+
+
+class TestOpFrameSeeds(object):
+
+    def setUp(self):
+        numpy.random.seed(0)
+        data = numpy.random.random( (3, 40, 50) ).astype(numpy.float32)
+        data = numpy.array( [ vigra.filters.gaussianSmoothing( frame, 2.0 ) for frame in data ] )
+        self.data = vigra.taggedView( data[..., None], 'tyxc' )
+        self.threshold = float( numpy.percentile( data, 30 ) )
+
+        graph = Graph()
+        self.opReads = OpCountReads( graph=graph )
+        self.opReads.Input.setValue( self.data )
+
+        self.op = OpFrameSeeds( graph=graph )
+        self.op.Input.connect( self.opReads.Output )
+        self.op.Threshold.setValue( self.threshold )
+
+    def _expected(self, t, threshold=None, minSize=0):
+        if threshold is None:
+            threshold = self.threshold
+        return expectedSeeds( self.data[t, ..., 0].view(numpy.ndarray), threshold, minSize )
+
+    def testSeeds(self):
+        seeds = self.op.Output[:].wait()
+        for t in range(3):
+            assert ( seeds[t, ..., 0] == self._expected(t) ).all()
+
+    def testMinSeedSize(self):
+        self.op.MinSeedSize.setValue( 20 )
+        seeds = self.op.Output[:].wait()
+        for t in range(3):
+            assert ( seeds[t, ..., 0] == self._expected(t, minSize=20) ).all()
+
+    def testBlocksShareSeeds(self):
+        # Blocks get the labels of the whole frame, and the frame is read only once.
+        full = self._expected(1)
+        for roi in [ numpy.s_[1:2, 0:20, 0:25, :], numpy.s_[1:2, 20:40, 25:50, :], numpy.s_[1:2, 13:37, 7:41, :] ]:
+            block = self.op.Output[roi].wait()
+            assert ( block[0, ..., 0] == full[roi[1:3]] ).all()
+        assert self.opReads.pixelsRead == 40 * 50
+
+    def _changedBlocks(self, t, oldSeeds, newSeeds, blockShape, padding):
+        # The (start, stop) of the blocks whose seeds changed within padding of the block
+        changed = ( oldSeeds != newSeeds )
+        blocks = []
+        for y in range(0, 40, blockShape[1]):
+            for x in range(0, 50, blockShape[2]):
+                padded = changed[ max(0, y - padding) : y + blockShape[1] + padding,
+                                  max(0, x - padding) : x + blockShape[2] + padding ]
+                if padded.any():
+                    blocks.append( ( (t, y, x, 0), (t+1, min(40, y + blockShape[1]), min(50, x + blockShape[2]), 1) ) )
+        return blocks
+
+    def testThresholdChange(self):
+        # Seeds at two levels: only the blocks near the seeds of the second level change
+        self.data[:] = 1
+        self.data[:, 3:6, 3:6] = 0.1
+        self.data[:, 4:9, 21:28] = 0.2
+        self.data[:, 30:38, 33:36] = 0.2
+        self.threshold = 0.15
+
+        blockShape = (1, 10, 10, 1)
+        self.op.BlockShape.setValue( blockShape )
+        self.op.Padding.setValue( 2 )
+        self.op.Threshold.setValue( self.threshold )
+        self.op.Output[0:1].wait()
+        self.op.Output[2:3].wait()
+        pixelsRead = self.opReads.pixelsRead
+
+        dirtyRois = []
+        self.op.Output.notifyDirty( lambda slot, roi: dirtyRois.append( (tuple(roi.start), tuple(roi.stop)) ) )
+
+        newThreshold = 0.25
+        self.op.Threshold.setValue( newThreshold )
+        self.op.waitForUpdates()
+
+        # The computed frames are recomputed, and only the blocks whose seeds changed are dirty.
+        assert self.opReads.pixelsRead == pixelsRead + 2 * 40 * 50
+        expected = []
+        for t in (0, 2):
+            expected += self._changedBlocks( t, self._expected(t), self._expected(t, newThreshold), blockShape, 2 )
+        assert sorted( dirtyRois ) == sorted( expected )
+        assert len(expected) == 2 * (4 + 2)
+
+        # The recomputed frames are kept
+        seeds = self.op.Output[2:3].wait()
+        assert ( seeds[0, ..., 0] == self._expected(2, newThreshold) ).all()
+        assert self.opReads.pixelsRead == pixelsRead + 2 * 40 * 50
+
+        # Without a block shape, frames with changed seeds are dirty as a whole
+        del dirtyRois[:]
+        self.op.BlockShape.disconnect()
+        self.op.MinSeedSize.setValue( 20 )
+        self.op.waitForUpdates()
+        assert sorted( dirtyRois ) == [ ( (0, 0, 0, 0), (1, 40, 50, 1) ),
+                                        ( (2, 0, 0, 0), (3, 40, 50, 1) ) ]
+
+    def testMaxCachedFrames(self):
+        self.op.BlockShape.setValue( (1, 10, 10, 1) )
+        self.op.MaxCachedFrames = 2
+        self.op.Output[:].wait()
+        self.op.Output[0:1].wait()
+        pixelsRead = self.opReads.pixelsRead
+
+        dirtyRois = []
+        self.op.Output.notifyDirty( lambda slot, roi: dirtyRois.append( (tuple(roi.start), tuple(roi.stop)) ) )
+        self.op.Threshold.setValue( float( numpy.percentile( self.data, 40 ) ) )
+        self.op.waitForUpdates()
+
+        # Frame 1 was dropped (least recently used), so it is dirty as a whole and not recomputed.
+        assert ( (1, 0, 0, 0), (2, 40, 50, 1) ) in dirtyRois
+        assert all( start[0] != 1 or stop == (2, 40, 50, 1) for start, stop in dirtyRois )
+        assert self.opReads.pixelsRead == pixelsRead + 2 * 40 * 50
+
+    def testInputDirty(self):
+        self.op.Output[:].wait()
+        pixelsRead = self.opReads.pixelsRead
+
+        self.data[1, 10:12, 10:12] = 0
+        self.opReads.Input.setDirty( (1, 10, 10, 0), (2, 12, 12, 1) )
+
+        seeds = self.op.Output[:].wait()
+        assert ( seeds[1, ..., 0] == self._expected(1) ).all()
+        assert self.opReads.pixelsRead == pixelsRead + 40 * 50
+
+
+class TestChooseCacheBlockShape(object):
+
+    def testLargeData(self):
+        taggedShape = { 't' : 1, 'x' : 300, 'y' : 200, 'z' : 50, 'c' : 1 }
+        # 1 byte of input and 2 * 4 bytes of labels per voxel, 1/256 of 8 GiB per block
+        assert chooseCacheBlockShape( taggedShape, numpy.uint8, 8*2**30 ) == (512, 14)
+
+    def testSmallData(self):
+        taggedShape = { 'x' : 50, 'y' : 40, 'z' : 30 }
+        assert chooseCacheBlockShape( taggedShape, numpy.float32, 8*2**30 ) == (64, 30)
+
+    def testLittleMemory(self):
+        taggedShape = { 'x' : 1000, 'y' : 1000, 'z' : 100 }
+        assert chooseCacheBlockShape( taggedShape, numpy.float32, 0 ) == (512, 1)
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)